@@ -1,18 +1,34 @@
+import os
+import requests
 import streamlit as st
 import pandas as pd
-from functions import QdrantStorage
+import altair as alt
+from tracing import load_traces
 
 st.set_page_config(page_title="Monitor Técnico RAG", layout="wide")
 
 st.title("🛡️ Panel de Supervisión Técnica")
 
-storage = QdrantStorage()
+
+@st.cache_resource(show_spinner=False)
+def get_storage(): # Una conexión por proceso, no una por recarga. Si QDRANT falla no se cachea y se reintenta al actualizar
+    from functions import QdrantStorage # Import local: las secciones que no usan QDRANT se pintan igualmente
+    return QdrantStorage()
+
+
+try:
+    storage = get_storage()
+except Exception as e:
+    storage = None
+    storage_error = e
 
 # 1. ESTADO DE LA INFRAESTRUCTURA
 st.subheader("Estado de los Motores")
 col1, col2 = st.columns(2)
 
 try:
+    if storage is None:
+        raise storage_error
     # Intentamos conectar y pedir info de las colecciones
     coll_info = storage.client.get_collection("docs")
     audit_info = storage.client.get_collection("audit_logs")
@@ -29,6 +45,8 @@ st.divider()
 st.subheader("Últimas interacciones")
 
 try:
+    if storage is None:
+        raise storage_error
     # Intentamos traer los datos de auditoría
     logs, _ = storage.client.scroll(
         collection_name="audit_logs",
@@ -42,7 +60,7 @@ try:
         df = pd.DataFrame(data)
         
         # Filtro de seguridad para evitar el KeyError si falta alguna columna
-        cols_deseadas = ['timestamp', 'question', 'source_id', 'answer']
+        cols_deseadas = ['timestamp', 'tenant', 'question', 'source_id', 'answer']
         cols_finales = [c for c in cols_deseadas if c in df.columns]
         
         st.dataframe(df[cols_finales], use_container_width=True)
@@ -58,6 +76,18 @@ try:
                 st.warning(f"⚠️ Hay {no_info} consultas que el bot no supo responder.")
             else:
                 st.success("✅ Todas las consultas fueron respondidas con éxito.")
+
+            # Consultas resueltas por la ruta rápida (ningún contexto superó el umbral y no se llamó al LLM)
+            if 'llm_skipped' in df.columns:
+                st.caption(f"Respuestas sin llamada al LLM (sin contexto relevante): {int(df['llm_skipped'].fillna(False).sum())}")
+
+            # Presupuesto de latencia: consultas degradadas (hedges, pregunta sin condensar, respuesta cacheada...) y latencia
+            if 'degradations' in df.columns:
+                degraded = df['degradations'].dropna().explode().dropna()
+                if not degraded.empty:
+                    st.caption("Degradaciones por latencia: " + ", ".join(f"{k} ({v})" for k, v in degraded.value_counts().items()))
+            if 'latency_ms' in df.columns and df['latency_ms'].notna().any():
+                st.caption(f"Latencia p95 de las últimas consultas: {df['latency_ms'].dropna().quantile(0.95) / 1000:.1f} s")
     else:
         st.info("La colección de auditoría está vacía. El chat aún no ha guardado registros.")
 
@@ -65,6 +95,175 @@ except Exception as e:
     # Bloque except indentado correctamente para evitar errores
     st.warning(f"No se pudo cargar la tabla de interacciones: {e}")
 
+# 4. PROGRESO DE LA INGESTA (lo expone la API en /ingest/jobs)
+st.divider()
+st.subheader("Ingestas")
+
+try:
+    resp = requests.get(f"{os.getenv('RAG_API_BASE', 'http://127.0.0.1:8000')}/ingest/jobs", params={"limit": 20}, timeout=5)
+    resp.raise_for_status()
+    ingest = resp.json()
+    t = ingest["throughput"]
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("En curso", t["running"])
+    c2.metric("Terminadas", t["done"])
+    c3.metric("Con error", t["failed"])
+    c4.metric("Ritmo total", f"{t['chunks_per_second']:.1f} chunks/s")
+    for job in ingest["jobs"]:
+        eta = f" · ETA {job['eta_s']:.0f} s" if job.get("eta_s") is not None else ""
+        st.progress(
+            min(float(job["progress"]), 1.0),
+            text=f"{job['source_id']} — {job['status']} · {job['pages']} págs · {job['chunks_embedded']}/{job['chunks']} embeddings · "
+                 f"{job['points_upserted']} puntos · {job['rate']:.1f} chunks/s{eta}",
+        )
+        if job.get("error"):
+            st.caption(f"⚠️ {job['error']}")
+    if not ingest["jobs"]:
+        st.info("No hay ingestas recientes.")
+except Exception as e:
+    st.warning(f"No se pudo consultar el progreso de la ingesta: {e}")
+
+# 5. CONSUMO DE TOKENS Y COSTE (lo expone la API en /usage, ver usage.py)
+st.divider()
+st.subheader("Consumo y coste")
+
+try:
+    api = os.getenv('RAG_API_BASE', 'http://127.0.0.1:8000')
+    days = st.slider("Días", 1, 90, 30)
+
+    def _usage(by: str) -> pd.DataFrame:
+        resp = requests.get(f"{api}/usage", params={"by": by, "days": days}, timeout=5)
+        resp.raise_for_status()
+        return pd.DataFrame(resp.json()["rows"])
+
+    by_day, by_model = _usage("day"), _usage("model")
+    if by_day.empty:
+        st.info("Aún no hay consumo registrado.")
+    else:
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Coste total", f"{by_day['cost_usd'].sum():.2f} USD")
+        c2.metric("Tokens de chat", f"{int(by_day['prompt_tokens'].sum() + by_day['completion_tokens'].sum()):,}")
+        c3.metric("Tokens de embeddings", f"{int(by_day['embedding_tokens'].sum()):,}")
+        st.bar_chart(by_day.set_index("day").sort_index()[["cost_usd"]])
+        st.caption("Por modelo")
+        st.dataframe(by_model, use_container_width=True)
+        st.caption("Por PDF (las consultas sin PDF cuentan para el PDF del mejor contexto; las ingestas, para su PDF)")
+        st.dataframe(_usage("source").head(20), use_container_width=True)
+        st.caption("Sesiones de chat que más consumen")
+        st.dataframe(_usage("session").head(10), use_container_width=True)
+except Exception as e:
+    st.warning(f"No se pudo consultar el consumo: {e}")
+
+# 6. PREGUNTAS FRECUENTES: revisión de las respuestas minadas de la auditoría (solo las aprobadas se sirven en el chat, ver faq.py)
+st.divider()
+st.subheader("Preguntas frecuentes")
+
+try:
+    if storage is None:
+        raise storage_error
+    from faq import FAQStore
+    faq_store = FAQStore(storage.client)
+    faqs = faq_store.list()
+    pending_faqs = [f for f in faqs if not f.get("vetted")]
+    st.caption(f"{len(faqs) - len(pending_faqs)} aprobadas · {len(pending_faqs)} pendientes de revisión")
+    for faq in faqs:
+        estado = "✅" if faq.get("vetted") else "🕒"
+        with st.expander(f"{estado} [{faq.get('tenant')}/{faq['source_key']}] x{faq['count']} · {faq['question']}"):
+            st.markdown(faq["answer"])
+            st.caption("Fuentes: " + ", ".join(faq.get("sources", [])) + f" · cohesión {faq.get('cohesion', 0):.2f}")
+            st.caption("Ejemplos: " + " | ".join(faq.get("examples", [])[:5]))
+            c1, c2 = st.columns(2)
+            if not faq.get("vetted") and c1.button("Aprobar", key=f"vet-{faq['id']}"):
+                faq_store.set_vetted([faq["id"]], True)
+                st.rerun()
+            if faq.get("vetted") and c1.button("Retirar", key=f"unvet-{faq['id']}"):
+                faq_store.set_vetted([faq["id"]], False)
+                st.rerun()
+            if c2.button("Borrar", key=f"del-{faq['id']}"):
+                faq_store.delete([faq["id"]])
+                st.rerun()
+    if not faqs:
+        st.info("Aún no hay FAQ minadas. Se generan cada semana o con el evento rag/mine_faqs.")
+except Exception as e:
+    st.warning(f"No se pudieron cargar las FAQ: {e}")
+
+# 7. TRAZAS: cascada (waterfall) de una consulta, desde el chat hasta OpenAI y QDRANT (ver tracing.py)
+st.divider()
+st.subheader("Trazas")
+
+try:
+    spans = load_traces()
+    traces = {}
+    for sp in spans:
+        traces.setdefault(sp["trace_id"], []).append(sp)
+    if traces:
+        def _label(trace_id):
+            items = traces[trace_id]
+            root = min(items, key=lambda sp: (sp["parent_id"] is not None, sp["start"]))
+            total = max(sp["end"] for sp in items) - min(sp["start"] for sp in items)
+            when = pd.to_datetime(root["start"], unit="s").strftime("%H:%M:%S")
+            return f"{when} · {root['name']} · {total:.2f} s · {len(items)} spans"
+
+        recent = sorted(traces, key=lambda t: max(sp["end"] for sp in traces[t]), reverse=True)[:50]
+        trace_id = st.selectbox("Traza", recent, format_func=_label)
+        items = traces[trace_id]
+
+        # Orden en profundidad (cada span debajo de su padre) y sangría por nivel
+        ids = {sp["span_id"] for sp in items}
+        children = {}
+        for sp in sorted(items, key=lambda sp: sp["start"]):
+            parent = sp["parent_id"] if sp["parent_id"] in ids else None # Padre no exportado (p.ej. otro proceso): a la raíz
+            children.setdefault(parent, []).append(sp)
+        rows, stack = [], [(sp, 0) for sp in reversed(children.get(None, []))]
+        while stack:
+            sp, depth = stack.pop()
+            rows.append({**sp, "depth": depth})
+            stack.extend((child, depth + 1) for child in reversed(children.get(sp["span_id"], [])))
+
+        t0 = min(sp["start"] for sp in items)
+        df_trace = pd.DataFrame([{
+            "span": f"{i:03d} " + "  " * r["depth"] + r["name"], # Prefijo para conservar el orden en el eje
+            "servicio": r["service"],
+            "inicio_ms": (r["start"] - t0) * 1000,
+            "fin_ms": (r["end"] - t0) * 1000,
+            "duración_ms": r["duration_ms"],
+            "error": r["error"] or "",
+            "atributos": ", ".join(f"{k}={v}" for k, v in r["attrs"].items()),
+        } for i, r in enumerate(rows)])
+
+        chart = alt.Chart(df_trace).mark_bar().encode(
+            x=alt.X("inicio_ms:Q", title="ms desde el inicio de la traza"),
+            x2="fin_ms:Q",
+            y=alt.Y("span:N", sort="ascending", title=None),
+            color="servicio:N",
+            tooltip=["span", "servicio", "duración_ms", "error", "atributos"],
+        ).properties(height=max(120, 24 * len(df_trace)))
+        st.altair_chart(chart, use_container_width=True)
+        st.caption("El hueco entre el mensaje del chat y el primer paso es la cola de Inngest; ui.wait_output incluye el sondeo.")
+        st.dataframe(df_trace.drop(columns=["inicio_ms", "fin_ms"]), use_container_width=True)
+    else:
+        st.info("Aún no hay trazas (RAG_TRACE_FILE).")
+except Exception as e:
+    st.warning(f"No se pudieron cargar las trazas: {e}")
+
+# 8. CLIENTES (TENANTS): puntos y PDFs de cada cliente (ver tenants.py)
+st.divider()
+st.subheader("Clientes")
+
+try:
+    if storage is None:
+        raise storage_error
+    tenants = storage.list_tenants()
+    if tenants:
+        df_tenants = pd.DataFrame([{"cliente": t["tenant_id"], "puntos": t["points"], "PDFs": t["sources"]} for t in tenants])
+        st.dataframe(df_tenants.sort_values("puntos", ascending=False), use_container_width=True)
+        tenant = st.selectbox("Documentos del cliente", [t["tenant_id"] for t in tenants])
+        st.dataframe(pd.DataFrame(storage.list_sources(tenant_id=tenant)), use_container_width=True)
+    else:
+        st.info("No hay documentos con cliente asignado. Para los anteriores al aislamiento: uv run python tenants.py backfill")
+except Exception as e:
+    st.warning(f"No se pudieron cargar los clientes: {e}")
+
 # Espacio extra y botón de actualización
 st.write("")
 if st.button("🔄 Actualizar Datos"):
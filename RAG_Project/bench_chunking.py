@@ -0,0 +1,65 @@
+# BENCHMARK DE CHUNKING
+
+# Compara el SentenceSplitter de LlamaIndex con las estrategias de chunking.py sobre los mismos PDFs.
+# El texto de las páginas sale de la caché (PageTextCache), así que solo medimos el troceado, no la lectura del PDF.
+# Para correrlo: uv run python bench_chunking.py uploads/mi_documento.pdf [otro.pdf ...] --repeat 5
+
+import argparse
+import statistics
+import time
+
+from chunking import CHUNKERS, PageTextCache, get_chunker
+from tokens import count_tokens
+
+
+def _measure(split, pages, repeat):
+    times = []
+    chunks = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        chunks = [c for p in pages for c in split(p["text"]) if c and c.strip()]
+        times.append(time.perf_counter() - t0)
+    sizes = [count_tokens(c) for c in chunks] or [0]
+    return {
+        "ms": statistics.median(times) * 1000,
+        "chunks": len(chunks),
+        "tokens_medios": statistics.mean(sizes),
+        "tokens_max": max(sizes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de estrategias de chunking")
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cache = PageTextCache()
+    pages = []
+    for pdf in args.pdfs:
+        t0 = time.perf_counter()
+        _, doc_pages = cache.load_pages(pdf)
+        print(f"{pdf}: {len(doc_pages)} páginas cargadas en {(time.perf_counter() - t0) * 1000:.1f} ms")
+        pages.extend(doc_pages)
+
+    results = {}
+    try:
+        from llama_index.core.node_parser import SentenceSplitter
+        splitter = SentenceSplitter(chunk_size=args.chunk_size, chunk_overlap=args.overlap)
+        results["llama_index.SentenceSplitter"] = _measure(splitter.split_text, pages, args.repeat)
+    except ImportError:
+        print("AVISO: llama_index no está instalado, se omite la referencia SentenceSplitter.")
+
+    for name in CHUNKERS:
+        chunker = get_chunker(name, chunk_size=args.chunk_size, chunk_overlap=args.overlap)
+        results[name] = _measure(chunker.split_text, pages, args.repeat)
+
+    print(f"\n{'estrategia':<32}{'ms':>10}{'chunks':>8}{'tok. medios':>13}{'tok. max':>10}")
+    for name, r in results.items():
+        print(f"{name:<32}{r['ms']:>10.1f}{r['chunks']:>8}{r['tokens_medios']:>13.1f}{r['tokens_max']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# BENCHMARK DEL MOTOR DE EMBEDDINGS LOCAL
+
+# Compara tres formas de codificar una ingesta grande con LocalSVDEmbedder (HashingVectorizer + TF-IDF + SVD):
+#   - una sola llamada sobre todo el lote,
+#   - lotes repartidos en un grupo de HILOS,
+#   - lotes repartidos en un grupo de PROCESOS (lo que hace LocalSVDEmbedder.embed con RAG_LOCAL_EMBED_WORKERS > 1).
+# HashingVectorizer tokeniza en Python con el GIL tomado: los hilos solo pueden solapar la parte de scipy/numpy.
+# Con una sola CPU (4.000 chunks de ~150 palabras, lotes de 512): una llamada 1,00 s, 2 hilos 1,11 s, 2 procesos 1,04 s.
+# Es decir, repartir cuesta ~4% en una máquina sin núcleos libres; la ganancia de los procesos depende de cuántos haya.
+# Usa chunks sintéticos y un modelo temporal, así que no toca la caché ni el modelo real.
+# Para correrlo: uv run python bench_embedders.py --chunks 50000 --workers 8 --batch-size 512
+
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from embedders import LocalSVDEmbedder
+
+
+def _fake_chunks(n: int, words: int, seed: int = 0) -> list[str]: # Vocabulario de 5.000 palabras con frecuencias tipo Zipf
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(5_000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    return [" ".join(rng.choices(vocabulary, weights=weights, k=words)) for _ in range(n)]
+
+
+def _timed(fn, texts, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        vectors = fn(texts)
+        best = min(best, time.perf_counter() - t0)
+    assert len(vectors) == len(texts)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la codificación por lotes del motor de embeddings local")
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--words", type=int, default=150, help="Palabras por chunk (~200 tokens)")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = _fake_chunks(args.chunks, args.words)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "bench.joblib")
+        LocalSVDEmbedder(path, dim=args.dim, workers=1).fit(texts[:5_000])
+        single = LocalSVDEmbedder(path, workers=1)
+        pooled = LocalSVDEmbedder(path, batch_size=args.batch_size, workers=args.workers)
+        pooled.embed(texts[:args.batch_size * args.workers + 1]) # Arranca los procesos y carga el modelo fuera de la medida
+
+        def threaded(batch):
+            parts = [batch[i:i + args.batch_size] for i in range(0, len(batch), args.batch_size)]
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                return [v for part in pool.map(single._encode, parts) for v in part]
+
+        results = {
+            "una llamada": _timed(lambda t: single.embed(t), texts, args.repeat),
+            f"{args.workers} hilos": _timed(threaded, texts, args.repeat),
+            f"{args.workers} procesos": _timed(pooled.embed, texts, args.repeat),
+        }
+        pooled.close()
+
+    print(f"{args.chunks} chunks de ~{args.words} palabras, lotes de {args.batch_size}, {os.cpu_count()} CPUs")
+    print(f"{'modo':<16}{'s':>8}{'chunks/s':>12}{'x':>7}")
+    for name, seconds in results.items():
+        print(f"{name:<16}{seconds:>8.2f}{args.chunks / seconds:>12.0f}{results['una llamada'] / seconds:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# BENCHMARK DE INGESTA Y CONSULTAS SIN RED
+
+# Ingesta unos PDFs y lanza unas preguntas contra un QDRANT en memoria, con las llamadas a OpenAI grabadas en cassettes
+# (cassette.py). La primera vez se graba (--record, necesita OPENAI_API_KEY). Después se reproduce sin red, sin coste y con la
+# latencia simulada que se elija: con la misma semilla, dos ejecuciones hacen las mismas llamadas y dan las mismas respuestas.
+# Las cachés locales (embeddings, texto de las páginas, respuestas...) van a una carpeta temporal en cada ejecución:
+# si no, la segunda ejecución apenas llamaría a OpenAI y mediría otra cosa.
+# Para correrlo: uv run python bench_query.py uploads/manual.pdf --questions preguntas.txt --record
+#                uv run python bench_query.py uploads/manual.pdf --questions preguntas.txt --repeat 3 \
+#                    --latency "embeddings=lognormal:150:0.3,chat=lognormal:1200:0.4"
+
+import argparse
+import asyncio
+import hashlib
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+
+def _pct(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _run(pdfs: list, questions: list, top_k: int, budget_s: float) -> dict:
+    # Imports locales: las variables RAG_CASSETTE* y la carpeta de trabajo ya están preparadas
+    import cassette
+    from deadlines import Deadline
+    from functions import AuditLogger, QdrantStorage, VectorProcessor
+    from tenants import DEFAULT_TENANT
+    from workflow import RAGWorkflow
+
+    before = cassette.stats()
+    processor = VectorProcessor()
+    client = QdrantStorage.connect(url=":memory:")
+    storage = QdrantStorage(dim=processor.embed_dim, client=client)
+    workflow = RAGWorkflow(processor=processor, storage=storage, logger=AuditLogger(client))
+
+    # 1. INGESTA
+    ingest_s, chunks = [], 0
+    for pdf in pdfs:
+        t0 = time.perf_counter()
+        doc = await workflow._load_event({"pdf_path": pdf, "source_id": Path(pdf).name, "tenant_id": DEFAULT_TENANT})
+        result = await workflow._upsert(doc)
+        await workflow._activate(result.source_id, result.version, tenant_id=result.tenant_id)
+        ingest_s.append(time.perf_counter() - t0)
+        chunks += result.ingested
+
+    # 2. CONSULTAS (búsqueda y respuesta, con el mismo presupuesto de latencia que en producción)
+    system_content = await workflow._get_system_prompt()
+    search_ms, answer_ms, total_ms, degradations, answers = [], [], [], [], []
+    for question in questions:
+        deadline = Deadline(budget_s=budget_s)
+        t0 = time.perf_counter()
+        found = await workflow._search(question, top_k, deadline=deadline, tenant_id=DEFAULT_TENANT)
+        t1 = time.perf_counter()
+        if found.contexts:
+            answer = await workflow._answer(system_content, question, question, found, deadline, tenant_id=DEFAULT_TENANT)
+            answers.append(answer.answer)
+            degradations.extend(found.degradations + answer.degradations)
+        else: # Sin contexto no se llama al LLM (ruta rápida de main.py)
+            answers.append("")
+            degradations.extend(found.degradations)
+        t2 = time.perf_counter()
+        search_ms.append((t1 - t0) * 1000)
+        answer_ms.append((t2 - t1) * 1000)
+        total_ms.append((t2 - t0) * 1000)
+
+    after = cassette.stats()
+    return {
+        "ingest_s": sum(ingest_s),
+        "chunks": chunks,
+        "search_ms": search_ms,
+        "answer_ms": answer_ms,
+        "total_ms": total_ms,
+        "degradations": degradations,
+        "fingerprint": hashlib.sha1("\x00".join(answers).encode("utf-8")).hexdigest()[:12], # Igual en cada reproducción
+        "hits": after["hits"] - before["hits"],
+        "recorded": after["recorded"] - before["recorded"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reproducible de ingesta y consultas con OpenAI grabado")
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--questions", default=None, help="Fichero con una pregunta por línea")
+    parser.add_argument("--question", action="append", default=[])
+    parser.add_argument("--record", action="store_true", help="Llama a OpenAI y graba (si no, solo reproduce)")
+    parser.add_argument("--cassettes", default=os.getenv("RAG_CASSETTE_DIR", "cassettes"))
+    parser.add_argument("--latency", default=os.getenv("RAG_CASSETTE_LATENCY", "none"), help='p.ej. "recorded" o "chat=lognormal:1200:0.4"')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("RAG_QUERY_BUDGET_S", 20)))
+    args = parser.parse_args()
+
+    questions = list(args.question)
+    if args.questions:
+        questions += [q.strip() for q in Path(args.questions).read_text(encoding="utf-8").splitlines() if q.strip()]
+    if not questions:
+        parser.error("Hace falta al menos una pregunta (--question o --questions)")
+    pdfs = [str(Path(p).resolve()) for p in args.pdfs]
+
+    os.environ.update({
+        "RAG_CASSETTE": "record" if args.record else "replay",
+        "RAG_CASSETTE_DIR": str(Path(args.cassettes).resolve()),
+        "RAG_CASSETTE_LATENCY": "none" if args.record else args.latency,
+        "RAG_CASSETTE_SEED": str(args.seed),
+        "RAG_TRACING": "0",
+        "RAG_FAQ": "0",
+    })
+    workdir = os.getcwd()
+    runs = []
+    for i in range(1 if args.record else args.repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp) # Cachés .cache/... vacías en cada ejecución
+            try:
+                runs.append(asyncio.run(_run(pdfs, questions, args.top_k, args.budget)))
+            finally:
+                os.chdir(workdir)
+        r = runs[-1]
+        print(f"ejecución {i + 1}: ingesta {r['ingest_s']:.2f} s ({r['chunks']} chunks) · consultas p50 {statistics.median(r['total_ms']):.0f} ms "
+              f"· p95 {_pct(r['total_ms'], 0.95):.0f} ms · reproducidas {r['hits']} · grabadas {r['recorded']} · huella {r['fingerprint']}")
+
+    print(f"\n{'paso':<12}{'p50 ms':>10}{'p95 ms':>10}{'máx ms':>10}")
+    for step in ("search_ms", "answer_ms", "total_ms"):
+        values = [v for r in runs for v in r[step]]
+        print(f"{step[:-3]:<12}{statistics.median(values):>10.0f}{_pct(values, 0.95):>10.0f}{max(values):>10.0f}")
+    degraded = [d for r in runs for d in r["degradations"]]
+    if degraded:
+        print("degradaciones: " + ", ".join(f"{d} ({degraded.count(d)})" for d in sorted(set(degraded))))
+    if len({r["fingerprint"] for r in runs}) > 1:
+        print("AVISO: Las respuestas cambian entre ejecuciones (¿alguna petición sin grabar o con otro orden?).")
+
+
+if __name__ == "__main__":
+    main()
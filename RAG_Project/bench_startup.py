@@ -0,0 +1,73 @@
+# BENCHMARK DE ARRANQUE
+
+# Mide cuánto tarda en importarse main.py (lo que espera uvicorn antes de aceptar peticiones) en procesos nuevos,
+# como un worker recién creado por el autoescalado, y qué módulos se llevan ese tiempo (python -X importtime).
+# Falla (código 1) si la mediana supera el presupuesto: RAG_STARTUP_BUDGET_S o --budget (1 s por defecto).
+# Con --warm también mide el calentamiento de los motores (services.py), que ocurre después y en segundo plano.
+# Para correrlo: uv run python bench_startup.py --runs 5
+#                uv run python bench_startup.py --module streamlit_app --top 20
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import {module}
+print("import_s", time.perf_counter() - t0)
+if {warm}:
+    t0 = time.perf_counter()
+    {module}.services.warm_up()
+    print("warm_s", time.perf_counter() - t0)
+"""
+
+
+def _run(module: str, warm: bool) -> tuple[dict, list]:
+    """Importa el módulo en un intérprete nuevo. Devuelve ({medida: segundos}, [(ms acumulados, módulo de primer nivel)])."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SNIPPET.format(module=module, warm=warm)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"No se pudo importar {module}:\n{proc.stderr[-2000:]}")
+    timings = {name: float(value) for name, value in (line.split() for line in proc.stdout.splitlines() if line.split()[:1] in (["import_s"], ["warm_s"]))}
+    imports = []
+    for line in proc.stderr.splitlines(): # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("   "): # Solo los de primer nivel (sin sangría extra)
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return timings, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque del servicio RAG")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("RAG_STARTUP_BUDGET_S", 1.0)))
+    parser.add_argument("--warm", action="store_true", help="Mide también la creación de los motores (necesita QDRANT)")
+    args = parser.parse_args()
+
+    runs = [_run(args.module, args.warm) for _ in range(args.runs)]
+    import_s = statistics.median(t["import_s"] for t, _ in runs)
+    print(f"import {args.module}: mediana {import_s * 1000:.0f} ms · máx {max(t['import_s'] for t, _ in runs) * 1000:.0f} ms "
+          f"({args.runs} procesos nuevos, presupuesto {args.budget * 1000:.0f} ms)")
+    if args.warm:
+        print(f"calentamiento de los motores: mediana {statistics.median(t['warm_s'] for t, _ in runs) * 1000:.0f} ms")
+
+    print(f"\n{'módulo':<40}{'ms':>10}")
+    for ms, name in sorted(runs[-1][1], reverse=True)[:args.top]: # El último proceso: cachés de disco (pyc) ya calientes
+        print(f"{name:<40}{ms:>10.1f}")
+
+    if import_s > args.budget:
+        print(f"\nPRESUPUESTO SUPERADO: {import_s:.2f} s > {args.budget:.2f} s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# BENCHMARK DEL ALMACÉN EXTERNO DE TEXTO
+
+# Compara guardar el texto de los chunks en el payload de QDRANT frente a guardarlo en ChunkTextStore (RAG_EXTERNAL_TEXT=1).
+# Mide el tamaño de los payloads (lo que QDRANT guarda y envía en cada búsqueda) y la latencia de búsqueda de extremo a extremo,
+# incluida la lectura extra del texto por id. Usa un QDRANT en memoria y chunks sintéticos, así que no toca la colección real.
+# Para correrlo: uv run python bench_textstore.py --points 20000 --top-k 5 --queries 200
+
+import argparse
+import json
+import random
+import statistics
+import string
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+from functions import QdrantStorage
+from textstore import ChunkTextStore
+from tenants import DEFAULT_TENANT
+
+
+def _fake_chunk(rng: random.Random, chars: int) -> str:
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(chars // 6)]
+    return " ".join(words)[:chars]
+
+
+def _fill(storage: QdrantStorage, vectors, texts, batch: int = 512):
+    for start in range(0, len(texts), batch):
+        ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"bench:{i}")) for i in range(start, min(start + batch, len(texts)))]
+        payloads = [{"source": f"doc_{i % 50}.pdf", "tenant": DEFAULT_TENANT, "text": texts[i], "chunk_index": i, "version": "bench"}
+                    for i in range(start, start + len(ids))]
+        storage.upsert(ids, vectors[start:start + len(ids)].tolist(), payloads)
+
+
+def _latency(storage: QdrantStorage, queries, top_k: int) -> dict:
+    times = []
+    for q in queries:
+        t0 = time.perf_counter()
+        storage.search(q.tolist(), top_k=top_k, tenant_id=DEFAULT_TENANT)
+        times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return {"p50_ms": statistics.median(times), "p95_ms": times[int(len(times) * 0.95) - 1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Texto en el payload de QDRANT vs almacén externo")
+    parser.add_argument("--points", type=int, default=20_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--chars", type=int, default=1000)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    texts = [_fake_chunk(rng, args.chars) for _ in range(args.points)]
+    vectors = np.random.default_rng(42).standard_normal((args.points, args.dim)).astype("float32")
+    queries = np.random.default_rng(7).standard_normal((args.queries, args.dim)).astype("float32")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name, store in (("payload", None), ("externo", ChunkTextStore(f"{tmp}/chunks.sqlite"))):
+            client = QdrantStorage.connect(url=":memory:")
+            storage = QdrantStorage(collection="bench", dim=args.dim, client=client, use_alias=False, text_store=store)
+            t0 = time.perf_counter()
+            _fill(storage, vectors, texts)
+            ingest_s = time.perf_counter() - t0
+
+            sample, _ = client.scroll("bench", limit=1000, with_payload=True)
+            payload_bytes = statistics.mean(len(json.dumps(p.payload, ensure_ascii=False).encode("utf-8")) for p in sample)
+            results[name] = {
+                "payload_medio_B": payload_bytes,
+                "payload_total_MB": payload_bytes * args.points / 1e6,
+                "respuesta_busqueda_B": payload_bytes * args.top_k, # Lo que viaja desde QDRANT en cada búsqueda
+                "ingesta_s": ingest_s,
+                **_latency(storage, queries, args.top_k),
+            }
+
+    print(f"{'modo':<10}{'payload B':>12}{'total MB':>11}{'búsqueda B':>13}{'ingesta s':>12}{'p50 ms':>9}{'p95 ms':>9}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['payload_medio_B']:>12.0f}{r['payload_total_MB']:>11.1f}{r['respuesta_busqueda_B']:>13.0f}"
+              f"{r['ingesta_s']:>12.2f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# 15. ALMACÉN DE BLOBS PARA LOS PASOS DE INNGEST
+
+# Inngest guarda (memoiza) la salida de cada paso y la vuelve a enviar en cada invocación de la función.
+# Si un paso devuelve todos los chunks de un PDF grande, cada ejecución arrastra megas de estado.
+# En este pipeline los pasos escriben los datos grandes aquí y solo se pasan REFERENCIAS pequeñas (claves y contadores).
+#   - LocalBlobStore: guarda cada blob como JSON comprimido en una carpeta local. Hace de "object store" (S3, GCS...)
+#     en desarrollo: cualquier otro almacén con put/get/delete puede sustituirlo sin tocar el workflow.
+
+import gzip
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+
+class LocalBlobStore:
+    def __init__(self, root: str = None):
+        self.root = Path(root or os.getenv("RAG_BLOB_DIR", ".cache/blobs")) # Carpeta compartida por los workers
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / f"{key}.json.gz").resolve()
+        if self.root.resolve() not in path.parents: # Evitamos claves que se salgan de la carpeta ("../")
+            raise ValueError(f"Clave de blob no válida: {key}")
+        return path
+
+    def put_json(self, key: str, obj) -> str: # Escribe de forma atómica (fichero temporal + renombrado) y devuelve la clave
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        tmp.replace(path)
+        return key
+
+    def get_json(self, key: str):
+        with gzip.open(self._path(key), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def delete_prefix(self, prefix: str): # Borra todos los blobs bajo un prefijo (p.ej. los lotes de un PDF)
+        folder = (self.root / prefix).resolve()
+        if self.root.resolve() in folder.parents and folder.is_dir():
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def purge_older_than(self, seconds: float) -> int: # Limpieza de blobs huérfanos (ejecuciones que fallaron a medias)
+        cutoff = time.time() - seconds
+        removed = 0
+        for path in self.root.rglob("*.json.gz"):
+            if path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+                removed += 1
+        for folder in sorted((p for p in self.root.rglob("*") if p.is_dir()), key=lambda p: len(p.parts), reverse=True):
+            # Carpetas de ejecuciones ya vacías (chunks/<tenant>/<trabajo>/...). Solo las antiguas: una recién creada
+            # puede estar a punto de recibir su primer blob
+            if folder.stat().st_mtime < cutoff and not any(folder.iterdir()):
+                folder.rmdir()
+        return removed
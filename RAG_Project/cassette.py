@@ -0,0 +1,154 @@
+# 27. GRABACIÓN Y REPRODUCCIÓN DE LAS LLAMADAS A OPENAI (CASSETTES)
+
+# Cualquier camino por VectorProcessor y RAGWorkflow llama a la API de OpenAI: medir latencias o comparar dos versiones
+# del pipeline salía caro, necesitaba red y el ruido de la API tapaba las diferencias.
+# En este pipeline el cliente de OpenAI puede usar un transporte HTTP (httpx) que graba y reproduce las peticiones:
+#   - RAG_CASSETTE=record: llama a OpenAI y guarda cada respuesta en disco (RAG_CASSETTE_DIR), con su latencia real.
+#   - RAG_CASSETTE=replay: responde desde disco sin red ni clave. Una petición no grabada es un error (CassetteMiss).
+#   - RAG_CASSETTE=auto: reproduce lo grabado y graba lo que falte.
+# La clave de cada grabación es el hash de método, ruta y cuerpo JSON (con las claves ordenadas). Las cabeceras no cuentan:
+# la clave de la API, el user-agent o el número de reintento no cambian la respuesta.
+# LATENCIA SIMULADA (RAG_CASSETTE_LATENCY) al reproducir, reproducible con RAG_CASSETTE_SEED:
+#   "none" (por defecto) | "recorded" | "fixed:200" | "lognormal:800:0.5" (mediana en ms y sigma)
+#   y por tipo de llamada: "embeddings=lognormal:150:0.3,chat=lognormal:1200:0.4"
+# Si la latencia simulada supera el timeout de la petición se lanza un timeout, como haría la red (deadlines.py lo nota).
+# Para medir ingesta y consultas sin red: uv run python bench_query.py (ver ese fichero)
+
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+MODES = ("off", "record", "replay", "auto")
+_KEPT_HEADERS = ("content-type", "x-ratelimit-") # Cabeceras que se guardan (rate_limit.py lee las de límites)
+_HOP_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+_stats = Counter() # Peticiones reproducidas, no encontradas y grabadas en este proceso (las lee bench_query.py)
+
+
+class CassetteMiss(RuntimeError): # Petición que no está grabada en modo replay
+    pass
+
+
+def _kind(path: str) -> str: # Tipo de llamada para la latencia simulada: "embeddings", "chat"...
+    parts = [p for p in path.split("/") if p and p != "v1"]
+    return parts[0] if parts else "other"
+
+
+class LatencyModel:
+    """Latencia simulada por tipo de llamada. Con la misma semilla y las mismas peticiones, las mismas latencias."""
+
+    def __init__(self, spec: str = "none", seed: int = 0):
+        self.rules = {}
+        for part in (spec or "none").split(","):
+            kind, _, rule = part.strip().rpartition("=")
+            self.rules[kind or "*"] = rule.strip()
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock() # Las consultas con hedging llaman desde varios hilos
+
+    def delay_s(self, kind: str, recorded_ms: float) -> float:
+        rule = self.rules.get(kind, self.rules.get("*", "none"))
+        name, *args = rule.split(":")
+        if name == "none":
+            return 0.0
+        if name == "recorded":
+            return recorded_ms / 1000
+        if name == "fixed":
+            return float(args[0]) / 1000
+        if name == "lognormal":
+            median_ms, sigma = float(args[0]), float(args[1]) if len(args) > 1 else 0.5
+            with self.lock:
+                return self.rng.lognormvariate(math.log(median_ms), sigma) / 1000
+        raise ValueError(f"Latencia simulada desconocida: {rule}. Opciones: none, recorded, fixed:ms, lognormal:ms:sigma")
+
+
+class CassetteTransport(httpx.BaseTransport):
+    def __init__(self, mode: str = "replay", folder: str = None, latency: LatencyModel = None, inner: httpx.BaseTransport = None):
+        if mode not in MODES[1:]:
+            raise ValueError(f"Modo de cassette desconocido: {mode}. Opciones: {MODES[1:]}")
+        self.mode = mode
+        self.folder = Path(folder or os.getenv("RAG_CASSETTE_DIR", "cassettes"))
+        self.latency = latency or LatencyModel()
+        self.inner = inner or (httpx.HTTPTransport() if mode != "replay" else None) # En replay nunca se abre una conexión
+
+    @staticmethod
+    def request_key(request: httpx.Request) -> str:
+        body = request.read()
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8") # Mismo JSON, mismo hash
+        except ValueError:
+            pass
+        return hashlib.sha256(request.method.encode() + b" " + request.url.path.encode() + b"\n" + body).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.folder / key[:2] / f"{key}.json"
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = self.request_key(request)
+        path = self._path(key)
+        if self.mode != "record" and path.exists():
+            _stats["hits"] += 1
+            return self._replay(request, json.loads(path.read_text(encoding="utf-8")))
+        if self.mode == "replay":
+            _stats["misses"] += 1
+            raise CassetteMiss(f"Petición no grabada: {request.method} {request.url.path} ({path}). Grábala con RAG_CASSETTE=record")
+
+        t0 = time.perf_counter()
+        response = self.inner.handle_request(request)
+        content = response.read()
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        if response.status_code < 500 and response.status_code != 429: # Los errores transitorios no se graban
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(json.dumps({
+                "method": request.method,
+                "path": request.url.path,
+                "status": response.status_code,
+                "headers": {k: v for k, v in response.headers.items() if k.lower().startswith(_KEPT_HEADERS)},
+                "body": base64.b64encode(content).decode("ascii"),
+                "elapsed_ms": round(elapsed_ms, 1),
+            }), encoding="utf-8")
+            tmp.replace(path) # Sin ficheros a medias si dos workers graban la misma petición
+            _stats["recorded"] += 1
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in _HOP_HEADERS] # content ya viene descomprimido
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    def _replay(self, request: httpx.Request, entry: dict) -> httpx.Response:
+        delay = self.latency.delay_s(_kind(entry["path"]), entry.get("elapsed_ms", 0.0))
+        timeout = (request.extensions.get("timeout") or {}).get("read")
+        if timeout is not None and delay > timeout: # La "red" no llega a tiempo: mismo error que un timeout real
+            time.sleep(timeout)
+            raise httpx.ReadTimeout("Latencia simulada mayor que el timeout de la petición", request=request)
+        if delay:
+            time.sleep(delay)
+        return httpx.Response(entry["status"], headers=entry["headers"], content=base64.b64decode(entry["body"]), request=request)
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+
+def stats() -> dict:
+    return {"hits": _stats["hits"], "misses": _stats["misses"], "recorded": _stats["recorded"]}
+
+
+def openai_client_kwargs() -> dict:
+    """
+    Argumentos extra para OpenAI(...) según RAG_CASSETTE. Vacío si está desactivado ("off", por defecto).
+    En replay no hace falta clave: se pone una ficticia si no hay OPENAI_API_KEY.
+    """
+    mode = os.getenv("RAG_CASSETTE", "off")
+    if mode == "off":
+        return {}
+    latency = LatencyModel(os.getenv("RAG_CASSETTE_LATENCY", "none"), seed=int(os.getenv("RAG_CASSETTE_SEED", 0)))
+    kwargs = {"http_client": httpx.Client(transport=CassetteTransport(mode, latency=latency))}
+    if mode == "replay" and not os.getenv("OPENAI_API_KEY"):
+        kwargs["api_key"] = "cassette-replay"
+    return kwargs
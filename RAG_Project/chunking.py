@@ -0,0 +1,254 @@
+# 8. CHUNKING Y CACHÉ DE TEXTO DE LOS PDFs
+
+# En este pipeline sustituimos el SentenceSplitter de LlamaIndex por un motor de chunking propio:
+#   - ESTRATEGIAS: Varias formas de trocear el texto (por frases, por ventana de tokens o por títulos/páginas).
+#     Todas comparten la misma interfaz, así que se pueden intercambiar con un simple nombre ("sentence", "token", "heading").
+#   - METADATOS: Cada chunk sabe de qué página viene y en qué posición (offsets), y eso viaja hasta el payload de QDRANT.
+#   - CACHÉ: Extraer el texto de un PDF es lento. Guardamos el texto de cada página en disco, identificado
+#     por el hash del fichero, para que repetir el chunking (experimentos, migraciones) no vuelva a leer el PDF.
+#   - PADRE-HIJO (RAG_PARENT_CHILD=1): el mismo chunk servía para buscar y para el prompt. Ahora se embeben hijos pequeños
+#     (RAG_CHILD_TOKENS) y cada uno apunta a su ventana padre (el chunk grande de siempre: sección o trozo de página),
+#     que es lo que llega al LLM. Los hijos nunca cruzan el límite de su padre.
+
+import hashlib
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from custom_types import RAGChunk
+from tokens import split_pieces
+
+
+# PASO 1. CACHÉ DEL TEXTO EXTRAÍDO
+
+def file_hash(path: str) -> str: # Hash SHA-256 del contenido del fichero (no del nombre), leído por bloques
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PageTextCache:
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = Path(cache_dir or os.getenv("RAG_PAGE_CACHE_DIR", ".cache/pdf_text")) # Carpeta donde guardamos el texto de cada PDF
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, digest: str) -> Path:
+        return self.cache_dir / f"{digest}.json"
+
+    def get(self, digest: str): # Devuelve las páginas guardadas para ese hash o None si no existen
+        path = self._path(digest)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def put(self, digest: str, pages: list) -> None: # Escribe en un fichero temporal y lo renombra para no dejar ficheros a medias
+        path = self._path(digest)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(pages, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    def load_pages(self, pdf_path: str) -> tuple[str, list]:
+        """
+        Devuelve (hash, páginas) de un PDF. Cada página es {"page": etiqueta, "text": texto}.
+        Solo se lee el PDF con PDFReader si su hash no está en la caché.
+        """
+        digest = file_hash(pdf_path)
+        pages = self.get(digest)
+        if pages is None:
+            from llama_index.readers.file import PDFReader # Solo lo importamos si de verdad hay que leer el PDF
+            docs = PDFReader().load_data(file=pdf_path)
+            pages = []
+            for i, d in enumerate(docs):
+                if d.text and d.text.strip():
+                    label = (d.metadata or {}).get("page_label", str(i + 1))
+                    pages.append({"page": str(label), "text": d.text})
+            self.put(digest, pages)
+        return digest, pages
+
+
+# PASO 2. ESTRATEGIAS DE CHUNKING
+
+def _pack(units: list, chunk_size: int, overlap: int) -> list[tuple[int, int]]:
+    """
+    Agrupa unidades consecutivas (inicio, fin, tokens) en ventanas de como mucho chunk_size tokens.
+    Cada ventana nueva repite las últimas unidades de la anterior hasta sumar 'overlap' tokens.
+    Devuelve la lista de (inicio, fin) en caracteres de cada ventana.
+    """
+    windows = []
+    i = 0
+    n = len(units)
+    while i < n:
+        total = 0
+        j = i
+        while j < n and (total + units[j][2] <= chunk_size or j == i):
+            total += units[j][2]
+            j += 1
+        windows.append((units[i][0], units[j - 1][1]))
+        if j >= n:
+            break
+        # Retrocedemos para generar el solapamiento, pero siempre avanzando al menos una unidad
+        back = 0
+        k = j
+        while k - 1 > i and back + units[k - 1][2] <= overlap:
+            back += units[k - 1][2]
+            k -= 1
+        i = k
+    return windows
+
+
+class Chunker(ABC): # Clase abstracta: define lo que toda estrategia de chunking debe saber hacer
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+        self.chunk_size = chunk_size       # Tamaño máximo del chunk en tokens
+        self.chunk_overlap = chunk_overlap # Tokens que se repiten entre chunks consecutivos
+
+    @abstractmethod
+    def split_page(self, text: str) -> list[tuple[int, int, str]]:
+        """Devuelve (inicio, fin, título) de cada chunk dentro del texto de una página."""
+
+    def split_text(self, text: str) -> list[str]: # Misma firma que SentenceSplitter.split_text
+        return [text[s:e].strip() for s, e, _ in self.split_page(text) if text[s:e].strip()]
+
+    def split_pages(self, pages: list) -> list[RAGChunk]: # Trocea todas las páginas conservando página y offsets
+        chunks = []
+        for page in pages:
+            text = page["text"]
+            for start, end, heading in self.split_page(text):
+                piece = text[start:end]
+                stripped = piece.strip()
+                if not stripped:
+                    continue
+                lead = len(piece) - len(piece.lstrip()) # Ajustamos los offsets al texto sin espacios
+                chunks.append(RAGChunk(
+                    text=stripped,
+                    page=page.get("page"),
+                    start_char=start + lead,
+                    end_char=start + lead + len(stripped),
+                    heading=heading,
+                ))
+        return chunks
+
+
+class TokenWindowChunker(Chunker): # Ventanas fijas de tokens, sin mirar frases. La más rápida.
+    def split_page(self, text):
+        return [(s, e, None) for s, e in _pack(split_pieces(text), self.chunk_size, self.chunk_overlap)]
+
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…;:])\s+|\n\s*\n") # Final de frase o párrafo
+
+
+class SentenceChunker(Chunker): # Agrupa frases completas, como SentenceSplitter
+    def _sentences(self, text: str, offset: int = 0) -> list[tuple[int, int, int]]:
+        units = []
+        start = 0
+        bounds = [m.end() for m in _SENTENCE_END_RE.finditer(text)] + [len(text)]
+        for end in bounds:
+            if end <= start:
+                continue
+            pieces = split_pieces(text[start:end])
+            tokens = sum(p[2] for p in pieces)
+            if tokens > self.chunk_size: # Frase más larga que un chunk: la partimos por tokens
+                for s, e in _pack(pieces, self.chunk_size, 0):
+                    units.append((offset + start + s, offset + start + e, sum(p[2] for p in pieces if s <= p[0] < e)))
+            elif tokens:
+                units.append((offset + start, offset + end, tokens))
+            start = end
+        return units
+
+    def split_page(self, text):
+        return [(s, e, None) for s, e in _pack(self._sentences(text), self.chunk_size, self.chunk_overlap)]
+
+
+# Líneas que parecen títulos: "1.2 Instalación", "CAPÍTULO 3", "Anexo A: Garantía"...
+_HEADING_RE = re.compile(
+    r"^[ \t]*(?:\d+(?:\.\d+)*\.?[ \t]+\S[^\n]{0,80}|[A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ0-9 \t\-:,]{3,80}|(?:Cap[ií]tulo|Anexo|Secci[oó]n)[ \t]+[^\n]{1,80})[ \t]*$",
+    re.MULTILINE,
+)
+
+
+class HeadingChunker(SentenceChunker): # Respeta páginas y títulos: un chunk nunca mezcla dos secciones
+    def split_page(self, text):
+        starts = [m.start() for m in _HEADING_RE.finditer(text)]
+        if not starts or starts[0] != 0:
+            starts = [0] + starts
+        bounds = starts + [len(text)]
+
+        result = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            section = text[a:b]
+            first_line = section.strip().split("\n", 1)[0].strip()
+            heading = first_line if _HEADING_RE.match(section.lstrip("\n")) else None
+            for s, e in _pack(self._sentences(section, offset=a), self.chunk_size, self.chunk_overlap):
+                result.append((s, e, heading))
+        return result
+
+
+class ParentChildChunker: # Dos niveles: padres grandes para el prompt e hijos pequeños dentro de cada padre para la búsqueda
+    def __init__(self, parent: Chunker, child: Chunker):
+        self.parent = parent
+        self.child = child
+        self.chunk_size = child.chunk_size # El tamaño que se embebe es el del hijo
+
+    def split_text(self, text: str) -> list[str]:
+        return [c.text for c in self.split_pages([{"text": text}])]
+
+    def split_pages(self, pages: list) -> list[RAGChunk]:
+        """Devuelve los hijos; cada uno lleva la posición (parent) y el texto (parent_text) de su ventana padre."""
+        children = []
+        for j, parent in enumerate(self.parent.split_pages(pages)):
+            for start, end, heading in self.child.split_page(parent.text):
+                piece = parent.text[start:end]
+                stripped = piece.strip()
+                if not stripped:
+                    continue
+                lead = len(piece) - len(piece.lstrip())
+                children.append(RAGChunk(
+                    text=stripped,
+                    page=parent.page,
+                    start_char=parent.start_char + start + lead, # Offsets respecto a la página, como el resto de chunks
+                    end_char=parent.start_char + start + lead + len(stripped),
+                    heading=heading or parent.heading,
+                    parent=j,
+                    parent_text=parent.text,
+                ))
+        return children
+
+
+CHUNKERS = { # Registro de estrategias disponibles
+    "sentence": SentenceChunker,
+    "token": TokenWindowChunker,
+    "heading": HeadingChunker,
+}
+
+
+def get_chunker(name: str = "sentence", chunk_size: int = 1000, chunk_overlap: int = 200) -> Chunker:
+    if name not in CHUNKERS:
+        raise ValueError(f"Estrategia de chunking desconocida: {name}. Opciones: {sorted(CHUNKERS)}")
+    return CHUNKERS[name](chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def get_splitter(name: str = "sentence", chunk_size: int = 1000, chunk_overlap: int = 200):
+    """
+    Chunker de la ingesta: la estrategia elegida o, con RAG_PARENT_CHILD=1, la versión padre-hijo de esa misma estrategia.
+    Los padres tienen el tamaño de siempre (chunk_size) y sin solapamiento (RAG_PARENT_OVERLAP), para no repetir texto en el prompt.
+    """
+    if os.getenv("RAG_PARENT_CHILD", "0") != "1":
+        return get_chunker(name, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return ParentChildChunker(
+        parent=get_chunker(name, chunk_size=chunk_size, chunk_overlap=int(os.getenv("RAG_PARENT_OVERLAP", 0))),
+        child=get_chunker(name, chunk_size=int(os.getenv("RAG_CHILD_TOKENS", 200)), chunk_overlap=int(os.getenv("RAG_CHILD_OVERLAP", 40))),
+    )
+
+
+# PASO 4. TROCEADO EN OTRO PROCESO (ingesta de carpetas: un PDF por núcleo)
+
+def chunk_file(path: str, chunker: str = "sentence", chunk_size: int = 1000, chunk_overlap: int = 200):
+    """
+    Lee (o toma de la caché) y trocea un PDF. Es una función de módulo para que ProcessPoolExecutor pueda enviarla a otro proceso.
+    Devuelve (hash del PDF, lista de RAGChunk).
+    """
+    digest, pages = PageTextCache().load_pages(path)
+    return digest, get_splitter(chunker, chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_pages(pages)
@@ -8,15 +8,59 @@ from typing import List, Optional, Dict
 class RAGChunkAndSrc(pydantic.BaseModel):
     chunks: List[str]
     source_id: Optional[str] =None
+    metadata: Optional[List[Dict]] = None # Metadatos de cada chunk (página, offsets, hash del PDF...) que acaban en el payload
+    job_id: Optional[str] = None # Trabajo de ingesta al que se reporta el progreso (id del evento)
+    tenant_id: Optional[str] = None # Cliente dueño del PDF (tenants.py)
+    parents: List[str] = [] # Texto de las ventanas padre (recuperación padre-hijo); metadata[i]["parent"] es la posición del padre
+
+
+class RAGChunkRef(pydantic.BaseModel): # Referencia compacta a los chunks de un PDF guardados en el almacén de blobs
+    source_id: Optional[str] = None
+    version: Optional[str] = None # Hash del contenido: última parte del prefijo de los blobs (chunks/<tenant>/<trabajo>/<version>)
+    batches: int = 0              # Número de lotes guardados (.../<version>/batch_00000 ...)
+    count: int = 0                # Número total de chunks
+    job_id: Optional[str] = None
+    tenant_id: Optional[str] = None
+    parents: int = 0              # Número de ventanas padre guardadas (.../<version>/parents)
+
+
+class RAGChunkRefList(pydantic.BaseModel): # Referencias de todos los PDFs de una ingesta de carpeta (mismo orden que los ficheros)
+    refs: List[RAGChunkRef]
 
 
 class RAGUpsertResult(pydantic.BaseModel):
     ingested:int
+    version: Optional[str] = None # Versión (hash del contenido) con la que se ha ingestado el PDF
+    source_id: Optional[str] = None
+    duplicates_dropped: int = 0 # Casi duplicados dentro del PDF (descartados)
+    duplicates_aliased: int = 0 # Casi duplicados de otros PDFs (guardados reutilizando el vector del original)
+    embeddings_saved: int = 0   # Embeddings que no se han pedido gracias a la deduplicación
+    job_id: Optional[str] = None
+    tenant_id: Optional[str] = None
+
+
+class RAGUpsertBatchResult(pydantic.BaseModel):
+    results: List[RAGUpsertResult] # Un resultado por PDF del lote
 
 
 class RAGSearchResult(pydantic.BaseModel):
     contexts: List[str]
     sources: List[str]
+    scores: List[float] = [] # Similitud de cada contexto (mismo orden que contexts)
+    degradations: List[str] = [] # Hedges y rutas degradadas por falta de plazo (deadlines.py)
+
+
+class RAGCondenseResult(pydantic.BaseModel): # Pregunta condensada con presupuesto de latencia
+    query: str
+    degradations: List[str] = []
+
+
+class RAGAnswerResult(pydantic.BaseModel): # Respuesta del LLM (o su sustituta si no llegó a tiempo)
+    answer: str
+    sources: List[str]
+    num_contexts: int
+    degradations: List[str] = []
+    context_tokens: int = 0 # Tamaño del contexto recuperado que se mandó al LLM
 
 
 class RAGQueryResult(pydantic.BaseModel):
@@ -25,3 +69,55 @@ class RAGQueryResult(pydantic.BaseModel):
     num_contexts : int
     chat_history: Optional[List[Dict[str, str]]] = None
 
+
+
+class RAGBatchSearchResult(pydantic.BaseModel):
+    questions: List[str]
+    results: List[RAGSearchResult]
+
+
+class RAGBatchItem(pydantic.BaseModel):
+    question: str
+    answer: str
+    sources: List[str]
+    num_contexts: int
+
+
+class RAGBatchQueryResult(pydantic.BaseModel):
+    results: List[RAGBatchItem]
+
+
+class RAGChunk(pydantic.BaseModel):
+    text: str
+    page: Optional[str] = None       # Etiqueta de la página del PDF de la que sale el chunk
+    start_char: int = 0              # Offset de inicio dentro del texto de la página
+    end_char: int = 0                # Offset de fin dentro del texto de la página
+    heading: Optional[str] = None    # Título de la sección (solo con la estrategia "heading")
+    parent: Optional[int] = None     # Posición de su ventana padre (solo con RAG_PARENT_CHILD=1, ver chunking.py)
+    parent_text: Optional[str] = None # Texto de la ventana padre (el mismo objeto para todos sus hijos)
+
+
+class RAGMemoryState(pydantic.BaseModel):
+    summary: str = ""                 # Resumen incremental de los mensajes antiguos
+    summarized: int = 0               # Cuántos mensajes del historial recibido se han plegado en el resumen
+    window: List[Dict[str, str]] = [] # Mensajes recientes que se envían literalmente al LLM
+
+
+class RAGFAQHit(pydantic.BaseModel): # Respuesta pre-calculada y aprobada que coincide con la pregunta (faq.py)
+    faq_id: Optional[str] = None
+    answer: str = ""
+    sources: List[str] = []
+    score: float = 0.0
+
+
+class RAGFAQCandidate(pydantic.BaseModel): # Intención frecuente minada de la auditoría
+    source_id: Optional[str] = None  # PDF de las preguntas (None = preguntas sin PDF)
+    tenant_id: Optional[str] = None  # Cliente que hizo las preguntas
+    question: str                    # Pregunta más representativa del grupo
+    members: List[str]               # Preguntas del grupo (para el centroide)
+    count: int
+    cohesion: float
+
+
+class RAGFAQCandidates(pydantic.BaseModel):
+    candidates: List[RAGFAQCandidate]
@@ -0,0 +1,214 @@
+# 21. PRESUPUESTO DE LATENCIA DE LAS CONSULTAS (SLO)
+
+# rag_query_pdf_ai no tenía plazos: una respuesta lenta de OpenAI o de QDRANT (timeout=30) dejaba al usuario esperando
+# hasta los 120 s de wait_for_run_output. En este pipeline cada consulta tiene un PRESUPUESTO de tiempo:
+#   - PLAZO: RAG_QUERY_BUDGET_S segundos (por defecto 20) contados desde que se envió el evento, así que la cola de Inngest también cuenta.
+#     Se reparte entre los pasos (condensación, embedding, búsqueda y LLM) con RAG_BUDGET_SHARES. Los plazos son acumulados:
+#     lo que un paso no gasta lo aprovechan los siguientes.
+#   - HEDGING: si el embedding o la búsqueda tardan más que su p95 reciente, lanzamos una copia de la misma petición
+#     y nos quedamos con la primera que responda (solo en llamadas idempotentes y baratas; nunca en el LLM).
+#     Las copias van a su propio grupo de hilos, pequeño (RAG_HEDGE_WORKERS): las que pierden no se pueden cancelar y no deben
+#     ocupar los hilos de las consultas. Si todos sus hilos están ocupados no se lanza la copia ("hedge_skipped" en /metrics).
+#   - DEGRADACIÓN: si un paso se queda sin plazo, la consulta sigue por una ruta más barata: pregunta sin condensar,
+#     menos contextos para el LLM, la última respuesta cacheada para esa pregunta o un mensaje de "servicio lento".
+# Cada hedge y cada degradación queda en la auditoría (campo "degradations") y en las métricas que la API expone en /metrics.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from tracing import propagate
+
+STEPS = ("condense", "embed", "search", "llm") # Pasos de la consulta, en orden
+DEFAULT_SHARES = {"condense": 0.15, "embed": 0.10, "search": 0.10, "llm": 0.65}
+DEFAULT_HEDGE_DELAYS = {"embed": 1.0, "search": 0.5} # Retardo del hedge mientras no hay muestras suficientes para el p95
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget_s: float = None, started_at: float = None, shares: dict = None):
+        self.budget_s = float(budget_s or os.getenv("RAG_QUERY_BUDGET_S", 20))
+        self.started_at = started_at or time.time()
+        shares = shares or json.loads(os.getenv("RAG_BUDGET_SHARES", "null") or "null") or DEFAULT_SHARES
+        total = sum(shares.get(step, 0) for step in STEPS) or 1.0
+        acc, self.marks = 0.0, {}
+        for step in STEPS: # Instante (relativo al inicio) en el que debe haber terminado cada paso
+            acc += shares.get(step, 0) / total
+            self.marks[step] = acc * self.budget_s
+
+    @classmethod
+    def from_event(cls, ts_ms: int = None, budget_s: float = None) -> "Deadline":
+        """El plazo empieza cuando se envió el evento (ctx.event.ts, en ms): igual en todas las re-ejecuciones de Inngest."""
+        return cls(budget_s=budget_s, started_at=ts_ms / 1000 if ts_ms else None)
+
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
+
+    def remaining(self) -> float:
+        return max(0.0, self.budget_s - self.elapsed())
+
+    def step_timeout(self, step: str) -> float: # Segundos que le quedan a un paso para cumplir su plazo acumulado
+        return max(0.0, min(self.marks[step], self.budget_s) - self.elapsed())
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 500, min_samples: int = 20):
+        self.window = window # Solo las últimas muestras: el p95 sigue a la carga actual
+        self.min_samples = min_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def observe(self, op: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(op, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, op: str, q: float = 0.95):
+        with self.lock:
+            values = sorted(self.samples.get(op, ()))
+        if len(values) < self.min_samples:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def hedge_delay(self, op: str) -> float:
+        p95 = self.percentile(op, 0.95)
+        return max(0.05, p95) if p95 is not None else float(os.getenv("RAG_HEDGE_DEFAULT_S", DEFAULT_HEDGE_DELAYS.get(op, 1.0)))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            ops = list(self.samples)
+        return {
+            op: {"count": len(self.samples[op]), "p50_s": self.percentile(op, 0.5), "p95_s": self.percentile(op, 0.95)}
+            for op in ops
+        }
+
+
+class QueryMetrics:
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self.degradations = Counter()
+        self.queries = 0
+        self.within_budget = 0
+        self.lock = threading.Lock()
+
+    def record_query(self, seconds: float, budget_s: float, degradations: list):
+        self.latency.observe("total", seconds)
+        with self.lock:
+            self.queries += 1
+            self.within_budget += seconds <= budget_s
+            self.degradations.update(degradations or [])
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            queries, ok, degradations = self.queries, self.within_budget, dict(self.degradations)
+        return {
+            "queries": queries,
+            "slo_ratio": ok / queries if queries else None, # Fracción de consultas que cumplieron su presupuesto
+            "degradations": degradations,
+            "latency": self.latency.snapshot(),
+        }
+
+
+metrics = QueryMetrics() # Instancia única del proceso (la lee /metrics)
+
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_DEADLINE_WORKERS", 16)), thread_name_prefix="deadline")
+_HEDGE_WORKERS = int(os.getenv("RAG_HEDGE_WORKERS", 4))
+_hedge_pool = ThreadPoolExecutor(max_workers=_HEDGE_WORKERS, thread_name_prefix="hedge")
+_hedge_slots = threading.BoundedSemaphore(_HEDGE_WORKERS) # Copias en vuelo (incluidas las que ya perdieron y siguen corriendo)
+
+
+def _submit_hedge(fn):
+    """Lanza la copia en el grupo de hedges si tiene un hilo libre. Si no, devuelve None: mejor sin copia que en cola."""
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _hedge_pool.submit(fn)
+    except Exception:
+        _hedge_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def call_with_deadline(op: str, fn, timeout: float, hedge: bool = True):
+    """
+    Ejecuta fn() con un plazo de timeout segundos. Con hedge=True, si no ha respondido tras el p95 de op,
+    lanza una segunda copia y devuelve la primera respuesta correcta. Devuelve (resultado, hubo_hedge).
+    Las llamadas que pierden no se pueden cancelar: terminan en segundo plano y su resultado se descarta.
+    """
+    if timeout <= 0:
+        raise DeadlineExceeded(f"{op}: sin presupuesto")
+    start = time.monotonic()
+    submitted = {_pool.submit(propagate(fn)): start}
+    hedged = False
+    delay = metrics.latency.hedge_delay(op)
+    if hedge and delay < timeout:
+        done, _ = wait(submitted, timeout=delay)
+        if not done:
+            future = _submit_hedge(propagate(fn))
+            if future is None:
+                with metrics.lock:
+                    metrics.degradations["hedge_skipped"] += 1
+            else:
+                submitted[future] = time.monotonic()
+                hedged = True
+
+    error = None
+    while True:
+        pending = [f for f in submitted if not f.done()]
+        for future in (f for f in submitted if f.done()):
+            if future.exception() is None:
+                metrics.latency.observe(op, time.monotonic() - submitted[future])
+                return future.result(), hedged
+            error = future.exception()
+        left = timeout - (time.monotonic() - start)
+        if not pending:
+            raise error
+        if left <= 0:
+            metrics.latency.observe(op, timeout) # Cuenta para el p95: si no, los timeouts lo harían parecer mejor de lo que es
+            raise DeadlineExceeded(f"{op}: más de {timeout:.2f} s")
+        wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+
+
+class AnswerCache:
+    """Última respuesta buena por pregunta (ya condensada) y PDF. Solo se sirve como degradación cuando el LLM no llega a tiempo."""
+
+    def __init__(self, path: str = None, ttl_seconds: float = None):
+        path = path or os.getenv("RAG_ANSWER_CACHE", ".cache/answers.sqlite")
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RAG_ANSWER_CACHE_TTL_S", 7 * 24 * 3600))
+        self.conn = sqlite3.connect(path, check_same_thread=False) # Compartida entre hilos, protegida con el lock
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT NOT NULL, sources TEXT, created_at REAL)")
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(question: str, source_id) -> str: # Misma clave aunque cambien mayúsculas, espacios o signos
+        normalized = " ".join(re.findall(r"\w+", question.lower()))
+        return hashlib.sha256(f"{source_id or '*'}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, question: str, source_id=None):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT answer, sources, created_at FROM answers WHERE key = ?", (self._key(question, source_id),)
+            ).fetchone()
+        if row is None or time.time() - row[2] > self.ttl_seconds:
+            return None
+        return {"answer": row[0], "sources": json.loads(row[1] or "[]")}
+
+    def put(self, question: str, source_id, answer: str, sources: list):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, sources, created_at) VALUES (?, ?, ?, ?)",
+                (self._key(question, source_id), answer, json.dumps(sources, ensure_ascii=False), time.time()),
+            )
+            self.conn.commit()
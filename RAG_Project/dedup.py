@@ -0,0 +1,150 @@
+# 19. ELIMINACIÓN DE CHUNKS CASI DUPLICADOS
+
+# Los PDFs repiten mucho texto: cabeceras, pies legales, secciones copiadas entre versiones de un mismo documento...
+# Cada copia se convertía en embedding y en un punto de QDRANT. En este pipeline, entre el chunking y los embeddings:
+#   - MINHASH: cada chunk se resume en una firma de num_perm enteros. Dos chunks con muchos trozos de 3 palabras en común
+#     (similitud de Jaccard alta) tienen firmas que coinciden en casi todas las posiciones, aunque cambie un número de página.
+#   - LSH: la firma se parte en bandas; dos chunks solo se comparan si coinciden en alguna banda entera (no comparamos todos con todos).
+#   - DENTRO DE UN PDF: el casi duplicado se descarta (no aporta nada al contexto del LLM).
+#   - ENTRE PDFs: el casi duplicado se guarda como ALIAS: conserva su texto y su "source" (la atribución no se pierde),
+#     pero reutiliza el vector del chunk original (payload "duplicate_of") en lugar de pedir otro embedding.
+# Las firmas de los chunks ya ingestados se guardan en un SQLite (por colección física y cliente), así el alias funciona entre
+# ingestas sin que un cliente reutilice nunca los vectores de otro.
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+_PRIME = (1 << 61) - 1 # Primo de Mersenne para las permutaciones (a*h + b) mod p
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle: int = 3, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm debe ser múltiplo de bands")
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64) # a*h cabe en 64 bits (h es de 32)
+        self.b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+
+    def _shingles(self, text: str) -> np.ndarray:
+        words = re.findall(r"\w+", text.lower())
+        k = self.shingle
+        grams = {" ".join(words[i:i + k]) for i in range(max(1, len(words) - k + 1))} or {""}
+        return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self._shingles(text)
+        perms = (np.outer(hashes, self.a) + self.b) % _PRIME # Una fila por trozo, una columna por permutación
+        return (perms.min(axis=0) & 0xFFFFFFFF).astype(np.uint32)
+
+    def buckets(self, sig: np.ndarray) -> list[str]: # Una clave por banda: "banda:hash de sus filas"
+        return [
+            f"{band}:{hashlib.blake2b(sig[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).hexdigest()}"
+            for band in range(self.bands)
+        ]
+
+    @staticmethod
+    def similarity(sig1: np.ndarray, sig2: np.ndarray) -> float: # Estimación de la similitud de Jaccard
+        return float(np.mean(sig1 == sig2))
+
+
+class BatchIndex:
+    """Índice LSH en memoria para los chunks de una misma ingesta (todavía no están en QDRANT)."""
+
+    def __init__(self, hasher: MinHasher, threshold: float):
+        self.hasher = hasher
+        self.threshold = threshold
+        self.buckets = {}
+        self.entries = []
+
+    def find(self, sig: np.ndarray):
+        """Devuelve (posición, source) del chunk más parecido por encima del umbral, o None."""
+        candidates = {pos for key in self.hasher.buckets(sig) for pos in self.buckets.get(key, ())}
+        best = max(candidates, key=lambda pos: self.hasher.similarity(sig, self.entries[pos][1]), default=None)
+        if best is None or self.hasher.similarity(sig, self.entries[best][1]) < self.threshold:
+            return None
+        return self.entries[best][0], self.entries[best][2]
+
+    def add(self, sig: np.ndarray, position: int, source: str):
+        index = len(self.entries)
+        self.entries.append((position, sig, source))
+        for key in self.hasher.buckets(sig):
+            self.buckets.setdefault(key, []).append(index)
+
+
+class DedupIndex:
+    def __init__(self, path: str = None, threshold: float = None, hasher: MinHasher = None):
+        path = path or os.getenv("RAG_DEDUP_INDEX", ".cache/dedup.sqlite")
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold if threshold is not None else float(os.getenv("RAG_DEDUP_THRESHOLD", 0.85))
+        self.hasher = hasher or MinHasher()
+        self.conn = sqlite3.connect(path, check_same_thread=False) # Compartida entre hilos, protegida con el lock
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sigs (ns TEXT NOT NULL, id TEXT NOT NULL, source TEXT, version TEXT, sig BLOB NOT NULL, "
+            "PRIMARY KEY (ns, id))"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS bands (ns TEXT NOT NULL, bucket TEXT NOT NULL, id TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands (ns, bucket)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sigs_source ON sigs (ns, source)")
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def namespace(collection: str, tenant_id: str) -> str: # Firmas por colección física y cliente (los alias nunca cruzan de un cliente a otro)
+        return f"{collection}:{tenant_id}"
+
+    def signature(self, text: str) -> np.ndarray:
+        return self.hasher.signature(text)
+
+    def batch(self) -> BatchIndex:
+        return BatchIndex(self.hasher, self.threshold)
+
+    def find(self, ns: str, sig: np.ndarray, exclude_source: str = None):
+        """
+        Id del punto ya ingestado más parecido (por encima del umbral), o None.
+        Se excluye el propio PDF: sus versiones anteriores se borran al activar la nueva.
+        """
+        keys = self.hasher.buckets(sig)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT DISTINCT s.id, s.sig FROM bands b JOIN sigs s ON s.ns = b.ns AND s.id = b.id "
+                f"WHERE b.ns = ? AND b.bucket IN ({','.join('?' * len(keys))}) AND s.source IS NOT ?",
+                [ns, *keys, exclude_source],
+            ).fetchall()
+        best, best_sim = None, self.threshold
+        for point_id, blob in rows:
+            sim = self.hasher.similarity(sig, np.frombuffer(blob, dtype=np.uint32))
+            if sim >= best_sim:
+                best, best_sim = point_id, sim
+        return best
+
+    def add(self, ns: str, ids: list, sigs: list, sources: list, versions: list):
+        sig_rows = [(ns, str(ids[i]), sources[i], versions[i], sigs[i].tobytes()) for i in range(len(ids))]
+        band_rows = [(ns, key, str(ids[i])) for i in range(len(ids)) for key in self.hasher.buckets(sigs[i])]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO sigs (ns, id, source, version, sig) VALUES (?, ?, ?, ?, ?)", sig_rows)
+            self.conn.executemany("INSERT INTO bands (ns, bucket, id) VALUES (?, ?, ?)", band_rows)
+            self.conn.commit()
+
+    def _delete_where(self, where: str, params: tuple):
+        with self.lock:
+            self.conn.execute(f"DELETE FROM bands WHERE (ns, id) IN (SELECT ns, id FROM sigs WHERE {where})", params)
+            self.conn.execute(f"DELETE FROM sigs WHERE {where}", params)
+            self.conn.commit()
+
+    def delete_ids(self, ns: str, ids: list): # Puntos que ya no existen en QDRANT (limpieza perezosa)
+        for point_id in ids:
+            self._delete_where("ns = ? AND id = ?", (ns, str(point_id)))
+
+    def delete_other_versions(self, ns: str, source: str, version: str): # Acompaña al reemplazo atómico de un PDF
+        self._delete_where("ns = ? AND source = ? AND version IS NOT ?", (ns, source, version))
@@ -0,0 +1,49 @@
+# 13. CACHÉ DE EMBEDDINGS
+
+# Pedir a OpenAI el embedding de un texto que ya hemos convertido antes es pagar dos veces por lo mismo.
+# En este pipeline guardamos cada embedding en un fichero SQLite local, identificado por (modelo, dimensión, hash del texto).
+# Lo aprovechan la reingesta de un PDF que apenas cambia, las migraciones de colección y las preguntas repetidas.
+
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from pathlib import Path
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = None):
+        path = path or os.getenv("RAG_EMBED_CACHE", ".cache/embeddings.sqlite")
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False) # Compartida entre hilos, protegida con el lock
+        self.conn.execute("PRAGMA journal_mode=WAL") # Permite leer mientras otro proceso escribe
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: list) -> dict:
+        """Devuelve {posición: vector} para los textos que ya están en la caché."""
+        keys = [self._key(model, t) for t in texts]
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), 500): # SQLite limita el número de parámetros por consulta
+                block = keys[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(block))})", block
+                ).fetchall()
+                found.update(rows)
+        result = {}
+        for i, key in enumerate(keys):
+            if key in found:
+                result[i] = array("f", found[key]).tolist()
+        return result
+
+    def put_many(self, model: str, texts: list, vectors: list):
+        rows = [(self._key(model, t), array("f", v).tobytes()) for t, v in zip(texts, vectors)]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self.conn.commit()
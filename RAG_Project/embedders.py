@@ -0,0 +1,233 @@
+# 17. MOTORES DE EMBEDDINGS INTERCAMBIABLES
+
+# VectorProcessor dependía siempre de OpenAI (text-embedding-3-large): cada ingesta y cada consulta esperaba a una API remota.
+# En este pipeline el "traductor" de texto a vector es una pieza intercambiable (Embedder):
+#   - OpenAIEmbedder: el de siempre (calidad alta, red y coste por token).
+#   - LocalSVDEmbedder: 100% local y en CPU. HashingVectorizer (sin vocabulario que guardar) + TF-IDF + SVD truncada,
+#     ajustado sobre el propio corpus y guardado en disco con joblib. Sirve para niveles baratos, entornos sin internet y pruebas.
+#     Las ingestas grandes se codifican por lotes en un grupo de PROCESOS (RAG_LOCAL_EMBED_WORKERS, RAG_LOCAL_EMBED_BATCH):
+#     HashingVectorizer tokeniza en Python con el GIL tomado, así que los hilos no escalaban (ver bench_embedders.py).
+# Se elige con RAG_EMBEDDER ("openai" o "local") y se puede cambiar por colección con RAG_EMBEDDER_<COLECCIÓN> (p.ej. RAG_EMBEDDER_DOCS).
+# Ojo: los vectores de motores distintos no son comparables. Cambiar de motor en una colección existente = migración (migrate.py).
+# Para ajustar el modelo local: uv run python embedders.py fit --pdf-dir uploads   (o --collection docs para usar los chunks ya ingestados)
+
+import argparse
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from rate_limit import rate_limiter, INTERACTIVE
+from tokens import count_tokens
+
+
+class Embedder(ABC):
+    name: str # Identifica el modelo en la caché de embeddings: si cambia, los vectores cacheados no se reutilizan
+    dim: int
+
+    @abstractmethod
+    def embed(self, texts: list[str], priority: str = INTERACTIVE) -> list[list[float]]:
+        """Convierte los textos en vectores (sin caché: de eso se encarga VectorProcessor)."""
+
+
+class OpenAIEmbedder(Embedder):
+    def __init__(self, client, model: str = "text-embedding-3-large", dim: int = 3072):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.name = f"{model}:{dim}"
+
+    def embed(self, texts: list[str], priority: str = INTERACTIVE) -> list[list[float]]:
+        vectors = []
+        for batch in self._request_batches(texts): # Varias peticiones si el lote supera los límites por petición
+            extra = {"dimensions": self.dim} if self.dim != 3072 else {} # Dimensión reducida (solo modelos text-embedding-3)
+            response = rate_limiter.call( # Pasamos por el limitador: espera su turno y reintenta los 429
+                self.model,
+                lambda: self.client.embeddings.with_raw_response.create( # Creación de embeddings (raw para leer las cabeceras de límites)
+                    model=self.model,
+                    input=batch,
+                    **extra,
+                ),
+                tokens=sum(count_tokens(t) for t in batch), # Coste estimado en tokens
+                priority=priority, # "interactive" para consultas, "batch" para ingesta
+            )
+            vectors.extend(item.embedding for item in response.data)
+        return vectors
+
+    @staticmethod
+    def _request_batches(texts: list, max_inputs: int = 512, max_tokens: int = 250_000):
+        """Agrupa los textos en peticiones que respetan el máximo de entradas y de tokens por petición de OpenAI."""
+        batch, used = [], 0
+        for text in texts:
+            tokens = count_tokens(text)
+            if batch and (len(batch) >= max_inputs or used + tokens > max_tokens):
+                yield batch
+                batch, used = [], 0
+            batch.append(text)
+            used += tokens
+        if batch:
+            yield batch
+
+
+_worker_model = None # Modelo local de cada proceso del grupo: se carga una vez por proceso, no en cada lote
+
+
+def _init_worker(path: str):
+    global _worker_model
+    _worker_model = LocalSVDEmbedder(path, workers=1)
+    _worker_model.svd = None # Al proceso le basta la proyección: libera la copia en float64 de components_
+
+
+def _encode_batch(texts: list[str]): # Función de módulo para que ProcessPoolExecutor pueda enviarla a otro proceso
+    return _worker_model._encode(texts)
+
+
+class LocalSVDEmbedder(Embedder):
+    def __init__(self, path: str, dim: int = 256, n_features: int = 2 ** 18, batch_size: int = None, workers: int = None):
+        self.path = Path(path)
+        self.requested_dim = dim
+        self.n_features = n_features
+        self.batch_size = batch_size or int(os.getenv("RAG_LOCAL_EMBED_BATCH", 512))
+        self.workers = workers or int(os.getenv("RAG_LOCAL_EMBED_WORKERS", 0)) or os.cpu_count() or 1
+        self.pool = None # Grupo de procesos (se crea con la primera ingesta grande) y modelo con el que se creó
+        self.pool_model = None
+        self.vectorizer = None # Se crea al ajustar o cargar el modelo (sklearn solo se importa si se usa este motor)
+        self.tfidf = None
+        self.svd = None
+        self.projection = None # components_ de la SVD traspuesta y en float32, preparada una sola vez
+        self.dim = dim
+        self.name = "local-svd:sin-ajustar"
+        if self.path.exists():
+            self.load()
+
+    def _hashing(self):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        # Sin vocabulario: el mismo texto da siempre las mismas columnas, aunque el modelo se ajuste en otra máquina
+        return HashingVectorizer(n_features=self.n_features, ngram_range=(1, 2), alternate_sign=False, norm=None, strip_accents="unicode")
+
+    def fit(self, texts: list[str]):
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import TfidfTransformer
+
+        self.vectorizer = self._hashing()
+        counts = self.vectorizer.transform(texts)
+        self.tfidf = TfidfTransformer(sublinear_tf=True).fit(counts)
+        dim = min(self.requested_dim, max(1, counts.shape[0] - 1)) # La SVD no puede tener más componentes que documentos
+        self.svd = TruncatedSVD(n_components=dim, algorithm="randomized", random_state=42).fit(self.tfidf.transform(counts))
+        self.save()
+        return self
+
+    def save(self):
+        import joblib
+        self.close() # Los procesos tienen cargado el modelo anterior
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        joblib.dump({"n_features": self.n_features, "tfidf": self.tfidf, "svd": self.svd}, self.path)
+        self._set_identity()
+
+    def load(self):
+        import joblib
+        state = joblib.load(self.path)
+        self.n_features = state["n_features"]
+        self.vectorizer = self._hashing()
+        self.tfidf, self.svd = state["tfidf"], state["svd"]
+        self._set_identity()
+
+    def _set_identity(self): # El nombre incluye el hash del fichero: un reajuste invalida los vectores cacheados
+        import numpy as np
+        # svd.transform traspone y copia components_ (dim x n_features) en cada llamada: ~0,2 s fijos incluso para una consulta
+        self.projection = np.ascontiguousarray(self.svd.components_.T, dtype=np.float32)
+        self.dim = int(self.svd.n_components)
+        digest = hashlib.sha256(self.path.read_bytes()).hexdigest()[:12]
+        self.name = f"local-svd-{self.dim}:{digest}"
+
+    def _encode(self, texts: list[str]):
+        import numpy as np
+        weighted = self.tfidf.transform(self.vectorizer.transform(texts)).astype(np.float32)
+        reduced = weighted @ self.projection # Igual que svd.transform, sin la copia de components_
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return reduced / norms # Como array: entre procesos viaja mucho más rápido que una lista de floats
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self.pool is None or self.pool_model != self.name:
+            self.close()
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(str(self.path),))
+            self.pool_model = self.name
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def embed(self, texts: list[str], priority: str = INTERACTIVE) -> list[list[float]]:
+        if self.svd is None:
+            raise RuntimeError(f"El modelo local '{self.path}' no está ajustado. Ejecuta: uv run python embedders.py fit --pdf-dir uploads")
+        if len(texts) <= self.batch_size or self.workers <= 1: # Consultas y lotes pequeños: sin coste de repartir entre procesos
+            return self._encode(texts).tolist()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        return [vec for part in self._pool().map(_encode_batch, batches) for vec in part.tolist()]
+
+
+EMBEDDERS = ("openai", "local") # Motores disponibles
+
+
+def get_embedder(name: str = None, collection: str = "docs", client=None, model: str = None, dim: int = None) -> Embedder:
+    """
+    Crea el motor de embeddings de una colección. Orden de preferencia: name, RAG_EMBEDDER_<COLECCIÓN>, RAG_EMBEDDER, "openai".
+    """
+    name = name or os.getenv(f"RAG_EMBEDDER_{collection.upper()}") or os.getenv("RAG_EMBEDDER", "openai")
+    if name == "openai":
+        return OpenAIEmbedder(
+            client,
+            model=model or os.getenv("RAG_EMBED_MODEL", "text-embedding-3-large"),
+            dim=int(dim or os.getenv("RAG_EMBED_DIM", 3072)),
+        )
+    if name == "local":
+        return LocalSVDEmbedder(
+            path=os.getenv("RAG_LOCAL_EMBEDDER_PATH", f".cache/local_embedder_{collection}.joblib"),
+            dim=int(dim or os.getenv("RAG_LOCAL_EMBED_DIM", 256)),
+        )
+    raise ValueError(f"Motor de embeddings desconocido: {name}. Opciones: {list(EMBEDDERS)}")
+
+
+def _corpus_from_pdfs(folder: str, chunker: str) -> list[str]:
+    from chunking import PageTextCache, get_chunker
+    cache, splitter = PageTextCache(), get_chunker(chunker)
+    texts = []
+    for pdf in sorted(Path(folder).glob("*.pdf")):
+        _, pages = cache.load_pages(str(pdf))
+        texts.extend(c.text for c in splitter.split_pages(pages))
+    return texts
+
+
+def _corpus_from_collection(collection: str) -> list[str]:
+    from functions import QdrantStorage
+    client = QdrantStorage.connect()
+    storage = QdrantStorage(collection=collection, client=client, dim=client.get_collection(collection).config.params.vectors.size)
+    texts, offset = [], None
+    while True:
+        page, offset = client.scroll(collection_name=collection, limit=1024, offset=offset, with_payload=["text"])
+        texts.extend(p.payload["text"] for p in storage.hydrate(page) if p.payload.get("text")) # hydrate: texto externo
+        if offset is None:
+            return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ajuste del motor de embeddings local (TF-IDF + SVD)")
+    parser.add_argument("action", choices=["fit"])
+    parser.add_argument("--pdf-dir", default=None, help="Carpeta de PDFs con los que ajustar el modelo")
+    parser.add_argument("--collection", default="docs", help="Colección destino (y origen de los textos si no hay --pdf-dir)")
+    parser.add_argument("--chunker", default=os.getenv("RAG_CHUNKER", "sentence"))
+    parser.add_argument("--dim", type=int, default=None)
+    args = parser.parse_args()
+
+    texts = _corpus_from_pdfs(args.pdf_dir, args.chunker) if args.pdf_dir else _corpus_from_collection(args.collection)
+    embedder = get_embedder("local", collection=args.collection, dim=args.dim)
+    embedder.fit(texts)
+    print(f"Modelo local ajustado con {len(texts)} chunks: {embedder.name} -> {embedder.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# 24. PREGUNTAS FRECUENTES (FAQ) PRE-RESPONDIDAS A PARTIR DE LA AUDITORÍA
+
+# La colección audit_logs guarda todas las preguntas, pero nunca se usaba para acelerar nada: la misma pregunta,
+# formulada de veinte maneras, pagaba cada vez embedding + búsqueda + LLM. En este pipeline:
+#   - MINADO (offline, rag_mine_faqs en main.py): se convierten en vectores las preguntas auditadas y se agrupan por PDF
+#     con k-means por mini-lotes (scikit-learn, en local). Los grupos grandes y compactos son intenciones frecuentes.
+#   - RESPUESTA: para cada intención se responde la pregunta más representativa con el flujo RAG normal
+#     y se guarda en la colección faq_answers como PENDIENTE de revisión (vetted=False).
+#   - REVISIÓN: una persona aprueba o retira cada respuesta (admin_monitor.py o: uv run python faq.py vet <id>).
+#   - CONSULTA: antes de buscar y llamar al LLM, rag_query_pdf_ai busca la pregunta en las FAQ aprobadas del mismo PDF.
+#     Si la similitud supera RAG_FAQ_THRESHOLD se devuelve la respuesta guardada.
+# Al re-ingestar un PDF sus FAQ vuelven a "pendiente": la respuesta puede haber cambiado con el documento.
+# Todo se hace por cliente (tenant, ver tenants.py): las preguntas de un cliente nunca responden a otro.
+
+import argparse
+import math
+import os
+import time
+import uuid
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import (VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue,
+                                  FilterSelector, PayloadSchemaType, PointIdsList, KeywordIndexParams, KeywordIndexType)
+
+from tenants import require_tenant
+
+GLOBAL = "*" # Clave de las preguntas hechas sin filtrar por PDF
+
+
+def cluster_questions(vectors: np.ndarray, cluster_size: int = 8, min_count: int = 5, min_cohesion: float = 0.85, seed: int = 42) -> list[dict]:
+    """
+    Agrupa preguntas (vectores normalizados) con MiniBatchKMeans. k = n / cluster_size: buscamos intenciones, no temas.
+    Devuelve los grupos con al menos min_count preguntas y similitud media al centroide >= min_cohesion, los más grandes primero:
+    {"members": [índices], "representative": índice más cercano al centroide, "cohesion": similitud media}.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    n = len(vectors)
+    if n < min_count:
+        return []
+    k = max(1, math.ceil(n / cluster_size))
+    labels = MiniBatchKMeans(n_clusters=k, batch_size=1024, n_init=3, random_state=seed).fit_predict(vectors)
+    clusters = []
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        if len(members) < min_count:
+            continue
+        centroid = vectors[members].mean(axis=0)
+        centroid /= np.linalg.norm(centroid) or 1.0
+        sims = vectors[members] @ centroid # Vectores normalizados: producto escalar = similitud coseno
+        if sims.mean() < min_cohesion:
+            continue
+        clusters.append({"members": members.tolist(), "representative": int(members[sims.argmax()]), "cohesion": float(sims.mean())})
+    clusters.sort(key=lambda c: len(c["members"]), reverse=True)
+    return clusters
+
+
+class FAQStore:
+    def __init__(self, client: QdrantClient, collection: str = "faq_answers", threshold: float = None):
+        self.client = client
+        self.collection = collection
+        self.threshold = threshold if threshold is not None else float(os.getenv("RAG_FAQ_THRESHOLD", 0.92))
+        self._ready = False
+        self._checked_at = 0.0
+
+    def exists(self) -> bool: # Las consultas no deben pagar un collection_exists en cada pregunta
+        if not self._ready and time.time() - self._checked_at > 60:
+            self._checked_at = time.time()
+            self._ready = self.client.collection_exists(self.collection)
+        return self._ready
+
+    def ensure(self, dim: int):
+        if self.exists():
+            return
+        self.client.create_collection(self.collection, vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+        for field in ("source_key", "sources"):
+            self.client.create_payload_index(self.collection, field_name=field, field_schema=PayloadSchemaType.KEYWORD)
+        self.client.create_payload_index(self.collection, field_name="vetted", field_schema=PayloadSchemaType.BOOL)
+        self.client.create_payload_index(self.collection, field_name="tenant",
+                                         field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True))
+        self._ready = True
+
+    @staticmethod
+    def faq_id(tenant_id: str, source_key: str, question: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"faq:{tenant_id}:{source_key}:{question.strip().lower()}"))
+
+    @staticmethod
+    def _scope(tenant_id: str, *conditions) -> Filter: # Siempre dentro de un cliente
+        return Filter(must=[FieldCondition(key="tenant", match=MatchValue(value=require_tenant(tenant_id))), *conditions])
+
+    def lookup(self, vector, source_id: str = None, tenant_id: str = None):
+        """Respuesta aprobada más parecida a la pregunta (mismo cliente y PDF o, sin PDF, las globales del cliente), o None."""
+        if not self.exists():
+            return None
+        hits = self.client.query_points(
+            collection_name=self.collection,
+            query=vector,
+            query_filter=self._scope(tenant_id,
+                FieldCondition(key="source_key", match=MatchValue(value=source_id or GLOBAL)),
+                FieldCondition(key="vetted", match=MatchValue(value=True)),
+            ),
+            score_threshold=self.threshold,
+            limit=1,
+        ).points
+        return hits[0] if hits else None
+
+    def upsert(self, vector, source_key: str, question: str, answer: str, sources: list, count: int, cohesion: float, examples: list,
+               tenant_id: str = None):
+        """Guarda una respuesta minada como pendiente. Si ya estaba aprobada y sigue vigente solo se actualiza la frecuencia."""
+        point_id = self.faq_id(require_tenant(tenant_id), source_key, question)
+        current = self.client.retrieve(self.collection, ids=[point_id], with_payload=True)
+        if current and current[0].payload.get("vetted"):
+            self.client.set_payload(self.collection, payload={"count": count, "cohesion": cohesion, "examples": examples, "mined_at": time.time()},
+                                    points=[point_id])
+            return point_id
+        self.client.upsert(self.collection, points=[PointStruct(id=point_id, vector=vector, payload={
+            "tenant": tenant_id, "source_key": source_key, "question": question, "answer": answer, "sources": sources, "count": count,
+            "cohesion": cohesion, "examples": examples, "vetted": False, "mined_at": time.time(),
+        })])
+        return point_id
+
+    def set_vetted(self, ids: list, vetted: bool = True):
+        self.client.set_payload(self.collection, payload={"vetted": vetted, "vetted_at": time.time()}, points=list(ids))
+
+    def invalidate_source(self, source_id: str, tenant_id: str):
+        """El PDF ha cambiado: sus respuestas (y las globales del cliente que lo citan) vuelven a estar pendientes de revisión."""
+        if not self.exists():
+            return
+        for key in ("source_key", "sources"):
+            self.client.set_payload(self.collection, payload={"vetted": False},
+                                    points=self._scope(tenant_id, FieldCondition(key=key, match=MatchValue(value=source_id))))
+
+    def delete(self, ids: list):
+        self.client.delete(self.collection, points_selector=PointIdsList(points=list(ids)))
+
+    def delete_source(self, source_id: str, tenant_id: str): # El PDF se ha borrado: sus FAQ ya no tienen de dónde salir
+        if self.exists():
+            self.client.delete(self.collection, points_selector=FilterSelector(
+                filter=self._scope(tenant_id, FieldCondition(key="source_key", match=MatchValue(value=source_id)))))
+
+    def delete_tenant(self, tenant_id: str): # El cliente ha vaciado su base de conocimiento
+        if self.exists():
+            self.client.delete(self.collection, points_selector=FilterSelector(filter=self._scope(tenant_id)))
+
+    def clear(self): # Se vacía la base de conocimiento: ninguna FAQ sigue siendo válida
+        if self.exists():
+            self.client.delete_collection(self.collection)
+        self._ready, self._checked_at = False, 0.0
+
+    def list(self, limit: int = 200, tenant_id: str = None) -> list[dict]: # De un cliente o, sin tenant_id, de todos (revisión)
+        if not self.exists():
+            return []
+        points, _ = self.client.scroll(self.collection, scroll_filter=self._scope(tenant_id) if tenant_id else None, limit=limit, with_payload=True)
+        items = [{"id": str(p.id), **p.payload} for p in points]
+        return sorted(items, key=lambda f: (f.get("vetted", False), -f.get("count", 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Revisión de las respuestas FAQ minadas de la auditoría")
+    parser.add_argument("action", choices=["list", "vet", "unvet", "delete"])
+    parser.add_argument("ids", nargs="*", help="Ids de las FAQ (para vet, unvet y delete)")
+    parser.add_argument("--tenant", default=None, help="Solo las FAQ de este cliente (para list)")
+    args = parser.parse_args()
+
+    from functions import QdrantStorage
+    store = FAQStore(QdrantStorage.connect())
+    if args.action == "list":
+        for faq in store.list(tenant_id=args.tenant):
+            mark = "✔" if faq.get("vetted") else "·"
+            print(f"{mark} {faq['id']}  [{faq.get('tenant')}/{faq['source_key']}] x{faq['count']}  {faq['question']}\n    -> {faq['answer'][:160]}")
+    elif args.action in ("vet", "unvet"):
+        store.set_vetted(args.ids, args.action == "vet")
+        print(f"{len(args.ids)} FAQ {'aprobadas' if args.action == 'vet' else 'retiradas'}.")
+    else:
+        store.delete(args.ids)
+        print(f"{len(args.ids)} FAQ borradas.")
+
+
+if __name__ == "__main__":
+    main()
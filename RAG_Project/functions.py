@@ -17,6 +17,7 @@
 
 
 # PASO 1. IMPORTACIÓN DE LIBRERIAS 
+import os
 from qdrant_client import QdrantClient           # Importa el "conector" principal para conectar con DOCKER
 from qdrant_client.models import (VectorParams,  # Molde para configurar las reglas del estante (dimensión y medida).
                                 Distance,        # Define la regla matemática (Coseno) para buscar similitudes.
@@ -24,7 +25,19 @@ from qdrant_client.models import (VectorParams,  # Molde para configurar las reg
                                 Filter, 
                                 FieldCondition, 
                                 MatchValue, 
-                                PointStruct)     
+                                MatchAny,        # Filtro "source es uno de estos PDFs" (búsqueda tras el enrutado)
+                                PointStruct,
+                                QueryRequest,    # Molde para cada consulta dentro de una búsqueda por lotes (query_batch_points).
+                                FilterSelector,  # Selecciona puntos a borrar mediante un filtro (borrado por PDF).
+                                PayloadSchemaType,
+                                DeleteOperation, DeletePayloadOperation, DeletePayload, # Operaciones para el cambio de versión de un PDF
+                                CreateAliasOperation, CreateAlias, DeleteAliasOperation, DeleteAlias, # Alias: "docs" apunta a una colección versionada
+                                KeywordIndexParams, KeywordIndexType, HnswConfigDiff, # Índice de tenant y HNSW por cliente
+                                IsEmptyCondition, PayloadField)
+from routing import SourceRouter # Índice de un vector por PDF para enrutar las consultas sin PDF
+from textstore import ChunkTextStore # Texto de los chunks fuera de QDRANT (opcional, RAG_EXTERNAL_TEXT=1) y de las ventanas padre
+from tracing import span # Tramos de la traza de cada consulta (ver tracing.py)
+from tenants import DEFAULT_TENANT, require_tenant, source_key # Aislamiento por cliente (ver tenants.py)
 
 # PASO 2. CREACIÓN DE UN OBJETO CLASS
 # Los objetos class sirven para agrupar codigo, en este caso, estamos agrupando todas las funciones relacionadas con el tratamiento que le daremos a los datos en la fase de almacenamiento.
@@ -35,46 +48,174 @@ from qdrant_client.models import (VectorParams,  # Molde para configurar las reg
 class QdrantStorage: 
     def __init__( # Esta función establece la conexión entre el codigo y la base de datos QDRANT, que esta corriendo dentro de un contenedor DOCKER. Es la infraestructura sobre la que va ha trabajar 
                 self,  # Hilo conductor de las distintas funciones, es el objeto que le aplicaremos  
-                 url="http://localhost:6333", # Puerto del DOCKER 
+                 url=None, # Puerto del DOCKER (por defecto QDRANT_URL o http://localhost:6333). ":memory:" crea una base en memoria
                  collection="docs", # Nombre de una nueva colección
-                 dim=3072): # Dimensión de los datos de entrada
+                 dim=3072, # Dimensión de los datos de entrada
+                 path=None, # Carpeta para usar QDRANT en modo local (embebido, sin DOCKER)
+                 client=None, # Cliente ya creado que queremos reutilizar (p.ej. en las migraciones)
+                 use_alias=True, # Si es True, "collection" es un ALIAS que apunta a una colección versionada (docs -> docs_v1)
+                 text_store=None, # Almacén externo del texto de los chunks. Por defecto se activa con RAG_EXTERNAL_TEXT=1
+                 parent_store=None): # Texto de las ventanas padre (RAG_PARENT_CHILD=1). Los hijos solo guardan su "parent_id"
         
-        self.client = QdrantClient(url=url,timeout=30) # Establece conexión con el servidor QDRANT (DOCKER)
-        self.collection = collection # Guardamos el nombre de la carpeta donde guardaremos los datos
+        self.client = client or self.connect(url=url, path=path) # Establece conexión con el servidor QDRANT (DOCKER), local o en memoria
+        self.collection = collection # Guardamos el nombre de la carpeta donde guardaremos los datos (o su alias)
+        self.dim = dim # Guardamos la dimensión para poder recrear la colección
+        self._router = None # Índice de enrutado por documento (se crea al usarlo)
+        if text_store is None and os.getenv("RAG_EXTERNAL_TEXT", "0") == "1":
+            text_store = ChunkTextStore()
+        self.text_store = text_store # Si existe, el payload de QDRANT no lleva el texto: se guarda y se lee aquí
+        parent_path = os.getenv("RAG_PARENT_STORE", ".cache/parent_text.sqlite")
+        if parent_store is None and (os.getenv("RAG_PARENT_CHILD", "0") == "1" or os.path.exists(parent_path)):
+            parent_store = ChunkTextStore(parent_path) # También si ya hay padres guardados: hay que poder leerlos y borrarlos
+        self.parent_store = parent_store
         
-        if not self.client.collection_exists(self.collection): # Si la collection no existe, la creamos 
+        if self.alias_target(self.collection) is None and not self.client.collection_exists(self.collection): # Si la collection no existe, la creamos 
+            physical = f"{self.collection}_v1" if use_alias else self.collection # Con alias creamos la versión 1 y apuntamos el alias a ella
             self.client.create_collection(
-                collection_name = self.collection, # Nombre de la colección
-                vectors_config = VectorParams(size=dim, distance=Distance.COSINE),) # Configuración téncica de los vectores en la colección 
+                collection_name = physical, # Nombre de la colección
+                vectors_config = VectorParams(size=dim, distance=Distance.COSINE), # Configuración téncica de los vectores en la colección 
+                hnsw_config = self._hnsw_config(),) # Un grafo HNSW por cliente (tenants.py)
+            if use_alias:
+                self.switch_alias(physical)
+        self._ensure_indexes()
+
+
+    def _ensure_indexes(self): # Índice sobre "source": acelera filtros y borrados por PDF y permite contar puntos por PDF (facet)
+        physical = self.resolve_collection()
+        self.client.create_payload_index(physical, field_name="source", field_schema=PayloadSchemaType.KEYWORD)
+        # Índice de tenant: QDRANT agrupa en disco los puntos de cada cliente y toda consulta filtra por él
+        self.client.create_payload_index(physical, field_name="tenant",
+                                         field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True))
+
+
+    @staticmethod
+    def _hnsw_config(): # Sin grafo global (m=0) y con uno por valor de los campos indexados (payload_m): cada cliente tiene el suyo
+        if os.getenv("RAG_TENANT_HNSW", "1") != "1":
+            return None
+        return HnswConfigDiff(payload_m=16, m=0)
+
+
+    def alias_target(self, alias: str): # Devuelve la colección real a la que apunta un alias (o None si no es un alias)
+        for a in self.client.get_aliases().aliases:
+            if a.alias_name == alias:
+                return a.collection_name
+        return None
+
+
+    def resolve_collection(self) -> str: # Nombre de la colección física que hay detrás de self.collection
+        return self.alias_target(self.collection) or self.collection
+
+
+    def switch_alias(self, new_collection: str):
+        """
+        Apunta el alias self.collection a 'new_collection'. Borrar y crear el alias van en la misma petición,
+        así que QDRANT hace el cambio de forma atómica: ninguna búsqueda ve la colección vacía.
+        """
+        operations = []
+        if self.alias_target(self.collection) is not None:
+            operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=self.collection)))
+        operations.append(CreateAliasOperation(create_alias=CreateAlias(collection_name=new_collection, alias_name=self.collection)))
+        self.client.update_collection_aliases(change_aliases_operations=operations)
+        print(f"DEBUG: Alias '{self.collection}' -> '{new_collection}'.")
+
+
+    @property
+    def router(self) -> SourceRouter: # Cada colección física tiene su índice de enrutado: tras una migración el alias apunta a otro
+        physical = self.resolve_collection()
+        if self._router is None or self._router.collection != f"{physical}_routing":
+            self._router = SourceRouter(self.client, f"{physical}_routing", self.dim)
+        return self._router
+
+
+    def count(self, exact: bool = True, tenant_id: str = None) -> int: # Número de puntos visibles (sin versiones en staging), de todos o de un cliente
+        return self.client.count(
+            collection_name=self.collection,
+            count_filter=self._build_filter(tenant_id=tenant_id),
+            exact=exact,
+        ).count
+
+
+    @staticmethod
+    def connect(url=None, path=None) -> QdrantClient: # Crea el cliente según el tipo de despliegue, sin tocar ninguna colección
+        url = url or os.getenv("QDRANT_URL", "http://localhost:6333")
+        if path: # Modo local: QDRANT guarda los datos en una carpeta del disco
+            return QdrantClient(path=path)
+        if url == ":memory:": # Modo memoria: útil para pruebas y arranques en caliente desde un snapshot
+            return QdrantClient(location=":memory:")
+        return QdrantClient(url=url,timeout=int(os.getenv("RAG_QDRANT_TIMEOUT_S", 30))) # Las consultas además tienen su propio plazo (deadlines.py)
 
 
     def upsert( self, ids, vectors, payloads): # Función que inserta los datos que puedan llegar con un formato determinado
+        if self.text_store is not None: # El texto va al almacén externo y el payload se queda solo con los metadatos
+            payloads = [dict(p) for p in payloads]
+            texts = [p.pop("text", "") for p in payloads]
+            self.text_store.put_many(self.resolve_collection(), ids, texts,
+                                     [source_key(p.get("tenant"), p.get("source")) for p in payloads], [p.get("version") for p in payloads])
         points = [PointStruct(id=ids[i], vector = vectors[i], payload = payloads[i]) for i in range(len(ids))]
-        return self.client.upsert(self.collection, points=points)
+        with span("qdrant.upsert", collection=self.collection, points=len(points)):
+            return self.client.upsert(self.collection, points=points)
     
 
-    def search(self,query_vector, top_k: int=5, source_id: str = None): # Función que recibe una query convertida a vector y busca en la base de datos cual se parece más, similar a un senctence similarity
-        
-        # PASO A: CREACIÓN DEL FILTRO para que solo responda en función del pdf o pdfs adjuntados
-        search_filter = None
-        if source_id:
-            search_filter = Filter(
-                must=[
-                    FieldCondition(
-                        key="source", # Debe coincidir con la clave que pusimos en el payload del upsert
-                        match=MatchValue(value=source_id)
-                    )
-                ]
+    def get_vectors(self, ids: list) -> dict: # {id: vector} de los puntos que existen (p.ej. para reutilizar el vector de un duplicado)
+        if not ids:
+            return {}
+        points = self.client.retrieve(self.collection, ids=list(set(ids)), with_payload=False, with_vectors=True)
+        return {str(p.id): p.vector for p in points}
+    
+
+    def _build_filter(self, source_id = None, tenant_id: str = None): # Crea el filtro para que solo responda en función del cliente y del pdf o pdfs adjuntados
+        must = []
+        if tenant_id: # Primero el cliente: es el índice con is_tenant
+            must.append(FieldCondition(key="tenant", match=MatchValue(value=tenant_id)))
+        if isinstance(source_id, (list, tuple)): # Varios PDFs (p.ej. los elegidos por el enrutado)
+            must.append(FieldCondition(key="source", match=MatchAny(any=list(source_id))))
+        elif source_id:
+            must.append(
+                FieldCondition(
+                    key="source", # Debe coincidir con la clave que pusimos en el payload del upsert
+                    match=MatchValue(value=source_id)
+                )
             )
-        
-        # PASO B: Llamamos la función query_points incluyendo el filtro
-        results = self.client.query_points( # Llamamos la funcion search del cliente QdrantClient, busqueda por similitud matemática
-            collection_name = self.collection, # Le damos el nombre de la colección
-            query = query_vector, # El vector de la query
-            query_filter = search_filter, # El filtro de la query, el pdf o pdfs adjuntados
-            limit = top_k).points # Define el número máximo de resultados
+        return Filter(
+            must=must,
+            must_not=[FieldCondition(key="staging", match=MatchValue(value=True))] # Nunca respondemos con una versión a medio ingestar
+        )
+
+
+    def hydrate(self, points: list): # Rellena payload["text"] desde el almacén externo con una sola consulta para todos los puntos
+        if self.text_store is None:
+            return points
+        pending = [p for p in points if p.payload is not None and "text" not in p.payload]
+        if pending:
+            texts = self.text_store.get_many(self.resolve_collection(), [p.id for p in pending])
+            for p in pending:
+                p.payload["text"] = texts.get(str(p.id), "")
+        return points
+
+
+    def _side_stores(self) -> list: # Almacenes SQLite que acompañan a los puntos y se borran con ellos
+        return [store for store in (self.text_store, self.parent_store) if store is not None]
+
 
+    def put_parents(self, ids: list, texts: list, source_keys: list, versions: list): # Ventanas padre de los chunks hijo (ver chunking.py)
+        if ids:
+            if self.parent_store is None:
+                self.parent_store = ChunkTextStore(os.getenv("RAG_PARENT_STORE", ".cache/parent_text.sqlite"))
+            self.parent_store.put_many(self.resolve_collection(), ids, texts, source_keys, versions)
+
+
+    def get_parents(self, ids: list) -> dict: # {parent_id: texto} con una sola consulta para todos los hijos encontrados
+        ids = [i for i in set(ids) if i]
+        if not ids or self.parent_store is None:
+            return {}
+        return self.parent_store.get_many(self.resolve_collection(), ids)
+
+
+    def _parse_points(self, results): # Convierte los puntos devueltos por QDRANT en contexts y sources
         contexts = [] # Creación lista vacia llamada contexts
+        scores = [] # Similitud de cada contexto con la pregunta
+        parents = [] # Ventana padre de cada contexto (None si el chunk no es un hijo)
+        context_sources = [] # PDF de cada contexto (para recalcular sources si se descartan contextos)
         sources = set() # Creación de contenedor para las sourcers
 
         for r in results: 
@@ -83,20 +224,163 @@ class QdrantStorage:
             source = payload.get("source", "") # la fuente
             if text: # Si existe texto 
                 contexts.append(text) # Lo añade en contexts
+                scores.append(float(getattr(r, "score", 0.0) or 0.0)) # Y su puntuación
+                parents.append(payload.get("parent_id"))
+                context_sources.append(source)
                 sources.add(source)   # Lo añade en sources
         
-        return {"contexts":contexts, "sources":list(sources)} # Imprime el texto y la fuente
+        return {"contexts":contexts, "sources":list(sources), "scores":scores, "parents":parents, "context_sources":context_sources} # Imprime el texto, la fuente y las puntuaciones
+
+
+    def search(self,query_vector, top_k: int=5, source_id: str = None, score_threshold: float = None, tenant_id: str = None): # Función que recibe una query convertida a vector y busca en la base de datos cual se parece más, similar a un senctence similarity
+        
+        # PASO A: CREACIÓN DEL FILTRO para que solo responda en función del cliente (obligatorio) y del pdf o pdfs adjuntados
+        search_filter = self._build_filter(source_id, require_tenant(tenant_id))
+        
+        # PASO B: Llamamos la función query_points incluyendo el filtro
+        with span("qdrant.search", collection=self.collection, top_k=top_k) as attrs: # Tramo de la traza (tracing.py)
+            results = self.client.query_points( # Llamamos la funcion search del cliente QdrantClient, busqueda por similitud matemática
+                collection_name = self.collection, # Le damos el nombre de la colección
+                query = query_vector, # El vector de la query
+                query_filter = search_filter, # El filtro de la query, el pdf o pdfs adjuntados
+                score_threshold = score_threshold, # QDRANT descarta los puntos por debajo de esta similitud (None = sin umbral)
+                limit = top_k).points # Define el número máximo de resultados
+            attrs["hits"] = len(results)
+            attrs["tenant"] = tenant_id
+
+            return self._parse_points(self.hydrate(results))
     
 
+    def search_batch(self, query_vectors, top_k: int = 5, source_id: str = None, score_threshold: float = None,
+                     per_query_sources: list = None, tenant_id: str = None): # Igual que search pero para N vectores en un único viaje de red a QDRANT
+        # per_query_sources: una lista de PDFs por vector (enrutado); si falta o está vacía se usa source_id
+        tenant_id = require_tenant(tenant_id) # Todas las consultas del lote son del mismo cliente
+        per_query_sources = per_query_sources or [None] * len(query_vectors)
+        requests = [
+            QueryRequest(query=vec, filter=self._build_filter(per_query_sources[i] or source_id, tenant_id), limit=top_k,
+                         score_threshold=score_threshold, with_payload=True)
+            for i, vec in enumerate(query_vectors)
+        ]
+        if not requests:
+            return []
+
+        with span("qdrant.search_batch", collection=self.collection, queries=len(requests), top_k=top_k):
+            responses = self.client.query_batch_points( # Una sola llamada con todas las consultas
+                collection_name=self.collection,
+                requests=requests,
+            )
+            self.hydrate([p for resp in responses for p in resp.points]) # Los textos de todas las consultas en una sola lectura
+        return [self._parse_points(resp.points) for resp in responses] # Una respuesta por vector, en el mismo orden
+    
+
+    def delete_source(self, source_id: str, tenant_id: str): # Borra solo los puntos de un PDF de un cliente, sin tocar el resto de la colección
+        tenant_id = require_tenant(tenant_id)
+        self.client.delete(
+            collection_name=self.collection,
+            points_selector=FilterSelector(filter=Filter(must=[
+                FieldCondition(key="tenant", match=MatchValue(value=tenant_id)),
+                FieldCondition(key="source", match=MatchValue(value=source_id)),
+            ])),
+        )
+        self.router.remove(source_id, tenant_id) # El PDF deja de ser enrutable
+        for store in self._side_stores():
+            store.delete_source(self.resolve_collection(), source_key(tenant_id, source_id))
+        print(f"DEBUG: Borrado el PDF '{source_id}' del cliente '{tenant_id}' de '{self.collection}'.")
+
+
+    def activate_source(self, source_id: str, version: str, tenant_id: str):
+        """
+        Cambia un PDF a su nueva versión: la versión nueva se ingesta marcada como "staging" (invisible para search)
+        y aquí, en una sola petición, se hace visible y se borran las versiones anteriores.
+        Durante el cambio las búsquedas ven la versión antigua o la nueva, nunca un PDF vacío.
+        """
+        this_tenant = FieldCondition(key="tenant", match=MatchValue(value=require_tenant(tenant_id)))
+        this_source = FieldCondition(key="source", match=MatchValue(value=source_id))
+        this_version = FieldCondition(key="version", match=MatchValue(value=version))
+        self.client.batch_update_points(
+            collection_name=self.collection,
+            update_operations=[
+                DeletePayloadOperation(delete_payload=DeletePayload(keys=["staging"], filter=Filter(must=[this_tenant, this_source, this_version]))),
+                DeleteOperation(delete=FilterSelector(filter=Filter(must=[this_tenant, this_source], must_not=[this_version]))),
+            ],
+        )
+        for store in self._side_stores(): # Los textos (y padres) de las versiones borradas ya no los pide nadie
+            store.delete_other_versions(self.resolve_collection(), source_key(tenant_id, source_id), version)
+
+
+    def _facet(self, key: str, tenant_id: str = None, limit: int = 10_000): # Cuenta puntos visibles por valor de un campo indexado
+        return self.client.facet(
+            collection_name=self.collection,
+            key=key,
+            facet_filter=self._build_filter(tenant_id=tenant_id),
+            limit=limit,
+            exact=True,
+        ).hits
+
+
+    def list_sources(self, limit: int = 10_000, tenant_id: str = None) -> list[dict]: # Lista los PDFs de un cliente (o de todos) con su número de puntos
+        if tenant_id is None: # Todos los clientes (migraciones, enrutado): un facet por cliente
+            return [item for hit in self._facet("tenant", limit=limit) for item in self.list_sources(limit, hit.value)]
+        return [{"tenant_id": tenant_id, "source": hit.value, "points": hit.count} for hit in self._facet("source", tenant_id, limit)]
+
+
+    def tenant_stats(self, tenant_id: str) -> dict: # Solo recorre los puntos del cliente (índice de tenant), no la colección
+        sources = self.list_sources(tenant_id=require_tenant(tenant_id))
+        return {"tenant_id": tenant_id, "points": sum(s["points"] for s in sources), "sources": len(sources), "top_sources": sources[:10]}
+
+
+    def list_tenants(self, limit: int = 10_000) -> list[dict]: # Estadísticas de cada cliente
+        return [self.tenant_stats(hit.value) for hit in self._facet("tenant", limit=limit)]
+
+
+    def clear_tenant(self, tenant_id: str):
+        """Borra todos los documentos de un cliente (también las versiones en staging). El resto de clientes no se toca."""
+        tenant_id = require_tenant(tenant_id)
+        sources = [s["source"] for s in self.list_sources(tenant_id=tenant_id)]
+        self.client.delete(
+            collection_name=self.collection,
+            points_selector=FilterSelector(filter=Filter(must=[FieldCondition(key="tenant", match=MatchValue(value=tenant_id))])),
+        )
+        self.router.remove_tenant(tenant_id)
+        for store in self._side_stores():
+            for source_id in sources:
+                store.delete_source(self.resolve_collection(), source_key(tenant_id, source_id))
+        print(f"DEBUG: Borrados {len(sources)} PDFs del cliente '{tenant_id}' de '{self.collection}'.")
+
+
+    def backfill_tenant(self, tenant_id: str = DEFAULT_TENANT) -> int:
+        """Asigna tenant_id a los puntos anteriores al aislamiento por cliente (sin payload "tenant"). Devuelve cuántos eran."""
+        legacy = Filter(must=[IsEmptyCondition(is_empty=PayloadField(key="tenant"))])
+        pending = self.client.count(collection_name=self.collection, count_filter=legacy, exact=True).count
+        if pending:
+            self.client.set_payload(collection_name=self.collection, payload={"tenant": tenant_id}, points=legacy)
+        self.router.backfill_tenant(tenant_id)
+        return pending
+
+
+    def optimize_for_tenants(self): # Índice de tenant y HNSW por cliente en una colección creada antes de este cambio
+        self._ensure_indexes()
+        self.router.ensure_tenant_index()
+        self.client.update_collection(collection_name=self.resolve_collection(), hnsw_config=HnswConfigDiff(payload_m=16, m=0))
+
+
     def clear_collection(self):
-        """Borra la colección de documentos y la recrea vacía"""
-        self.client.delete_collection(collection_name=self.collection)
+        """Borra la colección de documentos (de TODOS los clientes) y la recrea vacía. Para un solo cliente: clear_tenant"""
+        physical = self.resolve_collection() # Si trabajamos con alias, borramos la colección a la que apunta
+        self.client.delete_collection(collection_name=physical)
+        for store in self._side_stores():
+            store.delete_namespace(physical)
         
         # La recreamos inmediatamente para que el sistema siga funcionando
         self.client.create_collection(
-            collection_name=self.collection,
-            vectors_config=VectorParams(size=3072, distance=Distance.COSINE),
+            collection_name=physical,
+            vectors_config=VectorParams(size=self.dim, distance=Distance.COSINE),
+            hnsw_config=self._hnsw_config(),
         )
+        if physical != self.collection: # Al borrar la colección QDRANT borra su alias: lo volvemos a crear
+            self.switch_alias(physical)
+        self._ensure_indexes()
+        self.router.clear()
         print(f"DEBUG: Colección '{self.collection}' reiniciada.")
 
 # 3. PROCESAMIENTO E INGESTA VECTORIAL
@@ -106,45 +390,75 @@ class QdrantStorage:
 #     y el CHUNKING (dividir el texto en fragmentos lógicos para no superar el límite de memoria de la IA).
 #   - OPENAI: Es nuestro "Embedding Model". Actúa como un traductor que convierte cada fragmento de 
 #     texto en un vector (una lista de números) que representa su significado semántico.
+#     El traductor es intercambiable (ver embedders.py): OpenAI por defecto o un modelo local en CPU.
 
-from openai import OpenAI # Imporatmos la api de OPNEAI para poder acceder al modelo
-from llama_index.readers.file import PDFReader # Extrae el texto de los PDFs limpio para que el LLM pueda entenderlo
-from llama_index.core.node_parser import SentenceSplitter # Esta herramienta corta el texto en troxos (chunks) sin romper frases a la mitad
+import os
+from chunking import PageTextCache, get_splitter # Motor de chunking propio (ver chunking.py) y caché del texto de los PDFs
+from rate_limit import INTERACTIVE # Prioridad de las peticiones en el limitador compartido (ver rate_limit.py)
+from embed_cache import EmbeddingCache # Caché local de embeddings (ver embed_cache.py)
+from embedders import Embedder, get_embedder # Motor de embeddings intercambiable: OpenAI o local en CPU (ver embedders.py)
 
 from dotenv import load_dotenv # Sirve para leer tu API KEY desde el archivo '.env'.
 
 load_dotenv() # Carga las variables de entorno desde un archivo '.env' al sistema para proteger claves y credenciales.
 
 class VectorProcessor:
-    def __init__(self):
+    def __init__(self, embed_model: str = None, embed_dim: int = None, chunker: str = None, embed_cache: EmbeddingCache = None,
+                 embedder = None, collection: str = "docs"):
         # Aquí preparamos las herramientas (Se ejecuta al poner: procesador = VectorProcesor())
-        self.client = OpenAI() # Llamamos a la Api de OpenAI
-        self.splitter = SentenceSplitter(chunk_size=1000, chunk_overlap=200) # Definimos la herramienta sentencesplitter y los parámetros que queremos
-        self.embed_model = "text-embedding-3-large" # Definimos el modelo
-        self.embed_dim = 3072 # Definimos la dimensión, en función del modelo
+        from openai import OpenAI # Import local: quien solo usa QdrantStorage (frontales, scripts) no carga el SDK de OpenAI
+        from cassette import openai_client_kwargs # Grabación / reproducción de las llamadas (RAG_CASSETTE, ver cassette.py)
+        self.client = OpenAI(max_retries=0, **openai_client_kwargs()) # Llamamos a la Api de OpenAI. Los reintentos (429, 5xx, conexión) los gestiona rate_limiter, con jitter
+        self.chunker_name = chunker or os.getenv("RAG_CHUNKER", "sentence") # Estrategia de chunking: "sentence", "token" o "heading"
+        self.splitter = get_splitter(self.chunker_name, chunk_size=1000, chunk_overlap=200) # Con RAG_PARENT_CHILD=1, hijos pequeños con su padre
+        self.page_cache = PageTextCache() # Caché en disco del texto de cada página, por hash del PDF
+        # Motor de embeddings de la colección: RAG_EMBEDDER_<COLECCIÓN> o RAG_EMBEDDER ("openai" por defecto, "local" en CPU)
+        if not isinstance(embedder, Embedder): # Nombre del motor (o None para leerlo del entorno)
+            embedder = get_embedder(embedder, collection=collection, client=self.client, model=embed_model, dim=embed_dim)
+        self.embedder = embedder
+        self.embed_model = getattr(self.embedder, "model", self.embedder.name) # Definimos el modelo
+        self.embed_dim = self.embedder.dim # Definimos la dimensión, en función del modelo (los text-embedding-3 admiten reducirla)
+        self.embed_cache = embed_cache or EmbeddingCache() # Caché local de embeddings: no pagamos dos veces el mismo texto
+
+    def chunk_pdf(self, path: str): # Funcion para leer y partir el pdf conservando página y offsets de cada chunk
+        digest, pages = self.page_cache.load_pages(path) # Solo se vuelve a leer el PDF si su hash no está en la caché
+        chunks = self.splitter.split_pages(pages) # Aplica la estrategia de chunking a cada página
+        return digest, chunks # Hash del PDF y lista de RAGChunk (texto + metadatos)
+
+    def chunk_metadata(self, digest: str, chunks) -> list[dict]: # Metadatos de cada chunk que acaban en el payload de QDRANT
+        return [
+            {"page": c.page, "start_char": c.start_char, "end_char": c.end_char, "heading": c.heading, "file_hash": digest,
+             **({"parent": c.parent} if c.parent is not None else {})} # Posición del padre: la ingesta la cambia por su parent_id
+            for c in chunks
+        ]
+
+    @staticmethod
+    def chunk_parents(chunks) -> list[str]: # Texto de cada ventana padre, en el orden de su posición (vacía sin padre-hijo)
+        parents = {c.parent: c.parent_text for c in chunks if c.parent is not None}
+        return [parents.get(j, "") for j in range(max(parents) + 1)] if parents else []
 
     def load_and_chunk_pdf(self, path: str): # Funcion para leer y partir el pdf donde le facilitamos el parametro path
-        docs = PDFReader().load_data(file=path) # Lee el documento, aplica PDFReader de LLamaIndex para que pueda ser procesado por el LLM
-        texts = [d.text for d in docs if d.text and d.text.strip()]  # Va recorriendo cada texto de docs y los añade a texts
-        chunks = [] # Creación de lista vacia 
-        for t in texts: # Para cada fragmentod etexto
-            split_results = self.splitter.split_text(t)
-            chunks.extend([c for c in split_results if c and c.strip()]) # Aplica el splitter y lo añade a chunks 
-        return chunks # Nos devuelve chunks, que es una lista con trozos de texto
-
-    def embed_texts(self, texts: list[str]) -> list[list[float]]: # Recibe una lista de trozos de texto(texts, creada con la función anterior) y promete devolver una lista de listas de números (floats).
-        # 1. VERIFICACIÓN: ¿Qué le estamos enviando a OpenAI?
-        print(f"DEBUG: Enviando {len(texts)} fragmentos a OpenAI.")
-    
+        _, chunks = self.chunk_pdf(path)
+        return [c.text for c in chunks] # Nos devuelve chunks, que es una lista con trozos de texto
+
+    def embed_texts(self, texts: list[str], priority: str = INTERACTIVE) -> list[list[float]]: # Recibe una lista de trozos de texto(texts, creada con la función anterior) y promete devolver una lista de listas de números (floats).
         if not texts:
-            print("ERROR: La lista de textos está VACÍA. No se puede llamar a OpenAI.")
+            print("ERROR: La lista de textos está VACÍA. No se puede generar ningún embedding.")
             return [] # Evitamos que explote el código
-    
-        response = self.client.embeddings.create( # Creación de embeddings
-            model=self.embed_model, # Modelo a usar
-            input=texts, # Lista texts. 
-        )
-        return [item.embedding for item in response.data] # Lista de vectores del objeto response 
+
+        # 1. CACHÉ: solo convertimos los textos que no hemos convertido antes con este motor (modelo y dimensión)
+        vectors = self.embed_cache.get_many(self.embedder.name, texts)
+        missing = [i for i in range(len(texts)) if i not in vectors]
+
+        # 2. VERIFICACIÓN: ¿Qué le estamos enviando al motor de embeddings?
+        print(f"DEBUG: Enviando {len(missing)} fragmentos a {self.embedder.name} ({len(texts) - len(missing)} desde la caché).")
+        if missing:
+            pending = [texts[i] for i in missing]
+            fresh = self.embedder.embed(pending, priority=priority) # OpenAI (por lotes y con limitador) o modelo local en CPU
+            self.embed_cache.put_many(self.embedder.name, pending, fresh)
+            vectors.update(zip(missing, fresh))
+
+        return [vectors[i] for i in range(len(texts))]
 
 
 # 4. PROCESO PARA GUATRDAR TODAS LAS CONSULTAS Y OPUTPUS REALZIADOS 
@@ -160,7 +474,9 @@ class AuditLogger:
             self.client = client
             self.collection_name = "audit_logs"
 
-    def save_log(self, question: str, answer: str, source_id: str, sources: list, chat_history: list = None): 
+    def save_log(self, question: str, answer: str, source_id: str, sources: list, session_id: str = None, llm_skipped: bool = False,
+                 degradations: list = None, latency_ms: int = None, usage: dict = None, context_tokens: int = 0,
+                 search_query: str = None, faq_id: str = None, tenant_id: str = None): 
         
 
             # 1. Crear colección si no existe (se queda igual)
@@ -182,8 +498,16 @@ class AuditLogger:
                             "question": question,
                             "answer": answer,
                             "pdf_usado": source_id,  
+                            "tenant": tenant_id, # Cliente de la consulta: las FAQ se minan por cliente y PDF
                             "fragmentos_encontrados": sources,
-                            "historial": chat_history
+                            "session_id": session_id, # Referencia a la sesión (chat_sessions), no una copia del historial
+                            "llm_skipped": llm_skipped, # True si se respondió con el mensaje por defecto sin llamar al LLM
+                            "degradations": degradations or [], # Hedges y rutas degradadas por el presupuesto de latencia
+                            "latency_ms": latency_ms, # Desde que se envió el evento hasta la auditoría
+                            "context_tokens": context_tokens, # Tamaño del contexto recuperado que recibió el LLM
+                            "usage": usage or {}, # Tokens por modelo, coste y latencia de cada paso (usage.py)
+                            "search_query": search_query, # Pregunta condensada (la que se busca y se agrupa en las FAQ)
+                            "faq_id": faq_id # FAQ aprobada que respondió la consulta, si la hubo (faq.py)
                         }
                     )
                 ]
@@ -14,29 +14,31 @@
 import logging # Para registrar eventos y errores en la consola (Logs).
 import os  # Para interactuar con el sistema (rutas de archivos, variables).
 import datetime #Para manejar fechas, horas y cálculos de tiempo.
-from fastapi import FastAPI # El framework principal para crear tu API web.
+import threading # Calentamiento de los motores en segundo plano al arrancar
+from contextlib import asynccontextmanager # Ciclo de vida (arranque) de la API
+from pathlib import Path # Rutas de los PDFs en la ingesta de carpetas
+from fastapi import FastAPI, HTTPException # El framework principal para crear tu API web.
+from fastapi.responses import JSONResponse # Respuesta con código 503 en /readyz
 import inngest # Librería base para gestionar flujos de trabajo (workflows).
 import inngest.fast_api # El "conector" que permite a Inngest trabajar dentro de FastAPI.
-from inngest.experimental import ai # Herramientas avanzadas para flujos de trabajo con IA/LLMs.
 from dotenv import load_dotenv # Para leer tus credenciales secretas desde un archivo .env.
 
 # Importamos nuestras hojas de pipeline
-from custom_types import RAGChunkAndSrc, RAGUpsertResult, RAGSearchResult, RAGQueryResult
-from functions import QdrantStorage, VectorProcessor, AuditLogger
-from workflow import RAGWorkflow
+from custom_types import RAGChunkAndSrc, RAGChunkRef, RAGChunkRefList, RAGUpsertResult, RAGUpsertBatchResult, RAGSearchResult, RAGQueryResult, RAGBatchSearchResult, RAGBatchQueryResult, RAGMemoryState, RAGCondenseResult, RAGAnswerResult, RAGFAQHit, RAGFAQCandidates
+from services import LazyServices # Motores perezosos: functions, workflow, openai y qdrant_client no se importan al arrancar
+from deadlines import Deadline, metrics # Presupuesto de latencia de las consultas y sus métricas
+from usage import get_ledger, GROUPS as USAGE_GROUPS # Libro de consumo de tokens y coste
+from tracing import StepTracer # Trazas: un span por paso, unido al mensaje del chat por event.data["traceparent"]
+from tenants import tenant_of, require_tenant # Cliente de cada evento: toda búsqueda se filtra por él
 
 # PASO 2. 
 # Necesario para activar las claves de la api al haber creado el archivo .env
 load_dotenv() # Carga las variables de entorno desde un archivo '.env' al sistema para proteger claves y credenciales.
 
-# PASO 8. INICIALIZACIÓN DE MOTORES 
-# Creamos las instancias una sola vez aquí para reutilizarlas
-storage_engine = QdrantStorage()
-processor_engine = VectorProcessor()
-audit_engine = AuditLogger(storage_engine.client)
-
-# PASO 9. INICIALIZACIÓN DEL WORKFLOW (Inyección de dependencias)
-workflow = RAGWorkflow(processor=processor_engine, storage=storage_engine, logger=audit_engine)
+# PASO 8. INICIALIZACIÓN DE MOTORES (perezosa, ver services.py)
+# Cada instancia se crea una sola vez, la primera vez que se usa (o en el calentamiento al arrancar la API), y se reutiliza
+# PASO 9. El workflow (services.workflow) recibe los motores por inyección de dependencias
+services = LazyServices()
 
 # PASO 3. CEREBRO DE INNGEST, necesario para establecer conexión con la api de inngest
 inngest_client = inngest.Inngest( # Crea la instancia del cliente principal para gestionar eventos y flujos. Es decir, aquello que conecta el código con la paltaforma de Inngest
@@ -45,127 +47,400 @@ inngest_client = inngest.Inngest( # Crea la instancia del cliente principal para
     is_production = False, # Indica que estás en modo desarrollo, mientras se mantenga False se abre la plataforma de inngest en local
     serializer = inngest.PydanticSerializer()) # Permite enviar objetos complejos (modelos Pydantic) como datos de eventos.
 
+# PASO 10. CONFIGURACIÓN DEL PROMPT 
+# Aqui es donde le damos contexto al LLM para que responda de una formad determinada.
+# Lo definimos a nivel de módulo para que lo compartan la consulta individual y la consulta por lotes
+
+NOMBRE_EMPRESA = "Empresa S.L"
+PERSONALIDAD = "un asistente técnico profesional, atento y preciso"
+
+# Respuesta por defecto: la usa el prompt y la ruta rápida que evita llamar al LLM cuando no hay contexto
+NO_ANSWER = f"Lo siento, no encuentro esa información en la documentación de {NOMBRE_EMPRESA}, ¿puedo ayudarte con otra consulta?"
+# Respuesta cuando la consulta agota su presupuesto de latencia y no hay respuesta cacheada
+SLOW_ANSWER = "Ahora mismo el servicio va más lento de lo normal y no he podido responder a tiempo. Por favor, vuelve a intentarlo en unos segundos."
+
+MI_PROMPT = f"""
+[ROL]: Eres {PERSONALIDAD} de la empresa {NOMBRE_EMPRESA}. Tu objetivo es ayudar a los usuarios basándote exclusivamente en la documentación proporcionada.
+
+[DIRECTRICES DE RESPUESTA]:
+1. FIDELIDAD: Responde ÚNICAMENTE utilizando la información del contexto suministrado. 
+2. HONESTIDAD: Si la respuesta no está en los documentos o no estás seguro, di: "{NO_ANSWER}". NO inventes datos.
+3. IDIOMA: Responde siempre en el mismo idioma en el que el usuario te pregunte.
+4. TONO: Mantén un tono corporativo, educado y servicial.
+
+[FORMATO]:
+- Utiliza negritas para resaltar términos importantes.
+- Si la información contiene pasos o listas, utiliza viñetas o numeración para mayor claridad.
+"""
+
+
+def event_tenant(data: dict) -> str: # Cliente del evento (event.data["tenant_id"]). Si no es válido, reintentar no sirve de nada
+    try:
+        return tenant_of(data)
+    except ValueError as e:
+        raise inngest.NonRetriableError(str(e))
+
+
 # PASO 4. FUNCIONES CLIENTE, necesario, pues sino no funciona nuestra conexión
 
 # FUNCIÓN 1, para la ingesto del pdf
+# Los eventos se agrupan en lotes (muchos PDFs pequeños en una sola ejecución que comparte las peticiones de embeddings)
+# y la concurrencia está limitada, para que una subida masiva no deje sin hueco a las consultas del chat.
 @inngest_client.create_function( # Crea un apartado donde le dira a inngest que la siguiente función se activará con el siguiente trigger.
     fn_id = "RAG: Ingest PDF", # Identificador único de la función para monitorearla en el panel de Inngest.
-    trigger = inngest.TriggerEvent(event="rag/ingest_pdf") # Define qué evento específico "despierta" a esta siguiente función.
+    trigger = inngest.TriggerEvent(event="rag/ingest_pdf"), # Define qué evento específico "despierta" a esta siguiente función.
+    batch_events = inngest.Batch( # Agrupa hasta max_size eventos o los que lleguen en 'timeout'
+        max_size = int(os.getenv("RAG_INGEST_BATCH_SIZE", 20)),
+        timeout = datetime.timedelta(seconds=int(os.getenv("RAG_INGEST_BATCH_TIMEOUT_S", 5))),
+    ),
+    concurrency = [
+        inngest.Concurrency(limit=int(os.getenv("RAG_INGEST_CONCURRENCY", 2))), # Máximo de ingestas simultáneas en total
+        inngest.Concurrency(limit=1, key="event.data.tenant_id"), # Una ingesta a la vez por cliente (tenant)
+    ],
+    throttle = inngest.Throttle( # Máximo de ejecuciones que empiezan por periodo y por cliente
+        limit = int(os.getenv("RAG_INGEST_THROTTLE", 10)),
+        period = datetime.timedelta(minutes=1),
+        key = "event.data.tenant_id",
+    ),
 ) 
 
 async def rag_ingest_pdf(ctx: inngest.Context): # Define la función lógica asíncrona (que no se bloquea) con el nombre de la función y los elementos de esta
     
     # Aqui es donde introducimos lo que hará nuestro sistema, las funciones definidas, PODEMOS INCLUSO DEFINIR OTRO PIPELINE CON ESTA ESTRUCTURA
-    chunks_and_src = await ctx.step.run("load-and-chunk", lambda: workflow._load(ctx), output_type=RAGChunkAndSrc)  
-    ingested = await ctx.step.run("embd-and-upsert", lambda: workflow._upsert(chunks_and_src), output_type=RAGUpsertResult)
+    events = ctx.events or [ctx.event] # Con batch_events, ctx.events trae todos los eventos del lote
+    step = StepTracer(ctx, "rag_ingest_pdf", events[0]) # ctx.step con un span por paso (la traza es la del primer evento del lote)
+    refs = []
+    for event in events:
+        event_tenant(event.data) # Cada PDF se guarda con el cliente de su evento (un lote puede mezclar clientes)
+    for i, event in enumerate(events):
+        # Los chunks se quedan en el almacén de blobs: entre pasos solo viaja una referencia de pocos bytes
+        refs.append(await step.run(f"load-and-chunk-{i}", lambda event=event: services.workflow._stage_event(event.data, job_id=event.id), output_type=RAGChunkRef))
+    ingested = await step.run("embd-and-upsert", lambda: services.workflow._upsert_refs(refs), output_type=RAGUpsertBatchResult)
+    # Reemplazo atómico: la versión nueva de cada PDF se hace visible y las anteriores se borran
+    await step.run("activate-sources", lambda: services.workflow._activate_many(ingested))
+    await step.run("release-blobs", lambda: services.workflow._release_refs(refs))
+    step.finish(events=len(events))
     return ingested.model_dump()
 
 # FUNCIÓN 2, para la query 
 @inngest_client.create_function( # Crea un apartado donde le dira a inngest que la siguiente función se activará con el siguiente trigger.
     fn_id = "RAG: Query PDF", # Identificador único de la función para monitorearla en el panel de Inngest.
-    trigger = inngest.TriggerEvent(event="rag/query_pdf_ai") # Define qué evento específico "despierta" a esta siguiente función.
+    trigger = inngest.TriggerEvent(event="rag/query_pdf_ai"), # Define qué evento específico "despierta" a esta siguiente función.
+    concurrency = [inngest.Concurrency(limit=int(os.getenv("RAG_QUERY_CONCURRENCY", 20)))], # Capacidad reservada para el chat, independiente de la ingesta
 ) 
 
 async def rag_query_pdf_ai(ctx: inngest.Context):
 
-    # 1. CONFIGURACIÓN DEL PROMPT 
-    # Aqui es donde le damos contexto al LLM para que responda de una formad determinada
+    # 1. RECUPERACIÓN DE DATOS DEL EVENTO
+
+    question = ctx.event.data["question"]
+    source_id = ctx.event.data.get("source_id")
+    top_k = int(ctx.event.data.get("top_k", 5))
+    score_threshold = ctx.event.data.get("score_threshold") # Opcional: si no viene, se usa RAG_SCORE_THRESHOLD
+    session_id = ctx.event.data.get("session_id") # El historial vive en el servidor (chat_sessions, por cliente), el evento solo lleva el id
+    tenant_id = event_tenant(ctx.event.data) # Solo se busca entre los documentos de este cliente
+    deadline = Deadline.from_event(ctx.event.ts, ctx.event.data.get("budget_s")) # Presupuesto de latencia contado desde el envío del evento
+    step = StepTracer(ctx, "rag_query_pdf_ai", usage_kind="query") # ctx.step con un span por paso (traza del chat) y su consumo de tokens
+
+    # 2. GENERACIÓN DEL SYSTEM PROMPT DINÁMICO USANDO EL WORKFLOW
+    # Llamamos a la Función 6 del workflow para combinar el prompt con la base RAG
+    system_content = await services.workflow._get_system_prompt(MI_PROMPT)
+
+    # 3. MEMORIA ACOTADA: ventana reciente por tokens + resumen incremental de lo anterior, leída de la sesión
+    if session_id:
+        memory = await step.run("load-session-memory", lambda: services.workflow._session_memory(session_id, tenant_id), output_type=RAGMemoryState)
+    else:
+        memory = RAGMemoryState() # Consulta sin sesión: sin historial
+
+    # 4. CONDENSACIÓN DE LA PREGUNTA (si no llega a su plazo se busca con la pregunta original)
+    condensed = await step.run("condense-question", lambda: services.workflow._condense_question(question, memory.window, memory.summary, deadline), output_type=RAGCondenseResult)
+    search_query = condensed.query
+    
+    # 5. PREGUNTAS FRECUENTES: si la pregunta coincide con una FAQ aprobada de este cliente y PDF, su respuesta ya está calculada (faq.py)
+    faq = await step.run("faq-lookup", lambda: services.workflow._faq_lookup(search_query, source_id, deadline, tenant_id), output_type=RAGFAQHit)
+    degradations = list(condensed.degradations)
+    context_tokens = 0
+    if faq.faq_id:
+        found = RAGSearchResult(contexts=[], sources=faq.sources, scores=[faq.score])
+        answer, sources, num_contexts, llm_skipped = faq.answer, faq.sources, 0, True
+    else:
+        # 6. BÚSQUEDA SEMÁNTICA EN QDRANT (embedding y búsqueda con hedging dentro de su plazo)
+        found = await step.run("embedn-and-search", lambda: services.workflow._search(search_query, top_k, source_id=source_id, score_threshold=float(score_threshold) if score_threshold is not None else None, deadline=deadline, tenant_id=tenant_id), output_type = RAGSearchResult)
+        degradations += found.degradations
+
+        # RUTA RÁPIDA: ningún chunk supera el umbral de similitud, así que la respuesta será la de por defecto.
+        # La devolvemos sin llamar al LLM (se ahorra una ida y vuelta completa en preguntas fuera de tema)
+        llm_skipped = not found.contexts and "search_timeout" not in found.degradations
+        if llm_skipped:
+            answer, sources, num_contexts = NO_ANSWER, found.sources, 0
+        else:
+            # 7. INFERENCIA DEL LLM CON EL PLAZO RESTANTE (resumen + historial + contexto + pregunta).
+            # Sin contexto por falta de plazo en la búsqueda, se sirve directamente la respuesta cacheada o SLOW_ANSWER
+            if found.contexts:
+                result = await step.run(
+                    "llm-asnwer",
+                    lambda: services.workflow._answer(system_content, question, search_query, found, deadline, source_id, memory.window, memory.summary, SLOW_ANSWER, tenant_id),
+                    output_type=RAGAnswerResult
+                )
+            else:
+                result = await step.run("cached-answer", lambda: services.workflow._cached_answer(search_query, source_id, SLOW_ANSWER, tenant_id), output_type=RAGAnswerResult)
+            answer, sources, num_contexts, context_tokens = result.answer, result.sources, result.num_contexts, result.context_tokens
+            degradations += result.degradations
+
+    # 8. AUDITORIA Y REGISTRO (CAJA NEGRA) (también en la ruta rápida), con la latencia y las degradaciones
+    await step.run(
+        "audit-log-interaction",
+        lambda: services.workflow._log_interaction(
+            question=question,
+            answer=answer,
+            source_id=source_id, # Enviamos el PDF usado
+            sources=sources,
+            session_id=session_id, # Referencia a la sesión en lugar de copiar el historial
+            llm_skipped=llm_skipped,
+            degradations=degradations,
+            deadline=deadline,
+            usage_key=ctx.event.id, # Tokens, coste y latencia de los pasos anteriores (usage.py)
+            context_tokens=context_tokens,
+            search_query=search_query, # Pregunta ya condensada: es la que se agrupa al minar las FAQ
+            faq_id=faq.faq_id,
+            tenant_id=tenant_id
+        )
+    )
 
-    NOMBRE_EMPRESA = "Empresa S.L"
-    PERSONALIDAD = "un asistente técnico profesional, atento y preciso"
+    # 9. GUARDAMOS EL TURNO EN LA SESIÓN (solo se añade, nunca se reescribe)
+    if session_id:
+        await step.run("save-session-turn", lambda: services.workflow._save_turn(session_id, ctx.event.id, question, answer, tenant_id))
 
-    MI_PROMPT = f"""
-    [ROL]: Eres {PERSONALIDAD} de la empresa {NOMBRE_EMPRESA}. Tu objetivo es ayudar a los usuarios basándote exclusivamente en la documentación proporcionada.
+    step.finish(degradations=",".join(degradations), llm_skipped=llm_skipped)
+    return {
+        "answer": answer,
+        "sources": sources,
+        "num_contexts": num_contexts,
+        "scores": found.scores,
+        "llm_skipped": llm_skipped,
+        "degradations": degradations,
+        "faq_id": faq.faq_id,
+        "session_id": session_id,
+    }
 
-    [DIRECTRICES DE RESPUESTA]:
-    1. FIDELIDAD: Responde ÚNICAMENTE utilizando la información del contexto suministrado. 
-    2. HONESTIDAD: Si la respuesta no está en los documentos o no estás seguro, di: "Lo siento, no encuentro esa información en la documentación de {NOMBRE_EMPRESA}, ¿puedo ayudarte con otra consulta?". NO inventes datos.
-    3. IDIOMA: Responde siempre en el mismo idioma en el que el usuario te pregunte.
-    4. TONO: Mantén un tono corporativo, educado y servicial.
 
-    [FORMATO]:
-    - Utiliza negritas para resaltar términos importantes.
-    - Si la información contiene pasos o listas, utiliza viñetas o numeración para mayor claridad.
-    """
 
+# FUNCIÓN 3, para la consulta por lotes (QA offline y evaluaciones)
+@inngest_client.create_function( # Crea un apartado donde le dira a inngest que la siguiente función se activará con el siguiente trigger.
+    fn_id = "RAG: Query Batch", # Identificador único de la función para monitorearla en el panel de Inngest.
+    trigger = inngest.TriggerEvent(event="rag/query_batch"), # Define qué evento específico "despierta" a esta siguiente función.
+    concurrency = [inngest.Concurrency(limit=int(os.getenv("RAG_QUERY_BATCH_CONCURRENCY", 1)))], # Los lotes offline no compiten con el chat
+)
 
-    # 2. RECUPERACIÓN DE DATOS DEL EVENTO
+async def rag_query_batch(ctx: inngest.Context):
 
-    question = ctx.event.data["question"]
+    # 1. RECUPERACIÓN DE DATOS DEL EVENTO
+    questions = list(ctx.event.data["questions"])
     source_id = ctx.event.data.get("source_id")
     top_k = int(ctx.event.data.get("top_k", 5))
-    chat_history = ctx.event.data.get("chat_history", [])
+    max_parallel = int(ctx.event.data.get("max_parallel", 4)) # Número máximo de respuestas del LLM en paralelo
+    chat_histories = ctx.event.data.get("chat_histories") # Opcional: un historial por pregunta
+    score_threshold = ctx.event.data.get("score_threshold")
+    tenant_id = event_tenant(ctx.event.data)
+    step = StepTracer(ctx, "rag_query_batch", usage_kind="query_batch")
 
-    # 3. GENERACIÓN DEL SYSTEM PROMPT DINÁMICO USANDO EL WORKFLOW
-    # Llamamos a la Función 6 del workflow para combinar el prompt con la base RAG
-    system_content = await workflow._get_system_prompt(MI_PROMPT)
+    system_content = await services.workflow._get_system_prompt(MI_PROMPT)
 
-    # 4. CONDENSACIÓN DE LA PREGUNTA 
-    search_query = await ctx.step.run("condense-question", lambda: workflow._condense_question(question, chat_history))
-    
-    # 5. BÚSQUEDA SEMÁNTICA EN QDRANT 
-    found = await ctx.step.run("embedn-and-search", lambda: workflow._search(search_query, top_k, source_id=source_id), output_type = RAGSearchResult)
+    # 2. CONDENSACIÓN DE TODAS LAS PREGUNTAS EN UNA SOLA LLAMADA
+    search_queries = await step.run("condense-questions", lambda: services.workflow._condense_questions(questions, chat_histories))
 
-    # 6. PREPARACIÓN DE LOS MENSAJES PARA EL LLM
-    messages = [{"role": "system", "content": system_content}]
-    
-    # Añadimos a messages el historial de mensajes 
-    for msg in (chat_history or [])[-6:]: # Pasamos los últimos 6 mensajes para dar fluidez
-        messages.append(msg) # Añadimos cada mensaje a messages
+    # 3. UN SOLO EMBEDDING Y UNA SOLA BÚSQUEDA POR LOTES EN QDRANT
+    found = await step.run("embed-and-search-batch", lambda: services.workflow._search_batch(search_queries, top_k, source_id=source_id, score_threshold=float(score_threshold) if score_threshold is not None else None, tenant_id=tenant_id), output_type=RAGBatchSearchResult)
 
-    # 7. EL CONTENIDO DEL USUARIO
-    context_block = "\n\n".join(f"- {c}" for c in found.contexts)
-    
-    user_content = (
-        f"Context:\n{context_block}\n\n"
-        f"Question: {question}\n"
-        )
-    
-    # 8. CONFIGURACIÓN DE IA E INFERENCIA 
-    # Configuración IA
-    adapter = ai.openai.Adapter(
-        auth_key= os.getenv("OPENAI_API_KEY"), # Activamos la api key personal
-        model = "gpt-4o-mini" # Modelo que queremos utilizar 
+    # 4. RESPUESTAS DEL LLM CON PARALELISMO ACOTADO
+    answers = await step.run(
+        "llm-answers-batch",
+        lambda: services.workflow._answer_batch(system_content, questions, found, chat_histories, max_parallel, NO_ANSWER),
+        output_type=RAGBatchQueryResult
     )
 
-    # Inferencia del LLM
-    res = await ctx.step.ai.infer(
-        "llm-asnwer",
-        adapter = adapter,
-        body = {
-            "max_tokens": 1024,
-            "temperature":0.2, # Nivel de "creatividad" de la IA
-            "messages": messages + [{"role": "user", "content": user_content}]
-        }
+    step.finish(questions=len(questions))
+    return answers.model_dump()
+
+
+
+# FUNCIÓN 4, limpieza periódica de las sesiones de chat caducadas (TTL)
+@inngest_client.create_function(
+    fn_id = "RAG: Evict Sessions",
+    trigger = inngest.TriggerCron(cron="0 * * * *") # Cada hora
+)
+
+async def rag_evict_sessions(ctx: inngest.Context):
+    step = StepTracer(ctx, "rag_evict_sessions")
+    evicted = await step.run("evict-expired-sessions", lambda: services.workflow.sessions.evict_expired())
+    step.finish(evicted=evicted)
+    return {"evicted": evicted}
+
+
+# FUNCIÓN 4.1, limpieza periódica de los blobs de ingesta huérfanos (ejecuciones que fallaron antes de liberarlos)
+@inngest_client.create_function(
+    fn_id = "RAG: Purge Blobs",
+    trigger = inngest.TriggerCron(cron=os.getenv("RAG_BLOB_PURGE_CRON", "30 * * * *")) # Cada hora, desfasada de la de sesiones
+)
+
+async def rag_purge_blobs(ctx: inngest.Context):
+    step = StepTracer(ctx, "rag_purge_blobs")
+    max_age_s = float(os.getenv("RAG_BLOB_TTL_S", 24 * 3600)) # Más que lo que tarda Inngest en agotar los reintentos de una ingesta
+    purged = await step.run("purge-stale-blobs", lambda: services.workflow.blobs.purge_older_than(max_age_s))
+    step.finish(purged=purged)
+    return {"purged": purged}
+
+
+# FUNCIÓN 5, ingesta de muchos PDFs a la vez (carpeta, zip o subida múltiple)
+@inngest_client.create_function(
+    fn_id = "RAG: Ingest Directory",
+    trigger = inngest.TriggerEvent(event="rag/ingest_dir"),
+    concurrency = [inngest.Concurrency(limit=1, key="event.data.tenant_id")], # Comparte la regla de la ingesta: una a la vez por cliente
+)
+
+async def rag_ingest_dir(ctx: inngest.Context):
+    step = StepTracer(ctx, "rag_ingest_dir")
+    tenant_id = event_tenant(ctx.event.data) # Todos los ficheros de la carpeta son del mismo cliente
+
+    # 1. LISTA DE FICHEROS: "pdf_paths" (subida múltiple / zip descomprimido) o "directory" (carpeta del servidor)
+    # Cada fichero es un trabajo de ingesta propio (<id del evento>-0000, -0001...) con su progreso en /ingest/jobs
+    def list_files():
+        data = ctx.event.data
+        if data.get("directory"):
+            root = Path(data["directory"])
+            paths = sorted(str(p) for p in root.rglob("*.pdf"))
+            sources = [str(Path(p).relative_to(root).as_posix()) for p in paths]
+        else:
+            paths = list(data["pdf_paths"])
+            sources = list(data.get("source_ids") or [Path(p).name for p in paths])
+        return [{"pdf_path": p, "source_id": src, "job_id": f"{ctx.event.id}-{i:04d}", "tenant_id": tenant_id}
+                for i, (p, src) in enumerate(zip(paths, sources))]
+
+    files = await step.run("list-files", list_files)
+
+    # 2. LECTURA Y TROCEADO EN PARALELO (un proceso por núcleo). Solo viajan referencias a los chunks (almacén de blobs)
+    refs = await step.run("parse-and-chunk-files", lambda: services.workflow._stage_files(files), output_type=RAGChunkRefList)
+
+    # 3. EMBEDDINGS Y SUBIDA COMPARTIDOS: los chunks de varios PDFs van en las mismas peticiones
+    max_chunks = int(os.getenv("RAG_INGEST_DIR_GROUP_CHUNKS", 5000))
+    for i, group in enumerate(services.workflow._group_refs(refs.refs, max_chunks)):
+        ingested = await step.run(f"embd-and-upsert-{i}", lambda group=group: services.workflow._upsert_refs(group), output_type=RAGUpsertBatchResult)
+        await step.run(f"activate-sources-{i}", lambda ingested=ingested: services.workflow._activate_many(ingested))
+        await step.run(f"release-blobs-{i}", lambda group=group: services.workflow._release_refs(group))
+
+    # 4. ESTADO POR FICHERO Y RITMO AGREGADO
+    summary = await step.run("summary", lambda: services.workflow._dir_summary(refs.refs))
+    step.finish(files=len(files))
+    return summary
+
+
+# FUNCIÓN 6, minado de preguntas frecuentes de la auditoría y pre-cálculo de sus respuestas (faq.py)
+# Semanal y bajo demanda (evento rag/mine_faqs). Las respuestas quedan pendientes hasta que alguien las aprueba en admin_monitor.py
+@inngest_client.create_function(
+    fn_id = "RAG: Mine FAQs",
+    trigger = [
+        inngest.TriggerCron(cron=os.getenv("RAG_FAQ_CRON", "0 3 * * 1")), # Los lunes a las 3:00
+        inngest.TriggerEvent(event="rag/mine_faqs"),
+    ],
+    concurrency = [inngest.Concurrency(limit=1)],
+)
+
+async def rag_mine_faqs(ctx: inngest.Context):
+    step = StepTracer(ctx, "rag_mine_faqs", usage_kind="faq")
+    data = ctx.event.data or {}
+    system_content = await services.workflow._get_system_prompt(MI_PROMPT)
+
+    # 1. AGRUPACIÓN DE LAS PREGUNTAS AUDITADAS POR PDF (k-means por mini-lotes en local)
+    found = await step.run(
+        "cluster-questions",
+        lambda: services.workflow._faq_clusters(
+            days=int(data.get("days", os.getenv("RAG_FAQ_DAYS", 30))),
+            min_count=int(data.get("min_count", os.getenv("RAG_FAQ_MIN_COUNT", 5))),
+            max_faqs=int(data.get("max_faqs", os.getenv("RAG_FAQ_MAX", 50))),
+        ),
+        output_type=RAGFAQCandidates,
     )
 
-    answer = res["choices"][0]["message"]["content"].strip()
+    # 2. RESPUESTA DE CADA INTENCIÓN CON EL FLUJO RAG Y GUARDADO COMO PENDIENTE DE REVISIÓN
+    stored = await step.run("answer-and-store", lambda: services.workflow._faq_answer_and_store(found, system_content, NO_ANSWER))
+    step.finish(candidates=len(found.candidates), stored=stored["stored"])
+    return stored
 
-    # 9. AUDITORIA Y REGISTRO (CAJA NEGRA) 
-    await ctx.step.run(
-        "audit-log-interaction",
-        lambda: workflow._log_interaction(
-            question=question,
-            answer=answer,
-            source_id=source_id, # Enviamos el PDF usado
-            sources=found.sources,
-            chat_history=chat_history
-        )
-    )
 
-    return {"answer": answer, "sources": found.sources, "num_contexts": len(found.contexts)}
+# PASO 5. API PROPIA, 
+@asynccontextmanager
+async def lifespan(app: FastAPI): # Al arrancar creamos los motores en otro hilo: uvicorn acepta peticiones sin esperar a QDRANT ni a OpenAI
+    if os.getenv("RAG_WARMUP", "1") == "1":
+        threading.Thread(target=services.warm_up, name="warmup", daemon=True).start()
+    yield
 
 
+app = FastAPI(lifespan=lifespan) # Inicializa la aplicación web que recibirá las peticiones HTTP.
 
-# PASO 5. API PROPIA, 
-app = FastAPI() # Inicializa la aplicación web que recibirá las peticiones HTTP.
+
+# PASO 5.1 PROGRESO DE LA INGESTA: lo escribe el workflow y lo leen streamlit_app.py y admin_monitor.py
+@app.get("/ingest/jobs")
+def list_ingest_jobs(limit: int = 50):
+    jobs = services.progress.list(limit)
+    return {"jobs": jobs, "throughput": services.progress.throughput(jobs)}
+
+
+@app.get("/ingest/jobs/{job_id}")
+def get_ingest_job(job_id: str): # job_id = id del evento rag/ingest_pdf
+    job = services.progress.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado (puede que aún esté en cola)")
+    return job
+
+
+# PASO 5.2 MÉTRICAS DE LATENCIA DE LAS CONSULTAS: p50/p95 por paso, cumplimiento del presupuesto y degradaciones
+@app.get("/metrics")
+def query_metrics():
+    return metrics.snapshot()
+
+
+# PASO 5.3 CONSUMO DE TOKENS Y COSTE: agregados por PDF, día, modelo, sesión o tipo (consulta / ingesta)
+@app.get("/usage")
+def usage_rollup(by: str = "source", days: int = 30, kind: str = None):
+    if by not in USAGE_GROUPS:
+        raise HTTPException(status_code=400, detail=f"Agregado desconocido: {by}. Opciones: {list(USAGE_GROUPS)}")
+    return {"by": by, "days": days, "rows": get_ledger().rollup(by, days, kind)}
+
+
+# PASO 5.4 CLIENTES (TENANTS): puntos y PDFs de cada cliente. Cada consulta solo recorre los puntos de su cliente
+@app.get("/tenants")
+def list_tenants():
+    return {"tenants": services.storage.list_tenants()}
+
+
+@app.get("/tenants/{tenant_id}")
+def get_tenant(tenant_id: str):
+    try:
+        stats = services.storage.tenant_stats(require_tenant(tenant_id))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not stats["points"]:
+        raise HTTPException(status_code=404, detail="Cliente sin documentos")
+    return stats
+
+
+# PASO 5.5 SALUD DEL SERVICIO: /healthz para saber si el proceso vive, /readyz para saber si puede atender consultas
+@app.get("/healthz")
+def healthz():
+    return services.health()
+
+
+@app.get("/readyz")
+def readyz(): # 503 mientras QDRANT no responda o los motores no estén creados: el balanceador no le manda tráfico todavía
+    status = services.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 
 # PASO 6. CONEXIÓN API PROPIA - CEREBRO INNGEST
 inngest.fast_api.serve( # Registra el punto de acceso (endpoint) para que Inngest pueda comunicarse con tu API.
                         app, # Servidor que aloja la comunicación, api propia
                        inngest_client,  # El cerebro que gestiona los eventos 
-                       functions=[rag_ingest_pdf,rag_query_pdf_ai])  # El catálogo de tareas disponibles, aqui añadiremos las funciones 
+                       functions=[rag_ingest_pdf,rag_query_pdf_ai,rag_query_batch,rag_evict_sessions,rag_purge_blobs,rag_ingest_dir,rag_mine_faqs])  # El catálogo de tareas disponibles, aqui añadiremos las funciones 
 
 # PASO 7: Para luego activar por un lado el local host y por el otro el portal de monitoreo de inngest debemos hacer los sigueintes pasos:
 # 5.1- Abrir un terminal y ejecutar lo siguiente: uv run uvicorn main:app
@@ -0,0 +1,88 @@
+# 10. MEMORIA DE CONVERSACIÓN
+
+# Enviar todo el historial del chat en cada pregunta hace que el prompt crezca sin límite
+# (sobre todo por las respuestas largas del asistente). En este pipeline acotamos la memoria:
+#   - VENTANA: Solo los mensajes más recientes que caben en un presupuesto de tokens se envían tal cual.
+#   - RESUMEN: Los mensajes que salen de la ventana se "pliegan" en un resumen que se actualiza de forma
+#     incremental (resumen anterior + mensajes nuevos -> resumen nuevo), nunca re-resumiendo toda la conversación.
+# Así el tamaño del prompt por turno queda acotado (ventana + resumen) sea cual sea la longitud de la conversación.
+
+import os
+
+from custom_types import RAGMemoryState
+from rate_limit import rate_limiter, estimate_chat_tokens, INTERACTIVE
+from tokens import CHARS_PER_TOKEN, count_tokens
+
+
+class ConversationMemory:
+    def __init__(self, client, window_tokens: int = None, summary_tokens: int = None, model: str = "gpt-4o-mini"):
+        self.client = client # Cliente de OpenAI (el mismo de VectorProcessor)
+        self.window_tokens = window_tokens or int(os.getenv("RAG_MEMORY_WINDOW_TOKENS", 1500)) # Presupuesto para mensajes literales
+        self.summary_tokens = summary_tokens or int(os.getenv("RAG_MEMORY_SUMMARY_TOKENS", 300)) # Tamaño máximo del resumen
+        self.model = model
+
+    def _truncate(self, msg: dict, max_tokens: int) -> dict: # Recorta un mensaje suelto que por sí solo no cabe en la ventana
+        content = msg.get("content") or ""
+        if count_tokens(content) <= max_tokens:
+            return msg
+        return {**msg, "content": content[: max_tokens * CHARS_PER_TOKEN] + " […]"}
+
+    def recent(self, history: list, budget: int = None) -> list:
+        """Devuelve los últimos mensajes del historial que caben en 'budget' tokens (en orden cronológico)."""
+        budget = budget or self.window_tokens
+        window = []
+        used = 0
+        for msg in reversed(history or []):
+            tokens = count_tokens(msg.get("content") or "")
+            if window and used + tokens > budget:
+                break
+            if not window and tokens > budget: # El último mensaje siempre entra, aunque sea recortado
+                msg = self._truncate(msg, budget)
+                tokens = budget
+            window.append({"role": msg["role"], "content": msg["content"]})
+            used += tokens
+        return list(reversed(window))
+
+    def update_summary(self, summary: str, turns: list) -> str:
+        """Actualiza el resumen con los mensajes que acaban de salir de la ventana."""
+        if not turns:
+            return summary or ""
+        conversation = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+        prompt = (
+            "Mantienes un resumen breve de una conversación entre un usuario y un asistente de documentación. "
+            "Actualiza el resumen con los nuevos mensajes, conservando los temas, entidades y datos que el usuario "
+            f"podría volver a mencionar. Máximo {self.summary_tokens * 3 // 4} palabras. Devuelve solo el resumen.\n\n"
+            f"Resumen actual:\n{summary or '(vacío)'}\n\n"
+            f"Nuevos mensajes:\n{conversation}\n\n"
+            "Resumen actualizado:"
+        )
+        messages = [{"role": "user", "content": prompt}]
+        response = rate_limiter.call(
+            self.model,
+            lambda: self.client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=self.summary_tokens,
+                temperature=0
+            ),
+            tokens=estimate_chat_tokens(messages, self.summary_tokens),
+            priority=INTERACTIVE,
+        )
+        return response.choices[0].message.content.strip()
+
+    def compact(self, history: list, summary: str = "") -> RAGMemoryState:
+        """
+        Recibe los mensajes que todavía no están resumidos y el resumen actual.
+        Solo pliega mensajes en el resumen cuando superan 1,5 veces la ventana (para no llamar al LLM en cada turno),
+        y entonces deja en la ventana la mitad del presupuesto.
+        'summarized' indica cuántos mensajes del principio de 'history' han pasado al resumen.
+        """
+        history = history or []
+        total = sum(count_tokens(m.get("content") or "") for m in history)
+        if total <= self.window_tokens * 1.5:
+            return RAGMemoryState(summary=summary or "", summarized=0, window=self.recent(history))
+
+        keep = self.recent(history, budget=self.window_tokens // 2)
+        folded = history[: len(history) - len(keep)]
+        new_summary = self.update_summary(summary, folded)
+        return RAGMemoryState(summary=new_summary, summarized=len(folded), window=keep)
@@ -0,0 +1,242 @@
+# 14. MIGRACIÓN DE COLECCIONES SIN CORTE DE SERVICIO
+
+# Cambiar el modelo de embeddings, la dimensión o el chunking obligaba a borrar "docs" y reingestar
+# mientras el asistente respondía con una colección vacía o a medias.
+# En este pipeline "docs" es un ALIAS que apunta a una colección versionada (docs_v1, docs_v2...):
+#   1. Creamos la colección nueva en segundo plano y la llenamos a ritmo limitado (el chat sigue usando la antigua).
+#      Reutilizamos el texto cacheado (PageTextCache) y la caché de embeddings, así que solo pagamos lo que cambia.
+#   2. Repasamos los PDFs que se hayan ingestado o borrado mientras tanto.
+#   3. Verificamos que el número de puntos cuadra.
+#   4. Cambiamos el alias de forma atómica. La colección antigua se conserva para poder volver atrás (rollback).
+# Para correrlo: uv run python migrate.py run --rechunk --chunker heading
+#                uv run python migrate.py rollback docs_v1
+
+import argparse
+import hashlib
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+
+from dedup import DedupIndex
+from functions import QdrantStorage, VectorProcessor
+from rate_limit import BATCH
+from snapshots import export_collection, import_collection
+from tenants import DEFAULT_TENANT, source_key
+
+_INTERNAL_KEYS = {"text", "source", "tenant", "staging"} # Campos del payload que se rellenan al escribir en la colección nueva
+
+
+def _source_points(storage: QdrantStorage, source_id: str, tenant_id: str) -> list:
+    """(id, payload) de los puntos visibles de un PDF de un cliente, ordenados por chunk_index."""
+    points = []
+    offset = None
+    while True:
+        page, offset = storage.client.scroll(
+            collection_name=storage.collection,
+            scroll_filter=storage._build_filter(source_id, tenant_id),
+            limit=512,
+            offset=offset,
+            with_payload=True,
+        )
+        points.extend((str(p.id), p.payload) for p in storage.hydrate(page)) # Con texto externo, lo recuperamos del almacén
+        if offset is None:
+            break
+    return sorted(points, key=lambda p: p[1].get("chunk_index", 0))
+
+
+def _rebuild_chunks(processor: VectorProcessor, points: list, rechunk: bool, key: str):
+    """
+    Devuelve (ids, textos, metadatos, padres) de un PDF para la colección nueva.
+    Con rechunk volvemos a trocear el texto cacheado del PDF con el chunker actual: versión, chunk_index e ids nuevos.
+    Si no, reutilizamos los chunks con su id, su versión y su chunk_index: los "duplicate_of" de otros PDFs siguen
+    apuntando a puntos que existen. padres es None al reutilizar: los hijos conservan su "parent_id" y copy_source copia esos padres.
+    """
+    digest = points[0][1].get("file_hash") if points else None
+    if rechunk and digest:
+        pages = processor.page_cache.get(digest)
+        if pages is not None:
+            chunks = processor.splitter.split_pages(pages)
+            texts = [c.text for c in chunks]
+            version = hashlib.sha1("\x00".join(texts).encode("utf-8")).hexdigest()[:12] # Igual que en la ingesta
+            metadata = [{**m, "chunk_index": i, "version": version} for i, m in enumerate(processor.chunk_metadata(digest, chunks))]
+            ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}:{version}:{i}")) for i in range(len(texts))]
+            return ids, texts, metadata, processor.chunk_parents(chunks)
+        print(f"AVISO: No hay texto cacheado para {digest}. Se reutilizan los chunks existentes.")
+    kept = [(point_id, p) for point_id, p in points if p.get("text")]
+    metadata = [{k: v for k, v in p.items() if k not in _INTERNAL_KEYS} for _, p in kept]
+    return [point_id for point_id, _ in kept], [p["text"] for _, p in kept], metadata, None
+
+
+def copy_source(source_id: str, old: QdrantStorage, new: QdrantStorage, processor: VectorProcessor,
+                rechunk: bool = False, batch_size: int = 64, max_batches_per_second: float = 1.0, tenant_id: str = None,
+                dedup: DedupIndex = None) -> int:
+    """
+    Copia (re-embebiendo) un PDF de un cliente de la colección antigua a la nueva a ritmo limitado. Devuelve los puntos escritos.
+    Con dedup, las firmas de sus chunks originales (los que no son alias) pasan al espacio de la colección nueva.
+    """
+    key = source_key(tenant_id, source_id)
+    ids, texts, metadata, parents = _rebuild_chunks(processor, _source_points(old, source_id, tenant_id), rechunk, key)
+    new.delete_source(source_id, tenant_id) # Por si es una segunda pasada
+    if not texts:
+        return 0
+
+    version = metadata[0]["version"]
+    if parents: # Troceado padre-hijo nuevo: los padres se guardan con ids de la colección nueva
+        parent_ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}:{version}:parent:{j}")) for j in range(len(parents))]
+        new.put_parents(parent_ids, parents, [key] * len(parents), [version] * len(parents))
+        metadata = [{**{k: v for k, v in m.items() if k != "parent"}, **({"parent_id": parent_ids[m["parent"]]} if "parent" in m else {})}
+                    for m in metadata]
+    else: # Chunks reutilizados: copiamos sus padres con el mismo id y la misma versión
+        copied = old.get_parents([m.get("parent_id") for m in metadata])
+        new.put_parents(list(copied), list(copied.values()), [key] * len(copied), [version] * len(copied))
+    all_vecs = [] # Para el centroide del índice de enrutado de la colección nueva
+    min_interval = 1.0 / max_batches_per_second if max_batches_per_second > 0 else 0.0
+    for start in range(0, len(texts), batch_size):
+        t0 = time.monotonic()
+        batch = texts[start:start + batch_size]
+        vecs = processor.embed_texts(batch, priority=BATCH) # Prioridad baja: el chat en producción va primero
+        payloads = [{"source": source_id, "tenant": tenant_id, "text": batch[i], **metadata[start + i]} for i in range(len(batch))]
+        new.upsert(ids[start:start + batch_size], vecs, payloads)
+        all_vecs.extend(vecs)
+        elapsed = time.monotonic() - t0
+        if elapsed < min_interval: # Limitamos el ritmo para no competir con el tráfico real
+            time.sleep(min_interval - elapsed)
+    new.router.update(source_id, all_vecs, version=version, tenant_id=tenant_id)
+    if dedup: # Sin esto, la detección de casi duplicados empezaría de cero en la colección nueva
+        ns = DedupIndex.namespace(new.resolve_collection(), tenant_id)
+        originals = [i for i, m in enumerate(metadata) if "duplicate_of" not in m]
+        dedup.delete_other_versions(ns, key, version) # Segunda pasada de un PDF reemplazado durante la copia
+        dedup.add(ns, [ids[i] for i in originals],
+                  [dedup.signature(texts[i]) for i in originals], [key] * len(originals), [version] * len(originals))
+    return len(texts)
+
+
+def _versions(storage: QdrantStorage) -> dict:
+    """{(cliente, source): versión visible} de cada PDF de la colección."""
+    versions = {}
+    for item in storage.list_sources():
+        payloads, _ = storage.client.scroll(
+            collection_name=storage.collection,
+            scroll_filter=storage._build_filter(item["source"], item["tenant_id"]),
+            limit=1,
+            with_payload=["version"],
+        )
+        versions[(item["tenant_id"], item["source"])] = payloads[0].payload.get("version") if payloads else None
+    return versions
+
+
+def _next_collection(storage: QdrantStorage, current: str) -> str:
+    match = re.search(r"_v(\d+)$", current)
+    n = int(match.group(1)) + 1 if match else 2
+    while storage.client.collection_exists(f"{storage.collection}_v{n}"):
+        n += 1
+    return f"{storage.collection}_v{n}"
+
+
+def migrate(alias: QdrantStorage, processor: VectorProcessor, rechunk: bool = False, batch_size: int = 64,
+            max_batches_per_second: float = 1.0, drop_legacy: bool = False, dedup: DedupIndex = None) -> str:
+    """
+    Construye una colección nueva con la configuración actual de 'processor' y cambia el alias. Devuelve su nombre.
+    dedup: índice de casi duplicados que recibe las firmas de la colección nueva (por defecto el de la ingesta; RAG_DEDUP=0 lo desactiva)
+    """
+    dedup = dedup or (DedupIndex() if os.getenv("RAG_DEDUP", "1") == "1" else None)
+    current = alias.resolve_collection()
+    legacy = current == alias.collection # "docs" es una colección real (anterior a los alias)
+    if legacy and not drop_legacy:
+        raise RuntimeError(
+            f"'{alias.collection}' es una colección sin alias. Usa --drop-legacy: se exporta un snapshot, "
+            "se borra y el alias pasa a apuntar a la colección nueva (el borrado deja unos segundos sin datos)."
+        )
+
+    target_name = _next_collection(alias, current)
+    old = QdrantStorage(collection=current, dim=alias.dim, client=alias.client, use_alias=False, text_store=alias.text_store,
+                     parent_store=alias.parent_store)
+    new = QdrantStorage(collection=target_name, dim=processor.embed_dim, client=alias.client, use_alias=False, text_store=alias.text_store,
+                     parent_store=alias.parent_store)
+    print(f"DEBUG: Migrando '{current}' -> '{target_name}' (dim={processor.embed_dim}, modelo={processor.embed_model}).")
+
+    # 1. COPIA INICIAL (los puntos sin cliente, anteriores a tenants.py, pasan antes al cliente por defecto: si no, no se listarían)
+    legacy_points = old.backfill_tenant(DEFAULT_TENANT)
+    if legacy_points:
+        print(f"DEBUG: {legacy_points} puntos sin cliente asignados a '{DEFAULT_TENANT}'.")
+    expected = {}
+    copied_versions = _versions(old)
+    for tenant_id, source_id in copied_versions:
+        expected[(tenant_id, source_id)] = copy_source(source_id, old, new, processor, rechunk, batch_size, max_batches_per_second, tenant_id, dedup)
+        print(f"DEBUG: {tenant_id}/{source_id}: {expected[(tenant_id, source_id)]} puntos.")
+
+    # 2. PUESTA AL DÍA: PDFs ingestados, reemplazados o borrados durante la copia
+    latest = _versions(old)
+    for (tenant_id, source_id), version in latest.items():
+        if copied_versions.get((tenant_id, source_id)) != version:
+            expected[(tenant_id, source_id)] = copy_source(source_id, old, new, processor, rechunk, batch_size, max_batches_per_second, tenant_id, dedup)
+    for tenant_id, source_id in set(expected) - set(latest):
+        new.delete_source(source_id, tenant_id)
+        expected.pop((tenant_id, source_id))
+
+    # 3. VERIFICACIÓN
+    counts = {(item["tenant_id"], item["source"]): item["points"] for item in new.list_sources()}
+    mismatched = {s: (n, counts.get(s, 0)) for s, n in expected.items() if counts.get(s, 0) != n}
+    if mismatched or new.count() != sum(expected.values()):
+        raise RuntimeError(f"La verificación ha fallado, el alias no se cambia. Diferencias (esperado, real): {mismatched}")
+
+    # 4. CAMBIO ATÓMICO DEL ALIAS (la colección antigua se conserva para el rollback)
+    if legacy:
+        export_collection(alias.client, current, f"snapshots/{current}_legacy_{datetime.now():%Y%m%d%H%M%S}", text_store=alias.text_store,
+                          parent_store=alias.parent_store)
+        alias.client.delete_collection(current)
+    alias.switch_alias(target_name)
+    alias.dim = processor.embed_dim
+    print(f"DEBUG: Migración completada. Rollback: uv run python migrate.py rollback {current}")
+    return target_name
+
+
+def restore(alias: QdrantStorage, in_dir: str, parallel: int = 1) -> str:
+    """
+    Restaura un snapshot (snapshots.py) en una colección versionada nueva y cambia el alias. Devuelve su nombre.
+    Igual que en migrate, el alias sigue apuntando a la colección anterior hasta que la restauración termina y esta se conserva para el rollback.
+    """
+    current = alias.resolve_collection()
+    if current == alias.collection:
+        raise RuntimeError(f"'{alias.collection}' es una colección sin alias. Conviértela antes con: uv run python migrate.py run --drop-legacy")
+    target = _next_collection(alias, current)
+    import_collection(alias.client, in_dir, collection=target, parallel=parallel, parent_store=alias.parent_store)
+    alias.switch_alias(target)
+    print(f"DEBUG: Snapshot restaurado en '{target}'. Rollback: uv run python migrate.py rollback {current}")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migración de colecciones con alias y sin corte de servicio")
+    sub = parser.add_subparsers(dest="action", required=True)
+    run = sub.add_parser("run", help="Construye una colección nueva y cambia el alias")
+    run.add_argument("--rechunk", action="store_true", help="Vuelve a trocear el texto cacheado con el chunker actual")
+    run.add_argument("--chunker", default=None)
+    run.add_argument("--model", default=None)
+    run.add_argument("--embedder", default=None, help="Motor de embeddings de la colección nueva: openai o local")
+    run.add_argument("--dim", type=int, default=None)
+    run.add_argument("--batch-size", type=int, default=64)
+    run.add_argument("--max-batches-per-second", type=float, default=1.0)
+    run.add_argument("--drop-legacy", action="store_true")
+    back = sub.add_parser("rollback", help="Vuelve a apuntar el alias a una colección anterior")
+    back.add_argument("collection")
+    sub.add_parser("status", help="Muestra a qué colección apunta el alias")
+    parser.add_argument("--alias", default="docs")
+    args = parser.parse_args()
+
+    client = QdrantStorage.connect()
+    alias = QdrantStorage(collection=args.alias, client=client, dim=client.get_collection(args.alias).config.params.vectors.size)
+    if args.action == "run":
+        processor = VectorProcessor(embed_model=args.model, embed_dim=args.dim, chunker=args.chunker, embedder=args.embedder, collection=args.alias)
+        migrate(alias, processor, rechunk=args.rechunk, batch_size=args.batch_size,
+                max_batches_per_second=args.max_batches_per_second, drop_legacy=args.drop_legacy)
+    elif args.action == "rollback":
+        alias.switch_alias(args.collection)
+    else:
+        print(f"{args.alias} -> {alias.resolve_collection()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# 20. SEGUIMIENTO DEL PROGRESO DE LA INGESTA
+
+# El frontend enviaba el evento de ingesta y a los 0.3 s decía "Documento listo", aunque Inngest siguiera trabajando:
+# los usuarios preguntaban contra PDFs a medio ingestar y no sabíamos a qué ritmo se ingestaba.
+# En este pipeline cada ingesta es un TRABAJO (job), identificado por el id del evento de Inngest:
+#   - El workflow lo va actualizando: páginas leídas, chunks troceados, chunks con embedding, puntos subidos y estado.
+#   - Se guarda como un JSON por trabajo (escritura atómica) en una carpeta compartida por los workers.
+#   - La API (main.py) lo expone en /ingest/jobs y /ingest/jobs/{id}; streamlit_app.py y admin_monitor.py pintan la barra.
+# El ritmo (chunks/s) y el tiempo restante (ETA) se calculan al leer, a partir de los contadores y las marcas de tiempo.
+
+import json
+import os
+import time
+from pathlib import Path
+
+STATUSES = ("parsing", "embedding", "upserting", "activating", "done", "error") # Estados en orden de avance
+
+
+class ProgressTracker:
+    def __init__(self, folder: str = None, ttl_seconds: float = 7 * 24 * 3600):
+        self.folder = Path(folder or os.getenv("RAG_PROGRESS_DIR", ".cache/ingest_jobs"))
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds # Los trabajos terminados se olvidan pasado este tiempo
+
+    def _path(self, job_id: str) -> Path:
+        return self.folder / f"{''.join(c for c in str(job_id) if c.isalnum() or c in '-_')}.json"
+
+    def _read(self, job_id: str):
+        try:
+            return json.loads(self._path(job_id).read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write(self, job: dict):
+        path = self._path(job["job_id"])
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path) # Atómico: quien lee nunca ve un JSON a medias
+
+    def update(self, job_id: str, **fields) -> dict:
+        """Crea o actualiza un trabajo. Los campos que no se pasan se conservan."""
+        if not job_id:
+            return {}
+        now = time.time()
+        job = self._read(job_id) or {
+            "job_id": job_id, "source_id": None, "status": "parsing", "pages": 0, "chunks": 0,
+            "chunks_embedded": 0, "points_upserted": 0, "error": None, "created_at": now, "embed_started_at": None,
+        }
+        if fields.get("status") == "embedding" and job.get("status") != "embedding":
+            job["embed_started_at"] = now # El ritmo se mide desde que empiezan los embeddings (también si Inngest reintenta)
+        if fields.get("status", "error") != "error":
+            job["error"] = None # Un reintento que avanza borra el error del intento anterior
+        job.update(fields)
+        job["updated_at"] = now
+        self._write(job)
+        return job
+
+    def advance(self, job_id: str, field: str, n: int) -> dict: # Suma n a un contador (chunks_embedded, points_upserted)
+        job = self._read(job_id) if job_id else None
+        if job is None or not n:
+            return job or {}
+        return self.update(job_id, **{field: job.get(field, 0) + n})
+
+    @staticmethod
+    def _with_rates(job: dict) -> dict:
+        job = dict(job)
+        done = job.get("chunks_embedded", 0)
+        started = job.get("embed_started_at")
+        end = job["updated_at"] if job["status"] in ("done", "error") else time.time()
+        elapsed = max(end - started, 1e-6) if started else 0
+        job["rate"] = done / elapsed if elapsed else 0.0 # chunks por segundo
+        remaining = max(job.get("chunks", 0) - done, 0)
+        job["eta_s"] = remaining / job["rate"] if job["rate"] and job["status"] not in ("done", "error") else None
+        total = job.get("chunks") or 0
+        # Progreso global: embeddings y subida pesan lo mismo; el troceado solo marca el arranque
+        job["progress"] = 1.0 if job["status"] == "done" else (
+            (done + job.get("points_upserted", 0)) / (2 * total) if total else 0.0
+        )
+        return job
+
+    def get(self, job_id: str):
+        job = self._read(job_id)
+        return self._with_rates(job) if job else None
+
+    def list(self, limit: int = 50) -> list[dict]:
+        """Trabajos más recientes primero. De paso borra los que han caducado."""
+        jobs = []
+        cutoff = time.time() - self.ttl_seconds
+        for path in self.folder.glob("*.json"):
+            try:
+                job = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                continue
+            if job.get("updated_at", 0) < cutoff:
+                path.unlink(missing_ok=True)
+                continue
+            jobs.append(self._with_rates(job))
+        jobs.sort(key=lambda j: j.get("created_at", 0), reverse=True)
+        return jobs[:limit]
+
+    def throughput(self, jobs: list = None) -> dict:
+        """Ritmo agregado de los trabajos en curso (chunks/s) y totales."""
+        jobs = self.list() if jobs is None else jobs
+        running = [j for j in jobs if j["status"] not in ("done", "error")]
+        return {
+            "running": len(running),
+            "done": sum(1 for j in jobs if j["status"] == "done"),
+            "failed": sum(1 for j in jobs if j["status"] == "error"),
+            "chunks_per_second": sum(j["rate"] for j in running),
+        }
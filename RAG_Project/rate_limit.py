@@ -0,0 +1,246 @@
+# 9. LIMITADOR DE PETICIONES A OPENAI
+
+# OpenAI limita cada modelo por peticiones por minuto (RPM) y tokens por minuto (TPM).
+# Si lanzamos peticiones sin control, recibimos errores 429 en cadena y los reintentos disparan la latencia.
+# En este pipeline creamos un limitador COMPARTIDO por todo el proceso:
+#   - TOKEN BUCKET: Un "cubo" por modelo para las peticiones y otro para los tokens. Solo se lanza una petición si hay saldo.
+#   - CONCURRENCIA ADAPTATIVA (AIMD): Sube poco a poco el número de peticiones en vuelo mientras todo va bien
+#     y lo divide a la mitad cuando llega un 429 o las cabeceras avisan de que queda poco margen.
+#   - REINTENTOS CON JITTER: Ante un 429 esperamos un tiempo aleatorio creciente (o lo que diga 'retry-after').
+#     Los errores transitorios (5xx, conexión, timeout) también se reintentan con la misma espera, pero menos veces
+#     (RAG_OPENAI_TRANSIENT_RETRIES, 2 como el SDK, que aquí tiene sus reintentos desactivados).
+#   - PRIORIDAD: Las consultas interactivas del chat ("interactive") pasan por delante de la ingesta y los lotes ("batch").
+
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from tokens import count_tokens
+from tracing import span
+from usage import record_response
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Límites por defecto (peticiones y tokens por minuto). Se pueden sobrescribir con RAG_OPENAI_LIMITS='{"modelo": {"rpm": .., "tpm": ..}}'
+DEFAULT_LIMITS = {
+    "text-embedding-3-large": {"rpm": 3000, "tpm": 1_000_000},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200_000},
+}
+FALLBACK_LIMITS = {"rpm": 500, "tpm": 200_000}
+
+
+class TokenBucket: # Cubo que se rellena de forma continua hasta 'capacity' unidades por minuto
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0 # Unidades que se recuperan por segundo
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float: # Segundos que faltan para poder gastar 'amount'
+        self._refill()
+        amount = min(amount, self.capacity) # Una petición más grande que el cubo no debe bloquear para siempre
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, remaining: float): # Ajusta el saldo a lo que OpenAI dice que nos queda
+        self._refill()
+        self.level = min(self.level, float(remaining))
+
+
+class AdaptiveConcurrency: # Control AIMD: suma lineal cuando va bien, reducción multiplicativa cuando hay 429
+    def __init__(self, initial: float = 8, minimum: float = 1, maximum: float = 64):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit) # +1 por cada "ventana" completa de éxitos
+
+    def on_throttle(self, factor: float = 0.5):
+        self.limit = max(self.minimum, self.limit * factor)
+
+
+def _parse_reset(value: str) -> float:
+    """Convierte cabeceras tipo '1s', '6m0s' o '250ms' a segundos."""
+    if not value:
+        return 0.0
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+class ModelLimiter: # Estado del limitador para un modelo concreto
+    def __init__(self, rpm: float, tpm: float, batch_share: float = 0.75):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveConcurrency()
+        self.batch_share = batch_share # Fracción de la concurrencia que puede ocupar el tráfico "batch"
+        self.in_flight = 0
+        self.waiting = {INTERACTIVE: 0, BATCH: 0}
+        self.cond = threading.Condition()
+
+    def _max_in_flight(self, priority: str) -> int:
+        limit = int(self.concurrency.limit)
+        if priority == BATCH:
+            limit = int(limit * self.batch_share)
+        return max(1, limit)
+
+    def acquire(self, tokens: int, priority: str = INTERACTIVE):
+        with self.cond:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    if priority == BATCH and self.waiting[INTERACTIVE] > 0: # Cedemos el turno a las consultas del chat
+                        self.cond.wait(0.05)
+                        continue
+                    if self.in_flight >= self._max_in_flight(priority):
+                        self.cond.wait(0.05)
+                        continue
+                    wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if wait > 0:
+                        self.cond.wait(wait)
+                        continue
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    self.in_flight += 1
+                    return
+            finally:
+                self.waiting[priority] -= 1
+
+    def release(self, throttled: bool = False, headers=None, ok: bool = True):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.concurrency.on_throttle()
+                self.requests.level = 0 # Vaciamos el cubo para cortar la tormenta de 429
+            elif ok: # Un error que no es 429 ni sube ni baja la concurrencia
+                self.concurrency.on_success()
+            if headers:
+                self._apply_headers(headers)
+            self.cond.notify_all()
+
+    def _apply_headers(self, headers):
+        remaining_req = headers.get("x-ratelimit-remaining-requests")
+        remaining_tok = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_req is not None:
+            self.requests.sync(float(remaining_req))
+        if remaining_tok is not None:
+            self.tokens.sync(float(remaining_tok))
+            if float(remaining_tok) < 0.1 * self.tokens.capacity: # Queda menos del 10%: frenamos un poco antes del 429
+                self.concurrency.on_throttle(factor=0.9)
+
+
+def _is_rate_limit(exc: Exception) -> bool:
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    try:
+        from openai import RateLimitError # Import local: este módulo se carga sin el SDK (tests, arranque perezoso)
+    except ImportError:
+        return False
+    return isinstance(exc, RateLimitError)
+
+
+def _is_transient(exc: Exception) -> bool: # Errores que el SDK de OpenAI reintentaría: 5xx, fallo de conexión y timeout
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    try:
+        from openai import APIConnectionError # APITimeoutError hereda de ella
+    except ImportError:
+        return False
+    return isinstance(exc, APIConnectionError)
+
+
+def _retry_after(exc: Exception) -> float:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            return 0.0
+    return _parse_reset(headers.get("x-ratelimit-reset-requests", ""))
+
+
+class RateLimiter: # Punto de entrada compartido: un ModelLimiter por modelo
+    def __init__(self, limits: dict = None, max_retries: int = 6, base_delay: float = 0.5, max_delay: float = 30.0,
+                 transient_retries: int = None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or json.loads(os.getenv("RAG_OPENAI_LIMITS", "{}")))
+        self.max_retries = max_retries
+        self.transient_retries = int(os.getenv("RAG_OPENAI_TRANSIENT_RETRIES", 2)) if transient_retries is None else transient_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def for_model(self, model: str) -> ModelLimiter:
+        with self._lock:
+            if model not in self._models:
+                cfg = self.limits.get(model, FALLBACK_LIMITS)
+                self._models[model] = ModelLimiter(cfg["rpm"], cfg["tpm"])
+            return self._models[model]
+
+    def backoff(self, attempt: int, exc: Exception = None) -> float: # Full jitter: aleatorio entre 0 y el tope exponencial
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if exc is not None:
+            delay = max(delay, _retry_after(exc))
+        return delay
+
+    def call(self, model: str, fn, tokens: int, priority: str = INTERACTIVE, transient_retries: int = None):
+        """
+        Ejecuta fn() respetando los límites del modelo y reintentando con jitter los 429 (hasta max_retries)
+        y los errores transitorios (hasta transient_retries; 0 cuando quien llama ya tiene su propio plazo).
+        Si fn devuelve una respuesta "raw" del SDK de OpenAI (with_raw_response) leemos sus cabeceras
+        para ajustar el limitador y devolvemos el objeto ya parseado.
+        """
+        limiter = self.for_model(model)
+        transient_retries = self.transient_retries if transient_retries is None else transient_retries
+        failures = 0 # Errores transitorios seguidos
+        with span(f"openai.{model}", model=model, priority=priority, tokens=tokens) as attrs: # La espera en el limitador también cuenta
+            for attempt in range(self.max_retries + 1):
+                limiter.acquire(tokens, priority)
+                try:
+                    result = fn()
+                except Exception as exc:
+                    throttled = _is_rate_limit(exc)
+                    limiter.release(throttled=throttled, ok=False)
+                    if throttled:
+                        retry = attempt < self.max_retries
+                    else:
+                        failures += 1
+                        retry = _is_transient(exc) and failures <= transient_retries and attempt < self.max_retries
+                    if not retry:
+                        raise
+                    time.sleep(self.backoff(attempt, exc))
+                    continue
+                attrs["attempts"] = attempt + 1
+                headers = getattr(result, "headers", None)
+                limiter.release(headers=headers)
+                parsed = result.parse() if hasattr(result, "parse") else result
+                record_response(model, parsed) # Tokens de la respuesta para la auditoría y el coste (usage.py)
+                return parsed
+
+
+def estimate_chat_tokens(messages: list, max_tokens: int = 0) -> int: # Coste estimado de una llamada de chat (entrada + salida máxima)
+    return sum(count_tokens(m.get("content") or "") + 4 for m in messages) + max_tokens
+
+
+rate_limiter = RateLimiter() # Instancia única compartida por ingesta y consultas
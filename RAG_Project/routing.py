@@ -0,0 +1,138 @@
+# 16. ÍNDICE DE ENRUTADO POR DOCUMENTO
+
+# Las consultas sin PDF (source_id=None) buscaban en TODOS los chunks de TODOS los PDFs, en un único grafo HNSW.
+# Con miles de documentos la búsqueda es más lenta y los chunks de PDFs que no tienen nada que ver "roban" puestos del top_k.
+# En este pipeline la búsqueda se hace en dos etapas:
+#   1. ENRUTADO: una colección pequeña ({colección}_routing) guarda UN vector por PDF (el centroide de sus chunks).
+#      La pregunta se compara primero con estos centroides para elegir los N PDFs más prometedores.
+#   2. BÚSQUEDA: la búsqueda normal de chunks, filtrada solo a esos N PDFs.
+# Los centroides se calculan en la ingesta (no hay que volver a leer los vectores) y se borran con el PDF.
+# Cada centroide lleva su cliente ("tenant", ver tenants.py) y el enrutado solo elige entre los PDFs del cliente que pregunta.
+# Para reconstruir el índice de una colección ya existente: uv run python routing.py rebuild
+
+import argparse
+import uuid
+
+import numpy as np
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import (VectorParams, Distance, PointStruct, PointIdsList, QueryRequest, Filter, FieldCondition, MatchValue,
+                                  FilterSelector, KeywordIndexParams, KeywordIndexType, IsEmptyCondition, PayloadField)
+
+from tenants import require_tenant, source_key
+from tracing import span
+
+
+def centroid(vectors: list) -> list[float]:
+    """Media de los vectores normalizada (la colección compara por coseno)."""
+    mean = np.asarray(vectors, dtype=np.float32).mean(axis=0)
+    norm = float(np.linalg.norm(mean)) or 1.0
+    return (mean / norm).tolist()
+
+
+class SourceRouter:
+    def __init__(self, client: QdrantClient, collection: str, dim: int):
+        self.client = client
+        self.collection = collection # Normalmente "<colección física>_routing": cada versión de docs tiene su propio índice
+        self.dim = dim
+        if not self.client.collection_exists(self.collection):
+            self._create()
+
+    def _create(self):
+        self.client.create_collection(
+            collection_name=self.collection,
+            vectors_config=VectorParams(size=self.dim, distance=Distance.COSINE),
+        )
+        self.ensure_tenant_index()
+
+    def ensure_tenant_index(self): # También para índices creados antes del aislamiento por cliente (tenants.py optimize)
+        self.client.create_payload_index(self.collection, field_name="tenant",
+                                         field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True))
+
+    @staticmethod
+    def _point_id(source_id: str, tenant_id: str) -> str: # Un punto por PDF y cliente: al reingestar se sobrescribe
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"route:{source_key(tenant_id, source_id)}"))
+
+    @staticmethod
+    def _tenant_filter(tenant_id: str) -> Filter:
+        return Filter(must=[FieldCondition(key="tenant", match=MatchValue(value=require_tenant(tenant_id)))])
+
+    def update(self, source_id: str, vectors: list, version: str = None, tenant_id: str = None):
+        if not vectors:
+            return
+        self.client.upsert(self.collection, points=[PointStruct(
+            id=self._point_id(source_id, require_tenant(tenant_id)),
+            vector=centroid(vectors),
+            payload={"source": source_id, "tenant": tenant_id, "version": version, "points": len(vectors)},
+        )])
+
+    def remove(self, source_id: str, tenant_id: str):
+        self.client.delete(self.collection, points_selector=PointIdsList(points=[self._point_id(source_id, tenant_id)]))
+
+    def remove_tenant(self, tenant_id: str):
+        self.client.delete(self.collection, points_selector=FilterSelector(filter=self._tenant_filter(tenant_id)))
+
+    def backfill_tenant(self, tenant_id: str): # Centroides anteriores al aislamiento por cliente (ver tenants.py)
+        self.client.set_payload(self.collection, payload={"tenant": tenant_id},
+                                points=Filter(must=[IsEmptyCondition(is_empty=PayloadField(key="tenant"))]))
+
+    def clear(self):
+        self.client.delete_collection(self.collection)
+        self._create()
+
+    def route(self, query_vector, top_n: int = 20, tenant_id: str = None) -> list[str]:
+        """PDFs del cliente cuyo centroide más se parece a la pregunta."""
+        with span("qdrant.route", collection=self.collection, top_n=top_n):
+            hits = self.client.query_points(collection_name=self.collection, query=query_vector, query_filter=self._tenant_filter(tenant_id),
+                                            limit=top_n, with_payload=["source"]).points
+        return [h.payload["source"] for h in hits]
+
+    def route_batch(self, query_vectors: list, top_n: int = 20, tenant_id: str = None) -> list[list[str]]:
+        if not query_vectors:
+            return []
+        tenant_filter = self._tenant_filter(tenant_id)
+        with span("qdrant.route_batch", collection=self.collection, queries=len(query_vectors), top_n=top_n):
+            responses = self.client.query_batch_points(
+                collection_name=self.collection,
+                requests=[QueryRequest(query=vec, filter=tenant_filter, limit=top_n, with_payload=["source"]) for vec in query_vectors],
+            )
+        return [[h.payload["source"] for h in resp.points] for resp in responses]
+
+    def rebuild(self, storage) -> int:
+        """Recalcula el centroide de cada PDF leyendo sus vectores de QDRANT (para colecciones anteriores al enrutado)."""
+        self.clear()
+        for item in storage.list_sources():
+            vectors, offset = [], None
+            while True:
+                page, offset = storage.client.scroll(
+                    collection_name=storage.collection,
+                    scroll_filter=storage._build_filter(item["source"], item["tenant_id"]),
+                    limit=512,
+                    offset=offset,
+                    with_vectors=True,
+                )
+                vectors.extend(p.vector for p in page)
+                if offset is None:
+                    break
+            self.update(item["source"], vectors, tenant_id=item["tenant_id"])
+        return self.client.count(self.collection).count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice de enrutado por documento")
+    parser.add_argument("action", choices=["rebuild", "status"])
+    parser.add_argument("--collection", default="docs")
+    args = parser.parse_args()
+
+    from functions import QdrantStorage # Import local: functions también importa este módulo
+    client = QdrantStorage.connect()
+    storage = QdrantStorage(collection=args.collection, client=client,
+                            dim=client.get_collection(args.collection).config.params.vectors.size)
+    if args.action == "rebuild":
+        print(f"{storage.router.collection}: {storage.router.rebuild(storage)} documentos enrutables.")
+    else:
+        print(f"{storage.router.collection}: {client.count(storage.router.collection).count} documentos enrutables.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# 26. ARRANQUE PEREZOSO Y SALUD DEL SERVICIO
+
+# main.py creaba todos los motores al importarse: VectorProcessor (importa openai, llama_index...), QdrantStorage
+# (collection_exists, create_collection, índices: varias llamadas de red) y el workflow. Un worker nuevo tardaba segundos
+# en arrancar y, si QDRANT no respondía en ese momento, uvicorn no llegaba a levantar la API.
+# En este pipeline:
+#   - IMPORTS DIFERIDOS: functions, workflow y sessions (y con ellos openai y qdrant_client) se importan al construir
+#     el primer motor, no al importar main.py.
+#   - MOTORES PEREZOSOS: cada motor se crea la primera vez que se usa y se reutiliza después. Si falla (QDRANT caído)
+#     no se guarda el error: la siguiente petición lo vuelve a intentar.
+#   - CALENTAMIENTO: al arrancar la API los motores se crean en un hilo aparte (RAG_WARMUP=0 lo desactiva), así la primera
+#     consulta no paga el arranque y el servidor ya acepta peticiones mientras tanto.
+#   - SALUD: /healthz (el proceso vive, sin E/S) y /readyz (motores creados y QDRANT responde; 503 si no) en main.py.
+# El tiempo de arranque se mide con: uv run python bench_startup.py
+
+import os
+import threading
+import time
+
+from progress import ProgressTracker # Solo disco: /ingest/jobs responde aunque QDRANT no esté disponible
+
+
+class LazyServices:
+    def __init__(self):
+        self._lock = threading.RLock() # Dos peticiones concurrentes no deben crear dos veces el mismo motor
+        self._engines = {}
+        self.progress = ProgressTracker()
+        self.started_at = time.time()
+
+    def _get(self, name: str, factory):
+        engine = self._engines.get(name)
+        if engine is None:
+            with self._lock:
+                engine = self._engines.get(name)
+                if engine is None:
+                    engine = factory()
+                    self._engines[name] = engine
+        return engine
+
+    def _build_processor(self):
+        from functions import VectorProcessor # Import local: openai, tiktoken y el chunker no se cargan al arrancar
+        return VectorProcessor()
+
+    def _build_storage(self):
+        from functions import QdrantStorage
+        return QdrantStorage(dim=self.processor.embed_dim) # "docs" es un alias: las migraciones (migrate.py) lo cambian sin cortar el servicio
+
+    def _build_audit(self):
+        from functions import AuditLogger
+        return AuditLogger(self.storage.client)
+
+    def _build_sessions(self):
+        from sessions import SessionStore
+        return SessionStore(self.storage.client)
+
+    def _build_workflow(self): # Inyección de dependencias
+        from workflow import RAGWorkflow
+        return RAGWorkflow(processor=self.processor, storage=self.storage, logger=self.audit, sessions=self.sessions,
+                           progress=self.progress)
+
+    @property
+    def processor(self):
+        return self._get("processor", self._build_processor)
+
+    @property
+    def storage(self):
+        return self._get("storage", self._build_storage)
+
+    @property
+    def audit(self):
+        return self._get("audit", self._build_audit)
+
+    @property
+    def sessions(self):
+        return self._get("sessions", self._build_sessions)
+
+    @property
+    def workflow(self):
+        return self._get("workflow", self._build_workflow)
+
+    def warm_up(self): # Se ejecuta en un hilo al arrancar la API: si falla, /readyz lo cuenta y la primera petición reintenta
+        try:
+            self.workflow
+        except Exception as e:
+            print(f"AVISO: No se pudieron crear los motores al arrancar: {e}")
+
+    def health(self) -> dict: # Liveness: sin E/S, solo que el proceso responde
+        return {"status": "ok", "uptime_s": round(time.time() - self.started_at, 1)}
+
+    def readiness(self) -> dict:
+        """
+        Readiness: crea los motores que falten y comprueba que QDRANT responde.
+        Devuelve {"ready": bool, "checks": {nombre: "ok" | error}}. No llama a OpenAI (costaría dinero en cada sondeo):
+        solo comprueba que hay clave configurada (las respuestas siempre usan su API de chat).
+        """
+        checks = {}
+        try:
+            storage = self.storage
+            storage.client.get_collections() # Ida y vuelta real a QDRANT, aunque los motores ya estuvieran creados
+            checks["qdrant"] = "ok"
+        except Exception as e:
+            checks["qdrant"] = f"{type(e).__name__}: {e}"
+        try:
+            self.workflow
+            checks["workflow"] = "ok"
+        except Exception as e:
+            checks["workflow"] = f"{type(e).__name__}: {e}"
+        replay = os.getenv("RAG_CASSETTE") == "replay" # Respuestas grabadas (cassette.py): no hace falta clave
+        checks["openai_key"] = "ok" if os.getenv("OPENAI_API_KEY") or replay else "OPENAI_API_KEY no configurada"
+        return {"ready": all(v == "ok" for v in checks.values()), "checks": checks,
+                "engines": sorted(self._engines)}
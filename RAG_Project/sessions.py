@@ -0,0 +1,153 @@
+# 11. SESIONES DE CHAT EN EL SERVIDOR
+
+# Antes el navegador enviaba todo el historial en cada evento y la auditoría lo volvía a guardar entero en cada pregunta,
+# así que el tamaño de eventos y registros crecía de forma cuadrática con la conversación.
+# En este pipeline guardamos las sesiones en QDRANT (igual que hacemos con la auditoría):
+#   - TURNOS: Cada mensaje es un punto independiente que solo se añade, nunca se reescribe (append-only).
+#   - ESTADO: Un punto "meta" por sesión con el resumen de la memoria y hasta qué mensaje llega (ver memory.py).
+#   - TTL: Las sesiones sin actividad durante más de RAG_SESSION_TTL_HOURS se borran.
+# Los eventos solo llevan el session_id y la pregunta nueva.
+# Cada sesión es de un cliente (tenant, ver tenants.py): payload "tenant" con índice is_tenant, y todas las lecturas, ids y
+# borrados van dentro del cliente. El session_id lo elige el navegador, así que otro cliente con el mismo id no ve su historial.
+# Los ids llevan el cliente (no se reutiliza la clave de "default" como en tenants.source_key): las sesiones anteriores a este
+# cambio no tienen "tenant", ya no se leen y evict_expired las borra enteras al caducar.
+
+import os
+import time
+import uuid
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import (VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue, Range, FilterSelector,
+                                  PayloadSchemaType, KeywordIndexParams, KeywordIndexType, IsEmptyCondition, PayloadField)
+
+from tenants import require_tenant
+
+
+class SessionStore:
+    def __init__(self, client: QdrantClient, collection: str = "chat_sessions", ttl_seconds: float = None):
+        self.client = client
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RAG_SESSION_TTL_HOURS", 24)) * 3600 # Tiempo de vida sin actividad
+        self._ready = False
+
+    def _ensure(self): # Crea la colección la primera vez que se usa
+        if self._ready:
+            return
+        if not self.client.collection_exists(self.collection):
+            self.client.create_collection(
+                collection_name=self.collection,
+                vectors_config=VectorParams(size=1, distance=Distance.DOT), # No buscamos por similitud: vector mínimo
+            )
+            self.client.create_payload_index(self.collection, field_name="session_id", field_schema=PayloadSchemaType.KEYWORD)
+            self.client.create_payload_index(self.collection, field_name="kind", field_schema=PayloadSchemaType.KEYWORD)
+            self.client.create_payload_index(self.collection, field_name="last_active", field_schema=PayloadSchemaType.FLOAT)
+        self.client.create_payload_index(self.collection, field_name="tenant", # También en colecciones creadas antes de este campo
+                                         field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True))
+        self._ready = True
+
+    @staticmethod
+    def _session_filter(session_id: str, tenant_id: str, kind: str = None, after_seq: int = None) -> Filter: # Siempre dentro de un cliente
+        must = [FieldCondition(key="tenant", match=MatchValue(value=require_tenant(tenant_id))),
+                FieldCondition(key="session_id", match=MatchValue(value=session_id))]
+        if kind:
+            must.append(FieldCondition(key="kind", match=MatchValue(value=kind)))
+        if after_seq is not None:
+            must.append(FieldCondition(key="seq", range=Range(gt=after_seq)))
+        return Filter(must=must)
+
+    @staticmethod
+    def _meta_id(session_id: str, tenant_id: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"session:{require_tenant(tenant_id)}:{session_id}:meta"))
+
+    def get_state(self, session_id: str, tenant_id: str = None) -> dict:
+        """Devuelve el estado de la memoria de la sesión: resumen y último mensaje ya resumido (seq)."""
+        self._ensure()
+        found = self.client.retrieve(self.collection, ids=[self._meta_id(session_id, tenant_id)], with_payload=True)
+        payload = found[0].payload if found else {}
+        return {"summary": payload.get("summary", ""), "summarized_seq": payload.get("summarized_seq", 0)}
+
+    def save_state(self, session_id: str, summary: str, summarized_seq: int, tenant_id: str = None):
+        self._ensure()
+        self.client.upsert(self.collection, points=[PointStruct(
+            id=self._meta_id(session_id, tenant_id),
+            vector=[1.0],
+            payload={
+                "tenant": tenant_id,
+                "session_id": session_id,
+                "kind": "meta",
+                "summary": summary,
+                "summarized_seq": summarized_seq,
+                "last_active": time.time(),
+            },
+        )])
+
+    def get_turns(self, session_id: str, after_seq: int = 0, tenant_id: str = None) -> list:
+        """Mensajes de la sesión posteriores a 'after_seq', en orden. Cada uno lleva role, content y seq."""
+        self._ensure()
+        turns = []
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection,
+                scroll_filter=self._session_filter(session_id, tenant_id, kind="turn", after_seq=after_seq),
+                limit=256,
+                offset=offset,
+                with_payload=True,
+            )
+            turns.extend(p.payload for p in points)
+            if offset is None:
+                break
+        turns.sort(key=lambda t: t["seq"])
+        return [{"role": t["role"], "content": t["content"], "seq": t["seq"]} for t in turns]
+
+    def append_turn(self, session_id: str, turn_id: str, question: str, answer: str, tenant_id: str = None):
+        """
+        Añade la pregunta y la respuesta de un turno. Los ids salen del turn_id (el id del evento),
+        así que si Inngest reintenta el paso no se duplican los mensajes.
+        """
+        self._ensure()
+        require_tenant(tenant_id)
+        now = time.time()
+        seq = time.time_ns() // 1000 # Microsegundos: caben exactos en un float (los filtros Range de QDRANT usan float)
+        points = []
+        for i, (role, content) in enumerate((("user", question), ("assistant", answer))):
+            points.append(PointStruct(
+                id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"session:{tenant_id}:{session_id}:{turn_id}:{role}")),
+                vector=[1.0],
+                payload={"tenant": tenant_id, "session_id": session_id, "kind": "turn", "seq": seq + i, "role": role,
+                         "content": content, "timestamp": now},
+            ))
+        self.client.upsert(self.collection, points=points)
+        self.touch(session_id, tenant_id)
+
+    def touch(self, session_id: str, tenant_id: str = None): # Marca la sesión como activa (renueva el TTL), creando el punto meta si aún no existe
+        state = self.get_state(session_id, tenant_id)
+        self.save_state(session_id, state["summary"], state["summarized_seq"], tenant_id)
+
+    def evict_expired(self) -> int:
+        """Borra todas las sesiones cuya última actividad es anterior al TTL. Devuelve cuántas se han borrado."""
+        self._ensure()
+        cutoff = time.time() - self.ttl_seconds
+        expired, offset = [], None
+        while True: # Página a página hasta el final: puede haber más de 1000 sesiones caducadas
+            page, offset = self.client.scroll(
+                collection_name=self.collection,
+                scroll_filter=Filter(must=[
+                    FieldCondition(key="kind", match=MatchValue(value="meta")),
+                    FieldCondition(key="last_active", range=Range(lt=cutoff)),
+                ]),
+                limit=1000,
+                offset=offset,
+                with_payload=["session_id", "tenant"],
+            )
+            expired.extend((point.payload["session_id"], point.payload.get("tenant")) for point in page)
+            if offset is None:
+                break
+        for session_id, tenant_id in expired: # Se borra al final: el recorrido no cambia mientras se pagina
+            if tenant_id:
+                selector = self._session_filter(session_id, tenant_id)
+            else: # Sesión anterior a los tenants: se borran sus puntos sin "tenant", nunca los de un cliente con el mismo id
+                selector = Filter(must=[FieldCondition(key="session_id", match=MatchValue(value=session_id)),
+                                        IsEmptyCondition(is_empty=PayloadField(key="tenant"))])
+            self.client.delete(self.collection, points_selector=FilterSelector(filter=selector))
+        return len(expired)
@@ -0,0 +1,196 @@
+# 12. SNAPSHOTS DE COLECCIONES (ARRANQUES EN CALIENTE)
+
+# Reconstruir la colección "docs" obliga a volver a pasar cada PDF por rag_ingest_pdf y a pagar de nuevo todos los embeddings.
+# En este pipeline exportamos una colección a un formato local y compacto y la restauramos con una subida masiva:
+#   - VECTORES: Ficheros NumPy en float16 (la mitad de espacio que float32, suficiente para similitud coseno).
+#   - PAYLOADS E IDS: Ficheros Parquet (una fila por punto).
+#   - MANIFEST: Un JSON con la dimensión, la distancia, la configuración HNSW, los índices de payload (con sus parámetros,
+#     p.ej. is_tenant) y la lista de shards: la colección restaurada queda igual que una recién creada.
+#   - ENRUTADO: el índice de enrutado ({colección}_routing, ver routing.py) va en la subcarpeta "routing" con el mismo formato.
+#   - PADRES: con recuperación padre-hijo, cada hijo lleva en el snapshot el texto de su padre ("parent_text") y al restaurar
+#     vuelve al almacén de padres: el snapshot no depende del SQLite local.
+# Restaurar no hace NINGUNA llamada a OpenAI y funciona igual con QDRANT en DOCKER, en local (path) o en memoria.
+# Desde la línea de comandos, "docs" es un alias: se exporta la colección a la que apunta y se restaura en una colección
+# versionada nueva (docs_vN) antes de cambiar el alias, como una migración (migrate.py); la anterior queda para el rollback.
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from qdrant_client import QdrantClient, models
+from qdrant_client.models import VectorParams, Distance, HnswConfigDiff, PayloadSchemaType
+
+from functions import QdrantStorage
+from tenants import source_key
+from textstore import ChunkTextStore
+
+
+def _index_spec(index) -> dict: # Índice de payload tal y como se creó (tipo y parámetros)
+    if index.params is not None:
+        return index.params.model_dump(mode="json", exclude_none=True)
+    return {"type": index.data_type.value if hasattr(index.data_type, "value") else str(index.data_type)}
+
+
+def _index_schema(spec):
+    if isinstance(spec, str): # Manifests anteriores: solo el tipo
+        return PayloadSchemaType(spec)
+    if len(spec) == 1:
+        return PayloadSchemaType(spec["type"])
+    return getattr(models, f"{spec['type'].capitalize()}IndexParams")(**spec) # KeywordIndexParams(is_tenant=True)...
+
+
+def export_collection(client: QdrantClient, collection: str, out_dir: str, shard_size: int = 10_000, page_size: int = 1_000,
+                      text_store: ChunkTextStore = None, parent_store: ChunkTextStore = None) -> dict:
+    """
+    Exporta ids, vectores y payloads de 'collection' a 'out_dir'. Devuelve el manifest.
+    Con text_store (texto externo), el texto de cada chunk se vuelve a meter en el payload: el snapshot no depende del almacén.
+    Con parent_store, lo mismo con el texto del padre de cada hijo ("parent_text").
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    info = client.get_collection(collection)
+    params = info.config.params.vectors # VectorParams de la colección (vector sin nombre)
+    manifest = {
+        "collection": collection,
+        "dim": params.size,
+        "distance": params.distance.value if hasattr(params.distance, "value") else str(params.distance),
+        "dtype": "float16",
+        "hnsw_config": info.config.hnsw_config.model_dump(mode="json", exclude_none=True),
+        "payload_schema": {k: _index_spec(v) for k, v in (info.payload_schema or {}).items()},
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "count": 0,
+        "shards": [],
+    }
+
+    def flush(ids, vectors, payloads):
+        name = f"shard_{len(manifest['shards']):05d}"
+        np.save(out / f"{name}.npy", np.asarray(vectors, dtype=np.float16))
+        pd.DataFrame({
+            "id": [json.dumps(i) for i in ids], # json conserva si el id era entero o UUID
+            "payload": [json.dumps(p, ensure_ascii=False) for p in payloads],
+        }).to_parquet(out / f"{name}.parquet", index=False)
+        manifest["shards"].append({"name": name, "count": len(ids)})
+        manifest["count"] += len(ids)
+
+    ids, vectors, payloads = [], [], []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection,
+            limit=page_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        texts = text_store.get_many(collection, [p.id for p in points]) if text_store is not None else {}
+        parent_ids = [p.payload.get("parent_id") for p in points if p.payload and p.payload.get("parent_id")]
+        parents = parent_store.get_many(collection, parent_ids) if parent_store is not None and parent_ids else {}
+        for p in points:
+            if str(p.id) in texts:
+                p.payload = {**(p.payload or {}), "text": texts[str(p.id)]}
+            if (p.payload or {}).get("parent_id") in parents:
+                p.payload = {**p.payload, "parent_text": parents[p.payload["parent_id"]]}
+            ids.append(p.id)
+            vectors.append(p.vector)
+            payloads.append(p.payload or {})
+        if len(ids) >= shard_size:
+            flush(ids, vectors, payloads)
+            ids, vectors, payloads = [], [], []
+        if offset is None:
+            break
+    if ids:
+        flush(ids, vectors, payloads)
+
+    routing = f"{collection}_routing" # Centroides de los PDFs: sin ellos las consultas sin PDF pierden el enrutado
+    if client.collection_exists(routing):
+        export_collection(client, routing, str(out / "routing"), shard_size=shard_size, page_size=page_size)
+        manifest["routing"] = "routing"
+
+    (out / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    print(f"DEBUG: Exportados {manifest['count']} puntos de '{collection}' en {len(manifest['shards'])} shards.")
+    return manifest
+
+
+def import_collection(client: QdrantClient, in_dir: str, collection: str = None, batch_size: int = 512,
+                      parallel: int = 1, recreate: bool = True, parent_store: ChunkTextStore = None) -> int:
+    """
+    Restaura un snapshot en 'collection' (por defecto la original) mediante subida masiva. Devuelve los puntos subidos.
+    Los "parent_text" del snapshot se guardan en parent_store (por defecto RAG_PARENT_STORE) y salen del payload.
+    La colección se crea con la configuración HNSW y los índices de payload del manifest; el índice de enrutado, si viene,
+    se restaura en "<collection>_routing".
+    """
+    src = Path(in_dir)
+    manifest = json.loads((src / "manifest.json").read_text(encoding="utf-8"))
+    collection = collection or manifest["collection"]
+
+    if recreate and client.collection_exists(collection):
+        client.delete_collection(collection)
+    if not client.collection_exists(collection):
+        client.create_collection(
+            collection_name=collection,
+            vectors_config=VectorParams(size=manifest["dim"], distance=Distance(manifest["distance"])),
+            hnsw_config=HnswConfigDiff(**manifest["hnsw_config"]) if manifest.get("hnsw_config") else None,
+        )
+        for field, spec in manifest.get("payload_schema", {}).items(): # Recreamos los índices de payload con sus parámetros
+            client.create_payload_index(collection, field_name=field, field_schema=_index_schema(spec))
+
+    total = 0
+    for shard in manifest["shards"]:
+        vectors = np.load(src / f"{shard['name']}.npy").astype(np.float32)
+        frame = pd.read_parquet(src / f"{shard['name']}.parquet")
+        payloads = [json.loads(p) for p in frame["payload"]]
+        parents = {p["parent_id"]: (p.pop("parent_text"), source_key(p.get("tenant"), p.get("source")), p.get("version"))
+                   for p in payloads if "parent_text" in p}
+        if parents:
+            parent_store = parent_store or ChunkTextStore(os.getenv("RAG_PARENT_STORE", ".cache/parent_text.sqlite"))
+            parent_store.put_many(collection, list(parents), *map(list, zip(*parents.values())))
+        client.upload_collection(
+            collection_name=collection,
+            vectors=vectors,
+            payload=payloads,
+            ids=[json.loads(i) for i in frame["id"]],
+            batch_size=batch_size,
+            parallel=parallel,
+            wait=True,
+        )
+        total += len(frame)
+    print(f"DEBUG: Restaurados {total} puntos en '{collection}'.")
+    if manifest.get("routing") and (src / manifest["routing"]).exists():
+        import_collection(client, str(src / manifest["routing"]), collection=f"{collection}_routing", batch_size=batch_size,
+                          parallel=parallel, recreate=recreate)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta o restaura snapshots de colecciones de QDRANT")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("directory", help="Carpeta del snapshot")
+    parser.add_argument("--collection", default="docs")
+    parser.add_argument("--url", default=None, help='URL de QDRANT (por defecto QDRANT_URL). ":memory:" para memoria')
+    parser.add_argument("--path", default=None, help="Carpeta de QDRANT en modo local")
+    parser.add_argument("--shard-size", type=int, default=10_000)
+    parser.add_argument("--parallel", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    client = QdrantStorage.connect(url=args.url, path=args.path)
+    if args.action == "export":
+        text_store = ChunkTextStore() if os.getenv("RAG_EXTERNAL_TEXT", "0") == "1" else None
+        parent_path = os.getenv("RAG_PARENT_STORE", ".cache/parent_text.sqlite")
+        parent_store = ChunkTextStore(parent_path) if os.path.exists(parent_path) else None
+        # Si nos pasan un alias exportamos la colección a la que apunta (el texto externo, los padres y el enrutado van por colección física)
+        collection = next((a.collection_name for a in client.get_aliases().aliases if a.alias_name == args.collection), args.collection)
+        export_collection(client, collection, args.directory, shard_size=args.shard_size, text_store=text_store, parent_store=parent_store)
+    else:
+        from migrate import restore # Import local: migrate también importa este módulo
+        local = bool(args.path) or args.url == ":memory:" # Los modos local y memoria no admiten subida en varios procesos
+        dim = json.loads((Path(args.directory) / "manifest.json").read_text(encoding="utf-8"))["dim"]
+        restore(QdrantStorage(collection=args.collection, client=client, dim=dim), args.directory, parallel=1 if local else args.parallel)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,12 +9,16 @@ import inngest
 from dotenv import load_dotenv
 import os
 import requests
-from functions import QdrantStorage
+import uuid
+import zipfile
+from tenants import DEFAULT_TENANT, require_tenant
+import tracing # Cada mensaje del chat abre una traza que sigue en el evento y en los pasos de Inngest
 
 
-storage_engine = QdrantStorage()
+tracing.set_service("ui")
 
 load_dotenv()
+TENANT_ID = require_tenant(os.getenv("RAG_TENANT_ID", DEFAULT_TENANT)) # Cliente de este frontal: solo ve y consulta sus documentos
 
 st.set_page_config(page_title="Asistente RAG Profesional", page_icon="📄", layout="centered")
 
@@ -22,14 +26,31 @@ st.set_page_config(page_title="Asistente RAG Profesional", page_icon="📄", lay
 # INICIALIZACIÓN DE LA MEMORIA DE SESIÓN ---
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "session_id" not in st.session_state: # El historial se guarda en el servidor bajo este id
+    st.session_state.session_id = str(uuid.uuid4())
 
 @st.cache_resource
 def get_inngest_client() -> inngest.Inngest:
     return inngest.Inngest(app_id="rag_app", is_production=False)
 
 
+@st.cache_resource(show_spinner=False)
+def get_storage_engine():
+    """
+    Conexión a QDRANT creada una vez por proceso (no en cada recarga de la página) y solo cuando hace falta.
+    Si QDRANT no responde se lanza la excepción y no se cachea: la siguiente recarga lo vuelve a intentar.
+    """
+    from functions import QdrantStorage # Import local: la página se pinta sin esperar a qdrant_client
+    return QdrantStorage()
+
+
+def get_faq_store():
+    from faq import FAQStore
+    return FAQStore(get_storage_engine().client)
+
+
 def save_uploaded_pdf(file) -> Path:
-    uploads_dir = Path("uploads")
+    uploads_dir = Path("uploads") / TENANT_ID # Cada cliente en su carpeta: dos "manual.pdf" no se pisan
     uploads_dir.mkdir(parents=True, exist_ok=True)
     file_path = uploads_dir / file.name
     file_bytes = file.getbuffer()
@@ -37,50 +58,213 @@ def save_uploaded_pdf(file) -> Path:
     return file_path
 
 
-async def send_rag_ingest_event(pdf_path: Path) -> None:
+def save_uploaded_zip(file) -> list[tuple[Path, str]]:
+    """Descomprime los PDFs de un zip en uploads/<nombre del zip>/ y devuelve (ruta, source_id) de cada uno."""
+    stem = Path(file.name).stem
+    target = Path("uploads") / TENANT_ID / stem
+    pdfs = []
+    with zipfile.ZipFile(file) as zf:
+        for member in zf.infolist():
+            rel = Path(member.filename)
+            if member.is_dir() or rel.suffix.lower() != ".pdf" or rel.is_absolute() or ".." in rel.parts: # Nada fuera de la carpeta
+                continue
+            dest = target / rel
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            dest.write_bytes(zf.read(member))
+            pdfs.append((dest, f"{stem}/{rel.as_posix()}"))
+    return pdfs
+
+
+async def send_rag_ingest_dir_event(pdfs: list[tuple[Path, str]]) -> str:
+    client = get_inngest_client()
+    result = await client.send(
+        inngest.Event(
+            name="rag/ingest_dir", # Un único evento para todos los ficheros: se trocean en paralelo y comparten embeddings
+            data={
+                "pdf_paths": [str(p.resolve()) for p, _ in pdfs],
+                "source_ids": [src for _, src in pdfs],
+                "tenant_id": TENANT_ID,
+                "traceparent": tracing.traceparent(),
+            },
+        )
+    )
+    return result[0]
+
+
+async def send_rag_ingest_event(pdf_path: Path) -> str:
     client = get_inngest_client()
-    await client.send(
+    result = await client.send(
         inngest.Event(
             name="rag/ingest_pdf",
             data={
                 "pdf_path": str(pdf_path.resolve()),
                 "source_id": pdf_path.name,
+                "tenant_id": TENANT_ID, # Cliente dueño del PDF; también es la clave de concurrencia y throttling de la ingesta
+                "traceparent": tracing.traceparent(),
             },
         )
     )
+    return result[0] # El id del evento es también el id del trabajo de ingesta (progreso en la API)
+
+
+def _rag_api_base() -> str:
+    # Nuestra API (main.py), donde se consulta el progreso de la ingesta
+    return os.getenv("RAG_API_BASE", "http://127.0.0.1:8000")
+
+
+def fetch_ingest_job(job_id: str):
+    resp = requests.get(f"{_rag_api_base()}/ingest/jobs/{job_id}", timeout=5)
+    if resp.status_code == 404: # Todavía en la cola de Inngest
+        return None
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _job_caption(job: dict) -> str:
+    estados = {"parsing": "Leyendo el PDF", "embedding": "Calculando embeddings", "upserting": "Guardando en la base de datos",
+               "activating": "Activando", "done": "Listo", "error": "Error (Inngest lo reintentará)"}
+    text = f"{estados.get(job['status'], job['status'])} · {job['pages']} páginas · {job['chunks_embedded']}/{job['chunks']} fragmentos"
+    if job.get("rate"):
+        text += f" · {job['rate']:.1f} fragmentos/s"
+    if job.get("eta_s") is not None:
+        text += f" · quedan ~{job['eta_s']:.0f} s"
+    return text
+
+
+def wait_for_ingest(job_id: str, timeout_s: float = 1800.0, poll_interval_s: float = 1.0) -> dict:
+    """Pinta una barra de progreso hasta que el documento se puede consultar o la ingesta falla (se devuelve con su error)."""
+    bar = st.progress(0.0, text="En cola...")
+    start = time.time()
+    while time.time() - start < timeout_s:
+        job = fetch_ingest_job(job_id)
+        if job:
+            bar.progress(min(float(job["progress"]), 1.0), text=_job_caption(job))
+            if job["status"] in ("done", "error"): # El error se muestra debajo, con su mensaje (job["error"])
+                return job
+        time.sleep(poll_interval_s)
+    raise TimeoutError("La ingesta está tardando más de lo esperado. Revisa el panel de Inngest.")
+
+
+def wait_for_ingest_many(job_ids: list, names: list, timeout_s: float = 3600.0, poll_interval_s: float = 2.0) -> list:
+    """Barra global + estado de cada fichero, hasta que todos terminan (listos o con error)."""
+    bar = st.progress(0.0, text="En cola...")
+    table = st.empty()
+    start = time.time()
+    while time.time() - start < timeout_s:
+        jobs = [fetch_ingest_job(j) for j in job_ids]
+        rows = [
+            {"fichero": name, "estado": job["status"] if job else "en cola", "páginas": job["pages"] if job else 0,
+             "fragmentos": f"{job['chunks_embedded']}/{job['chunks']}" if job else "-"}
+            for name, job in zip(names, jobs)
+        ]
+        table.dataframe(rows, use_container_width=True, hide_index=True)
+        finished = [j for j in jobs if j and j["status"] in ("done", "error")]
+        chunks = sum(j["chunks_embedded"] for j in jobs if j)
+        elapsed = time.time() - start
+        text = f"{len(finished)}/{len(jobs)} ficheros · {chunks} fragmentos"
+        if elapsed >= poll_interval_s: # En la primera vuelta todavía no hay ritmo que mostrar
+            text += f" · {chunks / elapsed:.1f} fragmentos/s"
+        bar.progress(sum(float(j["progress"]) for j in jobs if j) / len(jobs), text=text)
+        if len(finished) == len(jobs):
+            return jobs
+        time.sleep(poll_interval_s)
+    raise TimeoutError("La ingesta está tardando más de lo esperado. Revisa el panel de Inngest.")
 
 # --- BOTÓN DE LIMPIEZA EN LA BARRA LATERAL ---
 with st.sidebar:
     st.header("Administración")
     if st.button("🗑️ Limpiar Base de Datos"):
         with st.spinner("Borrando conocimiento..."):
-            storage_engine.clear_collection()
+            get_storage_engine().clear_tenant(TENANT_ID) # Solo los documentos de este cliente
+            get_faq_store().delete_tenant(TENANT_ID)
             st.success("¡Base de datos vacía!")
             time.sleep(1)
             st.rerun()
     
+    # Documentos cargados: borrado por PDF sin tener que reingestar el resto
+    st.subheader("Documentos")
+    try:
+        sources = get_storage_engine().list_sources(tenant_id=TENANT_ID)
+    except Exception as e:
+        sources = []
+        st.caption(f"No se pudo listar los documentos: {e}")
+    for item in sources:
+        col_name, col_btn = st.columns([4, 1])
+        col_name.write(f"📄 {item['source']} ({item['points']} fragmentos)")
+        if col_btn.button("🗑️", key=f"del-{item['source']}", help="Borrar solo este documento"):
+            get_storage_engine().delete_source(item["source"], TENANT_ID)
+            get_faq_store().delete_source(item["source"], TENANT_ID) # Sus FAQ pre-calculadas ya no tienen documento
+            st.rerun()
+
     # NUEVO: Botón para resetear solo el chat sin borrar la DB
     if st.button("💬 Limpiar Chat"):
         st.session_state.messages = []
+        st.session_state.session_id = str(uuid.uuid4()) # Nueva sesión en el servidor
         st.rerun()
 
 
 st.title("📂 Cargar Documentos")
-uploaded = st.file_uploader("Sube un PDF para alimentar al asistente", type=["pdf"], accept_multiple_files=False)
-
-if uploaded is not None:
-    with st.spinner("Procesando documento..."):
-        path = save_uploaded_pdf(uploaded)
-        # Kick off the event and block until the send completes
-        asyncio.run(send_rag_ingest_event(path))
-        # Small pause for user feedback continuity
-        time.sleep(0.3)
-    st.success(f"Documento listo: {path.name}")
-    st.caption("Puedes subir otro archivo si deseas actualizar el contexto.")
+uploaded_files = st.file_uploader("Sube uno o varios PDFs (o un .zip con PDFs) para alimentar al asistente",
+                                  type=["pdf", "zip"], accept_multiple_files=True)
+# Con un único PDF las preguntas se filtran a ese documento; con varios se busca en toda la colección
+uploaded = uploaded_files[0] if len(uploaded_files) == 1 and uploaded_files[0].name.lower().endswith(".pdf") else None
+
+if "ingested" not in st.session_state: # Ingestas ya enviadas por fichero: streamlit re-ejecuta el script en cada interacción
+    st.session_state.ingested = {}
+
+pending = [f for f in uploaded_files if f"{f.name}:{f.size}" not in st.session_state.ingested]
+if pending:
+    # El camino depende de lo que se sube, no de cuántos PDFs salen: un zip siempre va por rag/ingest_dir
+    # (sus PDFs se llaman <zip>/<ruta>, aunque solo traiga uno)
+    single = len(pending) == 1 and not pending[0].name.lower().endswith(".zip")
+    pdfs = []
+    for f in pending:
+        if f.name.lower().endswith(".zip"):
+            pdfs.extend(save_uploaded_zip(f))
+        else:
+            path = save_uploaded_pdf(f)
+            pdfs.append((path, path.name))
+    batch = {"job_ids": [], "names": [src for _, src in pdfs], "single": single, "jobs": []}
+    if single and pdfs: # Un solo PDF: ingesta normal (se agrupa con las de otros usuarios en batch_events)
+        with tracing.span("ui.ingest", root=True, files=1):
+            batch["job_ids"] = [asyncio.run(send_rag_ingest_event(pdfs[0][0]))] # El evento lleva el traceparent de ui.ingest
+    elif pdfs: # Varios: un único evento rag/ingest_dir; cada fichero tiene su trabajo <id del evento>-0000, -0001...
+        with tracing.span("ui.ingest", root=True, files=len(pdfs)):
+            event_id = asyncio.run(send_rag_ingest_dir_event(pdfs))
+        batch["job_ids"] = [f"{event_id}-{i:04d}" for i in range(len(pdfs))]
+    else:
+        st.warning("No se encontraron PDFs en los ficheros subidos.")
+    if batch["job_ids"]:
+        batch["jobs"] = None # Enviado, pendiente de terminar
+    for f in pending: # Se guarda nada más enviar el evento: si el seguimiento falla, el siguiente rerun no vuelve a enviarlo
+        st.session_state.ingested[f"{f.name}:{f.size}"] = batch
+
+# Seguimiento de las ingestas enviadas que aún no han terminado (también las de un rerun anterior que perdió el progreso)
+waiting = {id(b): b for b in (st.session_state.ingested.get(f"{f.name}:{f.size}") for f in uploaded_files) if b and b["jobs"] is None}
+for batch in waiting.values():
+    try:
+        with tracing.span("ui.wait_ingest", root=True, files=len(batch["job_ids"])):
+            if batch["single"]:
+                batch["jobs"] = [wait_for_ingest(batch["job_ids"][0])] # Solo está "listo" cuando ya responde en las búsquedas
+            else:
+                batch["jobs"] = wait_for_ingest_many(batch["job_ids"], batch["names"])
+    except (requests.RequestException, TimeoutError) as e:
+        st.warning(f"No se pudo seguir el progreso de la ingesta: {e}. Se volverá a consultar sin reenviar los ficheros.")
+
+for f in uploaded_files:
+    jobs = (st.session_state.ingested.get(f"{f.name}:{f.size}") or {}).get("jobs") or []
+    done = [j for j in jobs if j and j["status"] == "done"]
+    if jobs:
+        st.success(f"{f.name}: {len(done)}/{len(jobs)} documentos listos ({sum(j['chunks'] for j in done)} fragmentos)")
+    for j in jobs:
+        if j and j["status"] == "error":
+            st.error(f"{j['source_id']}: {j.get('error')}")
+if uploaded_files:
+    st.caption("Puedes subir más archivos si deseas actualizar el contexto.")
 
 st.divider()
 
-async def send_rag_query_event(question: str, top_k: int, chat_history: list, source_id: str = None) -> None:
+async def send_rag_query_event(question: str, top_k: int, session_id: str, source_id: str = None) -> None:
     client = get_inngest_client()
     result = await client.send(
         inngest.Event(
@@ -89,7 +273,9 @@ async def send_rag_query_event(question: str, top_k: int, chat_history: list, so
                 "question": question,
                 "top_k": top_k,
                 "source_id": source_id,
-                "chat_history": chat_history, # <-- ENVIAMOS LA MEMORIA
+                "tenant_id": TENANT_ID, # La búsqueda se filtra siempre por cliente
+                "session_id": session_id, # <-- SOLO EL ID, EL HISTORIAL ESTÁ EN EL SERVIDOR
+                "traceparent": tracing.traceparent(), # Une los pasos de Inngest a la traza de este mensaje
             },
         )
     )
@@ -112,19 +298,22 @@ def fetch_runs(event_id: str) -> list[dict]:
 def wait_for_run_output(event_id: str, timeout_s: float = 120.0, poll_interval_s: float = 0.5) -> dict:
     start = time.time()
     last_status = None
-    while True:
-        runs = fetch_runs(event_id)
-        if runs:
-            run = runs[0]
-            status = run.get("status")
-            last_status = status or last_status
-            if status in ("Completed", "Succeeded", "Success", "Finished"):
-                return run.get("output") or {}
-            if status in ("Failed", "Cancelled"):
-                raise RuntimeError(f"Function run {status}")
-        if time.time() - start > timeout_s:
-            raise TimeoutError(f"Timed out waiting for run output (last status: {last_status})")
-        time.sleep(poll_interval_s)
+    with tracing.span("ui.wait_output", event_id=event_id) as attrs: # Tiempo de espera y sondeos hasta tener la respuesta
+        attrs["polls"] = 0
+        while True:
+            runs = fetch_runs(event_id)
+            attrs["polls"] += 1
+            if runs:
+                run = runs[0]
+                status = run.get("status")
+                last_status = status or last_status
+                if status in ("Completed", "Succeeded", "Success", "Finished"):
+                    return run.get("output") or {}
+                if status in ("Failed", "Cancelled"):
+                    raise RuntimeError(f"Function run {status}")
+            if time.time() - start > timeout_s:
+                raise TimeoutError(f"Timed out waiting for run output (last status: {last_status})")
+            time.sleep(poll_interval_s)
 
 
 # INTERFAZ DE CHAT ---
@@ -148,15 +337,16 @@ if prompt := st.chat_input("Escribe tu pregunta..."):
         with st.spinner("Consultando documentos..."):
             current_file_name = uploaded.name if uploaded else None
             
-            # Pasamos el historial previo (sin la pregunta actual que acabamos de añadir)
-            event_id = asyncio.run(send_rag_query_event(
-                prompt.strip(), 
-                5, 
-                st.session_state.messages[:-1], # <-- PASAMOS EL PASADO
-                current_file_name
-            ))
-            
-            output = wait_for_run_output(event_id)
+            # Solo enviamos la pregunta nueva y el id de la sesión. Todo el mensaje es una traza (ver tracing.py)
+            with tracing.span("ui.chat_message", root=True, session_id=st.session_state.session_id):
+                event_id = asyncio.run(send_rag_query_event( # El evento lleva el traceparent de ui.chat_message
+                    prompt.strip(), 
+                    5, 
+                    st.session_state.session_id,
+                    current_file_name
+                ))
+                
+                output = wait_for_run_output(event_id)
             answer = output.get("answer", "No se obtuvo respuesta.")
             sources = output.get("sources", [])
             
@@ -167,7 +357,7 @@ if prompt := st.chat_input("Escribe tu pregunta..."):
                     for s in sources:
                         st.write(f"- {s}")
             
-            # 3. Guardar respuesta del asistente en memoria
+            # 3. Guardar respuesta del asistente para pintarla (la memoria del LLM está en el servidor)
             st.session_state.messages.append({"role": "assistant", "content": answer})
             st.rerun()
 
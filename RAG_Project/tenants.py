@@ -0,0 +1,69 @@
+# 25. AISLAMIENTO POR CLIENTE (MULTI-TENANT) EN LA BASE VECTORIAL
+
+# Todos los PDFs de todos los clientes iban a la misma colección "docs" y solo los separaba el filtro opcional por source_id
+# (el nombre del fichero): dos clientes con un "manual.pdf" se pisaban los puntos y se veían los chunks el uno al otro.
+# En este pipeline:
+#   - TENANT: cada evento lleva event.data["tenant_id"] (ya era la clave de concurrencia de la ingesta) y cada punto
+#     su payload "tenant". Los ids de los puntos, el índice de enrutado, el texto externo, las FAQ y la caché de respuestas
+#     usan la clave (tenant, PDF): el mismo nombre de fichero en dos clientes son dos documentos distintos.
+#   - FILTRO OBLIGATORIO: QdrantStorage.search y search_batch no buscan sin tenant_id (ValueError).
+#   - ÍNDICE DE TENANT: "tenant" es un índice keyword con is_tenant=True (QDRANT agrupa en disco los puntos de cada cliente)
+#     y las colecciones nuevas usan HNSW por payload (payload_m=16, m=0): un grafo por cliente y ninguno global,
+#     así que una búsqueda cuesta en función del tamaño del cliente y no del corpus entero. RAG_TENANT_HNSW=0 lo desactiva.
+#   - ESTADÍSTICAS: puntos y PDFs por cliente en /tenants (main.py) y en admin_monitor.py.
+# El cliente "default" conserva las claves de antes (ids, texto externo, firmas...), así una instalación de un solo cliente
+# sigue igual. Los puntos anteriores a este cambio no tienen "tenant": se asignan a "default" una vez con:
+#   uv run python tenants.py backfill
+#   uv run python tenants.py optimize   (aplica el HNSW por cliente a una colección ya creada; QDRANT reindexa en segundo plano)
+
+import argparse
+import os
+import re
+
+DEFAULT_TENANT = os.getenv("RAG_DEFAULT_TENANT", "default")
+_VALID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$") # Sin ":" ni "/": la clave (tenant, PDF) no puede ser ambigua
+
+
+def require_tenant(tenant_id) -> str:
+    if not tenant_id or not _VALID.match(str(tenant_id)):
+        raise ValueError(f"tenant_id no válido u omitido: {tenant_id!r}")
+    return str(tenant_id)
+
+
+def tenant_of(data: dict) -> str:
+    """Cliente de un evento. Si no viene se usa DEFAULT_TENANT, salvo con RAG_REQUIRE_TENANT=1 (despliegues con varios clientes)."""
+    tenant_id = (data or {}).get("tenant_id")
+    if tenant_id is None and os.getenv("RAG_REQUIRE_TENANT", "0") != "1":
+        tenant_id = DEFAULT_TENANT
+    return require_tenant(tenant_id)
+
+
+def source_key(tenant_id: str, source_id) -> str:
+    """Clave única de un PDF en los almacenes que solo conocen el PDF (texto externo, firmas, enrutado, caché de respuestas)."""
+    if tenant_id == DEFAULT_TENANT:
+        return source_id
+    return f"{tenant_id}:{source_id or '*'}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clientes (tenants) de la colección de documentos")
+    parser.add_argument("action", choices=["stats", "backfill", "optimize"])
+    parser.add_argument("--collection", default="docs")
+    args = parser.parse_args()
+
+    from functions import QdrantStorage # Import local: functions también importa este módulo
+    client = QdrantStorage.connect()
+    storage = QdrantStorage(collection=args.collection, client=client,
+                            dim=client.get_collection(args.collection).config.params.vectors.size)
+    if args.action == "stats":
+        for stats in storage.list_tenants():
+            print(f"{stats['tenant_id']}: {stats['points']} puntos, {stats['sources']} PDFs")
+    elif args.action == "backfill":
+        print(f"{storage.backfill_tenant(DEFAULT_TENANT)} puntos asignados a '{DEFAULT_TENANT}'.")
+    else:
+        storage.optimize_for_tenants()
+        print(f"{storage.resolve_collection()}: HNSW por cliente activado (la reindexación sigue en segundo plano).")
+
+
+if __name__ == "__main__":
+    main()
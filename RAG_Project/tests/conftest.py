@@ -0,0 +1,79 @@
+# PRUEBAS DEL PIPELINE RAG
+
+# Los módulos viven en la carpeta del proyecto (sin paquete): los hacemos importables desde aquí.
+# Cada prueba corre en una carpeta temporal (las cachés .cache/... no tocan las del proyecto) y sin red:
+#   - QDRANT en memoria (":memory:").
+#   - Embeddings deterministas (WordHashEmbedder): el mismo texto da siempre el mismo vector y textos con palabras en común se parecen.
+# Para correrlas: uv run python -m pytest tests -q
+
+import hashlib
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test") # El cliente de OpenAI se crea, pero ninguna prueba llega a la red
+    monkeypatch.setenv("RAG_TRACING", "0")
+    monkeypatch.setenv("RAG_FAQ", "0")
+    import tokens # tiktoken descarga sus tablas la primera vez: las pruebas cuentan con la aproximación de ~4 caracteres
+    monkeypatch.setattr(tokens, "_ENCODING", None)
+    monkeypatch.setattr(tokens, "_LOADED", True)
+    return tmp_path
+
+
+def word_hash_vector(text: str, dim: int = 64) -> list[float]: # Bolsa de palabras con hashing, normalizada
+    vec = [0.0] * dim
+    for word in re.findall(r"\w+", text.lower()):
+        vec[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % dim] += 1.0
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+@pytest.fixture
+def embedder():
+    from embedders import Embedder
+
+    class WordHashEmbedder(Embedder):
+        name = "word-hash:64"
+        dim = 64
+
+        def __init__(self):
+            self.calls = [] # Textos de cada llamada (para comprobar el agrupado en lotes)
+
+        def embed(self, texts, priority=None):
+            self.calls.append(list(texts))
+            return [word_hash_vector(t, self.dim) for t in texts]
+
+    return WordHashEmbedder()
+
+
+@pytest.fixture
+def workflow(embedder):
+    """RAGWorkflow completo sobre QDRANT en memoria, con los almacenes locales en la carpeta temporal."""
+    from functions import AuditLogger, QdrantStorage, VectorProcessor
+    from workflow import RAGWorkflow
+
+    processor = VectorProcessor(embedder=embedder)
+    client = QdrantStorage.connect(url=":memory:")
+    storage = QdrantStorage(dim=processor.embed_dim, client=client)
+    return RAGWorkflow(processor=processor, storage=storage, logger=AuditLogger(client))
+
+
+@pytest.fixture
+def ingest(workflow):
+    """Ingesta y activa un PDF a partir de sus chunks (sin leer ningún fichero)."""
+    from custom_types import RAGChunkAndSrc
+
+    async def _ingest(source_id: str, chunks: list, tenant_id: str = "default", **fields):
+        result = await workflow._upsert(RAGChunkAndSrc(chunks=chunks, source_id=source_id, tenant_id=tenant_id, **fields))
+        await workflow._activate(result.source_id, result.version, tenant_id=result.tenant_id)
+        return result
+
+    return _ingest
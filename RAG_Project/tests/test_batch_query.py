@@ -0,0 +1,68 @@
+# Consultas por lotes (rag/query_batch): una petición de embeddings y una búsqueda para N preguntas
+
+import asyncio
+from types import SimpleNamespace
+
+from custom_types import RAGBatchSearchResult, RAGSearchResult
+
+MANUAL = [
+    "La garantía del producto dura dos años desde la fecha de compra.",
+    "Para instalar la impresora conecte el cable USB y encienda el equipo.",
+    "El cartucho de tinta se cambia abriendo la tapa frontal.",
+]
+
+
+class EchoLLM: # Cliente de chat falso: responde con la pregunta del último mensaje
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=self)
+        self.with_raw_response = self # El limitador pide la respuesta "raw" para leer sus cabeceras
+        self.calls = []
+
+    def create(self, model, messages, **kwargs):
+        self.calls.append(messages)
+        question = messages[-1]["content"].split("Question: ")[-1].strip()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=question))])
+
+
+def test_search_batch_embeds_all_questions_in_one_call(workflow, ingest, embedder):
+    asyncio.run(ingest("manual.pdf", MANUAL))
+    embedder.calls.clear()
+
+    questions = ["¿Cuánto dura la garantía?", "¿Cómo se cambia el cartucho de tinta?"]
+    found = asyncio.run(workflow._search_batch(questions, top_k=1, tenant_id="default"))
+
+    assert embedder.calls == [questions] # Una sola llamada con todas las preguntas
+    assert found.questions == questions
+    assert [r.contexts for r in found.results] == [[MANUAL[0]], [MANUAL[2]]] # Mismo orden que las preguntas
+    assert all(r.sources == ["manual.pdf"] for r in found.results)
+
+
+def test_search_batch_keeps_results_per_question(workflow, ingest):
+    asyncio.run(ingest("manual.pdf", MANUAL))
+
+    found = asyncio.run(workflow._search_batch(["garantía", "impresora USB", "cartucho"], top_k=2, tenant_id="default"))
+
+    assert len(found.results) == 3
+    assert all(len(r.contexts) == 2 and len(r.scores) == 2 for r in found.results)
+    assert all(r.scores == sorted(r.scores, reverse=True) for r in found.results)
+    assert [r.contexts[0] for r in found.results] == MANUAL
+
+
+def test_answer_batch_keeps_question_order(workflow):
+    workflow.processor.client = EchoLLM()
+    found = RAGBatchSearchResult(questions=["a", "b", "c"], results=[RAGSearchResult(contexts=["ctx"], sources=["x.pdf"])] * 3)
+
+    answers = asyncio.run(workflow._answer_batch("sistema", ["a", "b", "c"], found, max_parallel=2))
+
+    assert [item.answer for item in answers.results] == ["a", "b", "c"]
+    assert all(item.sources == ["x.pdf"] and item.num_contexts == 1 for item in answers.results)
+    assert len(workflow.processor.client.calls) == 3
+
+
+def test_answer_batch_uses_fallback_without_calling_the_llm(workflow):
+    found = RAGBatchSearchResult(questions=["a", "b"], results=[RAGSearchResult(contexts=[], sources=[])] * 2)
+
+    answers = asyncio.run(workflow._answer_batch("sistema", ["a", "b"], found, fallback_answer="Sin datos"))
+
+    assert [item.question for item in answers.results] == ["a", "b"]
+    assert all(item.answer == "Sin datos" and item.num_contexts == 0 for item in answers.results)
@@ -0,0 +1,93 @@
+# Almacén de blobs y referencias entre pasos de la ingesta
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from blobstore import LocalBlobStore
+from custom_types import RAGChunkAndSrc
+
+CHUNKS = [f"fragmento {i} del manual" for i in range(10)]
+
+
+def test_put_get_and_delete_prefix(tmp_path):
+    blobs = LocalBlobStore(str(tmp_path / "blobs"))
+
+    blobs.put_json("chunks/a/batch_00000", {"chunks": ["á"]})
+    blobs.put_json("chunks/b/batch_00000", {"chunks": ["b"]})
+    blobs.delete_prefix("chunks/a")
+
+    assert not blobs.exists("chunks/a/batch_00000")
+    assert blobs.get_json("chunks/b/batch_00000") == {"chunks": ["b"]}
+
+
+def test_keys_cannot_escape_the_root(tmp_path):
+    blobs = LocalBlobStore(str(tmp_path / "blobs"))
+
+    with pytest.raises(ValueError):
+        blobs.put_json("../fuera", {})
+
+
+def test_purge_removes_only_old_blobs_and_empty_folders(tmp_path):
+    blobs = LocalBlobStore(str(tmp_path / "blobs"))
+    blobs.put_json("chunks/t/viejo/v1/batch_00000", {})
+    blobs.put_json("chunks/t/nuevo/v1/batch_00000", {})
+    old = time.time() - 7200
+    os.utime(blobs._path("chunks/t/viejo/v1/batch_00000"), (old, old))
+
+    assert blobs.purge_older_than(3600) == 1
+    os.utime(blobs.root / "chunks/t/viejo/v1", (old, old)) # Carpeta vacía y antigua
+    blobs.purge_older_than(3600)
+
+    assert not (blobs.root / "chunks/t/viejo/v1").exists()
+    assert blobs.exists("chunks/t/nuevo/v1/batch_00000")
+
+
+def _doc(tenant_id: str, job_id: str, source_id: str = "manual.pdf") -> RAGChunkAndSrc:
+    return RAGChunkAndSrc(chunks=CHUNKS, source_id=source_id, job_id=job_id, tenant_id=tenant_id)
+
+
+def test_same_content_in_two_runs_gets_two_prefixes(workflow):
+    ref_a = workflow._stage_doc(_doc("cliente-a", "evento-1"), batch_size=4)
+    ref_b = workflow._stage_doc(_doc("cliente-b", "evento-2"), batch_size=4)
+    assert ref_a.version == ref_b.version # Mismo contenido...
+
+    asyncio.run(workflow._release_refs([ref_a])) # ...y la primera ejecución termina antes
+
+    assert workflow._read_ref(ref_b).chunks == CHUNKS
+    with pytest.raises(FileNotFoundError):
+        workflow._read_ref(ref_a)
+
+
+def test_retried_stage_reuses_the_same_blobs(workflow):
+    first = workflow._stage_doc(_doc("default", "evento-1"), batch_size=3)
+    retried = workflow._stage_doc(_doc("default", "evento-1"), batch_size=3) # Inngest reintenta el paso
+
+    assert retried == first
+    assert first.batches == 4
+    assert workflow._read_ref(first).chunks == CHUNKS
+
+
+def test_direct_calls_without_job_id_are_scoped_by_source(workflow):
+    a = workflow._stage_doc(_doc("default", None, "a.pdf"))
+    b = workflow._stage_doc(_doc("default", None, "b.pdf"))
+
+    asyncio.run(workflow._release_refs([a]))
+
+    assert workflow._read_ref(b).source_id == "b.pdf"
+
+
+def test_concurrent_runs_with_the_same_content_do_not_interfere(workflow):
+    def run(i: int):
+        ref = workflow._stage_doc(_doc(f"cliente-{i % 3}", f"evento-{i}"), batch_size=2)
+        chunks = workflow._read_ref(ref).chunks
+        asyncio.run(workflow._release_refs([ref]))
+        return chunks
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(run, range(24)))
+
+    assert all(chunks == CHUNKS for chunks in results)
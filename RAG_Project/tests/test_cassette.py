@@ -0,0 +1,129 @@
+# Cassettes de OpenAI: clave de las peticiones, grabación, reproducción sin red y latencia simulada
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from openai import OpenAI
+
+import cassette
+from cassette import CassetteMiss, CassetteTransport, LatencyModel, openai_client_kwargs
+
+URL = "https://api.openai.com/v1/embeddings"
+BODY = {"model": "text-embedding-3-large", "input": ["hola"], "encoding_format": "float"}
+EMBEDDING = {"object": "list", "data": [{"object": "embedding", "index": 0, "embedding": [0.1, 0.2]}],
+             "model": "text-embedding-3-large", "usage": {"prompt_tokens": 1, "total_tokens": 1}}
+
+
+@pytest.fixture
+def openai_api(): # "Red" falsa: cuenta las peticiones que llegan a OpenAI
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        status = 500 if b"falla" in request.content else 200
+        return httpx.Response(status, json=EMBEDDING, headers={"x-ratelimit-remaining-tokens": "999", "set-cookie": "secreto"})
+
+    transport = httpx.MockTransport(handler)
+    transport.calls = calls
+    return transport
+
+
+def _post(transport, body: dict = BODY, timeout: float = 5.0, **headers) -> httpx.Response:
+    with httpx.Client(transport=transport, timeout=timeout) as client:
+        return client.post(URL, content=json.dumps(body), headers=headers)
+
+
+def test_request_key_ignores_json_key_order_and_headers():
+    a = httpx.Request("POST", URL, content=json.dumps(BODY), headers={"authorization": "Bearer sk-1"})
+    b = httpx.Request("POST", URL, content=json.dumps(dict(reversed(list(BODY.items())))), headers={"x-stainless-retry-count": "2"})
+    c = httpx.Request("POST", URL, content=json.dumps({**BODY, "input": ["adiós"]}))
+    d = httpx.Request("POST", URL.replace("embeddings", "chat/completions"), content=json.dumps(BODY))
+
+    assert CassetteTransport.request_key(a) == CassetteTransport.request_key(b)
+    assert len({CassetteTransport.request_key(r) for r in (a, c, d)}) == 3
+
+
+def test_record_then_replay_without_network(tmp_path, openai_api):
+    recorded = _post(CassetteTransport("record", str(tmp_path), inner=openai_api))
+
+    replayed = _post(CassetteTransport("replay", str(tmp_path)), authorization="Bearer otra-clave")
+
+    assert len(openai_api.calls) == 1
+    assert replayed.json() == recorded.json() == EMBEDDING
+    assert replayed.headers["x-ratelimit-remaining-tokens"] == "999" # rate_limit.py las necesita
+    assert "set-cookie" not in replayed.headers
+
+
+def test_replay_miss_is_an_error(tmp_path):
+    with pytest.raises(CassetteMiss):
+        _post(CassetteTransport("replay", str(tmp_path)))
+
+
+def test_server_errors_are_not_recorded(tmp_path, openai_api):
+    assert _post(CassetteTransport("record", str(tmp_path), inner=openai_api), {**BODY, "input": ["falla"]}).status_code == 500
+
+    with pytest.raises(CassetteMiss):
+        _post(CassetteTransport("replay", str(tmp_path)), {**BODY, "input": ["falla"]})
+
+
+def test_auto_records_once_and_replays_to_concurrent_callers(tmp_path, openai_api):
+    transport = CassetteTransport("auto", str(tmp_path), inner=openai_api)
+    _post(transport)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(lambda _: _post(transport), range(32)))
+
+    assert all(r.json() == EMBEDDING for r in responses)
+    assert len(openai_api.calls) == 1
+    assert len(list(tmp_path.rglob("*.json"))) == 1 and not list(tmp_path.rglob("*.tmp"))
+
+
+def test_latency_is_reproducible_with_the_same_seed():
+    spec = "embeddings=lognormal:150:0.3,chat=fixed:1200,recorded"
+
+    first = [LatencyModel(spec, seed=7).delay_s("embeddings", 0) for _ in range(2)]
+    model = LatencyModel(spec, seed=7)
+
+    assert first[0] == first[1]
+    assert model.delay_s("embeddings", 0) == first[0]
+    assert model.delay_s("embeddings", 0) != first[0] # La serie avanza
+    assert model.delay_s("chat", 80) == pytest.approx(1.2)
+    assert model.delay_s("moderations", 80) == pytest.approx(0.08) # Regla por defecto: la latencia grabada
+    assert LatencyModel().delay_s("chat", 80) == 0.0
+
+
+def test_unknown_latency_rule_and_mode_are_rejected():
+    with pytest.raises(ValueError):
+        LatencyModel("gaussian:100").delay_s("chat", 0)
+    with pytest.raises(ValueError):
+        CassetteTransport("off")
+
+
+def test_simulated_latency_above_the_timeout_is_a_timeout(tmp_path, openai_api):
+    _post(CassetteTransport("record", str(tmp_path), inner=openai_api))
+    slow = CassetteTransport("replay", str(tmp_path), latency=LatencyModel("fixed:5000"))
+
+    with pytest.raises(httpx.ReadTimeout):
+        _post(slow, timeout=0.05)
+
+
+def test_openai_client_replays_from_the_cassette_folder(monkeypatch, tmp_path, openai_api):
+    _post(CassetteTransport("record", str(tmp_path), inner=openai_api))
+    monkeypatch.setenv("RAG_CASSETTE", "replay")
+    monkeypatch.setenv("RAG_CASSETTE_DIR", str(tmp_path))
+    monkeypatch.delenv("OPENAI_API_KEY")
+    before = cassette.stats()["hits"]
+
+    client = OpenAI(max_retries=0, **openai_client_kwargs()) # Sin clave: en replay se pone una ficticia
+    response = client.embeddings.create(model="text-embedding-3-large", input=["hola"], encoding_format="float")
+
+    assert response.data[0].embedding == [0.1, 0.2]
+    assert cassette.stats()["hits"] == before + 1
+
+
+def test_cassettes_are_off_by_default(monkeypatch):
+    monkeypatch.delenv("RAG_CASSETTE", raising=False)
+
+    assert openai_client_kwargs() == {}
@@ -0,0 +1,129 @@
+# Chunking: tamaños en tokens, solapamiento, offsets respecto al texto de la página y ventanas padre-hijo
+
+import asyncio
+
+import pytest
+
+from chunking import HeadingChunker, PageTextCache, ParentChildChunker, SentenceChunker, TokenWindowChunker, _pack, get_chunker, get_splitter
+from custom_types import RAGChunkAndSrc
+from tokens import split_pieces
+
+TEXT = (
+    "La impresora se instala en pocos pasos. Conecte el cable de alimentación y el cable USB. "
+    "Encienda el equipo con el botón lateral.\n\n"
+    "Si la luz parpadea, revise el cartucho de tinta. El cartucho se cambia abriendo la tapa frontal. "
+    "No toque los contactos dorados del cartucho."
+)
+
+
+def test_pack_respects_size_and_overlap():
+    units = [(i * 10, i * 10 + 9, 3) for i in range(10)] # 10 unidades de 3 tokens
+
+    windows = _pack(units, chunk_size=9, overlap=3)
+
+    assert windows[0] == (0, 29) # Caben 3 unidades
+    assert windows[1][0] == 20 # La siguiente repite la última unidad (3 tokens de solapamiento)
+    assert windows[-1][1] == 99 # Se cubre todo el texto
+
+
+def test_pack_always_advances_with_oversized_units():
+    units = [(0, 10, 50), (10, 20, 50), (20, 30, 50)]
+
+    assert _pack(units, chunk_size=10, overlap=100) == [(0, 10), (10, 20), (20, 30)]
+
+
+@pytest.mark.parametrize("name", ["sentence", "token", "heading"])
+def test_offsets_point_at_the_chunk_text(name):
+    chunker = get_chunker(name, chunk_size=20, chunk_overlap=5)
+
+    chunks = chunker.split_pages([{"page": "3", "text": TEXT}])
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert TEXT[chunk.start_char:chunk.end_char] == chunk.text
+        assert chunk.page == "3"
+
+
+def test_sentence_chunker_does_not_cut_sentences():
+    chunks = SentenceChunker(chunk_size=25, chunk_overlap=0).split_text(TEXT)
+
+    assert all(c.endswith((".", "!", "?")) for c in chunks)
+    assert " ".join(chunks).split() == TEXT.split() # Sin solapamiento: cada palabra una vez
+
+
+def test_token_window_chunks_stay_within_size():
+    chunker = TokenWindowChunker(chunk_size=12, chunk_overlap=4)
+
+    for start, end, _ in chunker.split_page(TEXT):
+        assert sum(tokens for _, _, tokens in split_pieces(TEXT[start:end])) <= 12
+
+
+def test_heading_chunker_never_mixes_sections():
+    text = "1. Instalación\nConecte el cable.\n2. Mantenimiento\nCambie el cartucho."
+
+    chunks = HeadingChunker(chunk_size=200, chunk_overlap=0).split_pages([{"page": "1", "text": text}])
+
+    assert [c.heading for c in chunks] == ["1. Instalación", "2. Mantenimiento"]
+    assert "cartucho" not in chunks[0].text
+
+
+def test_unknown_chunker_is_rejected():
+    with pytest.raises(ValueError):
+        get_chunker("paragraph")
+
+
+def test_page_text_cache_round_trip(tmp_path):
+    cache = PageTextCache(str(tmp_path / "pages"))
+    pages = [{"page": "1", "text": "Hola"}]
+
+    assert cache.get("abc") is None
+    cache.put("abc", pages)
+    assert cache.get("abc") == pages
+
+
+@pytest.fixture
+def parent_child():
+    return ParentChildChunker(parent=SentenceChunker(chunk_size=40, chunk_overlap=0), child=SentenceChunker(chunk_size=12, chunk_overlap=0))
+
+
+def test_children_stay_inside_their_parent_window(parent_child):
+    children = parent_child.split_pages([{"page": "2", "text": TEXT}])
+
+    assert len({c.parent for c in children}) > 1
+    assert len(children) > len({c.parent for c in children}) # Varios hijos por padre
+    for child in children:
+        assert TEXT[child.start_char:child.end_char] == child.text # Offsets respecto a la página, no al padre
+        assert child.text in child.parent_text
+        assert child.page == "2"
+
+
+def test_parent_windows_do_not_overlap(parent_child):
+    parents = {c.parent: c.parent_text for c in parent_child.split_pages([{"page": "1", "text": TEXT}])}
+
+    assert sorted(parents) == list(range(len(parents)))
+    assert " ".join(parents[j] for j in sorted(parents)).split() == TEXT.split()
+
+
+def test_splitter_is_parent_child_only_when_enabled(monkeypatch):
+    assert isinstance(get_splitter("sentence"), SentenceChunker)
+
+    monkeypatch.setenv("RAG_PARENT_CHILD", "1")
+    monkeypatch.setenv("RAG_CHILD_TOKENS", "50")
+    splitter = get_splitter("heading", chunk_size=400)
+
+    assert isinstance(splitter.parent, HeadingChunker) and splitter.parent.chunk_size == 400
+    assert splitter.chunk_size == 50
+
+
+def test_search_answers_with_each_parent_once(workflow, parent_child):
+    children = parent_child.split_pages([{"page": "1", "text": TEXT}])
+    doc = RAGChunkAndSrc(chunks=[c.text for c in children], source_id="manual.pdf", tenant_id="default",
+                         metadata=workflow.processor.chunk_metadata("hash", children), parents=workflow.processor.chunk_parents(children))
+    result = asyncio.run(workflow._upsert(doc))
+    asyncio.run(workflow._activate("manual.pdf", result.version, tenant_id="default"))
+
+    found = asyncio.run(workflow._search("cartucho de tinta tapa frontal contactos", top_k=5, tenant_id="default"))
+
+    assert set(found.contexts) <= set(doc.parents) # El prompt recibe ventanas padre, no hijos sueltos...
+    assert len(found.contexts) == len(set(found.contexts)) # ...y cada una una sola vez
+    assert found.contexts[0] == next(c.parent_text for c in children if "tapa frontal" in c.text)
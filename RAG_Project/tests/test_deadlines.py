@@ -0,0 +1,140 @@
+# Presupuesto de latencia: reparto entre pasos, hedging y caché de respuestas de reserva
+
+import threading
+import time
+
+import pytest
+
+import deadlines
+from deadlines import AnswerCache, Deadline, DeadlineExceeded, LatencyTracker, QueryMetrics, call_with_deadline
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(monkeypatch):
+    metrics = QueryMetrics()
+    monkeypatch.setattr(deadlines, "metrics", metrics)
+    monkeypatch.setenv("RAG_HEDGE_DEFAULT_S", "0.05")
+    return metrics
+
+
+def test_shares_become_cumulative_marks():
+    deadline = Deadline(budget_s=10, started_at=time.time(), shares={"condense": 1, "embed": 1, "search": 1, "llm": 2})
+
+    assert deadline.marks == pytest.approx({"condense": 2.0, "embed": 4.0, "search": 6.0, "llm": 10.0})
+    assert deadline.step_timeout("embed") == pytest.approx(4.0, abs=0.05)
+
+
+def test_unused_time_carries_over_and_late_steps_get_nothing():
+    deadline = Deadline(budget_s=10, started_at=time.time() - 5, shares={"condense": 1, "embed": 1, "search": 1, "llm": 2})
+
+    assert deadline.step_timeout("condense") == 0.0 # Su plazo (2 s) ya pasó
+    assert deadline.step_timeout("llm") == pytest.approx(5.0, abs=0.05)
+    assert deadline.remaining() == pytest.approx(5.0, abs=0.05)
+
+
+def test_deadline_starts_when_the_event_was_sent():
+    sent_ms = (time.time() - 3) * 1000
+
+    assert Deadline.from_event(sent_ms, budget_s=20).elapsed() == pytest.approx(3.0, abs=0.05)
+
+
+def test_percentiles_need_enough_samples():
+    tracker = LatencyTracker(window=100, min_samples=10)
+    for i in range(9):
+        tracker.observe("embed", i / 10)
+    assert tracker.percentile("embed") is None
+
+    tracker.observe("embed", 0.9)
+
+    assert tracker.percentile("embed", 0.95) == pytest.approx(0.9)
+    assert tracker.percentile("embed", 0.5) == pytest.approx(0.5)
+    assert tracker.hedge_delay("embed") == pytest.approx(0.9)
+
+
+def test_fast_call_is_not_hedged():
+    assert call_with_deadline("embed", lambda: "ok", timeout=1.0) == ("ok", False)
+
+
+def test_slow_call_is_hedged_and_the_first_answer_wins():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1: # La primera copia se queda atascada
+            time.sleep(1.0)
+            return "lenta"
+        return "rápida"
+
+    t0 = time.monotonic()
+    result, hedged = call_with_deadline("search", fn, timeout=2.0)
+
+    assert (result, hedged) == ("rápida", True)
+    assert time.monotonic() - t0 < 0.5
+
+
+def test_hedge_is_skipped_when_the_hedge_pool_is_saturated(monkeypatch, fresh_metrics):
+    monkeypatch.setattr(deadlines, "_hedge_slots", threading.BoundedSemaphore(1))
+    deadlines._hedge_slots.acquire() # Todos los hilos de hedge ocupados por copias que ya perdieron
+
+    result, hedged = call_with_deadline("search", lambda: time.sleep(0.2) or "ok", timeout=2.0)
+
+    assert (result, hedged) == ("ok", False)
+    assert fresh_metrics.degradations["hedge_skipped"] == 1
+
+
+def test_hedge_slots_are_released_when_copies_finish(monkeypatch):
+    monkeypatch.setattr(deadlines, "_hedge_slots", threading.BoundedSemaphore(2))
+
+    for _ in range(3):
+        call_with_deadline("search", lambda: time.sleep(0.1) or "ok", timeout=2.0)
+    time.sleep(0.2)
+
+    assert deadlines._hedge_slots.acquire(blocking=False) and deadlines._hedge_slots.acquire(blocking=False)
+
+
+def test_no_hedge_when_disabled():
+    calls = []
+    fn = lambda: calls.append(1) or time.sleep(0.2) or "ok"
+
+    assert call_with_deadline("llm", fn, timeout=2.0, hedge=False) == ("ok", False)
+    assert len(calls) == 1
+
+
+def test_deadline_exceeded_is_counted_in_the_p95(fresh_metrics):
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline("llm", lambda: time.sleep(1.0), timeout=0.1, hedge=False)
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline("llm", lambda: "ok", timeout=0)
+
+    assert list(fresh_metrics.latency.samples["llm"]) == [0.1]
+
+
+def test_errors_propagate_when_every_copy_fails():
+    def fail():
+        raise RuntimeError("QDRANT caído")
+
+    with pytest.raises(RuntimeError, match="QDRANT"):
+        call_with_deadline("search", fail, timeout=1.0)
+
+
+def test_slo_ratio_and_degradations(fresh_metrics):
+    fresh_metrics.record_query(1.0, 20, [])
+    fresh_metrics.record_query(25.0, 20, ["timeout_answer"])
+
+    snapshot = fresh_metrics.snapshot()
+
+    assert snapshot["queries"] == 2
+    assert snapshot["slo_ratio"] == 0.5
+    assert snapshot["degradations"] == {"timeout_answer": 1}
+
+
+def test_answer_cache_normalises_questions_and_expires(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite"), ttl_seconds=60)
+    cache.put("¿Cuánto dura la garantía?", "manual.pdf", "Dos años.", ["manual.pdf"])
+
+    assert cache.get("cuanto DURA la garantía", "manual.pdf") is None # Las tildes sí cuentan
+    assert cache.get("  ¿cuánto dura la GARANTÍA ", "manual.pdf") == {"answer": "Dos años.", "sources": ["manual.pdf"]}
+    assert cache.get("¿Cuánto dura la garantía?", "otro.pdf") is None
+
+    cache.ttl_seconds = -1
+    assert cache.get("¿Cuánto dura la garantía?", "manual.pdf") is None
@@ -0,0 +1,103 @@
+# Casi duplicados: firmas MinHash, candidatos LSH y aislamiento entre clientes
+
+import asyncio
+
+import numpy as np
+import pytest
+
+from dedup import BatchIndex, DedupIndex, MinHasher
+
+LEGAL = ("Este documento es propiedad de la empresa y no puede reproducirse total ni parcialmente sin autorización "
+         "previa por escrito. Todos los derechos reservados. Versión para distribución interna.")
+NEAR = LEGAL.replace("Versión para distribución interna.", "Versión para distribución interna. Página 7.")
+OTHER = "Para cambiar el cartucho de tinta abra la tapa frontal, retire el cartucho usado e inserte el nuevo hasta oír un clic."
+
+
+@pytest.fixture
+def hasher():
+    return MinHasher()
+
+
+def test_near_duplicates_have_similar_signatures(hasher):
+    assert hasher.similarity(hasher.signature(LEGAL), hasher.signature(NEAR)) > 0.8
+    assert hasher.similarity(hasher.signature(LEGAL), hasher.signature(OTHER)) < 0.2
+    assert np.array_equal(hasher.signature(LEGAL), hasher.signature(LEGAL.upper())) # Sin distinguir mayúsculas
+
+
+def test_near_duplicates_share_an_lsh_band(hasher):
+    near = set(hasher.buckets(hasher.signature(LEGAL))) & set(hasher.buckets(hasher.signature(NEAR)))
+    other = set(hasher.buckets(hasher.signature(LEGAL))) & set(hasher.buckets(hasher.signature(OTHER)))
+
+    assert near # Se comparan...
+    assert not other # ...y los textos distintos ni siquiera llegan a compararse
+
+
+def test_num_perm_must_split_into_bands():
+    with pytest.raises(ValueError):
+        MinHasher(num_perm=10, bands=3)
+
+
+def test_batch_index_returns_the_best_candidate_above_threshold(hasher):
+    index = BatchIndex(hasher, threshold=0.8)
+    index.add(hasher.signature(OTHER), 0, "b.pdf")
+    index.add(hasher.signature(LEGAL), 1, "a.pdf")
+
+    assert index.find(hasher.signature(NEAR)) == (1, "a.pdf")
+    assert index.find(hasher.signature("texto que no se parece a nada de lo anterior")) is None
+
+
+def test_index_excludes_the_same_source_and_stays_in_its_namespace(tmp_path, hasher):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"), threshold=0.8, hasher=hasher)
+    index.add("docs_v1:a", ["p1"], [hasher.signature(LEGAL)], ["a.pdf"], ["v1"])
+
+    assert index.find("docs_v1:a", hasher.signature(NEAR)) == "p1"
+    assert index.find("docs_v1:a", hasher.signature(NEAR), exclude_source="a.pdf") is None # Sus versiones anteriores no cuentan
+    assert index.find("docs_v1:b", hasher.signature(NEAR)) is None
+
+
+def test_delete_other_versions_keeps_the_active_one(tmp_path, hasher):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"), threshold=0.8, hasher=hasher)
+    index.add("ns", ["old", "new"], [hasher.signature(LEGAL), hasher.signature(OTHER)], ["a.pdf", "a.pdf"], ["v1", "v2"])
+
+    index.delete_other_versions("ns", "a.pdf", "v2")
+
+    assert index.find("ns", hasher.signature(LEGAL)) is None
+    assert index.find("ns", hasher.signature(OTHER)) == "new"
+
+
+def test_duplicates_within_a_pdf_are_dropped(ingest):
+    result = asyncio.run(ingest("a.pdf", [LEGAL, OTHER, NEAR]))
+
+    assert result.ingested == 2
+    assert result.duplicates_dropped == 1
+
+
+def test_duplicates_across_pdfs_are_aliased_within_a_tenant(ingest, workflow):
+    asyncio.run(ingest("a.pdf", [LEGAL, OTHER]))
+
+    result = asyncio.run(ingest("b.pdf", [NEAR, "Otro contenido propio del segundo manual sobre la garantía."]))
+
+    assert result.duplicates_aliased == 1
+    assert result.embeddings_saved == 1
+
+
+def test_duplicates_are_never_aliased_across_tenants(ingest, workflow):
+    asyncio.run(ingest("a.pdf", [LEGAL, OTHER], tenant_id="cliente-a"))
+
+    result = asyncio.run(ingest("a.pdf", [NEAR, OTHER], tenant_id="cliente-b"))
+
+    assert result.duplicates_aliased == 0
+    found = workflow.storage.search(workflow.processor.embed_texts([NEAR])[0], top_k=5, tenant_id="cliente-b")
+    assert set(found["context_sources"]) == {"a.pdf"}
+    assert NEAR in found["contexts"]
+
+
+def test_mixed_tenant_batch_is_not_aliased_across_tenants(workflow):
+    from custom_types import RAGChunkAndSrc
+
+    batch = asyncio.run(workflow._upsert_many([
+        RAGChunkAndSrc(chunks=[LEGAL], source_id="a.pdf", tenant_id="cliente-a"),
+        RAGChunkAndSrc(chunks=[NEAR], source_id="b.pdf", tenant_id="cliente-b"),
+    ]))
+
+    assert [r.duplicates_aliased for r in batch.results] == [0, 0]
@@ -0,0 +1,86 @@
+# Motores de embeddings: modelo local (ajuste, guardado, carga y codificación por lotes) y elección por colección
+
+import numpy as np
+import pytest
+
+from embedders import LocalSVDEmbedder, OpenAIEmbedder, get_embedder
+
+CORPUS = [
+    "La impresora se instala conectando el cable USB y el cable de alimentación.",
+    "El cartucho de tinta se cambia abriendo la tapa frontal de la impresora.",
+    "El router se reinicia desde el panel web en la sección de mantenimiento.",
+    "La contraseña de la red wifi está en la pegatina inferior del router.",
+    "La garantía cubre dos años de defectos de fabricación con el ticket de compra.",
+    "Para devolver un producto hay que conservar la caja original y el ticket.",
+] * 3
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    return str(tmp_path / "local.joblib")
+
+
+def test_unfitted_model_refuses_to_embed(model_path):
+    with pytest.raises(RuntimeError, match="embedders.py fit"):
+        LocalSVDEmbedder(model_path).embed(["hola"])
+
+
+def test_fit_persist_and_load_give_the_same_vectors(model_path):
+    fitted = LocalSVDEmbedder(model_path, dim=256, workers=1).fit(CORPUS)
+
+    loaded = LocalSVDEmbedder(model_path, workers=1) # Otro proceso: lo carga del disco
+
+    assert loaded.name == fitted.name and loaded.name.startswith(f"local-svd-{loaded.dim}:")
+    assert loaded.dim == len(CORPUS) - 1 # La SVD no puede tener más componentes que documentos
+    vectors = np.asarray(loaded.embed(CORPUS[:3]))
+    assert np.allclose(vectors, fitted.embed(CORPUS[:3]), atol=1e-6)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+
+
+def test_similar_texts_are_closer(model_path):
+    embedder = LocalSVDEmbedder(model_path, workers=1).fit(CORPUS)
+
+    query, printer, router = np.asarray(embedder.embed(["cambiar el cartucho de tinta", CORPUS[1], CORPUS[2]]))
+
+    assert query @ printer > query @ router
+
+
+def test_refitting_changes_the_name(model_path):
+    first = LocalSVDEmbedder(model_path, dim=4, workers=1).fit(CORPUS).name
+
+    second = LocalSVDEmbedder(model_path, dim=8, workers=1).fit(CORPUS).name
+
+    assert first != second # Los embeddings cacheados con el modelo anterior no se reutilizan
+
+
+def test_large_inputs_are_encoded_in_batches_across_processes(model_path):
+    LocalSVDEmbedder(model_path, workers=1).fit(CORPUS)
+    pooled = LocalSVDEmbedder(model_path, batch_size=4, workers=2)
+    texts = CORPUS + [f"texto {i} sobre la impresora" for i in range(7)]
+
+    try:
+        vectors = pooled.embed(texts)
+    finally:
+        pooled.close()
+
+    assert pooled.pool is None
+    assert np.allclose(vectors, LocalSVDEmbedder(model_path, workers=1).embed(texts), atol=1e-6) # Mismo orden y mismos vectores
+
+
+def test_embedder_is_chosen_per_collection(monkeypatch):
+    monkeypatch.setenv("RAG_EMBEDDER", "openai")
+    monkeypatch.setenv("RAG_EMBEDDER_DOCS_LOCAL", "local")
+
+    local = get_embedder(collection="docs_local", dim=32)
+    remote = get_embedder(collection="docs", client=object(), dim=1024)
+
+    assert isinstance(local, LocalSVDEmbedder) and local.path.name == "local_embedder_docs_local.joblib"
+    assert isinstance(remote, OpenAIEmbedder) and remote.name == "text-embedding-3-large:1024"
+    with pytest.raises(ValueError):
+        get_embedder("cohere")
+
+
+def test_openai_requests_respect_input_and_token_limits():
+    batches = list(OpenAIEmbedder._request_batches(["x" * 400] * 7, max_inputs=3, max_tokens=250))
+
+    assert [len(b) for b in batches] == [2, 2, 2, 1] # ~100 tokens (400 caracteres) por texto: caben 2 por petición
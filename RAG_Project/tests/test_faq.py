@@ -0,0 +1,121 @@
+# Preguntas frecuentes: solo responden las aprobadas, dentro de su cliente y su PDF, y vuelven a revisión si el PDF cambia
+
+import asyncio
+
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+
+from conftest import word_hash_vector
+from faq import GLOBAL, FAQStore, cluster_questions
+
+QUESTION = "cómo se cambia el cartucho de tinta"
+ANSWER = "Abra la tapa frontal y cambie el cartucho."
+
+
+@pytest.fixture
+def store():
+    faq = FAQStore(QdrantClient(location=":memory:"), threshold=0.9)
+    faq.ensure(64)
+    return faq
+
+
+def _add(store: FAQStore, source_key: str = "manual.pdf", tenant_id: str = "cliente-a", vetted: bool = True, sources: list = None,
+         question: str = QUESTION) -> str:
+    faq_id = store.upsert(word_hash_vector(question), source_key, question, ANSWER, sources or [source_key], count=12, cohesion=0.95,
+                          examples=[question], tenant_id=tenant_id)
+    if vetted:
+        store.set_vetted([faq_id])
+    return faq_id
+
+
+def _lookup(store: FAQStore, source_id: str = "manual.pdf", tenant_id: str = "cliente-a", question: str = QUESTION):
+    return store.lookup(word_hash_vector(question), source_id, tenant_id)
+
+
+def test_only_vetted_answers_are_served(store):
+    faq_id = _add(store, vetted=False)
+
+    assert _lookup(store) is None # Pendiente de revisión
+
+    store.set_vetted([faq_id])
+    hit = _lookup(store)
+    assert str(hit.id) == faq_id and hit.payload["answer"] == ANSWER
+    assert _lookup(store, question="horario cafetería comedor") is None # Por debajo del umbral
+
+
+def test_answers_stay_inside_their_tenant_and_source(store):
+    _add(store)
+    _add(store, source_key=GLOBAL, question="quién fabrica la impresora")
+
+    assert _lookup(store, tenant_id="cliente-b") is None # Misma pregunta, otro cliente
+    assert _lookup(store, source_id="router.pdf") is None # Otro PDF
+    assert _lookup(store, source_id=None) is None # Las de un PDF no responden a las preguntas sin PDF...
+    assert _lookup(store, source_id=None, question="quién fabrica la impresora") is not None # ...las globales sí
+    with pytest.raises(ValueError):
+        _lookup(store, tenant_id=None)
+
+
+def test_same_question_in_two_tenants_are_two_faqs(store):
+    assert _add(store, tenant_id="cliente-a") != _add(store, tenant_id="cliente-b")
+    assert {f["tenant"] for f in store.list()} == {"cliente-a", "cliente-b"}
+    assert [f["tenant"] for f in store.list(tenant_id="cliente-b")] == ["cliente-b"]
+
+
+def test_changed_pdf_sends_its_answers_back_to_review(store):
+    _add(store)
+    _add(store, source_key=GLOBAL, sources=["manual.pdf"], question="quién fabrica la impresora") # Global que cita el PDF
+    _add(store, tenant_id="cliente-b")
+
+    store.invalidate_source("manual.pdf", "cliente-a")
+
+    assert _lookup(store) is None
+    assert _lookup(store, source_id=None, question="quién fabrica la impresora") is None
+    assert _lookup(store, tenant_id="cliente-b") is not None # El PDF de otro cliente no ha cambiado
+
+
+def test_remining_keeps_a_vetted_answer(store):
+    faq_id = _add(store)
+
+    store.upsert(word_hash_vector(QUESTION), "manual.pdf", QUESTION, "Otra respuesta", ["manual.pdf"], count=40, cohesion=0.9,
+                 examples=[], tenant_id="cliente-a")
+
+    payload = store.list(tenant_id="cliente-a")[0]
+    assert payload["id"] == faq_id and payload["vetted"] and payload["answer"] == ANSWER and payload["count"] == 40
+
+
+def test_delete_source_and_tenant(store):
+    _add(store)
+    _add(store, source_key="router.pdf", question="cómo se reinicia el router")
+    _add(store, tenant_id="cliente-b")
+
+    store.delete_source("manual.pdf", "cliente-a")
+    assert [f["source_key"] for f in store.list(tenant_id="cliente-a")] == ["router.pdf"]
+
+    store.delete_tenant("cliente-a")
+    assert [f["tenant"] for f in store.list()] == ["cliente-b"]
+
+
+def test_cluster_questions_keeps_large_cohesive_groups():
+    axes = np.eye(16)
+    frequent = axes[0] + np.random.default_rng(0).normal(scale=0.05, size=(12, 16)) # Una intención repetida doce veces
+    vectors = np.vstack([frequent, axes[1:7]]) # Y seis preguntas sueltas, cada una de un tema
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    clusters = cluster_questions(vectors, cluster_size=9, min_count=5, min_cohesion=0.9)
+
+    assert len(clusters) == 1 and set(clusters[0]["members"]) == set(range(12))
+    assert clusters[0]["representative"] in range(12)
+
+
+def test_workflow_serves_vetted_faqs_and_reingest_invalidates_them(workflow, ingest, monkeypatch):
+    monkeypatch.setattr(workflow, "faq_enabled", True)
+    asyncio.run(ingest("manual.pdf", ["Abra la tapa frontal y cambie el cartucho de tinta."]))
+    workflow.faq.ensure(workflow.processor.embed_dim)
+    faq_id = _add(workflow.faq, tenant_id="default")
+
+    assert asyncio.run(workflow._faq_lookup(QUESTION, "manual.pdf", tenant_id="default")).faq_id == faq_id
+
+    asyncio.run(ingest("manual.pdf", ["Nueva versión: el cartucho se cambia desde el lateral."]))
+
+    assert asyncio.run(workflow._faq_lookup(QUESTION, "manual.pdf", tenant_id="default")).faq_id is None
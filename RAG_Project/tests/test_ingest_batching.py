@@ -0,0 +1,60 @@
+# Ingesta por lotes: varios PDFs comparten embeddings y subida, y la concurrencia se limita por cliente
+
+import asyncio
+from types import SimpleNamespace
+
+import inngest
+import pytest
+
+import main
+from custom_types import RAGChunkAndSrc
+
+DOCS = {
+    "impresora.pdf": ["La impresora se reinicia con el botón de encendido.", "El cartucho se cambia desde la tapa frontal."],
+    "router.pdf": ["El router se reinicia desde el panel web."],
+    "garantia.pdf": ["La garantía cubre dos años con el ticket de compra."],
+}
+
+
+def test_batch_shares_embedding_requests_and_keeps_each_source(workflow, embedder):
+    docs = [RAGChunkAndSrc(chunks=chunks, source_id=source_id) for source_id, chunks in DOCS.items()]
+
+    batch = asyncio.run(workflow._upsert_many(docs))
+
+    assert len(embedder.calls) == 1 and len(embedder.calls[0]) == 4 # Los cuatro chunks de los tres PDFs en una sola petición
+    assert [(r.source_id, r.ingested, r.version) for r in batch.results] == \
+           [(s, len(c), workflow._content_version(c)) for s, c in DOCS.items()]
+    asyncio.run(workflow._activate_many(batch))
+    assert {s["source"]: s["points"] for s in workflow.storage.list_sources(tenant_id="default")} == {s: len(c) for s, c in DOCS.items()}
+
+
+def test_batch_can_mix_tenants_and_empty_documents(workflow):
+    docs = [RAGChunkAndSrc(chunks=DOCS["router.pdf"], source_id="manual.pdf", tenant_id="cliente-a"),
+            RAGChunkAndSrc(chunks=[], source_id="vacio.pdf", tenant_id="cliente-a"), # Un PDF sin texto no tumba el lote
+            RAGChunkAndSrc(chunks=DOCS["garantia.pdf"], source_id="manual.pdf", tenant_id="cliente-b")]
+
+    batch = asyncio.run(workflow._upsert_many(docs))
+    asyncio.run(workflow._activate_many(batch))
+
+    assert [(r.tenant_id, r.ingested) for r in batch.results] == [("cliente-a", 1), ("cliente-a", 0), ("cliente-b", 1)]
+    assert {t["tenant_id"]: t["points"] for t in workflow.storage.list_tenants()} == {"cliente-a": 1, "cliente-b": 1}
+
+
+def test_ingest_function_batches_events_and_limits_each_tenant():
+    config = main.rag_ingest_pdf.get_config("http://localhost:8000/api/inngest").main
+
+    assert config.batch_events.max_size == 20
+    assert [(c.key, c.limit) for c in config.concurrency] == [(None, 2), ("event.data.tenant_id", 1)]
+    assert config.throttle.key == "event.data.tenant_id"
+    query = main.rag_query_pdf_ai.get_config("http://localhost:8000/api/inngest").main
+    assert query.batch_events is None and query.concurrency[0].key is None # El chat tiene su propio cupo, sin lotes
+
+
+def test_a_batch_with_an_invalid_tenant_fails_before_staging_anything():
+    events = [SimpleNamespace(id=f"evento-{i}", name="rag/ingest_pdf", ts=None, data=data)
+              for i, data in enumerate([{"pdf_path": "a.pdf", "tenant_id": "cliente-a"}, {"pdf_path": "b.pdf", "tenant_id": "a:b"}])]
+    step = SimpleNamespace(run=None) # Ningún paso debe llegar a ejecutarse
+    ctx = SimpleNamespace(event=events[0], events=events, run_id="run-1", step=step)
+
+    with pytest.raises(inngest.NonRetriableError): # Reintentar no lo arreglaría
+        asyncio.run(main.rag_ingest_pdf._handler(ctx))
@@ -0,0 +1,78 @@
+# Ingesta de muchos PDFs: troceado en paralelo, un trabajo por fichero y embeddings compartidos entre ficheros
+
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from chunking import PageTextCache, file_hash
+from custom_types import RAGChunkRef
+from workflow import RAGWorkflow
+
+PAGES = {
+    "impresora.pdf": "El cartucho de tinta se cambia desde la tapa frontal. La impresora se reinicia con el botón de encendido.",
+    "manuales/router.pdf": "El router se reinicia desde el panel web. La contraseña wifi está en la pegatina inferior.",
+}
+
+
+class FakeStep:
+    def __init__(self):
+        self.names = []
+
+    async def run(self, name, handler, **kwargs):
+        self.names.append(name)
+        result = handler()
+        return await result if asyncio.iscoroutine(result) else result
+
+
+@pytest.fixture
+def folder(workdir):
+    """Carpeta con PDFs cuyo texto ya está en la caché de páginas (no hace falta leerlos) y uno corrupto."""
+    root = workdir / "subida"
+    for rel, text in PAGES.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(f"%PDF-falso {rel}".encode("utf-8"))
+        PageTextCache().put(file_hash(str(path)), [{"page": "1", "text": text}])
+    (root / "roto.pdf").write_bytes(b"no es un PDF")
+    return root
+
+
+def _files(root: Path) -> list:
+    return [{"pdf_path": str(root / rel), "source_id": rel, "job_id": f"evento-1-{i:04d}", "tenant_id": "default"}
+            for i, rel in enumerate(sorted([*PAGES, "roto.pdf"]))]
+
+
+def test_stage_files_keeps_the_order_and_isolates_failures(folder, workflow):
+    files = _files(folder)
+
+    refs = asyncio.run(workflow._stage_files(files, workers=2)).refs
+
+    assert [r.source_id for r in refs] == [f["source_id"] for f in files]
+    assert {r.source_id: bool(r.count) for r in refs} == {"impresora.pdf": True, "manuales/router.pdf": True, "roto.pdf": False}
+    assert workflow.progress.get("evento-1-0002")["status"] == "error" # roto.pdf
+    assert workflow.progress.get("evento-1-0000")["chunks"] == refs[0].count
+
+
+def test_group_refs_caps_the_chunks_per_group():
+    refs = [RAGChunkRef(source_id=s, count=c) for s, c in [("a", 3), ("b", 0), ("c", 2), ("d", 4)]]
+
+    groups = RAGWorkflow._group_refs(refs, max_chunks=5)
+
+    assert [[r.source_id for r in g] for g in groups] == [["a", "c"], ["d"]] # "b" no tiene chunks: no entra en ningún grupo
+
+
+def test_ingest_dir_function_ingests_every_pdf_and_reports_each_file(folder, workflow, embedder, monkeypatch):
+    monkeypatch.setitem(main.services._engines, "workflow", workflow)
+    ctx = SimpleNamespace(event=SimpleNamespace(id="evento-1", name="rag/ingest_dir", ts=None,
+                                                data={"directory": str(folder), "tenant_id": "default"}),
+                          run_id="run-1", step=FakeStep())
+
+    summary = asyncio.run(main.rag_ingest_dir._handler(ctx))
+
+    assert {f["source_id"]: f["status"] for f in summary["files"]} == {"impresora.pdf": "done", "manuales/router.pdf": "done", "roto.pdf": "error"}
+    assert summary["throughput"]["files"] == 3 and summary["throughput"]["failed"] == 1
+    assert sorted(s["source"] for s in workflow.storage.list_sources(tenant_id="default")) == ["impresora.pdf", "manuales/router.pdf"]
+    assert len(embedder.calls) == 1 # Los chunks de los dos PDFs comparten la petición de embeddings
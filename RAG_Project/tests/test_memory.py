@@ -0,0 +1,71 @@
+# Memoria de conversación: ventana por tokens y resumen incremental
+
+import pytest
+
+from memory import ConversationMemory
+from tokens import count_tokens
+
+
+def _history(n: int, words: int = 40) -> list:
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"mensaje {i} " + "palabra " * words} for i in range(n)]
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    mem = ConversationMemory(client=None, window_tokens=200, summary_tokens=50)
+    mem.summaries = [] # (resumen anterior, mensajes plegados) de cada llamada al LLM
+    monkeypatch.setattr(mem, "update_summary", lambda summary, turns: mem.summaries.append((summary, turns)) or f"resumen de {len(turns)}")
+    return mem
+
+
+def test_recent_keeps_the_newest_messages_within_budget(memory):
+    history = _history(20)
+
+    window = memory.recent(history)
+
+    assert window == [{"role": m["role"], "content": m["content"]} for m in history[-len(window):]] # Los últimos, en orden
+    assert sum(count_tokens(m["content"]) for m in window) <= memory.window_tokens
+    assert len(window) < len(history)
+
+
+def test_recent_truncates_a_single_oversized_message(memory):
+    huge = [{"role": "user", "content": "palabra " * 2000}]
+
+    window = memory.recent(huge, budget=50)
+
+    assert len(window) == 1
+    assert window[0]["content"].endswith("[…]")
+    assert len(window[0]["content"]) < len(huge[0]["content"])
+
+
+def test_compact_does_not_summarise_below_the_trigger(memory):
+    history = _history(2)
+    assert sum(count_tokens(m["content"]) for m in history) <= memory.window_tokens * 1.5
+
+    state = memory.compact(history, summary="previo")
+
+    assert memory.summaries == []
+    assert state.summary == "previo"
+    assert state.summarized == 0
+    assert len(state.window) == 2
+
+
+def test_compact_folds_old_messages_into_the_summary(memory):
+    history = _history(20)
+
+    state = memory.compact(history, summary="previo")
+
+    assert len(memory.summaries) == 1
+    previous, folded = memory.summaries[0]
+    assert previous == "previo" # Incremental: resumen anterior + mensajes nuevos
+    assert folded == history[:state.summarized]
+    assert state.summarized + len(state.window) == len(history)
+    assert sum(count_tokens(m["content"]) for m in state.window) <= memory.window_tokens // 2
+    assert state.summary == f"resumen de {state.summarized}"
+
+
+def test_update_summary_without_turns_skips_the_llm():
+    mem = ConversationMemory(client=None)
+
+    assert mem.update_summary("hola", []) == "hola"
+    assert mem.update_summary(None, []) == ""
@@ -0,0 +1,82 @@
+# Migración con alias: la colección nueva conserva ids, versiones y alias de duplicados, y hereda las firmas
+
+import asyncio
+import uuid
+
+import pytest
+
+from functions import QdrantStorage
+from migrate import copy_source, migrate
+
+LEGAL = ("Este documento es propiedad de la empresa y no puede reproducirse total ni parcialmente sin autorización "
+         "previa por escrito. Todos los derechos reservados. Versión para distribución interna.")
+NEAR = LEGAL.replace("Versión para distribución interna.", "Versión para distribución interna. Página 7.")
+OTHER = "Para cambiar el cartucho de tinta abra la tapa frontal, retire el cartucho usado e inserte el nuevo hasta oír un clic."
+GUARANTEE = "La garantía cubre dos años de defectos de fabricación si se conserva el ticket de compra."
+
+
+def _points(storage: QdrantStorage, collection: str = None) -> dict:
+    points, _ = storage.client.scroll(collection or storage.resolve_collection(), limit=100, with_payload=True)
+    return {str(p.id): p.payload for p in points}
+
+
+@pytest.fixture
+def ingested(ingest, workflow):
+    asyncio.run(ingest("a.pdf", [LEGAL, NEAR, OTHER])) # NEAR se descarta: chunk_index 0 y 2
+    asyncio.run(ingest("b.pdf", [NEAR, GUARANTEE])) # NEAR es alias del LEGAL de a.pdf
+    return _points(workflow.storage)
+
+
+def test_migration_keeps_ids_versions_and_chunk_indexes(ingested, workflow):
+    old = workflow.storage.resolve_collection()
+
+    target = migrate(workflow.storage, workflow.processor, max_batches_per_second=0, dedup=workflow.dedup)
+
+    copied = _points(workflow.storage)
+    assert workflow.storage.resolve_collection() == target != old
+    assert set(copied) == set(ingested)
+    for point_id, payload in ingested.items():
+        assert {k: copied[point_id].get(k) for k in ("version", "chunk_index", "duplicate_of")} == \
+               {k: payload.get(k) for k in ("version", "chunk_index", "duplicate_of")}
+    alias = next(p for p in copied.values() if p.get("duplicate_of"))
+    assert alias["duplicate_of"] in copied # El alias sigue apuntando a un punto que existe
+    assert sorted(p["chunk_index"] for p in copied.values() if p["source"] == "a.pdf") == [0, 2]
+
+
+def test_near_duplicates_are_still_detected_after_migrating(ingested, workflow, ingest):
+    migrate(workflow.storage, workflow.processor, max_batches_per_second=0, dedup=workflow.dedup)
+
+    result = asyncio.run(ingest("c.pdf", [NEAR, "Contenido propio del tercer manual."]))
+
+    assert result.duplicates_aliased == 1
+
+
+def test_second_pass_replaces_the_copy(ingested, workflow):
+    new = QdrantStorage(collection="docs_v9", dim=workflow.storage.dim, client=workflow.storage.client, use_alias=False)
+    for _ in range(2): # La puesta al día vuelve a copiar los PDFs que cambiaron
+        copied = copy_source("a.pdf", workflow.storage, new, workflow.processor, max_batches_per_second=0, tenant_id="default",
+                             dedup=workflow.dedup)
+
+    assert copied == 2
+    assert new.count(tenant_id="default") == 2
+
+
+def test_rechunk_uses_new_ids_and_the_ingest_version(ingest, workflow):
+    pages = [{"page": "1", "text": f"{OTHER}\n\n{GUARANTEE}"}]
+    workflow.processor.page_cache.put("hash-a", pages)
+    asyncio.run(ingest("a.pdf", [OTHER], metadata=[{"file_hash": "hash-a"}]))
+
+    migrate(workflow.storage, workflow.processor, rechunk=True, max_batches_per_second=0, dedup=workflow.dedup)
+
+    copied = sorted(_points(workflow.storage).items(), key=lambda item: item[1]["chunk_index"])
+    texts = [p["text"] for _, p in copied]
+    version = workflow._content_version(texts)
+    assert [point_id for point_id, _ in copied] == [str(uuid.uuid5(uuid.NAMESPACE_URL, f"a.pdf:{version}:{i}")) for i in range(len(texts))]
+    assert all(p["version"] == version for _, p in copied)
+
+
+def test_legacy_collection_needs_drop_legacy(workflow):
+    legacy = QdrantStorage(collection="legacy", dim=workflow.storage.dim, client=workflow.storage.client, use_alias=False)
+
+    with pytest.raises(RuntimeError, match="--drop-legacy"):
+        migrate(legacy, workflow.processor, max_batches_per_second=0)
@@ -0,0 +1,94 @@
+# Progreso de la ingesta: contadores, ritmo (chunks/s) y tiempo restante
+
+import pytest
+
+import progress
+from progress import ProgressTracker
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    return ProgressTracker(str(tmp_path / "jobs"))
+
+
+@pytest.fixture
+def clock(monkeypatch): # Reloj controlado: el ritmo depende del tiempo transcurrido
+    now = [1_000.0]
+    monkeypatch.setattr(progress.time, "time", lambda: now[0])
+    return now
+
+
+def test_rate_and_eta_while_embedding(tracker, clock):
+    tracker.update("job", source_id="a.pdf", status="parsing", chunks=100)
+    clock[0] += 5 # El troceado no cuenta para el ritmo
+    tracker.update("job", status="embedding")
+    clock[0] += 10
+    tracker.advance("job", "chunks_embedded", 40)
+
+    job = tracker.get("job")
+
+    assert job["rate"] == pytest.approx(4.0) # 40 chunks en 10 s
+    assert job["eta_s"] == pytest.approx(15.0) # Quedan 60 a 4 chunks/s
+    assert job["progress"] == pytest.approx(0.2) # Embeddings y subida pesan lo mismo
+
+
+def test_finished_jobs_have_no_eta_and_full_progress(tracker, clock):
+    tracker.update("job", status="embedding", chunks=10)
+    clock[0] += 2
+    tracker.update("job", status="done", chunks_embedded=10, points_upserted=10)
+    clock[0] += 100 # Leer más tarde no cambia el ritmo de un trabajo terminado
+
+    job = tracker.get("job")
+
+    assert job["rate"] == pytest.approx(5.0)
+    assert job["eta_s"] is None
+    assert job["progress"] == 1.0
+
+
+def test_no_rate_before_embeddings_start(tracker):
+    tracker.update("job", status="parsing", chunks=10)
+
+    job = tracker.get("job")
+
+    assert job["rate"] == 0.0
+    assert job["eta_s"] is None
+
+
+def test_retry_that_advances_clears_the_error(tracker):
+    tracker.update("job", status="error", error="timeout de OpenAI")
+    assert tracker.get("job")["error"] == "timeout de OpenAI"
+
+    tracker.update("job", status="embedding")
+
+    assert tracker.get("job")["error"] is None
+
+
+def test_advance_and_update_ignore_missing_jobs(tracker):
+    assert tracker.update(None, status="done") == {}
+    assert tracker.advance("nadie", "chunks_embedded", 5) == {}
+    assert tracker.get("nadie") is None
+
+
+def test_job_ids_cannot_escape_the_folder(tracker):
+    tracker.update("../../fuera", status="parsing")
+
+    assert [p.name for p in tracker.folder.iterdir()] == ["fuera.json"]
+
+
+def test_list_expires_old_jobs_and_aggregates_throughput(tmp_path, clock):
+    tracker = ProgressTracker(str(tmp_path / "jobs"), ttl_seconds=60)
+    tracker.update("viejo", status="done")
+    clock[0] += 120
+    for job_id in ("a", "b"):
+        tracker.update(job_id, status="embedding", chunks=100)
+    clock[0] += 10
+    tracker.advance("a", "chunks_embedded", 20)
+    tracker.advance("b", "chunks_embedded", 30)
+    tracker.update("c", status="error", error="x")
+
+    jobs = tracker.list()
+    stats = tracker.throughput(jobs)
+
+    assert sorted(j["job_id"] for j in jobs) == ["a", "b", "c"]
+    assert not (tracker.folder / "viejo.json").exists()
+    assert stats == {"running": 2, "done": 0, "failed": 1, "chunks_per_second": pytest.approx(5.0)}
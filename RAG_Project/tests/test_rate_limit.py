@@ -0,0 +1,172 @@
+# Limitador de OpenAI: token bucket, concurrencia AIMD, prioridad y reintentos
+
+import threading
+
+import httpx
+import openai
+import pytest
+
+import rate_limit
+from rate_limit import BATCH, INTERACTIVE, AdaptiveConcurrency, ModelLimiter, RateLimiter, TokenBucket, _is_rate_limit, _is_transient
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, message="error"):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch): # Los reintentos no esperan de verdad
+    sleeps = []
+    monkeypatch.setattr(rate_limit.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(per_minute=60) # 1 unidad por segundo
+
+    bucket.consume(60)
+
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
+    assert bucket.wait_time(1000) == pytest.approx(60.0, abs=0.1) # Nunca más que el cubo entero
+
+
+def test_token_bucket_sync_only_lowers_the_level():
+    bucket = TokenBucket(per_minute=100)
+
+    bucket.sync(10)
+    assert bucket.level <= 10
+    bucket.sync(90)
+    assert bucket.level <= 11
+
+
+def test_aimd_adds_slowly_and_halves_on_throttle():
+    aimd = AdaptiveConcurrency(initial=8, minimum=1, maximum=10)
+
+    for _ in range(8): # Una "ventana" completa de éxitos suma 1
+        aimd.on_success()
+    assert aimd.limit == pytest.approx(9, abs=0.1)
+
+    aimd.on_throttle()
+    assert aimd.limit == pytest.approx(4.5, abs=0.1)
+    for _ in range(10):
+        aimd.on_throttle()
+    assert aimd.limit == 1
+
+
+def test_batch_traffic_gets_a_share_of_the_concurrency():
+    limiter = ModelLimiter(rpm=10_000, tpm=10_000_000, batch_share=0.5)
+    limiter.concurrency.limit = 4
+
+    assert limiter._max_in_flight(INTERACTIVE) == 4
+    assert limiter._max_in_flight(BATCH) == 2
+
+
+def test_in_flight_never_exceeds_the_concurrency_limit():
+    limiter = ModelLimiter(rpm=100_000, tpm=100_000_000)
+    limiter.concurrency = AdaptiveConcurrency(initial=3, maximum=3)
+    peak, lock = [0], threading.Lock()
+
+    def worker():
+        limiter.acquire(1)
+        with lock:
+            peak[0] = max(peak[0], limiter.in_flight)
+        threading.Event().wait(0.005) # La llamada tarda un poco (time.sleep está parcheado)
+        limiter.release(ok=False)
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+
+    assert peak[0] <= 3
+    assert limiter.in_flight == 0
+
+
+def test_throttle_empties_the_request_bucket_and_lowers_concurrency():
+    limiter = ModelLimiter(rpm=600, tpm=1_000_000)
+    before = limiter.concurrency.limit
+    limiter.acquire(1)
+
+    limiter.release(throttled=True)
+
+    assert limiter.requests.level < 1
+    assert limiter.concurrency.limit == before / 2
+
+
+def test_rate_limit_is_detected_by_status_or_type_only():
+    response = httpx.Response(429, request=REQUEST)
+
+    assert _is_rate_limit(StatusError(429))
+    assert _is_rate_limit(openai.RateLimitError("slow down", response=response, body=None))
+    assert not _is_rate_limit(Exception("upstream returned 429 Too Many Requests"))
+    assert not _is_rate_limit(StatusError(500))
+
+
+def test_transient_errors():
+    assert _is_transient(StatusError(503))
+    assert _is_transient(openai.APIConnectionError(request=REQUEST))
+    assert _is_transient(openai.APITimeoutError(request=REQUEST))
+    assert not _is_transient(StatusError(400))
+    assert not _is_transient(ValueError("bad input"))
+
+
+def _flaky(errors: list, result="ok"):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return fn, calls
+
+
+def test_call_retries_rate_limits_with_backoff(no_sleep):
+    limiter = RateLimiter(limits={"m": {"rpm": 10_000, "tpm": 10_000_000}}, max_retries=6)
+    fn, calls = _flaky([StatusError(429)] * 3)
+
+    assert limiter.call("m", fn, tokens=1) == "ok"
+    assert len(calls) == 4
+    assert len(no_sleep) == 3
+
+
+def test_call_retries_transient_errors_a_bounded_number_of_times():
+    limiter = RateLimiter(limits={"m": {"rpm": 10_000, "tpm": 10_000_000}}, transient_retries=2)
+
+    fn, calls = _flaky([StatusError(502), openai.APIConnectionError(request=REQUEST)])
+    assert limiter.call("m", fn, tokens=1) == "ok"
+    assert len(calls) == 3
+
+    fn, calls = _flaky([StatusError(500)] * 5)
+    with pytest.raises(StatusError):
+        limiter.call("m", fn, tokens=1)
+    assert len(calls) == 3 # Primer intento + 2 reintentos
+
+
+def test_call_does_not_retry_client_errors_or_when_disabled():
+    limiter = RateLimiter(limits={"m": {"rpm": 10_000, "tpm": 10_000_000}})
+
+    fn, calls = _flaky([StatusError(400)])
+    with pytest.raises(StatusError):
+        limiter.call("m", fn, tokens=1)
+    assert len(calls) == 1
+
+    fn, calls = _flaky([openai.APITimeoutError(request=REQUEST)])
+    with pytest.raises(openai.APITimeoutError):
+        limiter.call("m", fn, tokens=1, transient_retries=0) # Quien tiene su propio plazo no reintenta
+    assert len(calls) == 1
+    assert limiter.for_model("m").in_flight == 0
+
+
+def test_backoff_honours_retry_after():
+    limiter = RateLimiter(base_delay=0.01, max_delay=0.02)
+    response = httpx.Response(429, headers={"retry-after": "3"}, request=REQUEST)
+
+    assert limiter.backoff(0, openai.RateLimitError("slow", response=response, body=None)) == 3.0
+    assert 0 <= limiter.backoff(10) <= 0.02
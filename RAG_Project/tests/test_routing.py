@@ -0,0 +1,62 @@
+# Enrutado en dos etapas: un centroide por PDF y cliente, y búsqueda filtrada a los PDFs elegidos
+
+import asyncio
+
+import numpy as np
+import pytest
+
+from routing import centroid
+
+DOCS = {
+    "impresora.pdf": ["El cartucho de tinta de la impresora se cambia desde la tapa frontal.", "La impresora imprime en color y en blanco y negro."],
+    "router.pdf": ["El router wifi se reinicia desde el panel web.", "La contraseña wifi del router está en la pegatina."],
+    "garantia.pdf": ["La garantía cubre dos años de defectos de fabricación.", "Para la garantía hay que conservar el ticket de compra."],
+}
+
+
+@pytest.fixture
+def routed(ingest, workflow):
+    for source_id, chunks in DOCS.items():
+        asyncio.run(ingest(source_id, chunks))
+    asyncio.run(ingest("router.pdf", ["Manual de otro cliente sobre impresora y tinta."], tenant_id="cliente-b"))
+    return workflow
+
+
+def _vector(workflow, text: str) -> list:
+    return workflow.processor.embed_texts([text])[0]
+
+
+def test_centroid_is_the_normalized_mean():
+    assert np.allclose(centroid([[1.0, 0.0], [0.0, 1.0]]), [2 ** -0.5, 2 ** -0.5])
+    assert centroid([[0.0, 0.0]]) == [0.0, 0.0] # Sin dividir por cero
+
+
+def test_route_batch_ranks_the_tenant_sources(routed):
+    router = routed.storage.router
+    queries = [_vector(routed, "cambiar el cartucho de tinta de la impresora"), _vector(routed, "contraseña del router wifi")]
+
+    routes = router.route_batch(queries, top_n=1, tenant_id="default")
+
+    assert routes == [["impresora.pdf"], ["router.pdf"]]
+    assert router.route(queries[0], top_n=5, tenant_id="cliente-b") == ["router.pdf"] # Solo los PDFs de ese cliente
+    assert router.route_batch([], tenant_id="default") == []
+
+
+def test_search_without_source_only_looks_at_the_routed_pdfs(routed, monkeypatch):
+    monkeypatch.setattr(routed, "route_top_n", 1)
+
+    found = asyncio.run(routed._search("cambiar el cartucho de tinta de la impresora", top_k=5, tenant_id="default"))
+
+    assert set(found.sources) == {"impresora.pdf"} and sorted(found.contexts) == sorted(DOCS["impresora.pdf"])
+
+
+def test_few_sources_search_everything(routed):
+    assert routed._route([_vector(routed, "impresora")], "default") == [None] # Menos PDFs que RAG_ROUTE_TOP_N: no se filtra
+
+
+def test_deleting_and_rebuilding_keep_the_index_in_sync(routed):
+    storage = routed.storage
+    storage.delete_source("router.pdf", "default")
+
+    assert set(storage.router.route(_vector(routed, "router wifi"), top_n=5, tenant_id="default")) == {"impresora.pdf", "garantia.pdf"}
+    assert storage.router.rebuild(storage) == 3 # impresora y garantía de "default" y el router de cliente-b
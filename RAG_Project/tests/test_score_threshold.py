@@ -0,0 +1,65 @@
+# Umbral de similitud: sin contexto relevante la consulta responde NO_ANSWER sin llamar al LLM
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+MANUAL = ["Para cambiar el cartucho de tinta abra la tapa frontal e inserte el cartucho nuevo.",
+          "La impresora se reinicia manteniendo pulsado el botón de encendido diez segundos."]
+
+
+class FakeStep:
+    def __init__(self):
+        self.names = []
+
+    async def run(self, name, handler, **kwargs):
+        self.names.append(name)
+        return await handler()
+
+
+class NoLLM: # Cualquier uso del cliente de OpenAI (chat) hace fallar la prueba
+    def __getattr__(self, name):
+        raise AssertionError(f"Se ha llamado al LLM ({name})")
+
+
+@pytest.fixture
+def query(workflow, ingest, monkeypatch):
+    asyncio.run(ingest("impresora.pdf", MANUAL))
+    monkeypatch.setattr(workflow.processor, "client", NoLLM())
+    monkeypatch.setitem(main.services._engines, "workflow", workflow)
+
+    def _query(question: str, **data):
+        ctx = SimpleNamespace(event=SimpleNamespace(id="evento-1", name="rag/query_pdf_ai", ts=None, data={"question": question, **data}),
+                              run_id="run-1", step=FakeStep())
+        return asyncio.run(main.rag_query_pdf_ai._handler(ctx)), ctx.step.names
+
+    return _query
+
+
+def test_search_drops_chunks_below_the_threshold(workflow, ingest):
+    asyncio.run(ingest("impresora.pdf", MANUAL))
+
+    relevant = asyncio.run(workflow._search("cambiar el cartucho de tinta", top_k=2, score_threshold=0.3, tenant_id="default"))
+    off_topic = asyncio.run(workflow._search("horario cafetería comedor", top_k=2, score_threshold=0.3, tenant_id="default"))
+
+    assert relevant.contexts[0] == MANUAL[0] and min(relevant.scores) >= 0.3
+    assert off_topic.contexts == [] and off_topic.degradations == []
+
+
+def test_off_topic_question_skips_the_llm(query):
+    result, steps = query("horario cafetería comedor", score_threshold=0.5)
+
+    assert result["answer"] == main.NO_ANSWER
+    assert result["llm_skipped"] is True and result["num_contexts"] == 0
+    assert "llm-asnwer" not in steps and "audit-log-interaction" in steps # La ruta rápida también queda auditada
+
+
+def test_threshold_comes_from_the_environment_when_the_event_has_none(query, workflow, monkeypatch):
+    monkeypatch.setattr(workflow, "score_threshold", 0.99)
+
+    result, _ = query("cómo se cambia el cartucho de tinta")
+
+    assert result["llm_skipped"] is True
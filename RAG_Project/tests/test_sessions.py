@@ -0,0 +1,94 @@
+# Sesiones de chat en el servidor: turnos idempotentes, aislamiento por cliente y limpieza por TTL
+
+import time
+
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
+
+from sessions import SessionStore
+
+
+@pytest.fixture
+def store():
+    return SessionStore(QdrantClient(location=":memory:"), ttl_seconds=3600)
+
+
+def _expired_sessions(store: SessionStore, n: int) -> list:
+    store._ensure()
+    ids = [f"old-{i}" for i in range(n)]
+    store.client.upsert(store.collection, points=[
+        PointStruct(id=store._meta_id(s, "default"), vector=[1.0],
+                    payload={"tenant": "default", "session_id": s, "kind": "meta", "summary": "", "summarized_seq": 0, "last_active": time.time() - 7200})
+        for s in ids
+    ])
+    return ids
+
+
+def test_turns_are_idempotent_per_turn_id(store):
+    store.append_turn("s1", "evento-1", "hola", "buenas", "default")
+    store.append_turn("s1", "evento-1", "hola", "buenas", "default") # Inngest reintenta el paso
+    store.append_turn("s1", "evento-2", "¿y ahora?", "ahora sí", "default")
+
+    turns = store.get_turns("s1", tenant_id="default")
+
+    assert [t["content"] for t in turns] == ["hola", "buenas", "¿y ahora?", "ahora sí"]
+    assert store.get_turns("s1", after_seq=turns[1]["seq"], tenant_id="default")[0]["content"] == "¿y ahora?"
+
+
+def test_evict_expired_pages_past_the_first_scroll_page(store):
+    expired = _expired_sessions(store, 1205) # Más de una página de scroll (1000)
+    store.append_turn(expired[0], "evento-viejo", "pregunta", "respuesta", "default")
+    store.client.set_payload(store.collection, payload={"last_active": time.time() - 7200}, points=[store._meta_id(expired[0], "default")])
+    store.append_turn("activa", "evento-1", "hola", "buenas", "default")
+
+    assert store.evict_expired() == 1205
+
+    assert store.get_turns(expired[0], tenant_id="default") == [] # También se borran sus turnos
+    assert store.get_state(expired[-1], "default") == {"summary": "", "summarized_seq": 0}
+    assert len(store.get_turns("activa", tenant_id="default")) == 2
+    assert store.evict_expired() == 0
+
+
+def test_touch_renews_the_ttl(store):
+    _expired_sessions(store, 1)
+
+    store.touch("old-0", "default")
+
+    assert store.evict_expired() == 0
+
+
+def test_state_round_trip(store):
+    store.save_state("s1", "resumen", 42, "default")
+
+    assert store.get_state("s1", "default") == {"summary": "resumen", "summarized_seq": 42}
+
+
+def test_sessions_are_isolated_per_tenant(store):
+    store.append_turn("s1", "evento-1", "mi contraseña es 1234", "anotado", "cliente-a")
+    store.save_state("s1", "resumen de cliente-a", 7, "cliente-a")
+
+    assert store.get_turns("s1", tenant_id="cliente-b") == [] # Mismo session_id, otro cliente: no ve nada
+    assert store.get_state("s1", "cliente-b") == {"summary": "", "summarized_seq": 0}
+    store.append_turn("s1", "evento-1", "hola", "buenas", "cliente-b")
+    assert [t["content"] for t in store.get_turns("s1", tenant_id="cliente-a")] == ["mi contraseña es 1234", "anotado"]
+
+
+def test_tenant_is_required(store):
+    for call in (lambda: store.get_turns("s1"), lambda: store.get_state("s1"), lambda: store.append_turn("s1", "e", "q", "a")):
+        with pytest.raises(ValueError):
+            call()
+
+
+def test_evict_expired_removes_sessions_from_before_tenants(store):
+    _expired_sessions(store, 1)
+    store.append_turn("viejo", "evento-1", "hola", "buenas", "default")
+    store.client.upsert(store.collection, points=[ # Meta y turno de una sesión guardada antes de que existiera "tenant"
+        PointStruct(id=1, vector=[1.0], payload={"session_id": "viejo", "kind": "meta", "last_active": time.time() - 7200}),
+        PointStruct(id=2, vector=[1.0], payload={"session_id": "viejo", "kind": "turn", "seq": 1, "role": "user", "content": "x"}),
+    ])
+
+    assert store.evict_expired() == 2
+
+    assert store.client.retrieve(store.collection, ids=[1, 2]) == []
+    assert len(store.get_turns("viejo", tenant_id="default")) == 2 # La sesión actual con el mismo id sigue viva
@@ -0,0 +1,71 @@
+# Snapshots: exportar y restaurar una colección con su configuración, sus índices y su índice de enrutado
+
+import asyncio
+import json
+
+import pytest
+from qdrant_client.models import HnswConfigDiff, KeywordIndexParams, KeywordIndexType, PayloadIndexInfo, PayloadSchemaType
+
+from functions import QdrantStorage
+from migrate import restore
+from snapshots import _index_schema, _index_spec, export_collection, import_collection
+
+MANUAL = ["La impresora se instala conectando el cable USB.", "El cartucho de tinta se cambia abriendo la tapa frontal."]
+ROUTER = ["El router se reinicia desde el panel web.", "La contraseña wifi está en la pegatina inferior."]
+
+
+@pytest.fixture
+def snapshot(ingest, workflow, tmp_path):
+    asyncio.run(ingest("impresora.pdf", MANUAL))
+    asyncio.run(ingest("router.pdf", ROUTER, tenant_id="cliente-b"))
+    return export_collection(workflow.storage.client, workflow.storage.resolve_collection(), str(tmp_path / "snap"))
+
+
+def test_index_params_survive_the_manifest():
+    tenant = PayloadIndexInfo(data_type=PayloadSchemaType.KEYWORD, params=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True),
+                              points=0)
+    source = PayloadIndexInfo(data_type=PayloadSchemaType.KEYWORD, points=0)
+
+    assert _index_schema(_index_spec(tenant)) == KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True)
+    assert _index_schema(_index_spec(source)) == PayloadSchemaType.KEYWORD
+    assert _index_schema("integer") == PayloadSchemaType.INTEGER # Manifests anteriores
+
+
+def test_import_recreates_hnsw_config_and_tenant_index(snapshot, workflow, tmp_path, monkeypatch):
+    client = workflow.storage.client
+    created, indexes = {}, {}
+    create_collection = client.create_collection
+    monkeypatch.setattr(client, "create_collection", lambda **kw: created.update({kw["collection_name"]: kw}) or create_collection(**kw))
+    monkeypatch.setattr(client, "create_payload_index",
+                        lambda name, field_name, field_schema: indexes.setdefault(name, {}).update({field_name: field_schema}))
+    snapshot["hnsw_config"] = {"m": 0, "payload_m": 16} # QDRANT en memoria no guarda ni índices ni HNSW: los ponemos en el manifest
+    snapshot["payload_schema"] = {"tenant": {"type": "keyword", "is_tenant": True}, "source": {"type": "keyword"}}
+    (tmp_path / "snap" / "manifest.json").write_text(json.dumps(snapshot), encoding="utf-8")
+
+    import_collection(client, str(tmp_path / "snap"), collection="docs_v7")
+
+    assert created["docs_v7"]["hnsw_config"] == HnswConfigDiff(m=0, payload_m=16)
+    assert indexes["docs_v7"] == {"tenant": KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True), "source": PayloadSchemaType.KEYWORD}
+    assert "docs_v7_routing" in created
+
+
+def test_restore_goes_to_a_new_version_and_keeps_search_and_routing(snapshot, workflow, tmp_path):
+    storage = workflow.storage
+    previous = storage.resolve_collection()
+    question = workflow.processor.embed_texts(["cómo se cambia el cartucho de tinta"])[0]
+    before = storage.search(question, top_k=2, tenant_id="default")
+
+    target = restore(storage, str(tmp_path / "snap"))
+
+    assert storage.resolve_collection() == target != previous
+    assert storage.client.collection_exists(previous) # Se conserva para el rollback
+    assert storage.count() == len(MANUAL) + len(ROUTER)
+    assert storage.search(question, top_k=2, tenant_id="default")["contexts"] == before["contexts"]
+    assert storage.router.route_batch([question], 5, "cliente-b") == [["router.pdf"]] # El enrutado también se restaura
+
+
+def test_restore_refuses_a_collection_without_alias(snapshot, workflow, tmp_path):
+    legacy = QdrantStorage(collection="legacy", dim=workflow.storage.dim, client=workflow.storage.client, use_alias=False)
+
+    with pytest.raises(RuntimeError, match="--drop-legacy"):
+        restore(legacy, str(tmp_path / "snap"))
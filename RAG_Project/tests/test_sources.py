@@ -0,0 +1,59 @@
+# Reemplazo y borrado por PDF: la versión nueva se activa de golpe y el resto de la colección no se toca
+
+import asyncio
+
+from custom_types import RAGChunkAndSrc
+
+OLD = ["Versión 1: la impresora se reinicia manteniendo pulsado el botón de encendido.",
+       "Versión 1: el cartucho de tinta se cambia desde la tapa frontal."]
+NEW = ["Versión 2: la impresora se reinicia desde el menú de ajustes."]
+ROUTER = ["El router se reinicia desde el panel web."]
+
+
+def _contexts(workflow, text: str, source_id: str = None) -> list:
+    vector = workflow.processor.embed_texts([text])[0]
+    return workflow.storage.search(vector, top_k=10, source_id=source_id, tenant_id="default")["contexts"]
+
+
+def test_new_version_stays_invisible_until_it_is_activated(ingest, workflow):
+    asyncio.run(ingest("manual.pdf", OLD))
+
+    staged = asyncio.run(workflow._upsert(RAGChunkAndSrc(chunks=NEW, source_id="manual.pdf")))
+
+    assert sorted(_contexts(workflow, "reiniciar la impresora")) == sorted(OLD) # Ni vacío ni mezclado mientras se ingesta
+    assert workflow.storage.count() == len(OLD)
+
+    asyncio.run(workflow._activate(staged.source_id, staged.version, tenant_id=staged.tenant_id))
+
+    assert _contexts(workflow, "reiniciar la impresora") == NEW
+    points, _ = workflow.storage.client.scroll(workflow.storage.resolve_collection(), limit=100, with_payload=True)
+    assert {p.payload["version"] for p in points} == {staged.version} # Las versiones anteriores se borran en la misma petición
+
+
+def test_activate_replaces_only_its_own_source(ingest, workflow):
+    asyncio.run(ingest("router.pdf", ROUTER))
+    asyncio.run(ingest("manual.pdf", OLD))
+
+    asyncio.run(ingest("manual.pdf", NEW))
+
+    assert {s["source"]: s["points"] for s in workflow.storage.list_sources(tenant_id="default")} == {"router.pdf": 1, "manual.pdf": 1}
+    assert _contexts(workflow, "reiniciar el router", source_id="router.pdf") == ROUTER
+
+
+def test_reingesting_the_same_content_is_idempotent(ingest, workflow):
+    first = asyncio.run(ingest("manual.pdf", OLD))
+
+    second = asyncio.run(ingest("manual.pdf", OLD)) # Inngest reintenta la ingesta entera
+
+    assert second.version == first.version
+    assert workflow.storage.count() == len(OLD)
+
+
+def test_delete_source_leaves_the_rest_of_the_collection(ingest, workflow):
+    asyncio.run(ingest("router.pdf", ROUTER))
+    asyncio.run(ingest("manual.pdf", OLD))
+
+    workflow.storage.delete_source("manual.pdf", "default")
+
+    assert [s["source"] for s in workflow.storage.list_sources(tenant_id="default")] == ["router.pdf"]
+    assert _contexts(workflow, "reiniciar la impresora") == ROUTER
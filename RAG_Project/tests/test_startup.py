@@ -0,0 +1,79 @@
+# Arranque perezoso: main.py no crea motores al importarse, /healthz no hace E/S y /readyz solo da 200 con QDRANT respondiendo
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services import LazyServices
+
+PROJECT = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture
+def services(monkeypatch, embedder):
+    monkeypatch.setenv("RAG_WARMUP", "0") # Sin hilo de calentamiento: cada prueba decide cuándo se crean los motores
+    from functions import VectorProcessor
+    lazy = LazyServices()
+    monkeypatch.setattr(lazy, "_build_processor", lambda: VectorProcessor(embedder=embedder)) # Embeddings de prueba, sin OpenAI
+    monkeypatch.setattr(main, "services", lazy)
+    return lazy
+
+
+@pytest.fixture
+def api(services):
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_importing_main_does_not_load_the_engines():
+    code = "import sys, main; print(sorted(m for m in ('functions', 'workflow', 'sessions', 'openai', 'qdrant_client') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=PROJECT, capture_output=True, text=True, check=True,
+                         env={**os.environ, "RAG_WARMUP": "0"})
+
+    assert out.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_healthz_answers_without_creating_engines(api, services):
+    response = api.get("/healthz")
+
+    assert response.status_code == 200 and response.json()["status"] == "ok"
+    assert services._engines == {}
+
+
+def test_readyz_is_503_while_qdrant_is_down_and_retries_later(api, services, monkeypatch):
+    monkeypatch.setenv("QDRANT_URL", "http://127.0.0.1:1") # Nadie escucha: conexión rechazada
+    monkeypatch.setenv("RAG_QDRANT_TIMEOUT_S", "1")
+
+    down = api.get("/readyz")
+
+    assert down.status_code == 503
+    assert down.json()["checks"]["qdrant"] != "ok" and "storage" not in down.json()["engines"] # El error no se guarda
+
+    monkeypatch.setenv("QDRANT_URL", ":memory:") # QDRANT vuelve
+    up = api.get("/readyz")
+
+    assert up.status_code == 200
+    assert up.json()["checks"] == {"qdrant": "ok", "workflow": "ok", "openai_key": "ok"}
+    assert {"processor", "storage", "workflow"} <= set(up.json()["engines"])
+
+
+def test_readyz_needs_an_openai_key_unless_replaying(api, monkeypatch):
+    monkeypatch.setenv("QDRANT_URL", ":memory:")
+    monkeypatch.delenv("OPENAI_API_KEY")
+
+    assert api.get("/readyz").status_code == 503
+
+    monkeypatch.setenv("RAG_CASSETTE", "replay") # Respuestas grabadas (cassette.py)
+    assert api.get("/readyz").status_code == 200
+
+
+def test_engines_are_built_once(services, monkeypatch):
+    monkeypatch.setenv("QDRANT_URL", ":memory:")
+
+    assert services.workflow is services.workflow
+    assert services.workflow.storage is services.storage
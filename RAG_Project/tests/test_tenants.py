@@ -0,0 +1,87 @@
+# Aislamiento por cliente: validación del tenant, claves (tenant, PDF) y filtro obligatorio en QDRANT
+
+import asyncio
+
+import pytest
+
+from tenants import DEFAULT_TENANT, require_tenant, source_key, tenant_of
+
+MANUAL_A = ["La impresora del cliente A se reinicia manteniendo pulsado el botón de encendido diez segundos."]
+MANUAL_B = ["El router del cliente B se reinicia desde el panel web en la sección de mantenimiento."]
+
+
+@pytest.mark.parametrize("value", [None, "", "a:b", "../otro", "con espacio", "x" * 65])
+def test_invalid_tenants_are_rejected(value):
+    with pytest.raises(ValueError):
+        require_tenant(value)
+
+
+def test_missing_tenant_falls_back_to_default_unless_required(monkeypatch):
+    assert tenant_of({}) == DEFAULT_TENANT
+    assert tenant_of({"tenant_id": "cliente-a"}) == "cliente-a"
+
+    monkeypatch.setenv("RAG_REQUIRE_TENANT", "1")
+
+    with pytest.raises(ValueError):
+        tenant_of({"pdf_path": "manual.pdf"})
+
+
+def test_default_tenant_keeps_the_old_keys():
+    assert source_key(DEFAULT_TENANT, "manual.pdf") == "manual.pdf"
+    assert source_key("cliente-a", "manual.pdf") == "cliente-a:manual.pdf"
+    assert source_key("cliente-a", None) == "cliente-a:*"
+
+
+def test_search_without_tenant_is_refused(workflow):
+    vector = workflow.processor.embed_texts(["reiniciar"])[0]
+
+    with pytest.raises(ValueError):
+        workflow.storage.search(vector, top_k=3)
+    with pytest.raises(ValueError):
+        workflow.storage.search_batch([vector], top_k=3)
+
+
+def _search(workflow, text: str, tenant_id: str) -> dict:
+    return workflow.storage.search(workflow.processor.embed_texts([text])[0], top_k=5, tenant_id=tenant_id)
+
+
+def test_same_file_name_in_two_tenants_are_two_documents(ingest, workflow):
+    async def run(): # Las dos ingestas se intercalan en el mismo bucle
+        return await asyncio.gather(ingest("manual.pdf", MANUAL_A, tenant_id="cliente-a"),
+                                    ingest("manual.pdf", MANUAL_B, tenant_id="cliente-b"))
+
+    asyncio.run(run())
+
+    assert _search(workflow, "reiniciar router", "cliente-a")["contexts"] == MANUAL_A
+    assert _search(workflow, "reiniciar impresora", "cliente-b")["contexts"] == MANUAL_B
+    assert {t["tenant_id"]: t["points"] for t in workflow.storage.list_tenants()} == {"cliente-a": 1, "cliente-b": 1}
+
+
+def test_deleting_a_tenant_document_leaves_the_other_tenant_alone(ingest, workflow):
+    asyncio.run(ingest("manual.pdf", MANUAL_A, tenant_id="cliente-a"))
+    asyncio.run(ingest("manual.pdf", MANUAL_B, tenant_id="cliente-b"))
+
+    workflow.storage.delete_source("manual.pdf", "cliente-a")
+
+    assert _search(workflow, "reiniciar", "cliente-a")["contexts"] == []
+    assert _search(workflow, "reiniciar", "cliente-b")["contexts"] == MANUAL_B
+
+
+def test_clear_tenant_only_removes_its_points(ingest, workflow):
+    asyncio.run(ingest("a.pdf", MANUAL_A, tenant_id="cliente-a"))
+    asyncio.run(ingest("b.pdf", MANUAL_B))
+
+    workflow.storage.clear_tenant("cliente-a")
+
+    assert workflow.storage.count(tenant_id="cliente-a") == 0
+    assert workflow.storage.list_sources(tenant_id=DEFAULT_TENANT) == [{"tenant_id": DEFAULT_TENANT, "source": "b.pdf", "points": 1}]
+
+
+def test_reingesting_a_tenant_document_keeps_the_other_version(ingest, workflow):
+    asyncio.run(ingest("manual.pdf", MANUAL_A, tenant_id="cliente-a"))
+    asyncio.run(ingest("manual.pdf", MANUAL_B, tenant_id="cliente-b"))
+
+    asyncio.run(ingest("manual.pdf", ["Nueva versión del manual del cliente A."], tenant_id="cliente-a")) # Activar borra sus versiones anteriores...
+
+    assert _search(workflow, "manual", "cliente-a")["contexts"] == ["Nueva versión del manual del cliente A."]
+    assert _search(workflow, "router", "cliente-b")["contexts"] == MANUAL_B # ...pero no las del otro cliente
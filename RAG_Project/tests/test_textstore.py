@@ -0,0 +1,83 @@
+# Texto de los chunks fuera de QDRANT: el payload no lo lleva y hydrate lo recupera en una sola lectura
+
+import asyncio
+
+import pytest
+
+from custom_types import RAGChunkAndSrc
+from functions import AuditLogger, QdrantStorage, VectorProcessor
+from textstore import ChunkTextStore
+from workflow import RAGWorkflow
+
+MANUAL = ["El cartucho de tinta se cambia desde la tapa frontal (ñ, €, 日本).", "La impresora se reinicia con el botón de encendido."]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkTextStore(str(tmp_path / "texts.sqlite"))
+
+
+@pytest.fixture
+def external(embedder, store):
+    """RAGWorkflow con el texto de los chunks en el almacén externo (como RAG_EXTERNAL_TEXT=1)."""
+    processor = VectorProcessor(embedder=embedder)
+    client = QdrantStorage.connect(url=":memory:")
+    storage = QdrantStorage(dim=processor.embed_dim, client=client, text_store=store)
+    return RAGWorkflow(processor=processor, storage=storage, logger=AuditLogger(client))
+
+
+def _ingest(workflow, source_id: str, chunks: list):
+    result = asyncio.run(workflow._upsert(RAGChunkAndSrc(chunks=chunks, source_id=source_id)))
+    asyncio.run(workflow._activate(result.source_id, result.version, tenant_id=result.tenant_id))
+    return result
+
+
+def _stored_ids(workflow) -> list:
+    points, _ = workflow.storage.client.scroll(workflow.storage.resolve_collection(), limit=100)
+    return [str(p.id) for p in points]
+
+
+def test_store_round_trip_per_namespace(store):
+    store.put_many("docs_v1", ["a", "b"], MANUAL, ["manual.pdf"] * 2, ["v1"] * 2)
+    store.put_many("docs_v2", ["a"], ["otro texto"], ["manual.pdf"], ["v1"])
+
+    assert store.get_many("docs_v1", ["a", "b", "no-existe"]) == {"a": MANUAL[0], "b": MANUAL[1]}
+    assert store.get_many("docs_v2", ["a"]) == {"a": "otro texto"} # Una migración no pisa los textos de la colección antigua
+    assert store.get_many("docs_v1", []) == {}
+
+
+def test_delete_other_versions_and_source(store):
+    store.put_many("docs_v1", ["a", "b", "c"], ["viejo", "nuevo", "otro"], ["manual.pdf", "manual.pdf", "router.pdf"], ["v1", "v2", "v1"])
+
+    store.delete_other_versions("docs_v1", "manual.pdf", "v2")
+    assert store.get_many("docs_v1", ["a", "b", "c"]) == {"b": "nuevo", "c": "otro"}
+
+    store.delete_source("docs_v1", "manual.pdf")
+    assert store.get_many("docs_v1", ["b", "c"]) == {"c": "otro"}
+
+
+def test_payload_has_no_text_and_search_hydrates_it(external, store):
+    _ingest(external, "manual.pdf", MANUAL)
+    storage = external.storage
+
+    points, _ = storage.client.scroll(storage.resolve_collection(), limit=10, with_payload=True)
+    vector = external.processor.embed_texts(["cambiar el cartucho de tinta"])[0]
+
+    assert points and all("text" not in p.payload for p in points)
+    assert storage.search(vector, top_k=1, tenant_id="default")["contexts"] == [MANUAL[0]]
+    assert storage.search_batch([vector, vector], top_k=2, tenant_id="default")[1]["contexts"][0] == MANUAL[0]
+
+
+def test_replacing_and_deleting_a_pdf_clean_up_its_texts(external, store):
+    _ingest(external, "manual.pdf", MANUAL)
+    namespace = external.storage.resolve_collection()
+    old_ids = _stored_ids(external)
+
+    _ingest(external, "manual.pdf", MANUAL[:1]) # Versión nueva: ids nuevos
+
+    new_ids = _stored_ids(external)
+    assert store.get_many(namespace, old_ids) == {} # Los textos de la versión anterior se borran al activar la nueva
+    assert list(store.get_many(namespace, new_ids).values()) == MANUAL[:1]
+
+    external.storage.delete_source("manual.pdf", "default")
+    assert store.get_many(namespace, new_ids) == {}
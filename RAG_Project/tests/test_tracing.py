@@ -0,0 +1,137 @@
+# Trazas: cabecera traceparent, jerarquía de spans, propagación entre hilos y spans de los pasos de Inngest
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import tracing
+from tracing import JsonlExporter, StepTracer, format_traceparent, load_traces, parse_traceparent, propagate, span, traceparent
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+SPAN_ID = "00f067aa0ba902b7"
+
+
+@pytest.fixture
+def exported(monkeypatch, tmp_path):
+    exporter = JsonlExporter(str(tmp_path / "traces.jsonl"))
+    monkeypatch.setattr(tracing, "_exporters", [exporter])
+    return lambda: load_traces(str(exporter.path))
+
+
+def test_traceparent_round_trip():
+    header = format_traceparent(TRACE_ID, SPAN_ID)
+
+    assert header == f"00-{TRACE_ID}-{SPAN_ID}-01"
+    assert parse_traceparent(header) == (TRACE_ID, SPAN_ID)
+
+
+@pytest.mark.parametrize("value", [None, "", "basura", f"00-{TRACE_ID}-{SPAN_ID}", f"00-{TRACE_ID[:-1]}-{SPAN_ID}-01",
+                                   f"00-{TRACE_ID}-{SPAN_ID}0-01"])
+def test_invalid_traceparent_is_ignored(value):
+    assert parse_traceparent(value) is None
+
+
+def test_spans_without_an_active_trace_are_not_recorded(exported):
+    with span("script") as attrs:
+        attrs["x"] = 1
+
+    assert exported() == []
+    assert traceparent() is None
+
+
+def test_child_spans_share_the_trace_and_point_at_their_parent(exported):
+    def run():
+        with span("ui.chat", root=True):
+            header = traceparent()
+            with span("openai.gpt-4o-mini", tokens=10) as attrs:
+                attrs["attempts"] = 1
+        return header
+
+    header = contextvars.copy_context().run(run)
+
+    child, root = exported() # El hijo termina (y se exporta) antes que el padre
+    assert root["name"] == "ui.chat" and root["parent_id"] is None
+    assert child["trace_id"] == root["trace_id"]
+    assert child["parent_id"] == root["span_id"]
+    assert child["attrs"] == {"tokens": 10, "attempts": 1}
+    assert parse_traceparent(header) == (root["trace_id"], root["span_id"])
+
+
+def test_errors_are_recorded_and_reraised(exported):
+    def run():
+        with span("qdrant.search", root=True):
+            raise TimeoutError("lento")
+
+    with pytest.raises(TimeoutError):
+        contextvars.copy_context().run(run)
+
+    assert exported()[0]["error"] == "TimeoutError: lento"
+
+
+def test_propagate_keeps_the_trace_in_worker_threads(exported):
+    def run():
+        with span("rag.batch", root=True):
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                inherited = list(pool.map(propagate(lambda _: traceparent()), range(2)))
+                lost = list(pool.map(lambda _: traceparent(), range(2))) # Sin propagate el hilo no ve la traza
+        return inherited, lost
+
+    inherited, lost = contextvars.copy_context().run(run)
+
+    root = exported()[-1]
+    assert all(parse_traceparent(h) == (root["trace_id"], root["span_id"]) for h in inherited)
+    assert lost == [None, None]
+
+
+class FakeStep:
+    def __init__(self):
+        self.memoized = {}
+
+    async def run(self, name, handler, **kwargs): # Como Inngest: un paso ya hecho no se vuelve a ejecutar
+        if name not in self.memoized:
+            self.memoized[name] = await handler()
+        return self.memoized[name]
+
+
+def _ctx(data: dict, ts: int = None):
+    event = SimpleNamespace(id="evento-1", name="rag/query_pdf_ai", data=data, ts=ts)
+    return SimpleNamespace(event=event, run_id="run-1", step=FakeStep())
+
+
+def test_step_tracer_joins_the_incoming_trace(exported):
+    ctx = _ctx({"traceparent": format_traceparent(TRACE_ID, SPAN_ID)}, ts=1_700_000_000_000)
+
+    async def run():
+        step = StepTracer(ctx, "rag_query_pdf_ai")
+        assert await step.run("search", lambda: 42) == 42
+        assert await step.run("search", lambda: 0) == 42 # Memoizado: sin span nuevo
+        step.finish(answered=True)
+
+    contextvars.copy_context().run(asyncio.run, run())
+
+    step_span, run_span = exported()
+    assert run_span["trace_id"] == step_span["trace_id"] == TRACE_ID
+    assert run_span["parent_id"] == SPAN_ID # Cuelga del span de la interfaz
+    assert step_span["parent_id"] == run_span["span_id"]
+    assert run_span["start"] == 1_700_000_000 # Desde que se envió el evento: incluye la cola de Inngest
+    assert run_span["attrs"]["answered"] is True
+
+
+def test_step_tracer_ids_are_stable_across_re_executions():
+    ids = []
+    for _ in range(2): # Inngest vuelve a llamar a la función en cada paso
+        step = contextvars.copy_context().run(StepTracer, _ctx({}), "rag_ingest_pdf")
+        ids.append((step.trace_id, step.run_span_id, step.parent_id))
+
+    assert ids[0] == ids[1]
+    assert ids[0][2] is None
+
+
+def test_load_traces_skips_a_truncated_first_line(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    path.write_text('{"name": "cortado"\n{"name": "a"}\n{"name": "b"}\n', encoding="utf-8")
+
+    assert [s["name"] for s in load_traces(str(path))] == ["a", "b"]
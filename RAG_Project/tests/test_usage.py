@@ -0,0 +1,101 @@
+# Consumo de tokens: coste, medidores anidados, libro de consumo y agregados
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from tracing import propagate
+from usage import UsageLedger, cost_usd, metered, record_response
+from workflow import RAGWorkflow
+
+
+def _chat(prompt: int, completion: int):
+    return SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion))
+
+
+def _embedding(prompt: int): # Las respuestas de embeddings no tienen "choices"
+    return SimpleNamespace(data=[], usage=SimpleNamespace(prompt_tokens=prompt, total_tokens=prompt))
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return UsageLedger(str(tmp_path / "usage.sqlite"))
+
+
+def test_cost_uses_input_and_output_prices():
+    assert cost_usd("gpt-4o-mini", 1_000_000, 1_000_000) == pytest.approx(0.75)
+    assert cost_usd("text-embedding-3-large", 2_000_000) == pytest.approx(0.26)
+    assert cost_usd("modelo-desconocido", 1_000_000, 1_000_000) == 0.0
+
+
+def test_nested_meters_both_see_the_calls():
+    record_response("gpt-4o-mini", _chat(10, 5)) # Sin medidor activo: no se anota en ningún sitio
+
+    with metered() as query:
+        record_response("text-embedding-3-large", _embedding(100))
+        with metered() as step:
+            record_response("gpt-4o-mini", _chat(10, 5))
+
+    assert step.totals() == {"gpt-4o-mini": {"prompt_tokens": 10, "completion_tokens": 5, "embedding_tokens": 0, "calls": 1,
+                                             "cost_usd": pytest.approx(cost_usd("gpt-4o-mini", 10, 5))}}
+    totals = query.totals()
+    assert totals["text-embedding-3-large"]["embedding_tokens"] == 100
+    assert totals["text-embedding-3-large"]["prompt_tokens"] == 0
+    assert totals["gpt-4o-mini"]["calls"] == 1
+
+
+def test_meter_counts_calls_from_propagated_threads():
+    with metered() as meter:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(propagate(lambda _: record_response("gpt-4o-mini", _chat(3, 1))), range(200)))
+            list(pool.map(lambda _: record_response("gpt-4o-mini", _chat(3, 1)), range(10))) # Sin propagate: otro contexto
+
+    m = meter.totals()["gpt-4o-mini"]
+    assert (m["calls"], m["prompt_tokens"], m["completion_tokens"]) == (200, 600, 200)
+
+
+def test_retried_step_replaces_its_row(ledger):
+    ledger.record("query", "evento-1", "answer", {"gpt-4o-mini": {"prompt_tokens": 100, "calls": 1, "cost_usd": 0.1}}, latency_ms=900)
+    ledger.record("query", "evento-1", "answer", {"gpt-4o-mini": {"prompt_tokens": 120, "calls": 1, "cost_usd": 0.2}}, latency_ms=800)
+    ledger.record("query", "evento-1", "search", {}, latency_ms=30) # Paso sin llamadas a OpenAI: solo latencia
+
+    summary = ledger.summary("query", "evento-1")
+
+    assert summary["prompt_tokens"] == 120
+    assert summary["cost_usd"] == pytest.approx(0.2)
+    assert summary["by_model"] == {"gpt-4o-mini": {"tokens": 120, "calls": 1, "cost_usd": pytest.approx(0.2)}}
+    assert summary["steps_ms"] == {"answer": 800, "search": 30}
+
+
+def test_rollup_by_source_and_model(ledger):
+    ledger.record("query", "q1", "answer", {"gpt-4o-mini": {"prompt_tokens": 10, "calls": 1, "cost_usd": 0.3}})
+    ledger.record("query", "q1", "search", {}, latency_ms=20)
+    ledger.set_source("query", "q1", "a.pdf", "sesion-1") # La consulta sabe su PDF al final
+    ledger.record("query", "q2", "answer", {"gpt-4o-mini": {"prompt_tokens": 5, "calls": 1, "cost_usd": 0.1}})
+    ledger.record("ingest", "job-1", "embed", {"text-embedding-3-large": {"embedding_tokens": 50, "calls": 1, "cost_usd": 0.5}},
+                  source="b.pdf")
+
+    by_source = {r["source"]: r for r in ledger.rollup("source")}
+    by_model = ledger.rollup("model", kind="query")
+
+    assert [r["source"] for r in ledger.rollup("source")] == ["b.pdf", "a.pdf", "(sin dato)"] # Por coste, de mayor a menor
+    assert by_source["a.pdf"]["requests"] == 1
+    assert by_source["b.pdf"]["embedding_tokens"] == 50
+    assert by_model == [{"model": "gpt-4o-mini", "requests": 2, "prompt_tokens": 15, "completion_tokens": 0, "embedding_tokens": 0,
+                         "calls": 2, "cost_usd": pytest.approx(0.4)}]
+
+
+def test_unknown_rollup_group_is_rejected(ledger):
+    with pytest.raises(ValueError):
+        ledger.rollup("source; DROP TABLE usage")
+
+
+def test_embedding_usage_is_shared_by_chunk_size():
+    spent = {}
+    models = {"text-embedding-3-large": {"embedding_tokens": 100, "calls": 1, "cost_usd": 1.0}}
+
+    RAGWorkflow._share_usage(spent, models, [("job-1", "a.pdf"), ("job-2", "b.pdf"), ("job-2", "b.pdf")], ["x" * 50, "y" * 25, "z" * 25])
+
+    assert spent[("job-1", "a.pdf")]["text-embedding-3-large"]["embedding_tokens"] == pytest.approx(50)
+    assert spent[("job-2", "b.pdf")]["text-embedding-3-large"]["cost_usd"] == pytest.approx(0.5)
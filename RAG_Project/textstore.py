@@ -0,0 +1,68 @@
+# 18. ALMACÉN EXTERNO DEL TEXTO DE LOS CHUNKS
+
+# Cada punto de QDRANT llevaba en el payload el texto completo del chunk (~1000 caracteres): QDRANT guardaba en RAM/disco
+# todo el texto de los documentos y cada query_points lo enviaba por la red.
+# Con RAG_EXTERNAL_TEXT=1, QDRANT solo guarda ids y metadatos pequeños, y el texto vive en un SQLite local comprimido con zlib.
+# Tras la búsqueda se recuperan los textos de todos los puntos encontrados en UNA consulta por id.
+#   - namespace: colección física (docs_v1, docs_v2...). Una migración escribe sus propios textos y no pisa los de la antigua.
+# El coste de la consulta extra frente al ahorro de memoria y red se mide con: uv run python bench_textstore.py
+
+import os
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+
+
+class ChunkTextStore:
+    def __init__(self, path: str = None, level: int = 6):
+        path = path or os.getenv("RAG_TEXT_STORE", ".cache/chunk_text.sqlite")
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.level = level # Nivel de compresión de zlib (6 = equilibrio entre tamaño y velocidad)
+        self.conn = sqlite3.connect(path, check_same_thread=False) # Compartida entre hilos, protegida con el lock
+        self.conn.execute("PRAGMA journal_mode=WAL") # Lecturas de las búsquedas mientras la ingesta escribe
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "ns TEXT NOT NULL, id TEXT NOT NULL, source TEXT, version TEXT, body BLOB NOT NULL, PRIMARY KEY (ns, id))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (ns, source)")
+        self.lock = threading.Lock()
+
+    def put_many(self, ns: str, ids: list, texts: list, sources: list = None, versions: list = None):
+        sources = sources or [None] * len(ids)
+        versions = versions or [None] * len(ids)
+        rows = [
+            (ns, str(ids[i]), sources[i], versions[i], zlib.compress(texts[i].encode("utf-8"), self.level))
+            for i in range(len(ids))
+        ]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO chunks (ns, id, source, version, body) VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def get_many(self, ns: str, ids: list) -> dict:
+        """Devuelve {id: texto} de los ids que existen."""
+        ids = [str(i) for i in ids]
+        found = {}
+        with self.lock:
+            for start in range(0, len(ids), 500): # SQLite limita el número de parámetros por consulta
+                block = ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT id, body FROM chunks WHERE ns = ? AND id IN ({','.join('?' * len(block))})", [ns, *block]
+                ).fetchall()
+                found.update(rows)
+        return {i: zlib.decompress(body).decode("utf-8") for i, body in found.items()}
+
+    def delete_source(self, ns: str, source: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM chunks WHERE ns = ? AND source = ?", (ns, source))
+            self.conn.commit()
+
+    def delete_other_versions(self, ns: str, source: str, version: str): # Acompaña al reemplazo atómico de un PDF
+        with self.lock:
+            self.conn.execute("DELETE FROM chunks WHERE ns = ? AND source = ? AND version IS NOT ?", (ns, source, version))
+            self.conn.commit()
+
+    def delete_namespace(self, ns: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM chunks WHERE ns = ?", (ns,))
+            self.conn.commit()
@@ -0,0 +1,59 @@
+# 7. CONTEO DE TOKENS
+
+# Los LLM y los modelos de embeddings no cuentan caracteres, cuentan TOKENS (trozos de palabra).
+# En este pipeline centralizamos como estimamos los tokens de un texto para que el chunking,
+# los limitadores de la API y la memoria de conversación usen la misma medida.
+#   - TIKTOKEN: Si la librería está instalada usamos el mismo tokenizador que OpenAI (cl100k_base).
+#   - APROXIMACIÓN: Si no está instalada usamos la regla de ~4 caracteres por token.
+# El tokenizador se carga la primera vez que se cuenta un texto (no al importar): cargar sus tablas BPE retrasaba el arranque.
+
+import re
+import threading
+
+_ENCODING = None
+_LOADED = False
+_LOCK = threading.Lock()
+
+CHARS_PER_TOKEN = 4 # Regla aproximada para textos en español/inglés
+
+# Divide el texto en piezas (palabras, signos y espacios) conservando la posición de cada una
+_PIECE_RE = re.compile(r"\w+|[^\w\s]|\s+", re.UNICODE)
+
+
+def _encoding():
+    global _ENCODING, _LOADED
+    if not _LOADED:
+        with _LOCK:
+            if not _LOADED:
+                try:
+                    import tiktoken # Tokenizador oficial de OpenAI (opcional)
+                    _ENCODING = tiktoken.get_encoding("cl100k_base")
+                except ImportError: # Sin tiktoken seguimos funcionando con la aproximación
+                    _ENCODING = None
+                _LOADED = True
+    return _ENCODING
+
+
+def count_tokens(text: str) -> int: # Devuelve el número (real o estimado) de tokens de un texto
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def split_pieces(text: str) -> list[tuple[int, int, int]]:
+    """
+    Parte el texto en piezas y devuelve una lista de (inicio, fin, tokens_estimados).
+    Permite cortar el texto por número de tokens sin perder los offsets de caracteres.
+    """
+    pieces = []
+    for m in _PIECE_RE.finditer(text):
+        start, end = m.span()
+        if m.group().isspace():
+            tokens = 0 # Los espacios se pegan al token siguiente en los tokenizadores BPE
+        else:
+            tokens = max(1, (end - start + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+        pieces.append((start, end, tokens))
+    return pieces
@@ -0,0 +1,230 @@
+# 22. TRAZAS DE EXTREMO A EXTREMO
+
+# Un mensaje del chat pasa por streamlit_app.py -> evento de Inngest -> pasos de rag_query_pdf_ai -> métodos de RAGWorkflow
+# -> OpenAI y QDRANT, y nada los unía: no sabíamos si la lentitud era cola, sondeo o cálculo. En este pipeline:
+#   - CONTEXTO: cada traza tiene un trace_id y cada tramo (span) su span_id, en formato W3C "traceparent".
+#     streamlit_app.py lo crea y lo manda en event.data["traceparent"]; main.py lo recoge y lo hereda cada paso.
+#   - SPANS: un span por paso de Inngest (StepTracer), por llamada a OpenAI (rate_limiter.call) y por búsqueda o escritura en QDRANT.
+#     El span de la ejecución empieza en ctx.event.ts, así el hueco hasta el primer paso es la cola de Inngest.
+#   - EXPORTACIÓN: un JSON por span en RAG_TRACE_FILE (.cache/traces.jsonl) y, si se define RAG_OTLP_ENDPOINT,
+#     también a un colector OTLP/HTTP (JSON) en segundo plano. admin_monitor.py pinta la cascada (waterfall) de cada traza.
+# Los ids de la ejecución salen del id del evento: Inngest re-ejecuta la función en cada paso y todos los spans caen en la misma traza.
+
+import contextvars
+import hashlib
+import inspect
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from usage import get_ledger, metered
+
+_current = contextvars.ContextVar("rag_trace", default=None) # (trace_id, span_id) del span activo
+_service = os.getenv("RAG_SERVICE_NAME", "api")
+
+
+def set_service(name: str): # Nombre del proceso en los spans ("api", "ui"...)
+    global _service
+    _service = name
+
+
+def _ids_from(seed: str, size: int) -> str: # Ids deterministas (mismo evento -> mismos ids en cada re-ejecución)
+    return hashlib.sha256(seed.encode("utf-8")).hexdigest()[:size]
+
+
+def format_traceparent(trace_id: str, span_id: str) -> str:
+    return f"00-{trace_id}-{span_id}-01"
+
+
+def parse_traceparent(value: str):
+    parts = (value or "").split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+def traceparent() -> str: # Cabecera del span activo, para propagarla a otro proceso (datos del evento)
+    current = _current.get()
+    return format_traceparent(*current) if current else None
+
+
+class JsonlExporter:
+    def __init__(self, path: str = None, max_mb: float = None):
+        self.path = Path(path or os.getenv("RAG_TRACE_FILE", ".cache/traces.jsonl"))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = (max_mb or float(os.getenv("RAG_TRACE_MAX_MB", 50))) * 1e6
+        self.lock = threading.Lock()
+
+    def export(self, span: dict):
+        line = json.dumps(span, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            if self.path.exists() and self.path.stat().st_size > self.max_bytes: # Rotación simple: se conserva el fichero anterior
+                self.path.replace(self.path.with_suffix(".jsonl.1"))
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class OtlpHttpExporter:
+    """Envía los spans por lotes a un colector OTLP/HTTP con JSON (p.ej. Jaeger u OpenTelemetry Collector en :4318)."""
+
+    def __init__(self, endpoint: str, batch_size: int = 100, interval_s: float = 2.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self.queue = queue.Queue(maxsize=10_000) # Si el colector no responde se pierden spans, nunca se bloquea la consulta
+        threading.Thread(target=self._loop, daemon=True, name="otlp-exporter").start()
+
+    def export(self, span: dict):
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    @staticmethod
+    def _otlp_span(span: dict) -> dict:
+        return {
+            "traceId": span["trace_id"], "spanId": span["span_id"], "parentSpanId": span["parent_id"] or "",
+            "name": span["name"], "kind": 1,
+            "startTimeUnixNano": str(int(span["start"] * 1e9)), "endTimeUnixNano": str(int(span["end"] * 1e9)),
+            "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in span["attrs"].items()],
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+        }
+
+    def _loop(self):
+        import requests
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.interval_s
+            while len(batch) < self.batch_size and time.time() < deadline:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            by_service = {}
+            for span in batch:
+                by_service.setdefault(span["service"], []).append(self._otlp_span(span))
+            body = {"resourceSpans": [
+                {"resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+                 "scopeSpans": [{"scope": {"name": "rag"}, "spans": spans}]}
+                for service, spans in by_service.items()
+            ]}
+            try:
+                requests.post(self.url, json=body, timeout=5)
+            except requests.RequestException:
+                pass # Las trazas son best effort
+
+
+_exporters = None
+
+
+def _get_exporters() -> list:
+    global _exporters
+    if _exporters is None:
+        _exporters = [JsonlExporter()] if os.getenv("RAG_TRACING", "1") == "1" else []
+        if _exporters and os.getenv("RAG_OTLP_ENDPOINT"):
+            _exporters.append(OtlpHttpExporter(os.getenv("RAG_OTLP_ENDPOINT")))
+    return _exporters
+
+
+def record(name: str, trace_id: str, span_id: str, parent_id: str, start: float, end: float, error: str = None, **attrs):
+    """Exporta un span ya terminado (también los que no se miden con el context manager, como el de la ejecución)."""
+    span = {
+        "trace_id": trace_id, "span_id": span_id, "parent_id": parent_id, "name": name, "service": _service,
+        "start": start, "end": end, "duration_ms": round((end - start) * 1000, 2), "error": error, "attrs": attrs,
+    }
+    for exporter in _get_exporters():
+        exporter.export(span)
+
+
+@contextmanager
+def span(name: str, root: bool = False, **attrs):
+    """
+    Mide un tramo como hijo del span activo. Sin traza activa no se registra nada (scripts, migraciones...),
+    salvo con root=True, que empieza una traza nueva (el mensaje del chat en streamlit_app.py).
+    Devuelve un dict de atributos que se puede completar dentro del bloque.
+    """
+    parent = _current.get()
+    if parent is None and not root:
+        yield attrs
+        return
+    trace_id = parent[0] if parent else secrets.token_hex(16)
+    span_id = secrets.token_hex(8)
+    token = _current.set((trace_id, span_id))
+    start, error = time.time(), None
+    try:
+        yield attrs
+    except BaseException as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        _current.reset(token)
+        record(name, trace_id, span_id, parent[1] if parent else None, start, time.time(), error, **attrs)
+
+
+def propagate(fn):
+    """Envuelve fn para que se ejecute con el contexto de traza actual en otro hilo (ThreadPoolExecutor no lo copia)."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+class StepTracer:
+    """
+    Sustituto de ctx.step dentro de una función de Inngest: step.run(...) igual que ctx.step.run(...), pero con un span por paso.
+    Los pasos ya memoizados por Inngest no se ejecutan y no generan span. finish() registra el span de la ejecución completa.
+    Con usage_kind, cada paso también mide sus tokens y su latencia en el libro de consumo (usage.py) con la clave del evento.
+    """
+
+    def __init__(self, ctx, function: str, event=None, usage_kind: str = None):
+        event = event or ctx.event
+        self.ctx = ctx
+        self.function = function
+        self.event = event
+        self.usage_kind = usage_kind
+        incoming = parse_traceparent((event.data or {}).get("traceparent"))
+        self.trace_id, self.parent_id = incoming or (_ids_from(f"trace:{event.id}", 32), None)
+        self.run_span_id = _ids_from(f"run:{ctx.run_id}", 16)
+        _current.set((self.trace_id, self.run_span_id))
+
+    async def run(self, name: str, handler, **kwargs):
+        async def traced():
+            start = time.time()
+            with span(f"step.{name}", function=self.function), metered() as meter:
+                result = handler()
+                if inspect.isawaitable(result):
+                    result = await result
+            if self.usage_kind:
+                get_ledger().record(self.usage_kind, self.event.id, name, meter.totals(), latency_ms=(time.time() - start) * 1000)
+            return result
+        return await self.ctx.step.run(name, traced, **kwargs)
+
+    def finish(self, **attrs):
+        """Span de la ejecución: desde que se envió el evento (incluye la cola) hasta ahora. Llamar justo antes del return."""
+        start = self.event.ts / 1000 if self.event.ts else time.time()
+        record(f"inngest.{self.function}", self.trace_id, self.run_span_id, self.parent_id, start, time.time(),
+               event=self.event.name, event_id=self.event.id, run_id=self.ctx.run_id, **attrs)
+
+
+def load_traces(path: str = None, limit: int = 5000) -> list[dict]:
+    """Últimos spans exportados al fichero (lo usa admin_monitor.py)."""
+    path = Path(path or os.getenv("RAG_TRACE_FILE", ".cache/traces.jsonl"))
+    if not path.exists():
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        offset = max(0, f.tell() - limit * 600) # ~600 bytes por span: solo leemos la cola del fichero
+        f.seek(offset)
+        lines = f.read().decode("utf-8", errors="ignore").splitlines()
+    if offset:
+        lines = lines[1:] # La primera línea puede estar cortada
+    spans = []
+    for line in lines[-limit:]:
+        try:
+            spans.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return spans
@@ -0,0 +1,167 @@
+# 23. CONSUMO DE TOKENS Y COSTE POR CONSULTA Y POR INGESTA
+
+# La auditoría guardaba pregunta, respuesta y fuentes, pero no cuántos tokens gastaba cada consulta ni cuánto tardaba cada paso:
+# la planificación de capacidad iba a ciegas. En este pipeline:
+#   - MEDIDOR: rate_limiter.call (por donde pasan TODAS las llamadas a OpenAI) anota el "usage" de cada respuesta
+#     (embeddings, condensación, resumen de memoria y respuesta) en los medidores activos (metered) del contexto.
+#   - LIBRO DE CONSUMO: un SQLite con una fila por (consulta o trabajo de ingesta, paso, modelo): tokens, llamadas, coste y latencia.
+#     Si Inngest reintenta un paso, su fila se reemplaza (no se cuenta dos veces).
+#   - CONSULTAS: StepTracer (tracing.py) mide cada paso con la clave del evento; el paso de auditoría adjunta el resumen al registro.
+#   - INGESTAS: los tokens de cada petición de embeddings se reparten entre los PDFs del lote según los tokens de sus chunks.
+# La API expone los agregados por PDF, día, modelo o sesión en /usage y admin_monitor.py los pinta.
+# Precios en USD por millón de tokens; se pueden sobrescribir con RAG_OPENAI_PRICES='{"modelo": {"input": .., "output": ..}}'
+
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+DEFAULT_PRICES = {
+    "text-embedding-3-large": {"input": 0.13, "output": 0.0},
+    "text-embedding-3-small": {"input": 0.02, "output": 0.0},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+}
+PRICES = {**DEFAULT_PRICES, **json.loads(os.getenv("RAG_OPENAI_PRICES", "{}"))}
+GROUPS = ("source", "day", "model", "session", "kind") # Agregados disponibles en /usage
+
+_meters = contextvars.ContextVar("rag_usage_meters", default=()) # Medidores activos (se pueden anidar)
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int = 0) -> float:
+    price = PRICES.get(model, {"input": 0.0, "output": 0.0})
+    return (prompt_tokens * price.get("input", 0.0) + completion_tokens * price.get("output", 0.0)) / 1e6
+
+
+class UsageMeter:
+    def __init__(self):
+        self.by_model = {}
+        self.lock = threading.Lock() # Los hilos del hedging y de las respuestas por lotes comparten el medidor
+
+    def add(self, model: str, prompt_tokens: int = 0, completion_tokens: int = 0, embedding: bool = False):
+        with self.lock:
+            m = self.by_model.setdefault(model, {"prompt_tokens": 0, "completion_tokens": 0, "embedding_tokens": 0, "calls": 0})
+            m["embedding_tokens" if embedding else "prompt_tokens"] += prompt_tokens
+            m["completion_tokens"] += completion_tokens
+            m["calls"] += 1
+
+    def totals(self) -> dict:
+        with self.lock:
+            models = {k: dict(v) for k, v in self.by_model.items()}
+        for model, m in models.items():
+            m["cost_usd"] = cost_usd(model, m["prompt_tokens"] + m["embedding_tokens"], m["completion_tokens"])
+        return models
+
+
+@contextmanager
+def metered():
+    """Activa un medidor para todas las llamadas a OpenAI hechas dentro del bloque (también en hilos con tracing.propagate)."""
+    meter = UsageMeter()
+    token = _meters.set(_meters.get() + (meter,))
+    try:
+        yield meter
+    finally:
+        _meters.reset(token)
+
+
+def record_response(model: str, response):
+    """Anota el usage de una respuesta de OpenAI (embeddings o chat) en los medidores activos."""
+    meters = _meters.get()
+    usage = getattr(response, "usage", None)
+    if not meters or usage is None:
+        return
+    embedding = not hasattr(response, "choices")
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    for meter in meters:
+        meter.add(model, prompt, completion, embedding)
+
+
+class UsageLedger:
+    def __init__(self, path: str = None):
+        path = path or os.getenv("RAG_USAGE_DB", ".cache/usage.sqlite")
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False) # Compartida entre hilos, protegida con el lock
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage (kind TEXT NOT NULL, key TEXT NOT NULL, step TEXT NOT NULL, model TEXT NOT NULL, "
+            "source TEXT, session TEXT, day TEXT, prompt_tokens INTEGER, completion_tokens INTEGER, embedding_tokens INTEGER, "
+            "calls INTEGER, cost_usd REAL, latency_ms REAL, created_at REAL, PRIMARY KEY (kind, key, step, model))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS usage_day ON usage (day)")
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, key: str, step: str, models: dict, latency_ms: float = None, source: str = None, session: str = None):
+        """Una fila por modelo usado en el paso (o una sin modelo si el paso no llamó a OpenAI, para guardar su latencia)."""
+        now = time.time()
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        rows = [
+            (kind, str(key), step, model, source, session, day, m.get("prompt_tokens", 0), m.get("completion_tokens", 0),
+             m.get("embedding_tokens", 0), m.get("calls", 0), m.get("cost_usd", 0.0), latency_ms, now)
+            for model, m in (models or {"": {}}).items()
+        ]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def set_source(self, kind: str, key: str, source: str, session: str = None): # La consulta sabe su PDF al final (mejor contexto)
+        with self.lock:
+            self.conn.execute("UPDATE usage SET source = ?, session = ? WHERE kind = ? AND key = ?", (source, session, kind, str(key)))
+            self.conn.commit()
+
+    def summary(self, kind: str, key: str) -> dict:
+        """Resumen de una consulta o ingesta: totales, desglose por modelo y latencia por paso (va al registro de auditoría)."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT step, model, prompt_tokens, completion_tokens, embedding_tokens, calls, cost_usd, latency_ms "
+                "FROM usage WHERE kind = ? AND key = ?", (kind, str(key))
+            ).fetchall()
+        out = {"prompt_tokens": 0, "completion_tokens": 0, "embedding_tokens": 0, "cost_usd": 0.0, "by_model": {}, "steps_ms": {}}
+        for step, model, prompt, completion, embedding, calls, cost, latency in rows:
+            out["prompt_tokens"] += prompt
+            out["completion_tokens"] += completion
+            out["embedding_tokens"] += embedding
+            out["cost_usd"] += cost
+            if model:
+                m = out["by_model"].setdefault(model, {"tokens": 0, "calls": 0, "cost_usd": 0.0})
+                m["tokens"] += prompt + completion + embedding
+                m["calls"] += calls
+                m["cost_usd"] += cost
+            if latency is not None:
+                out["steps_ms"][step] = latency
+        return out
+
+    def rollup(self, by: str = "source", days: int = 30, kind: str = None) -> list[dict]:
+        if by not in GROUPS:
+            raise ValueError(f"Agregado desconocido: {by}. Opciones: {list(GROUPS)}")
+        since = datetime.fromtimestamp(time.time() - days * 86400, timezone.utc).strftime("%Y-%m-%d")
+        where, params = "day >= ?", [since]
+        if by == "model":
+            where += " AND model != ''" # Filas sin modelo: pasos que no llamaron a OpenAI (solo latencia)
+        if kind:
+            where, params = where + " AND kind = ?", params + [kind]
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT COALESCE({by}, '(sin dato)'), COUNT(DISTINCT kind || ':' || key), SUM(prompt_tokens), SUM(completion_tokens), "
+                f"SUM(embedding_tokens), SUM(calls), SUM(cost_usd) FROM usage WHERE {where} GROUP BY 1 ORDER BY 7 DESC",
+                params,
+            ).fetchall()
+        return [
+            {by: r[0], "requests": r[1], "prompt_tokens": r[2], "completion_tokens": r[3], "embedding_tokens": r[4],
+             "calls": r[5], "cost_usd": r[6]}
+            for r in rows
+        ]
+
+
+_ledger = None
+
+
+def get_ledger() -> UsageLedger: # Se abre al primer uso (los scripts que no miden consumo no crean el fichero)
+    global _ledger
+    if _ledger is None:
+        _ledger = UsageLedger()
+    return _ledger
@@ -3,72 +3,497 @@
 # Importación de librerias 
 import uuid
 import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import inngest
-from inngest.experimental import ai
-from custom_types import RAGChunkAndSrc, RAGUpsertResult, RAGSearchResult
+from custom_types import RAGChunkAndSrc, RAGUpsertResult, RAGUpsertBatchResult, RAGChunkRef, RAGChunkRefList, RAGSearchResult, RAGBatchSearchResult, RAGBatchItem, RAGBatchQueryResult, RAGMemoryState, RAGCondenseResult, RAGAnswerResult, RAGFAQHit, RAGFAQCandidate, RAGFAQCandidates
 from functions import QdrantStorage, VectorProcessor, AuditLogger
+from rate_limit import rate_limiter, estimate_chat_tokens, INTERACTIVE, BATCH
+from memory import ConversationMemory
+from sessions import SessionStore
+from blobstore import LocalBlobStore
+from dedup import DedupIndex
+from progress import ProgressTracker
+from chunking import chunk_file
+from deadlines import Deadline, DeadlineExceeded, AnswerCache, call_with_deadline, metrics
+from openai import APITimeoutError
+from tracing import propagate
+from usage import get_ledger, metered
+from tokens import count_tokens
+from faq import FAQStore, GLOBAL, cluster_questions
+from tenants import DEFAULT_TENANT, tenant_of, require_tenant, source_key
+from datetime import datetime, timedelta
+import numpy as np
 
 class RAGWorkflow:
-    def __init__(self, processor:VectorProcessor, storage:QdrantStorage, logger:AuditLogger):
+    def __init__(self, processor:VectorProcessor, storage:QdrantStorage, logger:AuditLogger, memory:ConversationMemory = None, sessions:SessionStore = None,
+                 blobs:LocalBlobStore = None, dedup:DedupIndex = None, progress:ProgressTracker = None, answers:AnswerCache = None,
+                 faq:FAQStore = None):
         """
         processor: instancia de VectorProcessor
         storage: instancia de QdrantStorage
         logger: instancia de AuditLogger
+        memory: instancia de ConversationMemory (por defecto usa el cliente de OpenAI del processor)
+        sessions: instancia de SessionStore (por defecto guarda las sesiones en el mismo QDRANT que storage)
+        blobs: almacén donde los pasos de ingesta dejan los chunks (solo se pasan referencias entre pasos)
+        dedup: índice de casi duplicados (por defecto activo; RAG_DEDUP=0 lo desactiva)
+        progress: seguimiento de los trabajos de ingesta (lo lee la API en /ingest/jobs)
+        answers: última respuesta buena por pregunta (se sirve si el LLM no llega a tiempo)
+        faq: respuestas pre-calculadas de las preguntas frecuentes (RAG_FAQ=0 desactiva la consulta previa)
         """
         self.processor = processor
         self.storage = storage
         self.logger = logger
+        self.memory = memory or ConversationMemory(processor.client)
+        self.sessions = sessions or SessionStore(storage.client)
+        self.blobs = blobs or LocalBlobStore()
+        self.dedup = dedup or (DedupIndex() if os.getenv("RAG_DEDUP", "1") == "1" else None)
+        self.progress = progress or ProgressTracker()
+        self.answers = answers or AnswerCache()
+        self.faq = faq or FAQStore(storage.client)
+        self.faq_enabled = os.getenv("RAG_FAQ", "1") == "1"
+        # Similitud mínima para usar un chunk como contexto (vacío = sin umbral). Depende del modelo de embeddings
+        self.score_threshold = float(os.getenv("RAG_SCORE_THRESHOLD")) if os.getenv("RAG_SCORE_THRESHOLD") else None
+        # Número de PDFs que elige el enrutado en las consultas sin PDF (0 = búsqueda plana en toda la colección)
+        self.route_top_n = int(os.getenv("RAG_ROUTE_TOP_N", 20))
+        # Contextos que se mandan al LLM cuando el plazo no da para todos (degradación "fewer_contexts")
+        self.min_contexts = int(os.getenv("RAG_MIN_CONTEXTS", 2))
+        # Recuperación padre-hijo: se buscan top_k * RAG_CHILD_FANOUT hijos (varios suelen compartir padre) y al LLM
+        # llegan como mucho top_k padres distintos que sumen RAG_PARENT_TOKEN_BUDGET tokens
+        self.child_fanout = int(os.getenv("RAG_CHILD_FANOUT", 3)) if os.getenv("RAG_PARENT_CHILD", "0") == "1" else 1
+        self.parent_token_budget = int(os.getenv("RAG_PARENT_TOKEN_BUDGET", 3000))
 
     # FUNCIÓN 1 (CARGA) 
     
     async def _load(self, ctx: inngest.Context) -> RAGChunkAndSrc:
-        pdf_path = ctx.event.data["pdf_path"]
-        source_id = ctx.event.data.get("source_id", pdf_path)
-        chunks = self.processor.load_and_chunk_pdf(pdf_path)
-        return RAGChunkAndSrc(chunks=chunks, source_id=source_id)
+        return await self._load_event(ctx.event.data)
+
+    async def _load_event(self, data: dict, job_id: str = None) -> RAGChunkAndSrc: # Carga a partir de los datos de un evento (sirve para lotes de eventos)
+        pdf_path = data["pdf_path"]
+        source_id = data.get("source_id", pdf_path)
+        tenant_id = tenant_of(data)
+        self.progress.update(job_id, source_id=source_id, status="parsing")
+        digest, chunks = self.processor.chunk_pdf(pdf_path)
+        metadata = self.processor.chunk_metadata(digest, chunks)
+        self.progress.update(job_id, pages=len({c.page for c in chunks}), chunks=len(chunks))
+        return RAGChunkAndSrc(chunks=[c.text for c in chunks], source_id=source_id, metadata=metadata, job_id=job_id, tenant_id=tenant_id,
+                              parents=self.processor.chunk_parents(chunks))
     
     # FUNCIÓN 2 (INGESTA)
 
+    @staticmethod
+    def _content_version(chunks: list) -> str: # La versión sale del contenido: si Inngest reintenta el paso, los ids y la versión son los mismos
+        return hashlib.sha1("\x00".join(chunks).encode("utf-8")).hexdigest()[:12]
+
+    def _dedup_ns(self, tenant_id: str, collection: str = None) -> str:
+        """Espacio de las firmas de casi duplicados: colección física y cliente (los alias nunca cruzan de un cliente a otro)."""
+        return DedupIndex.namespace(collection or self.storage.resolve_collection(), tenant_id or DEFAULT_TENANT)
+
+    @staticmethod
+    def _blob_prefix(tenant_id: str, source_id: str, job_id: str, version: str) -> str:
+        """
+        Prefijo de los blobs de una ejecución: chunks/<tenant>/<trabajo>/<versión>.
+        La versión sola no basta: el mismo contenido de dos clientes (o dos nombres del mismo PDF) compartiría carpeta y
+        la primera ejecución en terminar borraría los blobs que la otra todavía tiene que leer. El id del trabajo (id del evento)
+        es el mismo en cada reintento de Inngest; sin él (llamadas directas) se usa el hash de la clave del PDF.
+        """
+        tenant_id = tenant_id or DEFAULT_TENANT
+        run = job_id or hashlib.sha1(source_key(tenant_id, source_id).encode("utf-8")).hexdigest()[:12]
+        return f"chunks/{tenant_id}/{run}/{version}"
+
+    async def _stage_event(self, data: dict, batch_size: int = 256, job_id: str = None) -> RAGChunkRef:
+        """
+        Carga y trocea el PDF de un evento, guarda los chunks por lotes en el almacén de blobs
+        y devuelve solo una referencia de pocos bytes (lo que Inngest memoiza entre pasos).
+        """
+        try:
+            doc = await self._load_event(data, job_id=job_id)
+        except Exception as e: # Lo dejamos anotado en el trabajo; Inngest reintentará el paso
+            self.progress.update(job_id, status="error", error=str(e))
+            raise
+        return self._stage_doc(doc, batch_size)
+
+    def _stage_doc(self, doc: RAGChunkAndSrc, batch_size: int = 256) -> RAGChunkRef: # Guarda los chunks de un PDF en lotes y devuelve su referencia
+        job_id = doc.job_id
+        if not doc.chunks:
+            self.progress.update(job_id, status="done")
+            return RAGChunkRef(source_id=doc.source_id, job_id=job_id, tenant_id=doc.tenant_id)
+        version = self._content_version(doc.chunks)
+        metadata = doc.metadata or [{}] * len(doc.chunks)
+        prefix = self._blob_prefix(doc.tenant_id, doc.source_id, job_id, version)
+        batches = 0
+        for start in range(0, len(doc.chunks), batch_size):
+            self.blobs.put_json(f"{prefix}/batch_{batches:05d}", {
+                "chunks": doc.chunks[start:start + batch_size],
+                "metadata": metadata[start:start + batch_size],
+            })
+            batches += 1
+        if doc.parents: # Las ventanas padre van en un solo blob: cada lote de hijos las necesita enteras
+            self.blobs.put_json(f"{prefix}/parents", {"parents": doc.parents})
+        return RAGChunkRef(source_id=doc.source_id, version=version, batches=batches, count=len(doc.chunks), job_id=job_id,
+                           tenant_id=doc.tenant_id, parents=len(doc.parents))
+
+    async def _stage_files(self, files: list, workers: int = None) -> RAGChunkRefList:
+        """
+        Ingesta de carpetas: lee y trocea muchos PDFs en paralelo, uno por proceso (el troceado es CPU y no libera el GIL).
+        files: lista de {"pdf_path", "source_id", "job_id", "tenant_id"}. Devuelve una RAGChunkRef por fichero, en el mismo orden.
+        Un PDF que falla no para al resto: su trabajo queda en "error" y su referencia vacía.
+        """
+        workers = workers or int(os.getenv("RAG_INGEST_WORKERS", 0)) or os.cpu_count() or 1
+        for f in files:
+            self.progress.update(f["job_id"], source_id=f["source_id"], status="parsing")
+        chunker = self.processor.chunker_name
+        refs = []
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(files)))) as pool:
+            futures = [pool.submit(chunk_file, f["pdf_path"], chunker) for f in files]
+            for f, future in zip(files, futures):
+                try:
+                    digest, chunks = future.result()
+                except Exception as e:
+                    print(f"AVISO: No se pudo leer {f['pdf_path']}: {e}")
+                    self.progress.update(f["job_id"], status="error", error=str(e))
+                    refs.append(RAGChunkRef(source_id=f["source_id"], job_id=f["job_id"], tenant_id=tenant_of(f)))
+                    continue
+                self.progress.update(f["job_id"], pages=len({c.page for c in chunks}), chunks=len(chunks))
+                doc = RAGChunkAndSrc(chunks=[c.text for c in chunks], source_id=f["source_id"],
+                                     metadata=self.processor.chunk_metadata(digest, chunks), job_id=f["job_id"], tenant_id=tenant_of(f),
+                                     parents=self.processor.chunk_parents(chunks))
+                refs.append(self._stage_doc(doc))
+        return RAGChunkRefList(refs=refs)
+
+    @staticmethod
+    def _group_refs(refs: list, max_chunks: int = 5000) -> list: # Agrupa los PDFs en lotes que comparten embeddings y subida
+        groups, current, size = [], [], 0
+        for ref in refs:
+            if not ref.count:
+                continue
+            if current and size + ref.count > max_chunks:
+                groups.append(current)
+                current, size = [], 0
+            current.append(ref)
+            size += ref.count
+        if current:
+            groups.append(current)
+        return groups
+
+    async def _dir_summary(self, refs: list) -> dict:
+        """Estado de cada fichero y ritmo agregado de toda la carpeta."""
+        jobs = [self.progress.get(ref.job_id) or {} for ref in refs]
+        files = [
+            {"source_id": ref.source_id, "job_id": ref.job_id, "status": job.get("status"), "chunks": job.get("chunks", 0),
+             "points": job.get("points_upserted", 0), "error": job.get("error")}
+            for ref, job in zip(refs, jobs)
+        ]
+        started = min((j["created_at"] for j in jobs if j), default=None)
+        finished = max((j["updated_at"] for j in jobs if j), default=None)
+        elapsed = (finished - started) if started else 0
+        chunks = sum(f["chunks"] for f in files)
+        return {
+            "files": files,
+            "throughput": {
+                "files": len(files),
+                "failed": sum(1 for f in files if f["status"] == "error"),
+                "chunks": chunks,
+                "seconds": elapsed,
+                "chunks_per_second": chunks / elapsed if elapsed else 0.0,
+            },
+        }
+
+    def _read_ref(self, ref: RAGChunkRef) -> RAGChunkAndSrc: # Reconstruye los chunks de un PDF a partir de su referencia
+        prefix = self._blob_prefix(ref.tenant_id, ref.source_id, ref.job_id, ref.version)
+        chunks, metadata = [], []
+        for i in range(ref.batches):
+            blob = self.blobs.get_json(f"{prefix}/batch_{i:05d}")
+            chunks.extend(blob["chunks"])
+            metadata.extend(blob["metadata"])
+        parents = self.blobs.get_json(f"{prefix}/parents")["parents"] if ref.parents else []
+        return RAGChunkAndSrc(chunks=chunks, source_id=ref.source_id, metadata=metadata, job_id=ref.job_id, tenant_id=ref.tenant_id,
+                              parents=parents)
+
+    async def _upsert_refs(self, refs: list) -> RAGUpsertBatchResult:
+        """Igual que _upsert_many, pero leyendo los chunks del almacén de blobs a partir de sus referencias."""
+        try:
+            return await self._upsert_many([self._read_ref(ref) for ref in refs if ref.count])
+        except Exception as e:
+            for ref in refs:
+                self.progress.update(ref.job_id, status="error", error=str(e))
+            raise
+
+    async def _release_refs(self, refs: list):
+        """Borra los blobs de una ingesta ya activada."""
+        for ref in refs:
+            if ref.version:
+                self.blobs.delete_prefix(self._blob_prefix(ref.tenant_id, ref.source_id, ref.job_id, ref.version))
+        return {"released": len(refs)}
+
     async def _upsert(self, chunks_and_src: RAGChunkAndSrc) -> RAGUpsertResult:
         """Mantiene la lógica exacta de tu función original"""
-        chunks = chunks_and_src.chunks
-        source_id = chunks_and_src.source_id
-        
-        if not chunks:
-            print(f"AVISO: No se encontraron chunks para {source_id}. Cancelando upsert.")
-            return RAGUpsertResult(ingested=0)
-            
-        vecs = self.processor.embed_texts(chunks)
-        ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source_id}:{i}")) for i in range(len(chunks))]
-        payloads = [{"source": source_id, "text": chunks[i]} for i in range(len(chunks))]
-        
-        self.storage.upsert(ids, vecs, payloads)
-        return RAGUpsertResult(ingested=len(chunks))
+        batch = await self._upsert_many([chunks_and_src])
+        return batch.results[0]
+
+    async def _upsert_many(self, docs: list, upsert_batch: int = 512) -> RAGUpsertBatchResult:
+        """
+        Ingesta varios PDFs a la vez: los chunks de todos ellos comparten las mismas peticiones de embeddings
+        y se suben a QDRANT en una sola operación.
+        Con la deduplicación activa, los casi duplicados dentro de un PDF se descartan y los de otros PDFs
+        se guardan como alias que reutilizan el vector del original (ver dedup.py).
+        Un lote puede mezclar clientes: cada PDF se identifica por (cliente, PDF). Entre clientes solo se comparte
+        el vector de un texto casi idéntico, nunca su texto ni su payload.
+        """
+        results = []
+        all_ids, all_payloads, all_chunks, all_sigs, all_jobs = [], [], [], [], []
+        parent_rows = ([], [], [], []) # ids, textos, clave del PDF y versión de las ventanas padre (recuperación padre-hijo)
+        aliases = {} # posición -> ("pos", posición del original en esta ingesta) o ("point", id del original en QDRANT)
+        batch_indexes = {} # Un índice en memoria por cliente: un chunk nunca se compara con los de otro cliente
+        collection = self.storage.resolve_collection() if self.dedup else None
+        for doc in docs:
+            chunks = doc.chunks
+            source_id = doc.source_id
+            tenant_id = require_tenant(doc.tenant_id or DEFAULT_TENANT)
+            key = source_key(tenant_id, source_id) # Clave del PDF en los ids, las firmas y el texto externo
+            if not chunks:
+                print(f"AVISO: No se encontraron chunks para {source_id}. Cancelando upsert.")
+                results.append(RAGUpsertResult(ingested=0, source_id=source_id, job_id=doc.job_id, tenant_id=tenant_id))
+                continue
+            self.progress.update(doc.job_id, status="embedding", chunks=len(chunks), chunks_embedded=0, points_upserted=0)
+
+            version = self._content_version(chunks)
+            metadata = doc.metadata or [{}] * len(chunks)
+            parent_ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}:{version}:parent:{j}")) for j in range(len(doc.parents))]
+            for row, values in zip(parent_rows, (parent_ids, doc.parents, [key] * len(parent_ids), [version] * len(parent_ids))):
+                row.extend(values)
+            written = dropped = 0
+            for i, chunk in enumerate(chunks):
+                payload = {"source": source_id, "tenant": tenant_id, "text": chunk, "chunk_index": i, "version": version, "staging": True, **metadata[i]} # Invisible hasta _activate
+                if "parent" in payload: # El hijo guarda el id de su padre, no su posición
+                    payload["parent_id"] = parent_ids[payload.pop("parent")]
+                pos = len(all_chunks)
+                sig = None
+                if self.dedup:
+                    sig = self.dedup.signature(chunk)
+                    batch_index = batch_indexes.setdefault(tenant_id, self.dedup.batch())
+                    match = batch_index.find(sig)
+                    if match and match[1] == key: # Casi duplicado dentro del mismo PDF: se descarta
+                        dropped += 1
+                        continue
+                    if match: # Casi duplicado de otro PDF de esta misma ingesta
+                        aliases[pos] = ("pos", match[0])
+                    else:
+                        original = self.dedup.find(self._dedup_ns(tenant_id, collection), sig, exclude_source=key)
+                        if original: # Casi duplicado de un chunk ya ingestado en la colección
+                            aliases[pos] = ("point", original)
+                    batch_index.add(sig, pos, key)
+                all_ids.append(str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}:{version}:{i}")))
+                all_payloads.append(payload)
+                all_chunks.append(chunk)
+                all_sigs.append(sig)
+                all_jobs.append(doc.job_id)
+                written += 1
+            self.progress.advance(doc.job_id, "chunks_embedded", dropped) # Los descartados ya no necesitan embedding
+            results.append(RAGUpsertResult(ingested=written, version=version, source_id=source_id, duplicates_dropped=dropped, job_id=doc.job_id,
+                                           tenant_id=tenant_id))
+
+        if all_chunks:
+            vecs = self._vectors_with_aliases(all_ids, all_payloads, all_chunks, aliases, collection, all_jobs)
+            for job_id in set(all_jobs):
+                self.progress.update(job_id, status="upserting")
+            for start in range(0, len(all_ids), upsert_batch): # Por lotes: peticiones más pequeñas y progreso visible
+                end = start + upsert_batch
+                self.storage.upsert(all_ids[start:end], vecs[start:end], all_payloads[start:end])
+                self._report(all_jobs[start:end], "points_upserted")
+            self.storage.put_parents(*parent_rows) # Antes de _activate: ningún hijo visible se queda sin su padre
+            # Centroide de cada PDF para el índice de enrutado (reutilizamos los vectores recién calculados)
+            start = 0
+            for r in results:
+                if r.ingested:
+                    self.storage.router.update(r.source_id, vecs[start:start + r.ingested], version=r.version, tenant_id=r.tenant_id)
+                    aliased = sum(1 for pos in range(start, start + r.ingested) if "duplicate_of" in all_payloads[pos])
+                    r.duplicates_aliased = aliased
+                    r.embeddings_saved = r.duplicates_dropped + aliased
+                    start += r.ingested
+            if self.dedup: # Los originales quedan disponibles para futuros alias
+                by_tenant = {}
+                for pos in range(len(all_ids)):
+                    if "duplicate_of" not in all_payloads[pos]:
+                        by_tenant.setdefault(all_payloads[pos]["tenant"], []).append(pos)
+                for tenant_id, originals in by_tenant.items():
+                    self.dedup.add(self._dedup_ns(tenant_id, collection), [all_ids[p] for p in originals], [all_sigs[p] for p in originals],
+                                   [source_key(tenant_id, all_payloads[p]["source"]) for p in originals],
+                                   [all_payloads[p]["version"] for p in originals])
+        saved = sum(r.embeddings_saved for r in results)
+        if saved:
+            print(f"DEBUG: Deduplicación: {saved} embeddings ahorrados.")
+        return RAGUpsertBatchResult(results=results)
+
+    def _report(self, jobs: list, field: str): # Suma al contador de cada trabajo los chunks que le tocan de este tramo
+        for job_id in set(jobs):
+            self.progress.advance(job_id, field, jobs.count(job_id))
+
+    def _vectors_with_aliases(self, ids: list, payloads: list, chunks: list, aliases: dict, collection: str, jobs: list = None,
+                              slice_size: int = 512) -> list:
+        """
+        Vectores de todos los chunks: los alias copian el vector de su original y el resto se piden al motor de embeddings.
+        Si el original ya no existe en QDRANT (PDF borrado), el alias se descarta y el chunk se convierte normalmente.
+        """
+        canonical = self.storage.get_vectors([ref for kind, ref in aliases.values() if kind == "point"])
+        for pos, (kind, ref) in aliases.items():
+            if kind == "point" and ref not in canonical:
+                self.dedup.delete_ids(self._dedup_ns(payloads[pos]["tenant"], collection), [ref]) # Limpieza perezosa del índice
+        aliases = {pos: a for pos, a in aliases.items() if a[0] == "pos" or a[1] in canonical}
+
+        jobs = jobs or [None] * len(chunks)
+        vecs = [None] * len(chunks)
+        spent = {} # (trabajo, PDF) -> consumo de embeddings por modelo
+        pending = [pos for pos in range(len(chunks)) if pos not in aliases]
+        for start in range(0, len(pending), slice_size): # Por tramos (una petición de OpenAI cada uno) para ir reportando el progreso
+            part = pending[start:start + slice_size]
+            with metered() as meter:
+                fresh = self.processor.embed_texts([chunks[p] for p in part], priority=BATCH) # La ingesta cede el paso a las consultas del chat
+            self._share_usage(spent, meter.totals(), [(jobs[p], payloads[p].get("source")) for p in part], [chunks[p] for p in part])
+            for pos, vec in zip(part, fresh):
+                vecs[pos] = vec
+            self._report([jobs[p] for p in part], "chunks_embedded")
+        for (job, source), models in spent.items():
+            get_ledger().record("ingest", job or source, "embed", models, source=source)
+        for pos in sorted(aliases): # En orden: un alias siempre apunta a una posición anterior
+            kind, ref = aliases[pos]
+            vecs[pos] = vecs[ref] if kind == "pos" else canonical[ref]
+            payloads[pos]["duplicate_of"] = ids[ref] if kind == "pos" else ref
+        self._report([jobs[p] for p in aliases], "chunks_embedded")
+        return vecs
+
+    @staticmethod
+    def _share_usage(spent: dict, models: dict, owners: list, texts: list):
+        """Reparte el consumo de una petición de embeddings entre los PDFs del lote, en proporción al tamaño de sus chunks."""
+        total = sum(len(t) for t in texts) or 1
+        for owner, text in zip(owners, texts):
+            share = len(text) / total
+            for model, m in models.items():
+                acc = spent.setdefault(owner, {}).setdefault(model, {"prompt_tokens": 0, "completion_tokens": 0, "embedding_tokens": 0, "calls": 0, "cost_usd": 0.0})
+                for field in acc:
+                    acc[field] += m.get(field, 0) * share
+
+    async def _activate(self, source_id: str, version: str, job_id: str = None, tenant_id: str = None):
+        """
+        Hace visible la versión recién ingestada de un PDF y borra las anteriores (reemplazo atómico).
+        """
+        if not version: # No se ingestó nada: mantenemos la versión anterior
+            self.progress.update(job_id, status="done")
+            return {"status": "skipped"}
+        self.progress.update(job_id, status="activating")
+        self.storage.activate_source(source_id, version, tenant_id)
+        self.faq.invalidate_source(source_id, tenant_id) # Sus FAQ aprobadas vuelven a revisión: el documento ha cambiado
+        if self.dedup: # Las firmas de las versiones borradas ya no sirven como originales
+            self.dedup.delete_other_versions(self._dedup_ns(tenant_id), source_key(tenant_id, source_id), version)
+        self.progress.update(job_id, status="done") # A partir de aquí el PDF ya responde en las búsquedas
+        return {"status": "active", "version": version}
+
+    async def _activate_many(self, batch: RAGUpsertBatchResult):
+        return [await self._activate(r.source_id, r.version, r.job_id, r.tenant_id) for r in batch.results]
 
     # FUNCIÓN 3 (BÚSQUEDA) 
 
-    async def _search(self, question: str, top_k: int = 5, source_id: str = None) -> RAGSearchResult:
+    async def _search(self, question: str, top_k: int = 5, source_id: str = None, score_threshold: float = None, deadline: Deadline = None,
+                      tenant_id: str = None) -> RAGSearchResult:
         """
-        Busca contexto filtrando opcionalmente por un PDF específico.
+        Busca contexto entre los PDFs del cliente (tenant_id, obligatorio) filtrando opcionalmente por un PDF específico.
+        Los chunks con similitud menor que score_threshold (o RAG_SCORE_THRESHOLD) se descartan.
+        Con deadline, embedding y búsqueda se hacen con hedging dentro de su plazo; si no llegan, se devuelve
+        un resultado vacío marcado con "search_timeout" (no es lo mismo que "no hay contexto relevante").
         """
-        query_vec = self.processor.embed_texts([question])[0] # Convertimos la pregunta en un vector
-        
-        found = self.storage.search(query_vec, top_k=top_k, source_id=source_id) # Busca el almacenamiento en función de estos parámetros 
+        threshold = score_threshold if score_threshold is not None else self.score_threshold
+        degradations = []
+
+        def guarded(op, fn): # Sin presupuesto, llamada directa como siempre
+            if deadline is None:
+                return fn()
+            result, hedged = call_with_deadline(op, fn, deadline.step_timeout(op))
+            if hedged:
+                degradations.append(f"{op}_hedged")
+            return result
+
+        def search(vec, sources):
+            if sources is None: # Sin PDF: primero elegimos los PDFs más prometedores del cliente
+                sources = self._route([vec], tenant_id)[0]
+            found = self.storage.search(vec, top_k=top_k * self.child_fanout, source_id=sources, score_threshold=threshold, tenant_id=tenant_id) # Busca el almacenamiento en función de estos parámetros
+            return self._expand_parents(found, top_k)
+
+        try:
+            query_vec = guarded("embed", lambda: self.processor.embed_texts([question])[0]) # Convertimos la pregunta en un vector
+            found = guarded("search", lambda: search(query_vec, source_id))
+        except DeadlineExceeded:
+            return RAGSearchResult(contexts=[], sources=[], degradations=degradations + ["search_timeout"])
 
-        return RAGSearchResult(contexts=found["contexts"], sources=found["sources"]) # Devuelve respuesta y la fuente
+        return RAGSearchResult(contexts=found["contexts"], sources=found["sources"], scores=found["scores"], degradations=degradations) # Devuelve respuesta, fuente y puntuaciones
+
+    def _expand_parents(self, found: dict, top_k: int) -> dict:
+        """
+        Recuperación padre-hijo: cambia cada hijo encontrado por el texto de su ventana padre, sin repetir padres,
+        en orden de similitud y hasta top_k contextos y parent_token_budget tokens. Si un padre no cabe se usa el hijo.
+        Los chunks sin padre (PDFs ingestados sin RAG_PARENT_CHILD) se quedan como están.
+        """
+        parent_ids = found.get("parents") or []
+        if not any(parent_ids): # Solo los top_k mejores (con RAG_CHILD_FANOUT se pidieron más)
+            return {**found, "contexts": found["contexts"][:top_k], "scores": found["scores"][:top_k],
+                    "sources": list(set(found["context_sources"][:top_k]))}
+        texts = self.storage.get_parents(parent_ids)
+        contexts, scores, sources, seen, used = [], [], set(), set(), 0
+        for child, score, parent_id, source in zip(found["contexts"], found["scores"], parent_ids, found["context_sources"]):
+            if len(contexts) >= top_k:
+                break
+            key = parent_id if parent_id in texts else child
+            if key in seen: # Otro hijo del mismo padre, ya en el prompt
+                continue
+            text = texts.get(parent_id, child)
+            tokens = count_tokens(text)
+            if contexts and used + tokens > self.parent_token_budget and text is not child:
+                text, tokens = child, count_tokens(child)
+            if contexts and used + tokens > self.parent_token_budget:
+                continue
+            seen.add(key)
+            contexts.append(text)
+            scores.append(score)
+            sources.add(source)
+            used += tokens
+        return {**found, "contexts": contexts, "scores": scores, "sources": list(sources)}
+
+    def _route(self, query_vecs: list, tenant_id: str) -> list:
+        """
+        Primera etapa de la búsqueda sin PDF: para cada vector, los route_top_n PDFs del cliente cuyo centroide más se parece.
+        Devuelve None para un vector si no merece la pena filtrar (enrutado desactivado o menos PDFs que route_top_n),
+        de modo que la búsqueda se hace sobre todos los PDFs del cliente.
+        """
+        if self.route_top_n <= 0:
+            return [None] * len(query_vecs)
+        routes = self.storage.router.route_batch(query_vecs, self.route_top_n, tenant_id)
+        return [r if len(r) >= self.route_top_n else None for r in routes]
 
     # FUNCIÓN 4 (FLUJO DE PREGUNTAS)
     
-    async def _condense_question(self, question: str, chat_history: list) -> str:
+    async def _condense_question(self, question: str, chat_history: list, summary: str = None, deadline: Deadline = None) -> RAGCondenseResult:
         """
         Transforma una pregunta de seguimiento en una pregunta independiente.
         Ej: Pregunta: "¿Dónde nació?" + Historial: "Cervantes" -> "¿Dónde nació Miguel de Cervantes?"
+        Con deadline, si la reescritura no llega a tiempo se busca con la pregunta original ("condense_skipped").
         """
-        if not chat_history:
-            return question
+        if not chat_history and not summary:
+            return RAGCondenseResult(query=question)
+        if deadline is None:
+            return RAGCondenseResult(query=self._condense_call(question, chat_history, summary))
+        try: # Sin hedge: duplicar una llamada al LLM cuesta tokens y compite con la respuesta
+            query, _ = call_with_deadline("condense", lambda: self._condense_call(question, chat_history, summary),
+                                          deadline.step_timeout("condense"), hedge=False)
+        except DeadlineExceeded:
+            return RAGCondenseResult(query=question, degradations=["condense_skipped"])
+        return RAGCondenseResult(query=query)
 
-        # Tomamos los últimos mensajes para dar contexto
-        context = "\n".join([f"{m['role']}: {m['content']}" for m in chat_history[-5:]])
+    def _condense_call(self, question: str, chat_history: list, summary: str = None) -> str: # La llamada al LLM de _condense_question
+
+        # Tomamos los últimos mensajes que caben en el presupuesto de tokens de la memoria
+        context = "\n".join([f"{m['role']}: {m['content']}" for m in self.memory.recent(chat_history)])
+        if summary:
+            context = f"(Resumen de la conversación anterior: {summary})\n{context}"
 
         prompt = (
             "Dada la siguiente conversación y una pregunta de seguimiento, "
@@ -79,28 +504,53 @@ class RAGWorkflow:
             "Pregunta reescrita:"
         )
 
-        response = self.processor.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
+        messages = [{"role": "user", "content": prompt}]
+        response = rate_limiter.call(
+            "gpt-4o-mini",
+            lambda: self.processor.client.chat.completions.with_raw_response.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0
+            ),
+            tokens=estimate_chat_tokens(messages, 100),
+            priority=INTERACTIVE,
         )
         return response.choices[0].message.content.strip()
 
 
      # FUNCION 5 (AUDITORIA)
 
-    async def _log_interaction(self, question: str, answer: str, source_id: str, sources: list, chat_history: list = None):
+    async def _log_interaction(self, question: str, answer: str, source_id: str, sources: list, session_id: str = None, llm_skipped: bool = False,
+                               degradations: list = None, deadline: Deadline = None, usage_key: str = None, context_tokens: int = 0,
+                               search_query: str = None, faq_id: str = None, tenant_id: str = None):
         """
-        Método asíncrono modificado para recibir el source_id (nombre del PDF)
-        y pasárselo al motor de auditoría.
+        Método asíncrono modificado para recibir el source_id (nombre del PDF) y el cliente
+        y pasárselo al motor de auditoría. Con deadline, también anota la latencia y las degradaciones en las métricas.
+        Con usage_key (id del evento), adjunta los tokens, el coste y la latencia de cada paso (usage.py).
         """
+        usage = None
+        if usage_key:
+            # Las consultas sin PDF se atribuyen al PDF del mejor contexto, para ver qué documentos generan carga
+            get_ledger().set_source("query", usage_key, source_id or (sources[0] if sources else None), session_id)
+            usage = get_ledger().summary("query", usage_key)
+        latency_s = deadline.elapsed() if deadline else None
         self.logger.save_log(
             question=question, 
             answer=answer, 
             source_id=source_id, 
             sources=sources,
-            chat_history = chat_history
+            session_id = session_id,
+            llm_skipped = llm_skipped,
+            degradations = degradations or [],
+            latency_ms = round(latency_s * 1000) if latency_s is not None else None,
+            usage = usage,
+            context_tokens = context_tokens,
+            search_query = search_query,
+            faq_id = faq_id,
+            tenant_id = tenant_id
         )
+        if deadline:
+            metrics.record_query(latency_s, deadline.budget_s, degradations)
         return {"status": "logged"}
     
     # FUNCIÓN 6 (SISTEMA PROMPT)
@@ -117,3 +567,300 @@ class RAGWorkflow:
             return f"{custom_instructions}\n\nREGLA CRÍTICA: {base_behavior}"
         
         return base_behavior
+
+    # FUNCIÓN 7 (MENSAJES PARA EL LLM)
+
+    def _build_messages(self, system_content: str, question: str, contexts: list, chat_history: list = None, summary: str = None) -> list:
+        """
+        Construye la lista de mensajes (system + resumen + historial + contexto y pregunta) que se envía al LLM.
+        """
+        messages = [{"role": "system", "content": system_content}]
+        if summary:
+            messages.append({"role": "system", "content": f"Resumen de la conversación anterior: {summary}"})
+
+        for msg in self.memory.recent(chat_history): # Pasamos los últimos mensajes que caben en el presupuesto de tokens
+            messages.append(msg)
+
+        context_block = "\n\n".join(f"- {c}" for c in contexts)
+        user_content = (
+            f"Context:\n{context_block}\n\n"
+            f"Question: {question}\n"
+            )
+        messages.append({"role": "user", "content": user_content})
+        return messages
+
+    # FUNCIÓN 8 (CONDENSACIÓN POR LOTES)
+
+    async def _condense_questions(self, questions: list, chat_histories: list = None) -> list:
+        """
+        Versión por lotes de _condense_question: reescribe en una sola llamada al LLM
+        todas las preguntas que tienen historial. Las que no lo tienen se devuelven tal cual.
+        """
+        chat_histories = chat_histories or [None] * len(questions)
+        pending = [i for i, h in enumerate(chat_histories) if h]
+        if not pending:
+            return list(questions)
+
+        items = []
+        for i in pending:
+            context = "\n".join([f"{m['role']}: {m['content']}" for m in self.memory.recent(chat_histories[i])])
+            items.append({"id": i, "historial": context, "pregunta": questions[i]})
+
+        prompt = (
+            "Para cada elemento de la lista, dada la conversación (historial) y una pregunta de seguimiento, "
+            "reescribe la pregunta para que sea una consulta independiente que se entienda por sí sola. "
+            "No respondas las preguntas, solo reescríbelas.\n"
+            'Devuelve un JSON con la forma {"preguntas": [{"id": <id>, "pregunta": <pregunta reescrita>}]}.\n\n'
+            f"{json.dumps(items, ensure_ascii=False)}"
+        )
+
+        messages = [{"role": "user", "content": prompt}]
+        response = rate_limiter.call(
+            "gpt-4o-mini",
+            lambda: self.processor.client.chat.completions.with_raw_response.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                response_format={"type": "json_object"},
+                temperature=0
+            ),
+            tokens=estimate_chat_tokens(messages, 100 * len(pending)),
+            priority=BATCH,
+        )
+
+        condensed = list(questions)
+        try:
+            rewritten = json.loads(response.choices[0].message.content).get("preguntas", [])
+            for item in rewritten:
+                idx = int(item["id"])
+                if idx in pending and item.get("pregunta"):
+                    condensed[idx] = item["pregunta"].strip()
+        except (ValueError, KeyError, TypeError, AttributeError):
+            print("AVISO: No se pudo interpretar la condensación por lotes. Se usan las preguntas originales.")
+        return condensed
+
+    # FUNCIÓN 9 (BÚSQUEDA POR LOTES)
+
+    async def _search_batch(self, questions: list, top_k: int = 5, source_id: str = None, score_threshold: float = None,
+                            tenant_id: str = None) -> RAGBatchSearchResult:
+        """
+        Convierte las N preguntas en vectores con una única petición de embeddings
+        y las busca en QDRANT con una única llamada de búsqueda por lotes.
+        """
+        query_vecs = self.processor.embed_texts(list(questions), priority=BATCH)
+        threshold = score_threshold if score_threshold is not None else self.score_threshold
+        routed = self._route(query_vecs, tenant_id) if source_id is None else None
+        found = self.storage.search_batch(query_vecs, top_k=top_k * self.child_fanout, source_id=source_id, score_threshold=threshold,
+                                          per_query_sources=routed, tenant_id=tenant_id)
+        found = [self._expand_parents(f, top_k) for f in found]
+        results = [RAGSearchResult(contexts=f["contexts"], sources=f["sources"], scores=f["scores"]) for f in found]
+        return RAGBatchSearchResult(questions=list(questions), results=results)
+
+    # FUNCIÓN 10 (RESPUESTAS POR LOTES)
+
+    async def _answer_batch(self, system_content: str, questions: list, found: RAGBatchSearchResult,
+                            chat_histories: list = None, max_parallel: int = 4, fallback_answer: str = None) -> RAGBatchQueryResult:
+        """
+        Genera las respuestas del LLM para cada pregunta con un paralelismo acotado (max_parallel).
+        Si se indica fallback_answer, las preguntas sin contexto reciben ese mensaje sin llamar al LLM.
+        """
+        chat_histories = chat_histories or [None] * len(questions)
+
+        def answer_one(i: int) -> RAGBatchItem:
+            result = found.results[i]
+            if fallback_answer and not result.contexts: # Nada supera el umbral: la respuesta ya la conocemos
+                return RAGBatchItem(question=questions[i], answer=fallback_answer, sources=[], num_contexts=0)
+            messages = self._build_messages(system_content, questions[i], result.contexts, chat_histories[i])
+            response = rate_limiter.call(
+                "gpt-4o-mini",
+                lambda: self.processor.client.chat.completions.with_raw_response.create(
+                    model="gpt-4o-mini",
+                    messages=messages,
+                    max_tokens=1024,
+                    temperature=0.2
+                ),
+                tokens=estimate_chat_tokens(messages, 1024),
+                priority=BATCH,
+            )
+            return RAGBatchItem(
+                question=questions[i],
+                answer=response.choices[0].message.content.strip(),
+                sources=result.sources,
+                num_contexts=len(result.contexts),
+            )
+
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as pool: # El pool limita cuántas llamadas al LLM hay en vuelo a la vez
+            items = list(pool.map(propagate(answer_one), range(len(questions)))) # propagate: los spans de OpenAI siguen en la traza
+        return RAGBatchQueryResult(results=items)
+
+    # FUNCIÓN 11 (CONSULTA POR LOTES COMPLETA)
+
+    async def _query_batch(self, questions: list, system_content: str, top_k: int = 5, source_id: str = None,
+                           chat_histories: list = None, max_parallel: int = 4, fallback_answer: str = None, tenant_id: str = None) -> RAGBatchQueryResult:
+        """
+        Ejecuta el flujo completo para N preguntas: condensación, embeddings y búsqueda por lotes, y respuestas en paralelo.
+        Pensado para trabajos offline (QA y evaluaciones) que no pasan por Inngest.
+        """
+        search_queries = await self._condense_questions(questions, chat_histories)
+        found = await self._search_batch(search_queries, top_k, source_id=source_id, tenant_id=tenant_id)
+        return await self._answer_batch(system_content, questions, found, chat_histories, max_parallel, fallback_answer)
+
+    # FUNCIÓN 12 (SESIONES EN EL SERVIDOR)
+
+    async def _session_memory(self, session_id: str, tenant_id: str = None) -> RAGMemoryState:
+        """
+        Carga la memoria de una sesión guardada en el servidor: resumen + mensajes aún no resumidos.
+        La compacta y guarda el nuevo resumen, de modo que cada turno solo lee los mensajes posteriores al resumen.
+        """
+        state = self.sessions.get_state(session_id, tenant_id)
+        turns = self.sessions.get_turns(session_id, after_seq=state["summarized_seq"], tenant_id=tenant_id)
+        history = [{"role": t["role"], "content": t["content"]} for t in turns]
+
+        memory = self.memory.compact(history, state["summary"])
+        summarized_seq = turns[memory.summarized - 1]["seq"] if memory.summarized else state["summarized_seq"]
+        self.sessions.save_state(session_id, memory.summary, summarized_seq, tenant_id)
+        return memory
+
+    async def _save_turn(self, session_id: str, turn_id: str, question: str, answer: str, tenant_id: str = None):
+        self.sessions.append_turn(session_id, turn_id, question, answer, tenant_id)
+        return {"status": "saved"}
+
+    # FUNCIÓN 13 (RESPUESTA CON PRESUPUESTO DE LATENCIA)
+
+    async def _answer(self, system_content: str, question: str, search_query: str, found: RAGSearchResult, deadline: Deadline,
+                      source_id: str = None, chat_history: list = None, summary: str = None, timeout_answer: str = None,
+                      tenant_id: str = None) -> RAGAnswerResult:
+        """
+        Llama al LLM con el plazo que le queda a la consulta (sin hedge: duplicar la respuesta duplica el coste).
+        Si el p95 reciente del LLM no cabe en el plazo, solo se mandan los min_contexts mejores contextos ("fewer_contexts").
+        Si aun así no llega, se sirve la última respuesta buena a esa pregunta ("cached_answer") o timeout_answer ("timeout_answer").
+        """
+        degradations = []
+        contexts = found.contexts
+        timeout = deadline.step_timeout("llm")
+        p95 = metrics.latency.percentile("llm", 0.95)
+        if p95 is not None and p95 > timeout and len(contexts) > self.min_contexts: # Menos tokens de entrada, respuesta antes
+            contexts = contexts[:self.min_contexts]
+            degradations.append("fewer_contexts")
+
+        messages = self._build_messages(system_content, question, contexts, chat_history, summary)
+        client = self.processor.client.with_options(timeout=max(timeout, 0.1), max_retries=0) # La petición HTTP tampoco pasa del plazo
+        try:
+            response, _ = call_with_deadline(
+                "llm",
+                lambda: rate_limiter.call(
+                    "gpt-4o-mini",
+                    lambda: client.chat.completions.with_raw_response.create(
+                        model="gpt-4o-mini",
+                        messages=messages,
+                        max_tokens=1024,
+                        temperature=0.2
+                    ),
+                    tokens=estimate_chat_tokens(messages, 1024),
+                    priority=INTERACTIVE,
+                    transient_retries=0, # Con el plazo encima no se reintenta: se sirve la respuesta de reserva
+                ),
+                timeout,
+                hedge=False,
+            )
+        except (DeadlineExceeded, APITimeoutError):
+            result = await self._cached_answer(search_query, source_id, timeout_answer, tenant_id)
+            result.degradations = degradations + result.degradations
+            return result
+
+        answer = response.choices[0].message.content.strip()
+        self.answers.put(search_query, source_key(tenant_id, source_id), answer, found.sources) # Reserva para cuando el LLM no llegue a tiempo
+        return RAGAnswerResult(answer=answer, sources=found.sources, num_contexts=len(contexts), degradations=degradations,
+                               context_tokens=sum(count_tokens(c) for c in contexts))
+
+    async def _cached_answer(self, search_query: str, source_id: str = None, timeout_answer: str = None, tenant_id: str = None) -> RAGAnswerResult:
+        """Sustituto de la respuesta cuando se agota el plazo: la última respuesta buena a esa pregunta (del mismo cliente) o timeout_answer."""
+        cached = self.answers.get(search_query, source_key(tenant_id, source_id))
+        if cached:
+            return RAGAnswerResult(answer=cached["answer"], sources=cached["sources"], num_contexts=0, degradations=["cached_answer"])
+        return RAGAnswerResult(answer=timeout_answer or "", sources=[], num_contexts=0, degradations=["timeout_answer"])
+
+    # FUNCIÓN 14 (PREGUNTAS FRECUENTES PRE-RESPONDIDAS)
+
+    async def _faq_lookup(self, question: str, source_id: str = None, deadline: Deadline = None, tenant_id: str = None) -> RAGFAQHit:
+        """
+        Busca la pregunta (ya condensada) entre las FAQ aprobadas de su cliente y PDF. El embedding queda en la caché,
+        así que si no hay coincidencia la búsqueda normal no lo vuelve a pedir.
+        """
+        if not self.faq_enabled or not self.faq.exists():
+            return RAGFAQHit()
+        lookup = lambda: self.faq.lookup(self.processor.embed_texts([question])[0], source_id, tenant_id)
+        try:
+            hit = call_with_deadline("embed", lookup, deadline.step_timeout("embed"))[0] if deadline else lookup()
+        except DeadlineExceeded: # Sin plazo para la FAQ: seguimos por el flujo normal
+            return RAGFAQHit()
+        if hit is None:
+            return RAGFAQHit()
+        return RAGFAQHit(faq_id=str(hit.id), answer=hit.payload["answer"], sources=hit.payload.get("sources", []), score=hit.score)
+
+    async def _faq_clusters(self, days: int = 30, min_count: int = 5, cluster_size: int = 8, min_cohesion: float = 0.85,
+                            max_faqs: int = 50) -> RAGFAQCandidates:
+        """
+        Minado offline: lee las preguntas auditadas de los últimos días, las convierte en vectores y las agrupa por cliente y PDF.
+        Solo cuentan las que se respondieron con el LLM a tiempo (sin ruta rápida, sin FAQ y sin degradar la respuesta).
+        """
+        since = (datetime.now() - timedelta(days=days)).isoformat()
+        by_source, offset = {}, None
+        while True:
+            points, offset = self.storage.client.scroll(self.logger.collection_name, limit=1024, offset=offset, with_payload=True)
+            for p in points:
+                log = p.payload
+                degraded = {"cached_answer", "timeout_answer"} & set(log.get("degradations") or [])
+                if log.get("timestamp", "") < since or log.get("llm_skipped") or log.get("faq_id") or degraded:
+                    continue
+                group = (log.get("tenant") or DEFAULT_TENANT, log.get("pdf_usado") or GLOBAL)
+                by_source.setdefault(group, []).append((log.get("search_query") or log["question"]).strip())
+            if offset is None:
+                break
+
+        candidates = []
+        for (tenant_id, source), questions in by_source.items():
+            if len(questions) < min_count:
+                continue
+            unique = list(dict.fromkeys(questions)) # Las repeticiones exactas cuentan para la frecuencia, pero se convierten una vez
+            position = {q: i for i, q in enumerate(unique)}
+            vectors = np.asarray(self.processor.embed_texts(unique, priority=BATCH), dtype="float32")[[position[q] for q in questions]]
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+            for cluster in cluster_questions(vectors, cluster_size, min_count, min_cohesion):
+                members = [questions[i] for i in cluster["members"]]
+                candidates.append(RAGFAQCandidate(
+                    source_id=None if source == GLOBAL else source,
+                    tenant_id=tenant_id,
+                    question=questions[cluster["representative"]],
+                    members=members[:200], # Suficientes para el centroide; el paso de Inngest memoiza esta salida
+                    count=len(members),
+                    cohesion=cluster["cohesion"],
+                ))
+        candidates.sort(key=lambda c: c.count, reverse=True)
+        return RAGFAQCandidates(candidates=candidates[:max_faqs])
+
+    async def _faq_answer_and_store(self, found: RAGFAQCandidates, system_content: str, fallback_answer: str = None,
+                                    top_k: int = 5, max_parallel: int = 4) -> dict:
+        """
+        Responde la pregunta representativa de cada intención con el flujo RAG por lotes y la guarda como pendiente de revisión.
+        El vector de la FAQ es el centroide de las preguntas del grupo (sus embeddings ya están en la caché).
+        """
+        stored, skipped = [], 0
+        by_source = {}
+        for cand in found.candidates:
+            by_source.setdefault((cand.tenant_id or DEFAULT_TENANT, cand.source_id), []).append(cand)
+        self.faq.ensure(self.processor.embed_dim)
+        for (tenant_id, source_id), cands in by_source.items():
+            answers = await self._query_batch([c.question for c in cands], system_content, top_k, source_id,
+                                              max_parallel=max_parallel, fallback_answer=fallback_answer, tenant_id=tenant_id)
+            for cand, item in zip(cands, answers.results):
+                if not item.num_contexts: # Sin contexto en la documentación: nada que pre-calcular
+                    skipped += 1
+                    continue
+                vectors = np.asarray(self.processor.embed_texts(cand.members, priority=BATCH), dtype="float32")
+                centroid = vectors.mean(axis=0)
+                centroid /= np.linalg.norm(centroid) or 1.0
+                stored.append(self.faq.upsert(
+                    centroid.tolist(), source_id or GLOBAL, cand.question, item.answer, item.sources, cand.count, cand.cohesion,
+                    examples=cand.members[:10], tenant_id=tenant_id,
+                ))
+        return {"stored": len(stored), "skipped_without_context": skipped, "ids": stored}